@@ -1,51 +1,59 @@
+import os
 import uuid
 import json
+import time
+import asyncio
 import logging
-from datetime import datetime, timezone, timedelta
+import base64
+import tempfile
+from datetime import date, datetime, timezone, timedelta
 
-from fastapi import APIRouter, UploadFile, File, Form, HTTPException, Depends, Query
-from sqlalchemy.orm import Session
-
-from app.deps import get_db
-from app.core.uniface_engine import UniFaceEngine
-from app.db.crud import load_gallery_for_class, save_attendance_session, list_sessions, get_session
-from app.utils.image import decode_upload_to_bgr
+import numpy as np
 
-from app.core.quality import quality_gate
-from app.core.matching import best_match
+from fastapi import APIRouter, UploadFile, File, Form, HTTPException, Depends, Query, Request, Response
+from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.deps import get_db, get_async_db, get_engine
+from app.db.async_database import AsyncSessionLocal
+from app.db import crud_async
+from app.settings import settings
+from app.api.routes_students import date_range
+from app.db.crud import (
+    list_sessions, get_session, get_session_result,
+    list_session_faces, get_attendance_job,
+)
+from app.core.gallery_cache import gallery_cache
+from app.core.image_cache import image_cache
+from app.core.campus_index import campus_index
+from app.core.inference import inference_executor, InferenceBusy
+from app.core.engine_registry import engine_registry
+from app.core.job_queue import job_queue, JobQueueFull, LANES
+from app.core.leader import leader
+from app.core.pipeline import process_attendance_image, embed_faces
+from app.core.video import process_video, VideoError
+from app.core.matching import match_students, match_tracks
 from app.core.attendance_logic import update_present_best, build_result
+from app.core.metrics import span, observe_stage, count, request_timings
+from app.utils.multipart_stream import iter_multipart, multipart_boundary, StreamLimitExceeded, BodyStreamingResponse
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/attendance", tags=["attendance"])
-engine = UniFaceEngine()
 
 
-@router.post("/")
-async def attendance(
-    class_id: str = Form(...),
-    images: list[UploadFile] = File(...),
-    threshold: float = Form(0.40),
-    db: Session = Depends(get_db),
-):
-    # gallery: names lặp theo số embedding (vì enroll bạn đã lưu nhiều embeddings/1 student)
-    names, gallery_embs = load_gallery_for_class(db, class_id)
-    if len(names) == 0:
-        raise HTTPException(400, f"No gallery embeddings for class_id={class_id}. Enroll students first.")
+# quality thresholds (tune)
+# LƯU Ý: min_blur là Laplacian variance trên crop nhỏ,
+# webcam/điện thoại thường cho giá trị 5-80.
+# Đặt quá cao sẽ lọc mất khuôn mặt hơi mờ (webcam, ánh sáng yếu).
+MIN_CONF = 0.4
+MIN_FACE = 20
+MIN_BLUR = 3.0   # rất thấp → chỉ reject ảnh cực kỳ mờ
 
-    # danh sách học sinh (unique) để tính absent/present
-    all_students = sorted(list(set(names)))
 
-    # quality thresholds (tune)
-    # LƯU Ý: min_blur là Laplacian variance trên crop nhỏ,
-    # webcam/điện thoại thường cho giá trị 5-80.
-    # Đặt quá cao sẽ lọc mất khuôn mặt hơi mờ (webcam, ánh sáng yếu).
-    min_conf = 0.4
-    min_face = 20
-    min_blur = 3.0   # rất thấp → chỉ reject ảnh cực kỳ mờ
-
-    dbg = {
-        "images_received": len(images),
+def _new_debug(images_count: int) -> dict:
+    return {
+        "images_received": images_count,
         "images_decoded": 0,
         "faces_detected": 0,
         "faces_pass_quality": 0,
@@ -55,107 +63,891 @@ async def attendance(
         "filtered_blur": 0,
         "filtered_empty_crop": 0,
         "filtered_no_landmarks": 0,
-        "gallery_vectors": len(names),
-        "gallery_people": len(all_students),
-        "quality_thresholds": {"min_conf": min_conf, "min_face": min_face, "min_blur": min_blur},
+        "images_downscaled": 0,
+        "images_full_res_decoded": 0,
+        "quality_thresholds": {"min_conf": MIN_CONF, "min_face": MIN_FACE, "min_blur": MIN_BLUR},
         "rejected_details": [],
     }
 
+
+def _pipeline_kwargs() -> dict:
+    """Tham số của process_attendance_image (ngưỡng quality + policy detect)."""
+    return {
+        "min_conf": MIN_CONF,
+        "min_face": MIN_FACE,
+        "min_blur": MIN_BLUR,
+        "detect_max_side": settings.detect_max_side,
+        "detect_decode": settings.detect_decode,
+        "align_full_res_below": settings.align_full_res_below,
+    }
+
+
+def _merge_image_debug(dbg: dict, out: dict) -> bool:
+    """Cộng counter của 1 ảnh (output process_attendance_image) vào dbg. Return ảnh decode được hay không."""
+    if not out["decoded"]:
+        return False
+    dbg["images_decoded"] += 1
+    dbg["faces_detected"] += out["faces_detected"]
+    dbg["faces_pass_quality"] += out["faces_pass_quality"]
+    for key, n in out["counters"].items():
+        dbg[key] += n
+    dbg["rejected_details"].extend(out["rejected"])
+    return True
+
+
+def _cache_fingerprint(engine) -> str:
+    """Phần key cache ngoài bytes ảnh: mọi tham số ảnh hưởng tới kết quả detect / embed."""
+    return json.dumps([type(engine).__qualname__, _pipeline_kwargs()], sort_keys=True)
+
+
+def _cache_debug(dbg: dict, hits: int, lookups: int):
+    dbg["image_cache"] = {
+        "hits": hits,
+        "misses": lookups - hits,
+        "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+    }
+
+
+def _observe_image(out: dict, queue_wait: float):
+    """Ghi thời gian từng stage của 1 ảnh (output process_attendance_image) vào metrics."""
+    observe_stage("queue_wait", queue_wait * 1000)
+    for stage, ms in out["timings_ms"].items():
+        observe_stage(stage, ms)
+    count("images")
+    count("faces_detected", out["faces_detected"])
+
+
+def _match_mode(gallery) -> dict:
+    calib = gallery.calibration
+    return {
+        "aggregate": settings.match_aggregate,
+        "top_k": settings.match_topk,
+        "one_to_one": settings.match_one_to_one,
+        "calibration": "off" if calib is None or calib.identity else calib.mode,
+    }
+
+
+def _add_request_timings(dbg: dict):
+    """gallery_load / db_write (đo bằng @timed trong crud_async) vào debug.timings_ms của response."""
+    req = request_timings()
+    for stage in ("gallery_load", "db_write"):
+        if stage in req:
+            dbg["timings_ms"][stage] = req[stage]
+
+
+async def _extract_face_embeddings(engine, datas: list[bytes], dbg: dict, on_image=None):
+    """
+    Ảnh (bytes) -> (face_embs (F, D) | None, face_image_ids (F,), face_meta (F,) {bbox, conf}),
+    cập nhật counter/timing vào dbg.
+    Ảnh đã xử lý trước đó (cùng bytes, xem app/core/image_cache.py) lấy lại kết quả detect +
+    embedding từ cache, chỉ ảnh mới chạy inference.
+    on_image(): gọi mỗi khi 1 ảnh xong decode/detect/align (vd cập nhật tiến độ job).
+    """
+    keys, cached = [None] * len(datas), [None] * len(datas)
+    if image_cache.enabled:
+        keys, cached = await asyncio.to_thread(image_cache.lookup, datas, _cache_fingerprint(engine))
+    _cache_debug(dbg, sum(c is not None for c in cached), len(datas))
+    misses = [i for i, c in enumerate(cached) if c is None]
+    count("images_cached", len(datas) - len(misses))
+
+    async def run_image(data: bytes):
+        res = await inference_executor.run(process_attendance_image, engine, data, **_pipeline_kwargs())
+        if on_image is not None:
+            on_image()
+        return res
+
+    # decode/detect/quality/align chạy trên inference executor, các ảnh của
+    # request chạy song song, event loop chỉ await kết quả
+    try:
+        outputs = await asyncio.gather(*(run_image(datas[i]) for i in misses))
+    except InferenceBusy as e:
+        raise HTTPException(503, f"Server busy, try again later ({e})")
+    if on_image is not None:
+        for _ in range(len(datas) - len(misses)):
+            on_image()
+
+    timings = {"queue_wait": 0.0, "decode": 0.0, "detect": 0.0, "quality": 0.0, "align": 0.0, "embed": 0.0}
+    fresh = {}
+    face_crops = []
+    for i, (out, queue_wait) in zip(misses, outputs):
+        timings["queue_wait"] = max(timings["queue_wait"], queue_wait * 1000)
+        for stage, ms in out["timings_ms"].items():
+            timings[stage] += ms
+        _observe_image(out, queue_wait)
+        fresh[i] = out
+        face_crops.extend(out["aligned"])
+
+    # embedding cho mọi face mới của request: 1 (hoặc vài) lượt ArcFace theo batch
+    new_embs = None
+    if face_crops:
+        try:
+            (new_embs, embed_ms), queue_wait = await inference_executor.run(embed_faces, engine, face_crops)
+            timings["queue_wait"] = max(timings["queue_wait"], queue_wait * 1000)
+            timings["embed"] = embed_ms
+            observe_stage("embed", embed_ms)
+            count("faces_embedded", len(face_crops))
+        except InferenceBusy as e:
+            raise HTTPException(503, f"Server busy, try again later ({e})")
+        except Exception as e:
+            logger.warning(f"Embedding error: {e}")
+            dbg["faces_embedding_error"] += len(face_crops)
+            new_embs = None
+
+    # tách embedding theo ảnh, lưu cache (ảnh embed lỗi thì không cache để lần sau thử lại)
+    per_image = {}
+    pos = 0
+    to_cache = []
+    for i in misses:
+        n = len(fresh[i]["aligned"])
+        if n == 0:
+            per_image[i] = None
+        elif new_embs is not None:
+            per_image[i] = new_embs[pos:pos + n]
+        pos += n
+        if keys[i] is not None and (n == 0 or new_embs is not None):
+            to_cache.append((keys[i], fresh[i], per_image[i]))
+    if to_cache:
+        await asyncio.to_thread(lambda: [image_cache.put(*item) for item in to_cache])
+
+    embs_parts = []
+    face_image_ids = []
+    face_meta = []
+    for image_idx in range(len(datas)):
+        if cached[image_idx] is not None:
+            out, embs = cached[image_idx].out, cached[image_idx].embs
+        else:
+            out, embs = fresh[image_idx], per_image.get(image_idx)
+        if not _merge_image_debug(dbg, out) or embs is None:
+            continue
+        embs_parts.append(embs)
+        face_image_ids.extend([image_idx] * len(embs))
+        face_meta.extend(out["faces"])
+
+    # queue_wait: lâu nhất trong các lần chờ; các stage: tổng CPU time qua các ảnh (ảnh lấy từ cache: 0)
+    dbg["timings_ms"] = {k: round(v, 3) for k, v in timings.items()}
+    face_embs = np.concatenate(embs_parts) if embs_parts else None
+    return face_embs, face_image_ids, face_meta
+
+
+def _face_rows(image_ids: list[int], meta: list[dict], embs, student_ids: list, scores: list) -> list[dict]:
+    """Các face đã match -> tham số faces của save_attendance_session (student_id None = unknown)."""
+    return [
+        {"image_idx": i, "bbox": m["bbox"], "conf": m["conf"], "emb": e, "student_id": sid, "score": sc}
+        for i, m, e, sid, sc in zip(image_ids, meta, embs, student_ids, scores)
+    ]
+
+
+async def _run_attendance(engine, db: AsyncSession, class_id: str, datas: list[bytes], threshold: float,
+                          on_image=None) -> dict:
+    """
+    Điểm danh 1 lớp từ các ảnh: detect/embed -> match -> lưu session.
+    Dùng chung cho POST /attendance/ và job điểm danh (POST /attendance/jobs).
+    Return result (kèm session_id), HTTPException nếu lớp chưa có gallery / server bận.
+    """
+    # gallery: names lặp theo số embedding (vì enroll bạn đã lưu nhiều embeddings/1 student)
+    # lấy từ cache theo class_id, chỉ build lại khi có enroll mới
+    gallery = await crud_async.get_gallery(db, class_id)
+    names, gallery_embs = gallery.names, gallery.embs
+    if len(names) == 0:
+        raise HTTPException(400, f"No gallery embeddings for class_id={class_id}. Enroll students first.")
+
+    # danh sách học sinh (unique, theo Student.id) để tính absent/present
+    all_students = dict(zip(gallery.student_keys, gallery.student_names))
+
+    dbg = _new_debug(len(datas))
+    dbg.update({
+        "gallery_vectors": len(names),
+        "gallery_people": len(all_students),
+        "gallery_version": gallery.version,
+    })
+
     present_best = {}
     unknown_faces = 0
+    faces = []
+    face_embs, face_image_ids, face_meta = await _extract_face_embeddings(engine, datas, dbg, on_image=on_image)
+
+    # match tất cả face của request trong 1 lần (1 GEMM), gộp điểm theo student
+    # và gán 1-1 face -> student trong từng ảnh
+    dbg["match_mode"] = _match_mode(gallery)
+    if face_embs is not None:
+        with span("match") as sp:
+            student_idx, scores = match_students(
+                face_embs,
+                gallery_embs,
+                gallery.seg_starts,
+                threshold=threshold,
+                image_ids=face_image_ids,
+                aggregate=settings.match_aggregate,
+                top_k=settings.match_topk,
+                one_to_one=settings.match_one_to_one,
+                calibration=gallery.calibration,
+            )
+        dbg["timings_ms"]["match"] = round(sp.ms, 3)
+        matched_ids = []
+        for idx, score in zip(student_idx.tolist(), scores.tolist()):
+            if idx >= 0:
+                matched_ids.append(gallery.student_keys[idx])
+                update_present_best(present_best, gallery.student_keys[idx], score)
+            else:
+                matched_ids.append(None)
+                unknown_faces += 1
+                # Lưu score cao nhất dù không match để debug
+                dbg.setdefault("unknown_best_scores", []).append(round(score, 4))
+        faces = _face_rows(face_image_ids, face_meta, face_embs, matched_ids, scores.tolist())
 
-    for f in images:
-        data = await f.read()
-        img = decode_upload_to_bgr(data)
-        if img is None:
-            continue
-        dbg["images_decoded"] += 1
-
-        faces = engine.detect(img)  # multi-face detection
-        dbg["faces_detected"] += len(faces)
-
-        for face in faces:
-            ok, meta = quality_gate(img, face, min_conf=min_conf, min_face=min_face, min_blur=min_blur)
-            if not ok:
-                r = meta.get("reason")
-                if r == "lowconf":
-                    dbg["filtered_lowconf"] += 1
-                elif r == "small":
-                    dbg["filtered_small"] += 1
-                elif r == "blur":
-                    dbg["filtered_blur"] += 1
-                elif r == "empty_crop":
-                    dbg["filtered_empty_crop"] += 1
-                # Lưu chi tiết face bị reject để debug
-                dbg["rejected_details"].append(meta)
-                continue
+    result = build_result(
+        class_id=class_id,
+        students=all_students,
+        present_best=present_best,
+        unknown_faces=unknown_faces,
+        threshold=threshold,
+        dbg=dbg,
+    )
+
+    session_id = str(uuid.uuid4())
+    await crud_async.save_attendance_session(
+        db,
+        session_id=session_id,
+        class_id=class_id,
+        images_count=len(datas),
+        result=result,
+        threshold=threshold,
+        faces=faces,
+    )
+    _add_request_timings(dbg)
+
+    result["session_id"] = session_id
+    return result
 
-            dbg["faces_pass_quality"] += 1
 
-            # Kiểm tra landmarks trước khi tính embedding
-            landmarks = getattr(face, "landmarks", None)
-            if landmarks is None:
-                dbg["filtered_no_landmarks"] += 1
-                dbg["rejected_details"].append({"reason": "no_landmarks"})
+@router.post("/")
+async def attendance(
+    class_id: str = Form(...),
+    images: list[UploadFile] = File(...),
+    threshold: float = Form(0.40),
+    db: AsyncSession = Depends(get_async_db),
+    engine=Depends(get_engine),
+):
+    datas = [await f.read() for f in images]
+    return await _run_attendance(engine, db, class_id, datas, threshold)
+
+
+async def run_attendance_job(job, datas: list[bytes], progress) -> str:
+    """
+    Handler của job_queue: chạy điểm danh cho 1 job, return session_id.
+    Gallery / lưu phiên qua AsyncSession riêng. Executor đầy (route sync trả 503) thì raise
+    InferenceBusy để job_queue trả job về hàng đợi thay vì đánh dấu failed.
+    """
+    engine = await asyncio.to_thread(engine_registry.get)
+    try:
+        async with AsyncSessionLocal() as adb:
+            result = await _run_attendance(engine, adb, job.class_id, datas, job.threshold, on_image=progress)
+    except HTTPException as e:
+        if e.status_code == 503:
+            raise InferenceBusy(e.detail) from e
+        raise
+    return result["session_id"]
+
+
+@router.post("/jobs", status_code=202)
+async def submit_attendance_job(
+    class_id: str = Form(...),
+    images: list[UploadFile] = File(...),
+    threshold: float = Form(0.40),
+    lane: str = Form("live"),
+    db: AsyncSession = Depends(get_async_db),
+):
+    """
+    Điểm danh bất đồng bộ: lưu ảnh + tạo job rồi trả job_id ngay, kết quả xem ở
+    GET /attendance/jobs/{job_id}. lane="live" (điểm danh trực tiếp, ưu tiên) hoặc
+    "bulk" (xử lý lại hàng loạt).
+    """
+    if lane not in LANES:
+        raise HTTPException(400, f"lane must be one of {list(LANES)}")
+    if len(images) == 0:
+        raise HTTPException(400, "No images")
+    if len(await crud_async.get_gallery(db, class_id)) == 0:
+        raise HTTPException(400, f"No gallery embeddings for class_id={class_id}. Enroll students first.")
+
+    datas = [await f.read() for f in images]
+    try:
+        # ghi file + insert job (sync) ngoài event loop
+        job, position = await asyncio.to_thread(job_queue.submit, class_id, threshold, lane, datas)
+    except JobQueueFull as e:
+        raise HTTPException(429, f"Too many queued jobs, try again later ({e})",
+                            headers={"Retry-After": str(int(settings.jobs_poll_interval * 5))})
+    return {"job_id": job.id, "status": job.status, "lane": job.lane, "position": position}
+
+
+@router.get("/jobs/{job_id}")
+def get_attendance_job_status(job_id: str, db: Session = Depends(get_db)):
+    job = get_attendance_job(db, job_id)
+    if job is None:
+        raise HTTPException(404, "Job not found")
+
+    out = {
+        "job_id": job.id,
+        "class_id": job.class_id,
+        "lane": job.lane,
+        "status": job.status,
+        "position": job_queue.queue_position(db, job),
+        "images_total": job.images_total,
+        "images_done": job.images_done,
+        "attempts": job.attempts,
+        "created_at": job.created_at.isoformat() if job.created_at else None,
+        "started_at": job.started_at.isoformat() if job.started_at else None,
+        "finished_at": job.finished_at.isoformat() if job.finished_at else None,
+        "error": job.error,
+        "session_id": job.session_id,
+        "result": None,
+    }
+    if job.status == "done" and job.session_id:
+        s = get_session(db, job.session_id)
+        if s is not None:
+            out["result"] = get_session_result(db, s)
+            if out["result"] is not None:
+                out["result"]["session_id"] = s.id
+    return out
+
+
+@router.get("/job-queue")
+def get_job_queue_stats():
+    return job_queue.stats() | {"leader": leader.stats()}
+
+
+def _encode_event(event: dict, sse: bool) -> bytes:
+    data = json.dumps(event, ensure_ascii=False)
+    if sse:
+        return f"event: {event['event']}\ndata: {data}\n\n".encode("utf-8")
+    return (data + "\n").encode("utf-8")
+
+
+async def _process_stream_image(engine, data: bytes):
+    """
+    decode/detect/quality/align + embedding cho 1 ảnh (hoặc lấy từ image cache).
+    Return (out, embs | None, queue_wait_s, cache hit).
+    """
+    key = None
+    if image_cache.enabled:
+        key, hit = await asyncio.to_thread(lambda: image_cache.lookup([data], _cache_fingerprint(engine)))
+        key, hit = key[0], hit[0]
+        if hit is not None:
+            out = dict(hit.out, timings_ms={k: 0.0 for k in hit.out["timings_ms"]})
+            count("images_cached")
+            return out, hit.embs, 0.0, True
+
+    out, queue_wait = await inference_executor.run(process_attendance_image, engine, data, **_pipeline_kwargs())
+    out["timings_ms"]["embed"] = 0.0
+    embs = None
+    if out["aligned"]:
+        (embs, embed_ms), wait = await inference_executor.run(embed_faces, engine, out["aligned"])
+        out["timings_ms"]["embed"] = embed_ms
+        queue_wait = max(queue_wait, wait)
+        count("faces_embedded", len(embs))
+    _observe_image(out, queue_wait)
+    if key is not None:
+        await asyncio.to_thread(image_cache.put, key, out, embs)
+    return out, embs, queue_wait, False
+
+
+@router.post("/stream")
+async def attendance_stream(
+    request: Request,
+    format: str = Query("ndjson", pattern="^(ndjson|sse)$"),
+    engine=Depends(get_engine),
+):
+    """
+    Điểm danh dạng streaming: body multipart như POST /attendance/ (field class_id,
+    threshold phải đứng trước các file images). Mỗi ảnh được đưa vào detect ngay khi
+    nhận xong part của nó (song song với phần upload còn lại), kết quả trả dần:
+
+      {"event": "image", "index", "filename", "faces_detected", "matched": [...], ...}  mỗi ảnh
+      {"event": "result", ...}   cuối cùng, giống response của POST /attendance/ + session_id
+      {"event": "error", "status", "detail"}   khi lỗi (vượt giới hạn, thiếu class_id, ...)
+
+    format=ndjson (mặc định, 1 JSON / dòng) hoặc sse (text/event-stream).
+    Giới hạn mỗi request: settings.stream_max_mb, settings.stream_max_images.
+    """
+    try:
+        multipart_boundary(request.headers.get("content-type", ""))
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+    max_bytes = settings.stream_max_mb * 1024 * 1024
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > max_bytes:
+        raise HTTPException(413, f"Request body too large (limit {settings.stream_max_mb} MB)")
+
+    sse = format == "sse"
+    media_type = "text/event-stream" if sse else "application/x-ndjson"
+    return BodyStreamingResponse(_attendance_events(request, engine, sse, max_bytes), media_type=media_type)
+
+
+async def _attendance_events(request: Request, engine, sse: bool, max_bytes: int):
+    t_start = time.perf_counter()
+    queue: asyncio.Queue = asyncio.Queue()
+    tasks: set = set()
+    state = {"images": 0, "bytes": 0, "body_read": False}
+
+    async def run_image(idx: int, filename: str, data: bytes):
+        try:
+            await queue.put(("image", idx, filename, await _process_stream_image(engine, data)))
+        except InferenceBusy as e:
+            await queue.put(("image_error", idx, filename, f"Server busy ({e})"))
+        except Exception as e:
+            logger.warning(f"Stream image {idx} error: {e}")
+            await queue.put(("image_error", idx, filename, str(e)))
+
+    async def reader():
+        fields = {}
+        fields_done = False
+        try:
+            async for part in iter_multipart(request, max_bytes=max_bytes, max_files=settings.stream_max_images):
+                state["bytes"] += len(part.data)
+                if not part.is_file:
+                    if not fields_done:
+                        fields[part.name] = part.text()
+                    continue
+                if part.name != "images":
+                    continue
+                if not fields_done:
+                    fields_done = True
+                    await queue.put(("fields", fields))
+                idx = state["images"]
+                state["images"] += 1
+                task = asyncio.create_task(run_image(idx, part.filename, part.data))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            state["body_read"] = True
+            if not fields_done:
+                await queue.put(("fields", fields))
+            while tasks:
+                await asyncio.gather(*list(tasks))
+            await queue.put(("end",))
+        except StreamLimitExceeded as e:
+            await queue.put(("abort", 413, str(e)))
+        except Exception as e:
+            await queue.put(("abort", 400, f"Invalid multipart body: {e}"))
+
+    db = AsyncSessionLocal()
+    reader_task = asyncio.create_task(reader())
+    try:
+        gallery = None
+        class_id = None
+        threshold = 0.40
+        all_students = {}
+        dbg = _new_debug(0)
+        timings = {"queue_wait": 0.0, "decode": 0.0, "detect": 0.0, "quality": 0.0,
+                   "align": 0.0, "embed": 0.0, "match": 0.0}
+        present_best = {}
+        unknown_faces = 0
+        faces = []
+        first_image_ms = None
+        cache_hits = 0
+
+        while True:
+            msg = await queue.get()
+            kind = msg[0]
+            # đọc xong body thì request.stream() không còn báo ClientDisconnect: tự kiểm tra giữa
+            # các ảnh (trước đó không được gọi, is_disconnected() sẽ nuốt 1 message http.request)
+            if state["body_read"] and await request.is_disconnected():
+                logger.info(f"Stream client disconnected after {state['images']} images, stopping")
+                return
+
+            if kind == "abort":
+                yield _encode_event({"event": "error", "status": msg[1], "detail": msg[2]}, sse)
+                return
+
+            if kind == "fields":
+                fields = msg[1]
+                class_id = (fields.get("class_id") or "").strip()
+                try:
+                    threshold = float(fields.get("threshold") or 0.40)
+                except ValueError:
+                    yield _encode_event({"event": "error", "status": 400, "detail": "threshold must be a number"}, sse)
+                    return
+                if not class_id:
+                    yield _encode_event({"event": "error", "status": 400,
+                                         "detail": "class_id is required (before images)"}, sse)
+                    return
+                gallery = await crud_async.get_gallery(db, class_id)
+                if len(gallery) == 0:
+                    yield _encode_event({"event": "error", "status": 400,
+                                         "detail": f"No gallery embeddings for class_id={class_id}. Enroll students first."}, sse)
+                    return
+                all_students = dict(zip(gallery.student_keys, gallery.student_names))
+                dbg.update({
+                    "gallery_vectors": len(gallery),
+                    "gallery_people": len(all_students),
+                    "gallery_version": gallery.version,
+                })
                 continue
 
-            try:
-                emb = engine.embedding(img, landmarks)
-            except Exception as e:
-                logger.warning(f"Embedding error: {e}")
-                dbg["faces_embedding_error"] += 1
+            if kind == "image_error":
+                _, idx, filename, detail = msg
+                yield _encode_event({"event": "image", "index": idx, "filename": filename, "error": detail}, sse)
                 continue
 
-            matched, score = best_match(emb, names, gallery_embs, threshold=threshold)
+            if kind == "image":
+                _, idx, filename, (out, embs, queue_wait, cache_hit) = msg
+                cache_hits += int(cache_hit)
+                if first_image_ms is None:
+                    first_image_ms = (time.perf_counter() - t_start) * 1000
+                timings["queue_wait"] = max(timings["queue_wait"], queue_wait * 1000)
+                for stage, ms in out["timings_ms"].items():
+                    timings[stage] += ms
+                _merge_image_debug(dbg, out)
+
+                matched = []
+                image_unknown = 0
+                if embs is not None:
+                    # gán 1-1 trong từng ảnh nên match từng ảnh riêng cho cùng kết quả với POST /attendance/
+                    with span("match") as sp:
+                        student_idx, scores = match_students(
+                            embs, gallery.embs, gallery.seg_starts, threshold=threshold,
+                            aggregate=settings.match_aggregate, top_k=settings.match_topk,
+                            one_to_one=settings.match_one_to_one, calibration=gallery.calibration,
+                        )
+                    timings["match"] += sp.ms
+                    matched_ids = []
+                    for si, score in zip(student_idx.tolist(), scores.tolist()):
+                        if si >= 0:
+                            sid = gallery.student_keys[si]
+                            matched_ids.append(sid)
+                            update_present_best(present_best, sid, score)
+                            matched.append({"student_id": sid, "name": all_students.get(sid), "score": score})
+                        else:
+                            matched_ids.append(None)
+                            image_unknown += 1
+                            dbg.setdefault("unknown_best_scores", []).append(round(score, 4))
+                    faces.extend(_face_rows([idx] * len(embs), out["faces"], embs, matched_ids, scores.tolist()))
+                unknown_faces += image_unknown
+                yield _encode_event({
+                    "event": "image",
+                    "index": idx,
+                    "filename": filename,
+                    "decoded": out["decoded"],
+                    "faces_detected": out["faces_detected"],
+                    "faces_pass_quality": out["faces_pass_quality"],
+                    "matched": matched,
+                    "unknown_faces": image_unknown,
+                    "count_present": len(present_best),
+                    "timings_ms": {k: round(v, 3) for k, v in out["timings_ms"].items()},
+                }, sse)
+                continue
 
-            if matched is None:
+            # kind == "end"
+            break
+
+        dbg["images_received"] = state["images"]
+        dbg["timings_ms"] = {k: round(v, 3) for k, v in timings.items()}
+        _cache_debug(dbg, cache_hits, state["images"])
+        dbg["stream"] = {
+            "bytes_received": state["bytes"],
+            "first_image_ms": round(first_image_ms, 3) if first_image_ms is not None else None,
+            "total_ms": round((time.perf_counter() - t_start) * 1000, 3),
+        }
+        if state["images"] == 0:
+            yield _encode_event({"event": "error", "status": 400, "detail": "No images"}, sse)
+            return
+        dbg["match_mode"] = _match_mode(gallery)
+
+        result = build_result(
+            class_id=class_id,
+            students=all_students,
+            present_best=present_best,
+            unknown_faces=unknown_faces,
+            threshold=threshold,
+            dbg=dbg,
+        )
+        session_id = str(uuid.uuid4())
+        await crud_async.save_attendance_session(
+            db,
+            session_id=session_id,
+            class_id=class_id,
+            images_count=state["images"],
+            result=result,
+            threshold=threshold,
+            faces=faces,
+        )
+        _add_request_timings(dbg)
+        result["session_id"] = session_id
+        yield _encode_event({"event": "result", **result}, sse)
+    finally:
+        reader_task.cancel()
+        for task in list(tasks):
+            task.cancel()
+        await db.close()
+
+
+def _video_kwargs() -> dict:
+    """Tham số của process_video (ngưỡng quality như ảnh + cấu hình lấy mẫu / track)."""
+    return {
+        "min_conf": MIN_CONF,
+        "min_face": MIN_FACE,
+        "min_blur": MIN_BLUR,
+        "detect_max_side": settings.video_detect_max_side,
+        "sample_fps": settings.video_sample_fps,
+        "max_gap_s": settings.video_max_gap_s,
+        "max_seconds": settings.video_max_seconds,
+        "embeds_per_track": settings.video_embeds_per_track,
+        "embed_gap_s": settings.video_embed_gap_s,
+        "track_iou": settings.video_track_iou,
+        "track_max_age_s": settings.video_track_max_age_s,
+        "reid_threshold": settings.video_reid_threshold,
+        "motion_threshold": settings.video_motion_threshold,
+    }
+
+
+def _spool_video(src, filename: str, max_bytes: int, chunk_size: int = 1024 * 1024) -> str:
+    """
+    Copy upload ra file tạm (OpenCV chỉ đọc video từ file) theo từng chunk. Return path,
+    ValueError ngay khi vượt max_bytes (không ghi hết file quá lớn ra đĩa).
+    """
+    suffix = os.path.splitext(filename or "")[1].lower() or ".mp4"
+    fd, path = tempfile.mkstemp(prefix="attendance_video_", suffix=suffix)
+    try:
+        with os.fdopen(fd, "wb") as dst:
+            size = 0
+            while chunk := src.read(chunk_size):
+                size += len(chunk)
+                if size > max_bytes:
+                    raise ValueError(f"Video too large (limit {max_bytes // (1024 * 1024)} MB)")
+                dst.write(chunk)
+    except Exception:
+        os.remove(path)
+        raise
+    return path
+
+
+@router.post("/video")
+async def attendance_video(
+    class_id: str = Form(...),
+    video: UploadFile = File(...),
+    threshold: float = Form(0.40),
+    db: AsyncSession = Depends(get_async_db),
+    engine=Depends(get_engine),
+):
+    """
+    Điểm danh từ 1 video quay lia lớp học (hoặc burst ghép thành video): lấy mẫu frame thích ứng,
+    track face qua các frame, mỗi track chỉ embed vài lần, điểm match gộp theo track
+    (xem app/core/video.py). Response như POST /attendance/ + "tracks" (từng người thấy trong video);
+    debug.video có frames_per_s (frame đọc / giây xử lý) và realtime_factor (> 1: nhanh hơn thời gian thực).
+    """
+    gallery = await crud_async.get_gallery(db, class_id)
+    if len(gallery) == 0:
+        raise HTTPException(400, f"No gallery embeddings for class_id={class_id}. Enroll students first.")
+    all_students = dict(zip(gallery.student_keys, gallery.student_names))
+
+    max_bytes = settings.video_max_mb * 1024 * 1024
+    if video.size is not None and video.size > max_bytes:
+        raise HTTPException(413, f"Video too large (limit {settings.video_max_mb} MB)")
+    try:
+        path = await asyncio.to_thread(_spool_video, video.file, video.filename, max_bytes)
+    except ValueError as e:
+        raise HTTPException(413, str(e))
+    try:
+        out, queue_wait = await inference_executor.run(process_video, engine, path, **_video_kwargs())
+    except InferenceBusy as e:
+        raise HTTPException(503, f"Server busy, try again later ({e})")
+    except VideoError as e:
+        raise HTTPException(400, f"Invalid video: {e}")
+    finally:
+        os.remove(path)
+
+    dbg = _new_debug(1)
+    dbg["images_decoded"] = 1
+    for key, n in out["counters"].items():
+        dbg[key] = dbg.get(key, 0) + n
+    dbg.update({
+        "gallery_vectors": len(gallery),
+        "gallery_people": len(all_students),
+        "gallery_version": gallery.version,
+        "match_mode": _match_mode(gallery),
+    })
+    timings = dict(out["timings_ms"], queue_wait=round(queue_wait * 1000, 3))
+    observe_stage("queue_wait", queue_wait * 1000)
+    for stage in ("detect", "quality", "track", "align", "embed"):
+        observe_stage(f"video_{stage}", out["timings_ms"][stage])
+    count("video_frames", out["video"]["frames_processed"])
+    count("faces_detected", out["counters"]["faces_detected"])
+    count("faces_embedded", out["counters"]["faces_embedded"])
+
+    tracks = out["tracks"]
+    present_best = {}
+    unknown_faces = 0
+    faces = []
+    track_out = []
+    if tracks:
+        with span("match") as sp:
+            embs = np.concatenate([t["embs"] for t in tracks])
+            owner = np.repeat(np.arange(len(tracks)), [len(t["embs"]) for t in tracks])
+            _, student_idx, scores = match_tracks(
+                embs, owner, gallery.embs, gallery.seg_starts, threshold=threshold,
+                aggregate=settings.match_aggregate, top_k=settings.match_topk,
+                one_to_one=settings.match_one_to_one, calibration=gallery.calibration,
+            )
+        timings["match"] = round(sp.ms, 3)
+        for t, idx, score in zip(tracks, student_idx.tolist(), scores.tolist()):
+            sid = gallery.student_keys[idx] if idx >= 0 else None
+            if sid is None:
                 unknown_faces += 1
-                # Lưu score cao nhất dù không match để debug
                 dbg.setdefault("unknown_best_scores", []).append(round(score, 4))
             else:
-                update_present_best(present_best, matched, score)
+                update_present_best(present_best, sid, score)
+            mean = t["embs"].mean(axis=0)
+            faces.append({"image_idx": 0, "bbox": t["bbox"], "conf": t["conf"],
+                          "emb": mean / max(float(np.linalg.norm(mean)), 1e-9), "student_id": sid, "score": score})
+            track_out.append({"track_id": t["track_id"], "student_id": sid, "name": all_students.get(sid),
+                              "score": round(score, 4), "first_s": t["first_s"], "last_s": t["last_s"],
+                              "frames": t["frames"], "embeddings": len(t["embs"])})
+
+    v = out["video"]
+    elapsed_s = out["timings_ms"]["total"] / 1000
+    dbg["video"] = dict(
+        v,
+        frames_per_s=round(v["frames_read"] / elapsed_s, 2) if elapsed_s > 0 else None,
+        processed_frames_per_s=round(v["frames_processed"] / elapsed_s, 2) if elapsed_s > 0 else None,
+        realtime_factor=round(v["duration_s"] / elapsed_s, 2) if elapsed_s > 0 else None,
+    )
+    dbg["timings_ms"] = timings
 
     result = build_result(
         class_id=class_id,
-        all_names=all_students,
+        students=all_students,
         present_best=present_best,
         unknown_faces=unknown_faces,
         threshold=threshold,
         dbg=dbg,
     )
-
     session_id = str(uuid.uuid4())
-    save_attendance_session(
+    await crud_async.save_attendance_session(
         db,
         session_id=session_id,
         class_id=class_id,
-        images_count=len(images),
+        images_count=1,
         result=result,
         threshold=threshold,
+        faces=faces,
     )
-
+    _add_request_timings(dbg)
+    result["tracks"] = track_out
     result["session_id"] = session_id
     return result
 
 
-@router.get("/sessions")
-def get_sessions(class_id: str = Query(...), db: Session = Depends(get_db)):
-    rows = list_sessions(db, class_id=class_id)
+@router.post("/identify")
+async def identify(
+    images: list[UploadFile] = File(...),
+    threshold: float = Form(0.40),
+    engine=Depends(get_engine),
+):
+    """
+    Nhận diện không giới hạn theo lớp (cổng trường, căng tin): match với mọi học sinh
+    đã enroll qua campus index (IVF/Flat, xem app/core/campus_index.py).
+    """
+    dbg = _new_debug(len(images))
+    datas = [await f.read() for f in images]
+    face_embs, face_image_ids, _ = await _extract_face_embeddings(engine, datas, dbg)
+
+    # ensure mở session riêng trong thread: không chia sẻ Session của request giữa các thread
+    await asyncio.to_thread(campus_index.ensure)
+    dbg["campus_index"] = campus_index.stats()
+
+    identified = {}
+    unknown_faces = 0
+    if face_embs is not None:
+        with span("match") as sp:
+            student_ids, scores = await asyncio.to_thread(campus_index.identify, face_embs, threshold=threshold,
+                                                          image_ids=face_image_ids)
+        dbg["timings_ms"]["match"] = round(sp.ms, 3)
+        for sid, score in zip(student_ids, scores.tolist()):
+            if sid is None:
+                unknown_faces += 1
+                dbg.setdefault("unknown_best_scores", []).append(round(score, 4))
+            else:
+                update_present_best(identified, sid, score)
 
-    now = datetime.now(timezone.utc)
     out = []
+    for sid, score in sorted(identified.items(), key=lambda x: -x[1]):
+        name, cls = campus_index.student_info(sid)
+        out.append({"student_id": sid, "name": name, "class_id": cls, "score": score})
 
-    for r in rows:
-        created_at = r.created_at
-        # SQLite thường trả datetime "naive" (không tz), gắn UTC cho nhất quán
-        if created_at is not None and created_at.tzinfo is None:
-            created_at = created_at.replace(tzinfo=timezone.utc)
+    return {
+        "count_identified": len(out),
+        "identified": out,
+        "unknown_faces_count": unknown_faces,
+        "threshold": threshold,
+        "debug": dbg,
+    }
+
+
+@router.get("/campus-index")
+def get_campus_index_stats():
+    return campus_index.stats()
+
+
+@router.get("/gallery-cache")
+def get_gallery_cache_stats():
+    return gallery_cache.stats()
+
+
+@router.get("/image-cache")
+def get_image_cache_stats():
+    return image_cache.stats()
+
+
+@router.get("/inference-stats")
+def get_inference_stats():
+    return inference_executor.stats()
+
+
+def _session_expiry(created_at: datetime, now: datetime):
+    """(created_at có tz, expires_at, days_left) theo retention_days."""
+    # SQLite thường trả datetime "naive" (không tz), gắn UTC cho nhất quán
+    if created_at.tzinfo is None:
+        created_at = created_at.replace(tzinfo=timezone.utc)
+    expires_at = created_at + timedelta(days=settings.retention_days)
+    return created_at, expires_at, max(0, (expires_at - now).days)
+
+
+def _encode_cursor(created_at: datetime, session_id: str) -> str:
+    raw = json.dumps([created_at.isoformat(), session_id]).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def _decode_cursor(cursor: str):
+    try:
+        created_at, session_id = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        return datetime.fromisoformat(created_at), str(session_id)
+    except (ValueError, TypeError):
+        raise HTTPException(400, "Invalid cursor")
 
-        expires_at = created_at + timedelta(days=30)
-        days_left = (expires_at - now).days
-        if days_left < 0:
-            days_left = 0
 
+@router.get("/sessions")
+def get_sessions(
+    response: Response,
+    class_id: str = Query(...),
+    limit: int = Query(50, ge=1, le=500),
+    cursor: str | None = Query(None, description="X-Next-Cursor của trang trước"),
+    date_from: date | None = Query(None),
+    date_to: date | None = Query(None),
+    db: Session = Depends(get_db),
+):
+    """
+    Phiên của lớp, mới nhất trước, phân trang keyset: còn trang sau thì response có header
+    X-Next-Cursor, gửi lại qua ?cursor= để lấy trang tiếp (ổn định khi có phiên mới chen vào).
+    """
+    start, end = date_range(date_from, date_to)
+    rows = list_sessions(db, class_id=class_id, limit=limit + 1, before=_decode_cursor(cursor) if cursor else None,
+                         date_from=start, date_to=end)
+    if len(rows) > limit:
+        rows = rows[:limit]
+        response.headers["X-Next-Cursor"] = _encode_cursor(rows[-1].created_at, rows[-1].id)
+
+    now = datetime.now(timezone.utc)
+    out = []
+    for r in rows:
+        created_at, expires_at, days_left = _session_expiry(r.created_at, now)
         out.append({
             "session_id": r.id,
             "class_id": r.class_id,
@@ -166,37 +958,18 @@ def get_sessions(class_id: str = Query(...), db: Session = Depends(get_db)):
             "unknown_faces_count": r.unknown_faces_count,
             "threshold": r.threshold,
         })
-
     return out
 
 
-
 @router.get("/sessions/{session_id}")
-def get_session_detail(session_id: str, db: Session = Depends(get_db)):
+def get_session_detail(session_id: str, faces: bool = Query(False), db: Session = Depends(get_db)):
+    """faces=true: kèm từng face của phiên (bbox, student match, score) từ attendance_faces."""
     row = get_session(db, session_id)
     if not row:
         raise HTTPException(status_code=404, detail="session not found")
 
-    now = datetime.now(timezone.utc)
-
-    created_at = row.created_at
-    if created_at is not None and created_at.tzinfo is None:
-        created_at = created_at.replace(tzinfo=timezone.utc)
-
-    expires_at = created_at + timedelta(days=30)
-    days_left = (expires_at - now).days
-    if days_left < 0:
-        days_left = 0
-
-    # parse result json stored in note (nếu note là json)
-    result = None
-    if row.note:
-        try:
-            result = json.loads(row.note)
-        except Exception:
-            result = {"raw_note": row.note}
-
-    return {
+    created_at, expires_at, days_left = _session_expiry(row.created_at, datetime.now(timezone.utc))
+    out = {
         "session_id": row.id,
         "class_id": row.class_id,
         "created_at": created_at.isoformat(),
@@ -205,5 +978,18 @@ def get_session_detail(session_id: str, db: Session = Depends(get_db)):
         "images_count": row.images_count,
         "unknown_faces_count": row.unknown_faces_count,
         "threshold": row.threshold,
-        "result": result,
+        "result": get_session_result(db, row),
     }
+    if faces:
+        out["faces"] = [
+            {
+                "image_id": f.image_id,
+                "bbox": json.loads(f.bbox) if f.bbox else None,
+                "confidence": f.confidence,
+                "student_id": f.matched_student_id,
+                "score": f.match_score,
+                "status": f.status,
+            }
+            for f in list_session_faces(db, row.id)
+        ]
+    return out
@@ -1,8 +1,15 @@
-from fastapi import APIRouter, Depends
+from datetime import date
+from itertools import groupby
+
+from fastapi import APIRouter, Depends, Query, HTTPException
 from sqlalchemy.orm import Session
 
 from app.deps import get_db
 from app.db.models import ClassRoom  # hoặc import crud.list_classes nếu bạn đã tách crud
+from app.settings import settings
+from app.db.crud import class_attendance_report, class_daily_rollup, class_student_daily_rollup, get_gallery
+from app.core.attendance_logic import rollup_summary
+from app.api.routes_students import date_range
 
 router = APIRouter(prefix="/classes", tags=["classes"])
 
@@ -17,3 +24,125 @@ def get_classes(db: Session = Depends(get_db)):
         }
         for r in rows
     ]
+
+
+@router.get("/{class_id}/attendance-report")
+def get_class_attendance_report(
+    class_id: str,
+    date_from: date | None = Query(None),
+    date_to: date | None = Query(None),
+    db: Session = Depends(get_db),
+):
+    """Báo cáo điểm danh của lớp trong khoảng ngày (UTC): mỗi học sinh số phiên có mặt/vắng, tỉ lệ."""
+    if db.get(ClassRoom, class_id) is None:
+        raise HTTPException(404, "Class not found")
+
+    start, end = date_range(date_from, date_to)
+    sessions, rows = class_attendance_report(db, class_id, start, end)
+    return {
+        "class_id": class_id,
+        "date_from": date_from,
+        "date_to": date_to,
+        "sessions": sessions,
+        "students": [
+            {
+                "student_id": sid,
+                "name": name,
+                "sessions": total,
+                "present": present,
+                "absent": total - present,
+                "attendance_rate": round(present / total, 4) if total else None,
+                "avg_score": round(avg_score, 4) if avg_score is not None else None,
+                "last_present_at": last_present_at,
+            }
+            for sid, name, total, present, avg_score, last_present_at in rows
+        ],
+    }
+
+
+@router.get("/{class_id}/attendance-summary")
+def get_class_attendance_summary(
+    class_id: str,
+    date_from: date | None = Query(None),
+    date_to: date | None = Query(None),
+    chronic_rate: float | None = Query(None, ge=0, le=1, description="mặc định CHRONIC_ABSENCE_RATE"),
+    min_sessions: int | None = Query(None, ge=1, description="mặc định CHRONIC_MIN_SESSIONS"),
+    db: Session = Depends(get_db),
+):
+    """
+    Tổng hợp dài hạn của lớp (cả học kỳ) từ bảng tổng hợp ngày, không quét từng phiên:
+    tỉ lệ có mặt theo ngày, mỗi học sinh (tỉ lệ, chuỗi ngày có mặt / vắng) và danh sách
+    vắng thường xuyên. Ngày theo UTC, gồm cả date_to.
+    """
+    if db.get(ClassRoom, class_id) is None:
+        raise HTTPException(404, "Class not found")
+    chronic_rate = settings.chronic_absence_rate if chronic_rate is None else chronic_rate
+    min_sessions = settings.chronic_min_sessions if min_sessions is None else min_sessions
+
+    daily = class_daily_rollup(db, class_id, date_from, date_to)
+    students = []
+    for (sid, name), rows in groupby(class_student_daily_rollup(db, class_id, date_from, date_to),
+                                     key=lambda r: (r[0], r[1])):
+        summary = rollup_summary([(day, n, present, score) for _, _, day, n, present, score in rows],
+                                 chronic_rate, min_sessions)
+        students.append({"student_id": sid, "name": name, **summary})
+    students.sort(key=lambda x: (x["name"] or "", x["student_id"]))
+
+    results = sum(r.results for r in daily)
+    present = sum(r.present for r in daily)
+    chronic = sorted((s for s in students if s["chronic_absent"]),
+                     key=lambda s: (-s["absent"] / s["sessions"], s["student_id"]))
+    return {
+        "class_id": class_id,
+        "date_from": date_from,
+        "date_to": date_to,
+        "days": len(daily),
+        "sessions": sum(r.sessions for r in daily),
+        "attendance_rate": round(present / results, 4) if results else None,
+        "unknown_faces": sum(r.unknown_faces for r in daily),
+        "daily": [
+            {
+                "day": r.day,
+                "sessions": r.sessions,
+                "present": r.present,
+                "absent": r.results - r.present,
+                "attendance_rate": round(r.present / r.results, 4) if r.results else None,
+                "unknown_faces": r.unknown_faces,
+            }
+            for r in daily
+        ],
+        "students": students,
+        "chronic_absentees": {
+            "absence_rate": chronic_rate,
+            "min_sessions": min_sessions,
+            "students": [
+                {"student_id": s["student_id"], "name": s["name"], "sessions": s["sessions"], "absent": s["absent"],
+                 "absence_rate": round(s["absent"] / s["sessions"], 4), "current_streak": s["streaks"]["current"]}
+                for s in chronic
+            ],
+        },
+    }
+
+
+@router.get("/{class_id}/calibration")
+def get_class_calibration(class_id: str, db: Session = Depends(get_db)):
+    """
+    Hiệu chỉnh điểm theo học sinh của gallery hiện tại (xem app/core/calibration.py): phân bố
+    impostor (điểm với face của học sinh khác trong lớp), genuine (leave-one-out) và scale/bias.
+    Học sinh có impostor_mean cao là người dễ bị nhận nhầm; genuine_mean thấp là ảnh enroll kém.
+    """
+    if db.get(ClassRoom, class_id) is None:
+        raise HTTPException(404, "Class not found")
+    gallery = get_gallery(db, class_id)
+    calib = gallery.calibration
+    names = dict(zip(gallery.student_keys, gallery.student_names))
+    students = calib.student_stats(gallery.student_keys) if calib is not None else []
+    for s in students:
+        s["name"] = names.get(s["student_id"])
+    return {
+        "class_id": class_id,
+        "version": gallery.version,
+        "embeddings": len(gallery),
+        "calibration": calib.stats() if calib is not None else None,
+        "students": students,
+    }
@@ -1,15 +1,19 @@
+import asyncio
+import zipfile
+
 from fastapi import APIRouter, UploadFile, File, Form, HTTPException, Depends
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 import numpy as np
 
-from app.deps import get_db
-from app.core.uniface_engine import UniFaceEngine
-from app.db.crud import upsert_class, upsert_student, insert_embedding
+from app.deps import get_async_db, get_engine
+from app.settings import settings
+from app.db.crud_async import enroll_student, pack_class_gallery
 
-from app.utils.image import decode_upload_to_bgr
+from app.core.inference import inference_executor, InferenceBusy
+from app.core.pipeline import process_enroll_image, embed_faces
+from app.core.bulk_enroll import bulk_enroll, scan_zip, BulkEnrollError
 
 router = APIRouter(prefix="/enroll", tags=["enroll"])
-engine = UniFaceEngine()
 
 @router.post("/")
 async def enroll(
@@ -17,38 +21,43 @@ async def enroll(
     student_id: str = Form(...),
     student_name: str = Form(...),
     images: list[UploadFile] = File(...),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
+    engine=Depends(get_engine),
 ):
     if len(images) == 0:
         raise HTTPException(400, "No images")
 
-    embs = []
-    for f in images:
-        data = await f.read()
-        img = decode_upload_to_bgr(data)
-        if img is None:
-            continue
-
-        faces = engine.detect(img)
-        if not faces:
-            continue
-
-        faces = sorted(faces, key=lambda x: x.confidence, reverse=True)
-        face = faces[0]
-        emb = engine.embedding(img, face.landmarks)
-        embs.append(emb)
+    # decode/detect/align chạy trên inference executor (song song, không chặn event loop),
+    # sau đó embedding mọi ảnh trong 1 batch
+    datas = [await f.read() for f in images]
+    try:
+        outputs = await asyncio.gather(*(
+            inference_executor.run(
+                process_enroll_image, engine, data,
+                detect_max_side=settings.detect_max_side,
+                detect_decode=settings.detect_decode,
+                align_full_res_below=settings.align_full_res_below,
+            )
+            for data in datas
+        ))
+        crops = [crop for crop, _ in outputs if crop is not None]
+        embs = []
+        if crops:
+            (embs, _), _ = await inference_executor.run(embed_faces, engine, crops)
+    except InferenceBusy as e:
+        raise HTTPException(503, f"Server busy, try again later ({e})")
 
     if len(embs) == 0:
         raise HTTPException(400, "No valid face found in uploaded images")
     
-    upsert_class(db, class_id=class_id, name=class_id)
-    upsert_student(db, student_id=student_id, class_id=class_id, name=student_name)
+    # lớp + học sinh + mọi embedding: 1 transaction, 1 commit
+    embs = np.asarray(embs, dtype=np.float32)
+    embs = embs / (np.linalg.norm(embs, axis=1, keepdims=True) + 1e-9)
+    saved = len(await enroll_student(db, class_id=class_id, student_id=student_id, name=student_name,
+                               embs=embs, class_name=class_id))
 
-    saved = 0
-    for emb in embs:
-        emb = emb / (np.linalg.norm(emb) + 1e-9)
-        insert_embedding(db, student_id=student_id, emb=emb, source="enroll")
-        saved += 1
+    # gallery_storage="packed": ghi lại file gallery của lớp ngay sau enroll
+    await pack_class_gallery(db, class_id)
 
     return {
         "ok": True,
@@ -57,3 +66,39 @@ async def enroll(
         "images_used": len(embs),
         "embeddings_saved": saved
     }
+
+
+@router.post("/bulk")
+async def enroll_bulk(
+    archive: UploadFile = File(...),
+    db: AsyncSession = Depends(get_async_db),
+    engine=Depends(get_engine),
+):
+    """
+    Enroll cả lớp / cả trường từ 1 file zip <lớp>/<mã HS>[__<tên>]/<ảnh> (xem app/core/bulk_enroll.py).
+    Trả report: số học sinh / ảnh / embedding, lỗi từng học sinh, images_per_s.
+    Import rất lớn nên chạy offline: python -m app.jobs.bulk_enroll <zip|thư mục>.
+    """
+    def open_zip():
+        zf = zipfile.ZipFile(archive.file)
+        try:
+            return zf, scan_zip(zf, max_bytes=settings.bulk_enroll_max_mb * 1024 * 1024)
+        except Exception:
+            zf.close()
+            raise
+
+    try:
+        zf, (students, conflicts) = await asyncio.to_thread(open_zip)
+    except zipfile.BadZipFile:
+        raise HTTPException(400, "archive must be a zip file")
+    except BulkEnrollError as e:
+        raise HTTPException(413, str(e))
+
+    try:
+        if not students and not conflicts:
+            raise HTTPException(400, "No images found (expected <class_id>/<student_id>/<image>)")
+        return await bulk_enroll(engine, db, students, conflicts)
+    except InferenceBusy as e:
+        raise HTTPException(503, f"Server busy, try again later ({e})")
+    finally:
+        zf.close()
@@ -1,10 +1,23 @@
-from fastapi import APIRouter, Depends, Query
+from datetime import date, datetime, time, timedelta
+
+from fastapi import APIRouter, Depends, Query, HTTPException
 from sqlalchemy.orm import Session
 from app.deps import get_db
-from app.db.crud import list_students_in_class
+from app.db.models import Student
+from app.settings import settings
+from app.db.crud import list_students_in_class, student_attendance_summary, student_daily_rollup
+from app.core.attendance_logic import rollup_summary
 
 router = APIRouter(prefix="/students", tags=["students"])
 
+
+def date_range(date_from: date | None, date_to: date | None):
+    """[date_from, date_to] (ngày, UTC, gồm cả date_to) -> [start, end) datetime cho filter created_at."""
+    start = datetime.combine(date_from, time.min) if date_from else None
+    end = datetime.combine(date_to + timedelta(days=1), time.min) if date_to else None
+    return start, end
+
+
 @router.get("")
 def get_students(class_id: str = Query(...), db: Session = Depends(get_db)):
     rows = list_students_in_class(db, class_id=class_id)
@@ -12,3 +25,72 @@ def get_students(class_id: str = Query(...), db: Session = Depends(get_db)):
         {"student_id": r.id, "name": r.name, "class_id": r.class_id, "created_at": r.created_at}
         for r in rows
     ]
+
+
+@router.get("/{student_id}/attendance")
+def get_student_attendance(
+    student_id: str,
+    date_from: date | None = Query(None),
+    date_to: date | None = Query(None),
+    limit: int = Query(50, ge=0, le=1000),
+    db: Session = Depends(get_db),
+):
+    """Lịch sử điểm danh 1 học sinh: số phiên có mặt/vắng, tỉ lệ, điểm trung bình + limit phiên gần nhất."""
+    student = db.get(Student, student_id)
+    if student is None:
+        raise HTTPException(404, "Student not found")
+
+    start, end = date_range(date_from, date_to)
+    s = student_attendance_summary(db, student_id, start, end, limit=limit)
+    return {
+        "student_id": student.id,
+        "name": student.name,
+        "class_id": student.class_id,
+        "date_from": date_from,
+        "date_to": date_to,
+        "sessions": s["sessions"],
+        "present": s["present"],
+        "absent": s["absent"],
+        "attendance_rate": round(s["present"] / s["sessions"], 4) if s["sessions"] else None,
+        "avg_score": round(s["avg_score"], 4) if s["avg_score"] is not None else None,
+        "first_at": s["first_at"],
+        "last_at": s["last_at"],
+        "history": [
+            {"session_id": sid, "class_id": cls, "created_at": created_at, "status": status, "score": score}
+            for sid, cls, created_at, status, score in s["history"]
+        ],
+    }
+
+
+@router.get("/{student_id}/attendance-summary")
+def get_student_attendance_summary(
+    student_id: str,
+    date_from: date | None = Query(None),
+    date_to: date | None = Query(None),
+    daily: bool = Query(False, description="kèm từng ngày"),
+    db: Session = Depends(get_db),
+):
+    """
+    Tổng hợp dài hạn 1 học sinh từ bảng tổng hợp ngày: tỉ lệ có mặt, chuỗi ngày có mặt / vắng
+    (hiện tại, dài nhất), có thuộc diện vắng thường xuyên không.
+    """
+    student = db.get(Student, student_id)
+    if student is None:
+        raise HTTPException(404, "Student not found")
+
+    rows = student_daily_rollup(db, student_id, date_from, date_to)
+    out = {
+        "student_id": student.id,
+        "name": student.name,
+        "class_id": student.class_id,
+        "date_from": date_from,
+        "date_to": date_to,
+        **rollup_summary([(day, n, present, score) for day, _, n, present, score in rows],
+                         settings.chronic_absence_rate, settings.chronic_min_sessions),
+    }
+    if daily:
+        out["daily"] = [
+            {"day": day, "class_id": cls, "sessions": n, "present": present, "absent": n - present}
+            for day, cls, n, present, _ in rows
+        ]
+    return out
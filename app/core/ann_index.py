@@ -0,0 +1,233 @@
+"""
+Index vector cho matching trên gallery lớn (cả trường), thuần NumPy.
+
+- FlatIndex: brute-force chính xác (GEMM), dùng làm chuẩn để đo recall.
+- IVFIndex: inverted file, chia vector thành nlist cụm bằng spherical k-means,
+  search chỉ quét nprobe cụm gần query nhất.
+
+Cả hai dùng cosine (vector đã L2-normalize), label là int64 (StudentEmbedding.id),
+hỗ trợ add/remove tăng dần và lưu/đọc file .npz.
+"""
+import numpy as np
+
+from app.core.matching import normalize_rows
+
+
+def _topk(scores: np.ndarray, labels: np.ndarray, k: int):
+    """Top-k (giảm dần) của 1 vector score. Thiếu thì pad score -inf, label -1."""
+    out_s = np.full((k,), -np.inf, dtype=np.float32)
+    out_l = np.full((k,), -1, dtype=np.int64)
+    n = len(scores)
+    if n == 0:
+        return out_s, out_l
+    kk = min(k, n)
+    idx = np.argpartition(-scores, kk - 1)[:kk] if kk < n else np.arange(n)
+    idx = idx[np.argsort(-scores[idx], kind="stable")]
+    out_s[:kk] = scores[idx]
+    out_l[:kk] = labels[idx]
+    return out_s, out_l
+
+
+class FlatIndex:
+    kind = "flat"
+
+    def __init__(self, dim: int):
+        self.dim = dim
+        self._vecs = np.zeros((0, dim), dtype=np.float32)
+        self._labels = np.zeros((0,), dtype=np.int64)
+        self._n = 0
+
+    def __len__(self):
+        return self._n
+
+    def _reserve(self, n: int):
+        cap = self._vecs.shape[0]
+        if n <= cap:
+            return
+        new_cap = max(n, cap * 2, 1024)
+        vecs = np.empty((new_cap, self.dim), dtype=np.float32)
+        labels = np.empty((new_cap,), dtype=np.int64)
+        vecs[:self._n] = self._vecs[:self._n]
+        labels[:self._n] = self._labels[:self._n]
+        self._vecs, self._labels = vecs, labels
+
+    def add(self, labels, vecs):
+        vecs = normalize_rows(np.asarray(vecs).reshape(-1, self.dim))
+        labels = np.asarray(labels, dtype=np.int64).reshape(-1)
+        self._reserve(self._n + len(labels))
+        self._vecs[self._n:self._n + len(labels)] = vecs
+        self._labels[self._n:self._n + len(labels)] = labels
+        self._n += len(labels)
+
+    def remove(self, labels) -> int:
+        keep = ~np.isin(self._labels[:self._n], np.asarray(labels, dtype=np.int64))
+        removed = int(self._n - keep.sum())
+        if removed:
+            n = int(keep.sum())
+            self._vecs[:n] = self._vecs[:self._n][keep]
+            self._labels[:n] = self._labels[:self._n][keep]
+            self._n = n
+        return removed
+
+    def search(self, queries, k: int = 10):
+        """Return (scores (F, k), labels (F, k)), giảm dần; thiếu thì label -1."""
+        q = normalize_rows(np.asarray(queries).reshape(-1, self.dim))
+        sims = q @ self._vecs[:self._n].T
+        labels = self._labels[:self._n]
+        out = [_topk(row, labels, k) for row in sims]
+        if not out:
+            return np.zeros((0, k), dtype=np.float32), np.zeros((0, k), dtype=np.int64)
+        return np.stack([o[0] for o in out]), np.stack([o[1] for o in out])
+
+    def state(self) -> dict:
+        return {"vecs": self._vecs[:self._n], "labels": self._labels[:self._n]}
+
+    @classmethod
+    def from_state(cls, dim: int, st: dict, **_):
+        idx = cls(dim)
+        idx.add(st["labels"], st["vecs"])
+        return idx
+
+
+def train_spherical_kmeans(vecs: np.ndarray, nlist: int, iters: int = 10, seed: int = 0,
+                           chunk: int = 16384) -> np.ndarray:
+    """Centroid (nlist, D) đã normalize. vecs phải đã normalize."""
+    rng = np.random.default_rng(seed)
+    n = len(vecs)
+    nlist = max(1, min(nlist, n))
+    centroids = vecs[rng.choice(n, size=nlist, replace=False)].copy()
+
+    for _ in range(iters):
+        sums = np.zeros_like(centroids)
+        counts = np.zeros((nlist,), dtype=np.int64)
+        for s in range(0, n, chunk):
+            part = vecs[s:s + chunk]
+            assign = np.argmax(part @ centroids.T, axis=1)
+            np.add.at(sums, assign, part)
+            counts += np.bincount(assign, minlength=nlist)
+        empty = counts == 0
+        if empty.any():
+            # cụm rỗng: lấy ngẫu nhiên điểm khác làm tâm mới
+            sums[empty] = vecs[rng.choice(n, size=int(empty.sum()), replace=False)]
+        centroids = normalize_rows(sums)
+    return centroids
+
+
+class IVFIndex:
+    kind = "ivf"
+
+    def __init__(self, dim: int, nlist: int = 256, nprobe: int = 8):
+        self.dim = dim
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.centroids = None
+        self._list_vecs: list[np.ndarray] = []
+        self._list_labels: list[np.ndarray] = []
+
+    def __len__(self):
+        return int(sum(len(x) for x in self._list_labels))
+
+    @property
+    def trained(self) -> bool:
+        return self.centroids is not None
+
+    def train(self, vecs, iters: int = 10, seed: int = 0):
+        vecs = normalize_rows(np.asarray(vecs).reshape(-1, self.dim))
+        self.centroids = train_spherical_kmeans(vecs, self.nlist, iters=iters, seed=seed)
+        self.nlist = len(self.centroids)
+        self._list_vecs = [np.zeros((0, self.dim), dtype=np.float32) for _ in range(self.nlist)]
+        self._list_labels = [np.zeros((0,), dtype=np.int64) for _ in range(self.nlist)]
+
+    def add(self, labels, vecs):
+        if not self.trained:
+            raise RuntimeError("IVFIndex.add() before train()")
+        vecs = normalize_rows(np.asarray(vecs).reshape(-1, self.dim))
+        labels = np.asarray(labels, dtype=np.int64).reshape(-1)
+        assign = np.argmax(vecs @ self.centroids.T, axis=1)
+        for lst in np.unique(assign).tolist():
+            m = assign == lst
+            self._list_vecs[lst] = np.concatenate([self._list_vecs[lst], vecs[m]])
+            self._list_labels[lst] = np.concatenate([self._list_labels[lst], labels[m]])
+
+    def remove(self, labels) -> int:
+        labels = np.asarray(labels, dtype=np.int64)
+        removed = 0
+        for i, lab in enumerate(self._list_labels):
+            keep = ~np.isin(lab, labels)
+            if not keep.all():
+                removed += int(len(lab) - keep.sum())
+                self._list_vecs[i] = self._list_vecs[i][keep]
+                self._list_labels[i] = lab[keep]
+        return removed
+
+    def search(self, queries, k: int = 10, nprobe: int | None = None):
+        """Return (scores (F, k), labels (F, k)), giảm dần; thiếu thì label -1."""
+        q = normalize_rows(np.asarray(queries).reshape(-1, self.dim))
+        F = len(q)
+        if F == 0 or not self.trained:
+            return np.full((F, k), -np.inf, dtype=np.float32), np.full((F, k), -1, dtype=np.int64)
+
+        nprobe = min(nprobe or self.nprobe, self.nlist)
+        coarse = q @ self.centroids.T
+        probe = np.argpartition(-coarse, nprobe - 1, axis=1)[:, :nprobe] if nprobe < self.nlist \
+            else np.broadcast_to(np.arange(self.nlist), (F, self.nlist))
+
+        # gom query theo cụm: mỗi cụm được probe chỉ cần 1 GEMM cho mọi query của nó
+        cand_s = [[] for _ in range(F)]
+        cand_l = [[] for _ in range(F)]
+        for lst in np.unique(probe).tolist():
+            if len(self._list_labels[lst]) == 0:
+                continue
+            qs = np.flatnonzero((probe == lst).any(axis=1))
+            s = self._list_vecs[lst] @ q[qs].T
+            for j, f in enumerate(qs.tolist()):
+                cand_s[f].append(s[:, j])
+                cand_l[f].append(self._list_labels[lst])
+
+        out_s = np.empty((F, k), dtype=np.float32)
+        out_l = np.empty((F, k), dtype=np.int64)
+        for f in range(F):
+            scores = np.concatenate(cand_s[f]) if cand_s[f] else np.zeros((0,), dtype=np.float32)
+            labels = np.concatenate(cand_l[f]) if cand_l[f] else np.zeros((0,), dtype=np.int64)
+            out_s[f], out_l[f] = _topk(scores, labels, k)
+        return out_s, out_l
+
+    def state(self) -> dict:
+        sizes = np.array([len(x) for x in self._list_labels], dtype=np.int64)
+        return {
+            "centroids": self.centroids,
+            "nprobe": np.int64(self.nprobe),
+            "list_sizes": sizes,
+            "vecs": np.concatenate(self._list_vecs) if self._list_vecs else np.zeros((0, self.dim), np.float32),
+            "labels": np.concatenate(self._list_labels) if self._list_labels else np.zeros((0,), np.int64),
+        }
+
+    @classmethod
+    def from_state(cls, dim: int, st: dict, **_):
+        idx = cls(dim, nlist=len(st["centroids"]), nprobe=int(st["nprobe"]))
+        idx.centroids = st["centroids"]
+        bounds = np.concatenate(([0], np.cumsum(st["list_sizes"])))
+        idx._list_vecs = [st["vecs"][a:b] for a, b in zip(bounds[:-1], bounds[1:])]
+        idx._list_labels = [st["labels"][a:b] for a, b in zip(bounds[:-1], bounds[1:])]
+        return idx
+
+
+_KINDS = {FlatIndex.kind: FlatIndex, IVFIndex.kind: IVFIndex}
+
+
+def save_index(index, path: str, **meta):
+    """Lưu index + meta (số nguyên) ra .npz."""
+    st = index.state()
+    extra = {f"meta_{k}": np.int64(v) for k, v in meta.items()}
+    with open(path, "wb") as fh:
+        np.savez(fh, kind=np.array(index.kind), dim=np.int64(index.dim), **st, **extra)
+
+
+def load_index(path: str):
+    """Return (index, meta dict)."""
+    with np.load(path, allow_pickle=False) as z:
+        kind = str(z["kind"])
+        dim = int(z["dim"])
+        st = {k: z[k] for k in z.files if k not in ("kind", "dim") and not k.startswith("meta_")}
+        meta = {k[len("meta_"):]: int(z[k]) for k in z.files if k.startswith("meta_")}
+    return _KINDS[kind].from_state(dim, st), meta
@@ -1,4 +1,5 @@
 from collections import defaultdict
+from itertools import groupby
 
 
 def update_present_best(present_best: dict, matched: str, score: float):
@@ -7,17 +8,73 @@ def update_present_best(present_best: dict, matched: str, score: float):
         present_best[matched] = score
 
 
-def build_result(class_id: str, all_names: list[str], present_best: dict, unknown_faces: int, threshold: float, dbg: dict):
-    present = sorted(present_best.keys())
-    absent = sorted(list(set(all_names) - set(present)))
+def build_result(class_id: str, students: dict, present_best: dict, unknown_faces: int, threshold: float, dbg: dict):
+    """
+    students: {student_id: name} của cả lớp.
+    present_best: {student_id: best_score}.
+    """
+    def by_name(sid):
+        return (students.get(sid, ""), sid)
+
+    present = sorted(present_best.keys(), key=by_name)
+    absent = sorted(set(students.keys()) - set(present), key=by_name)
 
     return {
         "class_id": class_id,
-        "count_total": len(all_names),
+        "count_total": len(students),
         "count_present": len(present),
-        "present": [{"name": n, "score": present_best[n]} for n in present],
-        "absent": absent,
+        "present": [{"student_id": sid, "name": students.get(sid), "score": present_best[sid]} for sid in present],
+        "absent": [{"student_id": sid, "name": students.get(sid)} for sid in absent],
         "unknown_faces_count": unknown_faces,
         "threshold": threshold,
         "debug": dbg,
     }
+
+
+def day_streaks(days):
+    """
+    days: [(day, có mặt: bool)] theo thứ tự ngày (chỉ các ngày có phiên điểm danh).
+    Return {"current": {"status", "days"}, "longest_present", "longest_absent"}: chuỗi ngày
+    liên tiếp (tính theo ngày có điểm danh, bỏ qua ngày không có phiên như cuối tuần).
+    """
+    longest = {True: 0, False: 0}
+    status, run = None, 0
+    for _, present in days:
+        run = run + 1 if present == status else 1
+        status = present
+        longest[status] = max(longest[status], run)
+    return {
+        "current": {"status": None if status is None else ("present" if status else "absent"), "days": run},
+        "longest_present": longest[True],
+        "longest_absent": longest[False],
+    }
+
+
+def rollup_summary(days, chronic_rate: float, chronic_min_sessions: int) -> dict:
+    """
+    Tổng hợp 1 học sinh từ các dòng tổng hợp ngày [(day, sessions, present, score_sum)] (theo ngày,
+    1 ngày có thể nhiều dòng nếu đổi lớp). Ngày "có mặt" = có mặt ít nhất 1 phiên trong ngày.
+    chronic: vắng >= chronic_rate số phiên, khi có ít nhất chronic_min_sessions phiên.
+    """
+    sessions = present = 0
+    score_sum = 0.0
+    per_day = []
+    for day, rows in groupby(days, key=lambda r: r[0]):
+        p = 0
+        for _, n, pr, sc in rows:
+            sessions += n
+            p += pr
+            score_sum += sc
+        present += p
+        per_day.append((day, p > 0))
+    absent = sessions - present
+    return {
+        "days": len(per_day),
+        "sessions": sessions,
+        "present": present,
+        "absent": absent,
+        "attendance_rate": round(present / sessions, 4) if sessions else None,
+        "avg_score": round(score_sum / present, 4) if present else None,
+        "streaks": day_streaks(per_day),
+        "chronic_absent": sessions >= chronic_min_sessions and absent >= chronic_rate * sessions,
+    }
@@ -0,0 +1,246 @@
+"""
+Enroll hàng loạt từ cây thư mục / file zip dạng <lớp>/<học sinh>/<ảnh>:
+
+    10A1/HS001__Nguyen Van A/1.jpg
+    10A1/HS001__Nguyen Van A/2.jpg
+    10A1/HS002/front.png            # không có "__<tên>": giữ tên cũ (hoặc tên = mã HS)
+
+Chỉ lấy 3 cấp cuối của đường dẫn nên zip có thêm thư mục bọc ngoài vẫn đọc được.
+Dùng chung cho POST /enroll/bulk và python -m app.jobs.bulk_enroll.
+"""
+import asyncio
+import logging
+import os
+import time
+import zipfile
+
+import numpy as np
+
+from app.settings import settings
+from app.core.inference import inference_executor, InferenceBusy
+from app.core.pipeline import process_enroll_image, embed_faces
+from app.db import crud_async
+
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTS = {".jpg", ".jpeg", ".png", ".bmp", ".webp"}
+
+# số crop mỗi lần gọi embed_faces (engine tự chia tiếp theo embed_batch_size)
+_EMBED_CHUNK = 64
+
+
+class BulkEnrollError(Exception):
+    """Nguồn import không hợp lệ (không phải zip, quá lớn, không có ảnh nào)."""
+
+
+class StudentImages:
+    __slots__ = ("class_id", "student_id", "name", "images")
+
+    def __init__(self, class_id: str, student_id: str, name):
+        self.class_id = class_id
+        self.student_id = student_id
+        self.name = name            # None = giữ tên cũ
+        self.images = []            # [(tên file, read() -> bytes)]
+
+
+def parse_student_dir(dirname: str):
+    """'HS001__Nguyen Van A' -> ('HS001', 'Nguyen Van A'); 'HS001' -> ('HS001', None)."""
+    sid, sep, name = dirname.partition("__")
+    return sid.strip(), (name.strip() or None) if sep else None
+
+
+def _add_image(students: dict, conflicts: list, parts, label: str, read):
+    class_id, student_dir, filename = parts[-3:]
+    if os.path.splitext(filename)[1].lower() not in IMAGE_EXTS:
+        return
+    student_id, name = parse_student_dir(student_dir)
+    if not class_id or not student_id:
+        return
+    st = students.get(student_id)
+    if st is None:
+        st = students[student_id] = StudentImages(class_id, student_id, name)
+    elif st.class_id != class_id:
+        conflicts.append({"class_id": class_id, "student_id": student_id,
+                          "error": f"student_id already used in class {st.class_id}"})
+        return
+    st.images.append((label, read))
+
+
+def _read_file(path: str) -> bytes:
+    with open(path, "rb") as fh:
+        return fh.read()
+
+
+def scan_directory(root: str):
+    """Return (list StudentImages, conflicts) từ thư mục root/<lớp>/<học sinh>/<ảnh>."""
+    students, conflicts = {}, []
+    root = os.path.abspath(root)
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        rel = os.path.relpath(dirpath, root)
+        parts = [] if rel == "." else rel.split(os.sep)
+        if len(parts) < 2:
+            continue
+        for fn in sorted(filenames):
+            path = os.path.join(dirpath, fn)
+            _add_image(students, conflicts, parts + [fn], fn, lambda p=path: _read_file(p))
+    return list(students.values()), conflicts
+
+
+def scan_zip(zf: zipfile.ZipFile, max_bytes: int = 0):
+    """
+    Return (list StudentImages, conflicts) từ zip. max_bytes > 0: giới hạn tổng dung lượng
+    sau giải nén (chặn zip bomb), vượt thì BulkEnrollError.
+    """
+    students, conflicts = {}, []
+    total = 0
+    for info in sorted(zf.infolist(), key=lambda i: i.filename):
+        if info.is_dir():
+            continue
+        parts = [p for p in info.filename.replace("\\", "/").split("/") if p]
+        if len(parts) < 3 or parts[0] == "__MACOSX" or parts[-1].startswith("._"):
+            continue
+        total += info.file_size
+        if max_bytes and total > max_bytes:
+            raise BulkEnrollError(f"zip content > {max_bytes // (1024 * 1024)} MB")
+        _add_image(students, conflicts, parts, parts[-1], lambda n=info.filename: zf.read(n))
+    return list(students.values()), conflicts
+
+
+def _detect(engine, read):
+    """read ảnh + decode/detect/align (chạy trên inference executor). Return (crop | None, lỗi | None)."""
+    try:
+        data = read()
+    except (OSError, zipfile.BadZipFile) as e:
+        return None, f"read_error: {e}"
+    crop = process_enroll_image(
+        engine, data,
+        detect_max_side=settings.detect_max_side,
+        detect_decode=settings.detect_decode,
+        align_full_res_below=settings.align_full_res_below,
+    )
+    return crop, None if crop is not None else "no_face"
+
+
+def dedup_embeddings(embs: np.ndarray, existing: np.ndarray | None, threshold: float):
+    """
+    Bỏ embedding gần trùng (cosine >= threshold) với embedding đã giữ hoặc đã lưu trong DB
+    (ảnh chụp liên tiếp, ảnh gửi lại). embs đã L2-normalize. Return (embs giữ lại, số bị bỏ).
+    """
+    kept = [] if existing is None else list(existing)
+    n_existing = len(kept)
+    for e in embs:
+        if kept and float(np.max(np.stack(kept) @ e)) >= threshold:
+            continue
+        kept.append(e)
+    out = np.stack(kept[n_existing:]) if len(kept) > n_existing else np.zeros((0, embs.shape[1]), np.float32)
+    return out, len(embs) - len(out)
+
+
+async def bulk_enroll(engine, db, students: list, conflicts: list | None = None, executor=None,
+                      batch_students: int | None = None, dedup_threshold: float | None = None) -> dict:
+    """
+    Detect + embed mọi ảnh trên executor (mặc định inference_executor), bỏ embedding gần trùng,
+    ghi theo batch batch_students học sinh / transaction. db: AsyncSession.
+    Return report: số lượng, lỗi từng học sinh / từng ảnh, thời gian, images_per_s.
+    """
+    executor = executor or inference_executor
+    batch_students = batch_students or settings.bulk_enroll_batch_students
+    dedup_threshold = settings.enroll_dedup_threshold if dedup_threshold is None else dedup_threshold
+    # giới hạn số ảnh gửi vào executor cùng lúc: không chờ quá queue_timeout
+    slots = asyncio.Semaphore(max(1, executor.max_workers * 2))
+
+    report = {
+        "classes": len({s.class_id for s in students}),
+        "students_total": len(students) + len(conflicts or []),
+        "students_enrolled": 0,
+        "students_failed": 0,
+        "images_total": sum(len(s.images) for s in students),
+        "images_failed": 0,
+        "embeddings_saved": 0,
+        "duplicates_skipped": 0,
+        "transactions": 0,
+        "failures": list(conflicts or []),
+        "image_failures": [],
+        "timings_s": {"detect": 0.0, "embed": 0.0, "write": 0.0},
+    }
+    report["students_failed"] = len(report["failures"])
+    touched_classes = set()
+    t_start = time.perf_counter()
+
+    async def detect_one(read):
+        async with slots:
+            (crop, err), _ = await executor.run(_detect, engine, read)
+            return crop, err
+
+    for start in range(0, len(students), batch_students):
+        chunk = students[start:start + batch_students]
+
+        t0 = time.perf_counter()
+        jobs = [(si, label, read) for si, st in enumerate(chunk) for label, read in st.images]
+        results = await asyncio.gather(*(detect_one(read) for _, _, read in jobs), return_exceptions=True)
+        crops, owners = [], []
+        image_errors = [dict() for _ in chunk]
+        for (si, label, _), res in zip(jobs, results):
+            if isinstance(res, InferenceBusy):
+                raise res
+            if isinstance(res, Exception):
+                image_errors[si][label] = f"error: {res}"
+                continue
+            crop, err = res
+            if crop is None:
+                image_errors[si][label] = err
+            else:
+                crops.append(crop)
+                owners.append(si)
+        report["timings_s"]["detect"] += time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        parts = await asyncio.gather(*(
+            executor.run(embed_faces, engine, crops[i:i + _EMBED_CHUNK])
+            for i in range(0, len(crops), _EMBED_CHUNK)
+        ))
+        embs = np.concatenate([p[0][0] for p in parts]) if parts else np.zeros((0, 0), np.float32)
+        embs = np.asarray(embs, dtype=np.float32)
+        if len(embs):
+            embs = embs / (np.linalg.norm(embs, axis=1, keepdims=True) + 1e-9)
+        report["timings_s"]["embed"] += time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        owners = np.asarray(owners)
+        existing = await crud_async.student_embeddings(db, [st.student_id for st in chunk])
+        batch = []
+        for si, st in enumerate(chunk):
+            errs = image_errors[si]
+            report["images_failed"] += len(errs)
+            own = embs[owners == si] if len(embs) else embs
+            if len(own) == 0:
+                report["students_failed"] += 1
+                report["failures"].append({"class_id": st.class_id, "student_id": st.student_id,
+                                           "error": "no valid face", "images": errs})
+                continue
+            if errs:
+                report["image_failures"].append({"class_id": st.class_id, "student_id": st.student_id,
+                                                 "images": errs})
+            own, dropped = dedup_embeddings(own, existing.get(st.student_id), dedup_threshold)
+            report["duplicates_skipped"] += dropped
+            batch.append({"class_id": st.class_id, "student_id": st.student_id, "name": st.name, "embs": own})
+
+        if batch:
+            ids = await crud_async.bulk_enroll_students(db, batch)
+            report["transactions"] += 1
+            report["students_enrolled"] += len(batch)
+            report["embeddings_saved"] += sum(len(x) for x in ids)
+            touched_classes.update(b["class_id"] for b in batch)
+        report["timings_s"]["write"] += time.perf_counter() - t0
+        logger.info(f"Bulk enroll: {min(start + batch_students, len(students))}/{len(students)} students")
+
+    # gallery_storage="packed": ghi lại file của các lớp 1 lần ở cuối
+    for class_id in sorted(touched_classes):
+        await crud_async.pack_class_gallery(db, class_id)
+
+    elapsed = time.perf_counter() - t_start
+    report["timings_s"] = {k: round(v, 3) for k, v in report["timings_s"].items()}
+    report["elapsed_s"] = round(elapsed, 3)
+    report["images_per_s"] = round(report["images_total"] / elapsed, 2) if elapsed > 0 else None
+    return report
@@ -0,0 +1,255 @@
+"""
+Hiệu chỉnh điểm theo từng học sinh (score normalization), tính từ chính gallery của lớp.
+
+Ngưỡng cosine chung cho cả lớp không công bằng giữa các học sinh: ảnh enroll kém (mờ, lệch)
+cho điểm thấp với mọi face nên hay bị báo vắng, còn 2 học sinh giống nhau thì face của người
+này cũng có điểm cao với người kia. Với mỗi học sinh s ta đo phân bố impostor: điểm (gộp
+theo student như lúc match) của mọi embedding của học sinh khác trong lớp với s, rồi đưa
+điểm của s về cùng thang với cả lớp bằng 1 phép affine score * scale[s] + bias[s]:
+
+  - "znorm": (score - mu_s) / sigma_s rồi đổi lại về thang cosine theo trung vị (mu, sigma)
+    của lớp, để ngưỡng người dùng gửi lên vẫn mang nghĩa cũ với học sinh "trung bình".
+  - "offset": chỉ dịch: ngưỡng riêng mu_s + z * sigma_s so với trung vị của lớp.
+
+Độ dịch quanh đuôi phân bố impostor được chặn trong ±settings.calibration_max_shift.
+
+Tính 1 lần khi build gallery (GalleryCache), lưu cùng Gallery; áp dụng khi match chỉ là
+1 phép nhân + cộng trên ma trận điểm (F, S) đã gộp theo student (rẻ hơn nhiều so với GEMM
+(N, F) x D). Sau enroll chỉ tính lại phần liên quan tới học sinh thay đổi (update()).
+"""
+import time
+
+import numpy as np
+
+from app.core.matching import aggregate_by_student
+
+# số phần tử tối đa của 1 block similarity (hàng gallery x probe) khi tính cặp
+_BLOCK_ELEMS = 4_000_000
+# đổi nhiều hơn tỉ lệ này số hàng thì tính lại toàn bộ
+_FULL_REBUILD_FRACTION = 0.3
+
+
+def _impostor_stats(probes: np.ndarray, probe_owner: np.ndarray, target: np.ndarray, target_seg: np.ndarray,
+                    target_owner: np.ndarray, aggregate: str, top_k: int):
+    """
+    Điểm (gộp theo student của target) của từng probe với từng student của target, bỏ cặp
+    cùng học sinh. Return (n, sum, sumsq) theo student của target (S,), float64.
+    probe_owner / target_owner: id số của học sinh (để so khớp giữa 2 tập).
+    """
+    S = len(target_seg)
+    n = np.zeros(S, dtype=np.float64)
+    total = np.zeros(S, dtype=np.float64)
+    total_sq = np.zeros(S, dtype=np.float64)
+    if S == 0 or len(probes) == 0:
+        return n, total, total_sq
+    step = max(1, _BLOCK_ELEMS // max(1, len(target)))
+    for i in range(0, len(probes), step):
+        sims_t = target @ probes[i:i + step].T                                   # (N, B)
+        scores = aggregate_by_student(sims_t, target_seg, mode=aggregate, top_k=top_k).astype(np.float64)
+        valid = probe_owner[i:i + step, None] != target_owner[None, :]            # (B, S)
+        scores = np.where(valid, scores, 0.0)
+        n += valid.sum(axis=0)
+        total += scores.sum(axis=0)
+        total_sq += (scores * scores).sum(axis=0)
+    return n, total, total_sq
+
+
+def _genuine_stats(embs: np.ndarray, seg_starts: np.ndarray, students=None):
+    """
+    Leave-one-out: mỗi embedding với embedding còn lại gần nhất của cùng học sinh.
+    Return (n, sum) (S,) cho các student được chọn (mặc định tất cả; còn lại 0).
+    """
+    S = len(seg_starts)
+    bounds = np.append(seg_starts, len(embs))
+    n = np.zeros(S, dtype=np.float64)
+    total = np.zeros(S, dtype=np.float64)
+    for s in (range(S) if students is None else students):
+        block = embs[bounds[s]:bounds[s + 1]]
+        if len(block) < 2:
+            continue
+        sims = block @ block.T
+        np.fill_diagonal(sims, -np.inf)
+        n[s] = len(block)
+        total[s] = float(sims.max(axis=1).sum())
+    return n, total
+
+
+def _owners(seg_starts: np.ndarray, n: int) -> np.ndarray:
+    counts = np.diff(np.append(seg_starts, n))
+    return np.repeat(np.arange(len(seg_starts)), counts)
+
+
+class Calibration:
+    """
+    Thống kê impostor / genuine theo student của 1 gallery + phép affine (scale, bias) (S,).
+    identity = True: không đổi điểm (tắt, hoặc lớp quá ít học sinh).
+    """
+
+    __slots__ = ("mode", "aggregate", "top_k", "imp_n", "imp_sum", "imp_sumsq", "gen_n", "gen_sum",
+                 "scale", "bias", "identity", "ref_mu", "ref_sigma", "seconds", "incremental")
+
+    def __init__(self, mode: str, aggregate: str, top_k: int, imp, gen, z: float, max_shift: float,
+                 min_students: int, min_impostors: int = 5, sigma_floor: float = 0.02, max_scale: float = 2.0):
+        self.mode = mode
+        self.aggregate = aggregate
+        self.top_k = top_k
+        self.imp_n, self.imp_sum, self.imp_sumsq = imp
+        self.gen_n, self.gen_sum = gen
+        self.seconds = 0.0
+        self.incremental = False
+
+        S = len(self.imp_n)
+        mu, sigma = self.impostor_moments(sigma_floor)
+        ok = self.imp_n >= min_impostors
+        self.scale = np.ones(S, dtype=np.float32)
+        self.bias = np.zeros(S, dtype=np.float32)
+        self.ref_mu = float(np.median(mu[ok])) if ok.any() else None
+        self.ref_sigma = float(np.median(sigma[ok])) if ok.any() else None
+        self.identity = mode == "off" or int(ok.sum()) < min_students
+        if self.identity:
+            return
+
+        anchor = self.ref_mu + z * self.ref_sigma     # vùng quyết định: đuôi phân bố impostor
+        if mode == "znorm":
+            scale = np.clip(self.ref_sigma / sigma, 1.0 / max_scale, max_scale)
+            bias = self.ref_mu - mu * scale
+        elif mode == "offset":
+            scale = np.ones(S)
+            bias = np.median((mu + z * sigma)[ok]) - (mu + z * sigma)
+        else:
+            raise ValueError(f"unknown calibration mode: {mode}")
+        # chặn độ dịch tại anchor, học sinh thiếu dữ liệu giữ nguyên
+        shift = (scale - 1.0) * anchor + bias
+        bias = bias - shift + np.clip(shift, -max_shift, max_shift)
+        self.scale = np.where(ok, scale, 1.0).astype(np.float32)
+        self.bias = np.where(ok, bias, 0.0).astype(np.float32)
+
+    def impostor_moments(self, sigma_floor: float = 0.02):
+        n = np.maximum(self.imp_n, 1.0)
+        mu = self.imp_sum / n
+        var = np.maximum(self.imp_sumsq / n - mu * mu, 0.0)
+        return mu, np.maximum(np.sqrt(var), sigma_floor)
+
+    def apply(self, scores: np.ndarray) -> np.ndarray:
+        """scores (F, S) đã gộp theo student -> điểm đã hiệu chỉnh."""
+        if self.identity:
+            return scores
+        return scores * self.scale + self.bias
+
+    def stats(self) -> dict:
+        changed = np.abs(self.scale - 1.0) + np.abs(self.bias) > 1e-6
+        return {
+            "mode": self.mode,
+            "identity": self.identity,
+            "students": len(self.scale),
+            "students_adjusted": int(changed.sum()),
+            "impostor_mean": None if self.ref_mu is None else round(self.ref_mu, 4),
+            "impostor_std": None if self.ref_sigma is None else round(self.ref_sigma, 4),
+            "compute_ms": round(self.seconds * 1000, 3),
+            "incremental": self.incremental,
+        }
+
+    def student_stats(self, keys: list[str]) -> list[dict]:
+        mu, sigma = self.impostor_moments()
+        gen = np.where(self.gen_n > 0, self.gen_sum / np.maximum(self.gen_n, 1.0), np.nan)
+        return [
+            {
+                "student_id": sid,
+                "impostor_mean": round(float(mu[i]), 4) if self.imp_n[i] else None,
+                "impostor_std": round(float(sigma[i]), 4) if self.imp_n[i] else None,
+                "genuine_mean": None if np.isnan(gen[i]) else round(float(gen[i]), 4),
+                "scale": round(float(self.scale[i]), 4),
+                "bias": round(float(self.bias[i]), 4),
+            }
+            for i, sid in enumerate(keys)
+        ]
+
+
+def calibrate(embs: np.ndarray, seg_starts: np.ndarray, mode: str, aggregate: str, top_k: int, z: float,
+              max_shift: float, min_students: int) -> Calibration:
+    """Tính toàn bộ: mọi embedding làm probe với mọi học sinh khác (N x N, theo block)."""
+    t0 = time.perf_counter()
+    owner = _owners(seg_starts, len(embs))
+    if mode == "off" or len(seg_starts) < min_students:
+        S = len(seg_starts)
+        imp = (np.zeros(S), np.zeros(S), np.zeros(S))
+        gen = (np.zeros(S), np.zeros(S))
+    else:
+        imp = _impostor_stats(embs, owner, embs, seg_starts, np.arange(len(seg_starts)), aggregate, top_k)
+        gen = _genuine_stats(embs, seg_starts)
+    c = Calibration(mode, aggregate, top_k, imp, gen, z, max_shift, min_students)
+    c.seconds = time.perf_counter() - t0
+    return c
+
+
+def update(prev_keys: list[str], prev_embs: np.ndarray, prev_seg: np.ndarray, prev: Calibration,
+           keys: list[str], embs: np.ndarray, seg_starts: np.ndarray, mode: str, aggregate: str, top_k: int,
+           z: float, max_shift: float, min_students: int) -> Calibration:
+    """
+    Tính lại sau khi 1 vài học sinh đổi embedding (enroll, gom prototype, xoá):
+      - học sinh đổi / mới: tính cả cột (mọi embedding khác làm probe với học sinh đó),
+      - học sinh không đổi: trừ đóng góp của embedding cũ, cộng đóng góp của embedding mới
+        của các học sinh đổi (tổng, tổng bình phương nên trừ được chính xác).
+    Đổi quá nhiều (hoặc đổi cách gộp điểm) thì tính lại toàn bộ.
+    """
+    def full():
+        return calibrate(embs, seg_starts, mode, aggregate, top_k, z, max_shift, min_students)
+
+    if (prev.mode != mode or prev.aggregate != aggregate or prev.top_k != top_k or mode == "off"
+            or np.all(prev.imp_n == 0)):
+        return full()
+    t0 = time.perf_counter()
+    prev_bounds = np.append(prev_seg, len(prev_embs))
+    bounds = np.append(seg_starts, len(embs))
+    prev_idx = {k: i for i, k in enumerate(prev_keys)}
+
+    changed, same = [], []          # index trong gallery mới; same: (mới, cũ)
+    for i, k in enumerate(keys):
+        j = prev_idx.pop(k, None)
+        if j is not None and np.array_equal(embs[bounds[i]:bounds[i + 1]], prev_embs[prev_bounds[j]:prev_bounds[j + 1]]):
+            same.append((i, j))
+        else:
+            changed.append(i)
+            if j is not None:
+                prev_idx[k] = j     # học sinh đổi: embedding cũ cũng phải trừ
+    old_changed = sorted(prev_idx.values())     # học sinh đổi + học sinh đã bị xoá (gallery cũ)
+    new_rows = np.concatenate([np.arange(bounds[i], bounds[i + 1]) for i in changed]) if changed else np.zeros(0, np.int64)
+    old_rows = (np.concatenate([np.arange(prev_bounds[j], prev_bounds[j + 1]) for j in old_changed])
+                if old_changed else np.zeros(0, np.int64))
+    if len(new_rows) + len(old_rows) > _FULL_REBUILD_FRACTION * max(1, len(embs)):
+        return full()
+
+    S = len(keys)
+    owner = _owners(seg_starts, len(embs))
+    prev_owner = _owners(prev_seg, len(prev_embs))
+    # id chung cho học sinh của 2 gallery: theo gallery mới, học sinh đã xoá -> S + j
+    key_to_new = {k: i for i, k in enumerate(keys)}
+    prev_to_common = np.array([key_to_new.get(k, S + j) for j, k in enumerate(prev_keys)], dtype=np.int64)
+
+    imp_n, imp_sum, imp_sumsq = np.zeros(S), np.zeros(S), np.zeros(S)
+    gen_n, gen_sum = np.zeros(S), np.zeros(S)
+    if same:
+        si = np.array([i for i, _ in same])
+        sj = np.array([j for _, j in same])
+        imp_n[si], imp_sum[si], imp_sumsq[si] = prev.imp_n[sj], prev.imp_sum[sj], prev.imp_sumsq[sj]
+        gen_n[si], gen_sum[si] = prev.gen_n[sj], prev.gen_sum[sj]
+        # embedding cũ / mới của học sinh đổi làm probe với học sinh không đổi
+        d_old = _impostor_stats(prev_embs[old_rows], prev_to_common[prev_owner[old_rows]], prev_embs, prev_seg,
+                                prev_to_common, aggregate, top_k)
+        d_new = _impostor_stats(embs[new_rows], owner[new_rows], embs, seg_starts, np.arange(S), aggregate, top_k)
+        for dst, a, b in ((imp_n, d_old[0], d_new[0]), (imp_sum, d_old[1], d_new[1]), (imp_sumsq, d_old[2], d_new[2])):
+            dst[si] += b[si] - a[sj]
+    if changed:
+        # cột của học sinh đổi: mọi embedding (của học sinh khác) làm probe với gallery con
+        ci = np.array(changed)
+        sub_rows = new_rows
+        sub_seg = np.concatenate(([0], np.cumsum(bounds[ci + 1] - bounds[ci])[:-1])).astype(np.int64)
+        n, s1, s2 = _impostor_stats(embs, owner, embs[sub_rows], sub_seg, ci, aggregate, top_k)
+        imp_n[ci], imp_sum[ci], imp_sumsq[ci] = n, s1, s2
+        g_n, g_sum = _genuine_stats(embs, seg_starts, students=changed)
+        gen_n[ci], gen_sum[ci] = g_n[ci], g_sum[ci]
+
+    c = Calibration(mode, aggregate, top_k, (imp_n, imp_sum, imp_sumsq), (gen_n, gen_sum), z, max_shift, min_students)
+    c.seconds = time.perf_counter() - t0
+    c.incremental = True
+    return c
@@ -0,0 +1,287 @@
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from app.settings import settings
+from app.core.ann_index import FlatIndex, IVFIndex, save_index, load_index
+from app.core.matching import assign_one_to_one
+
+logger = logging.getLogger(__name__)
+
+
+class CampusIndex:
+    """
+    Index mọi embedding của mọi lớp, dùng cho nhận diện toàn trường (cổng, căng tin).
+
+    - Backend IVF (ANN) khi đủ nhiều vector, ngược lại Flat (chính xác).
+    - Label của index = StudentEmbedding.id; enroll trong process này được add/remove
+      tăng dần qua notify_* (gọi từ crud).
+    - Lưu ra storage_dir/index/campus.npz kèm chữ ký DB (số embedding, id lớn nhất);
+      chữ ký lệch (vd worker khác đã enroll) thì chỉ add/remove phần chênh lệch theo id,
+      build lại (train IVF) khi chênh lệch quá lớn hoặc Flat đã đủ vector để lên IVF.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._index = None
+        self._label_student: dict[int, str] = {}
+        self._students: dict[str, tuple] = {}   # student_id -> (name, class_id)
+        self._signature = None
+        self._dirty = False
+        self.build_seconds = None
+        self.delta_seconds = None
+        self.builds = 0
+        self.deltas = 0
+
+    @property
+    def path(self) -> str:
+        return os.path.join(settings.storage_dir, "index", "campus.npz")
+
+    @property
+    def loaded(self) -> bool:
+        return self._index is not None
+
+    # ---- đồng bộ với DB ----
+
+    def _db_signature(self, db: Session):
+        from app.db.models import StudentEmbedding
+
+        count, max_id = db.query(func.count(StudentEmbedding.id), func.max(StudentEmbedding.id)).one()
+        return int(count or 0), int(max_id or 0)
+
+    def _load_students(self, db: Session):
+        from app.db.models import Student
+
+        self._students = {sid: (name, cid) for sid, name, cid in db.query(Student.id, Student.name, Student.class_id)}
+
+    def ensure(self, db: Session | None = None):
+        """
+        Đảm bảo index khớp DB: giữ bản trong RAM, đọc từ đĩa, cập nhật phần chênh lệch hoặc build lại.
+        db=None: mở SessionLocal riêng (route async gọi qua asyncio.to_thread, session thuộc thread đó).
+        """
+        if db is None:
+            from app.db.database import SessionLocal
+
+            db = SessionLocal()
+            try:
+                return self.ensure(db)
+            finally:
+                db.close()
+        sig = self._db_signature(db)
+        with self._lock:
+            if self._index is not None and self._signature == sig and not self._needs_ivf():
+                return
+            if self._index is None and self._load_from_disk(db, sig):
+                return
+            if self._index is not None and not self._needs_ivf() and self._apply_delta(db, sig):
+                return
+            self.rebuild(db, sig)
+
+    def _needs_ivf(self) -> bool:
+        # Flat tăng dần qua add đã vượt ngưỡng -> build lại thành IVF
+        return (isinstance(self._index, FlatIndex) and settings.campus_index_backend == "ivf"
+                and len(self._index) >= settings.campus_ivf_min_vectors)
+
+    def _apply_delta(self, db: Session, sig) -> bool:
+        """
+        Đồng bộ theo id embedding: add embedding mới, remove embedding đã xoá (enroll ở worker
+        khác). Return False nếu chênh lệch > 1/2 index (build lại để train lại IVF).
+        """
+        from app.db.models import StudentEmbedding
+
+        t0 = time.perf_counter()
+        db_labels = dict(db.query(StudentEmbedding.id, StudentEmbedding.student_id).all())
+        removed = [i for i in self._label_student if i not in db_labels]
+        added = [i for i in db_labels if i not in self._label_student]
+        if len(added) + len(removed) > max(1, len(db_labels)) // 2:
+            return False
+
+        vec_rows = []
+        for i in range(0, len(added), 5000):
+            vec_rows += db.query(StudentEmbedding.id, StudentEmbedding.vector).filter(
+                StudentEmbedding.id.in_(added[i:i + 5000])).all()
+        if removed:
+            self._index.remove(removed)
+            for i in removed:
+                self._label_student.pop(i, None)
+        if vec_rows:
+            labels = np.array([r[0] for r in vec_rows], dtype=np.int64)
+            vecs = np.frombuffer(b"".join(r[1] for r in vec_rows), dtype=np.float32).reshape(len(vec_rows), -1)
+            self._index.add(labels, vecs)
+            for lab in labels.tolist():
+                self._label_student[lab] = db_labels[lab]
+        self._load_students(db)
+        self._signature = sig
+        self._dirty = True
+        self.delta_seconds = time.perf_counter() - t0
+        self.deltas += 1
+        if self._needs_ivf():
+            return False
+        self.save()
+        return True
+
+    def _load_from_disk(self, db: Session, sig) -> bool:
+        from app.db.models import StudentEmbedding
+
+        if not os.path.exists(self.path):
+            return False
+        try:
+            index, meta = load_index(self.path)
+        except Exception as e:
+            logger.warning(f"Cannot load campus index {self.path}: {e}")
+            return False
+        if (meta.get("count"), meta.get("max_id")) != sig:
+            return False
+
+        self._index = index
+        self._label_student = dict(db.query(StudentEmbedding.id, StudentEmbedding.student_id).all())
+        self._load_students(db)
+        self._signature = sig
+        self._dirty = False
+        return True
+
+    def rebuild(self, db: Session, sig=None):
+        from app.db.models import StudentEmbedding
+
+        t0 = time.perf_counter()
+        rows = db.query(StudentEmbedding.id, StudentEmbedding.student_id, StudentEmbedding.vector).all()
+        with self._lock:
+            self._load_students(db)
+            self._label_student = {r[0]: r[1] for r in rows}
+            if rows:
+                labels = np.array([r[0] for r in rows], dtype=np.int64)
+                vecs = np.frombuffer(b"".join(r[2] for r in rows), dtype=np.float32).reshape(len(rows), -1)
+                self._index = self._new_index(vecs)
+                self._index.add(labels, vecs)
+            else:
+                self._index = None
+            self._signature = sig or self._db_signature(db)
+            self.build_seconds = time.perf_counter() - t0
+            self.builds += 1
+            self._dirty = False
+            self.save()
+
+    def _new_index(self, vecs: np.ndarray):
+        n, dim = vecs.shape
+        if settings.campus_index_backend == "ivf" and n >= settings.campus_ivf_min_vectors:
+            nlist = settings.campus_ivf_nlist or int(np.sqrt(n))
+            index = IVFIndex(dim, nlist=nlist, nprobe=settings.campus_ivf_nprobe)
+            # train trên mẫu con là đủ cho k-means
+            rng = np.random.default_rng(0)
+            sample = vecs if n <= 50 * nlist else vecs[rng.choice(n, size=50 * nlist, replace=False)]
+            index.train(sample)
+            return index
+        return FlatIndex(dim)
+
+    def save(self):
+        with self._lock:
+            if self._index is None or self._signature is None:
+                return
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp = self.path + ".tmp"
+            save_index(self._index, tmp, count=self._signature[0], max_id=self._signature[1])
+            os.replace(tmp, self.path)
+            self._dirty = False
+
+    def save_if_dirty(self):
+        if self._dirty:
+            self.save()
+
+    # ---- cập nhật tăng dần (gọi từ crud sau commit) ----
+
+    def notify_embedding_added(self, emb_id: int, student_id: str, emb: np.ndarray):
+        with self._lock:
+            if self._index is None:
+                return
+            self._index.add([emb_id], np.asarray(emb, dtype=np.float32).reshape(1, -1))
+            self._label_student[emb_id] = student_id
+            count, max_id = self._signature
+            self._signature = (count + 1, max(max_id, emb_id))
+            self._dirty = True
+
+    def notify_embeddings_removed(self, emb_ids):
+        with self._lock:
+            if self._index is None:
+                return
+            removed = self._index.remove(list(emb_ids))
+            for i in emb_ids:
+                self._label_student.pop(i, None)
+            count, max_id = self._signature
+            self._signature = (count - removed, max_id)
+            self._dirty = True
+
+    def notify_student(self, student_id: str, name: str, class_id: str):
+        with self._lock:
+            if self._index is not None:
+                self._students[student_id] = (name, class_id)
+
+    # ---- nhận diện ----
+
+    def identify(self, embs: np.ndarray, threshold: float, image_ids=None, k: int | None = None):
+        """
+        Return (student_ids list (None = unknown), scores (F,)).
+        Mỗi face lấy top-k embedding từ index, gộp theo student (max), rồi gán 1-1 trong từng ảnh.
+        """
+        embs = np.asarray(embs, dtype=np.float32).reshape(len(embs), -1)
+        F = len(embs)
+        with self._lock:
+            if self._index is None or F == 0:
+                return [None] * F, np.zeros((F,), dtype=np.float32)
+            scores, labels = self._index.search(embs, k=k or settings.campus_search_k)
+            label_student = self._label_student
+
+            # ứng viên theo student cho mỗi face
+            cands = []
+            for f in range(F):
+                best = {}
+                for s, lab in zip(scores[f].tolist(), labels[f].tolist()):
+                    sid = label_student.get(lab)
+                    if sid is not None and s > best.get(sid, -np.inf):
+                        best[sid] = s
+                cands.append(best)
+
+        image_ids = np.zeros((F,), dtype=np.int64) if image_ids is None else np.asarray(image_ids)
+        out_ids = [None] * F
+        out_scores = np.zeros((F,), dtype=np.float32)
+        for img in np.unique(image_ids).tolist():
+            rows = np.flatnonzero(image_ids == img).tolist()
+            keys = sorted({sid for f in rows for sid in cands[f]})
+            if not keys:
+                continue
+            col = {sid: j for j, sid in enumerate(keys)}
+            mat = np.full((len(rows), len(keys)), -1.0, dtype=np.float32)
+            for i, f in enumerate(rows):
+                for sid, s in cands[f].items():
+                    mat[i, col[sid]] = s
+            assigned, sc = assign_one_to_one(mat, threshold)
+            for i, f in enumerate(rows):
+                out_scores[f] = sc[i]
+                if assigned[i] >= 0:
+                    out_ids[f] = keys[assigned[i]]
+        return out_ids, out_scores
+
+    def student_info(self, student_id: str):
+        return self._students.get(student_id, (None, None))
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "loaded": self._index is not None,
+                "backend": self._index.kind if self._index is not None else None,
+                "vectors": len(self._index) if self._index is not None else 0,
+                "nlist": getattr(self._index, "nlist", None),
+                "nprobe": getattr(self._index, "nprobe", None),
+                "build_ms": round(self.build_seconds * 1000, 1) if self.build_seconds is not None else None,
+                "builds": self.builds,
+                "deltas": self.deltas,
+                "delta_ms": round(self.delta_seconds * 1000, 1) if self.delta_seconds is not None else None,
+                "dirty": self._dirty,
+            }
+
+
+campus_index = CampusIndex()
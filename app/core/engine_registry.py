@@ -0,0 +1,85 @@
+import logging
+import threading
+import time
+
+from app.settings import settings
+
+logger = logging.getLogger(__name__)
+
+
+class EngineRegistry:
+    """
+    Giữ 1 UniFaceEngine dùng chung cho mọi router.
+
+    Model được load lần đầu khi get() được gọi (lazy) hoặc lúc startup nếu
+    settings.engine_preload = True (xem lifespan trong app/main.py).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._engine = None
+        self.load_seconds = None
+        self.warmup_seconds = None
+        self.loaded_at = None
+        self.error = None
+
+    @property
+    def loaded(self) -> bool:
+        return self._engine is not None
+
+    def get(self):
+        engine = self._engine
+        if engine is None:
+            engine = self.load()
+        return engine
+
+    def load(self):
+        with self._lock:
+            if self._engine is not None:
+                return self._engine
+
+            # import ở đây để import app không kéo theo onnxruntime/model download
+            from app.core.uniface_engine import UniFaceEngine
+
+            try:
+                t0 = time.perf_counter()
+                engine = UniFaceEngine(
+                    intra_op_threads=settings.ort_intra_op_threads,
+                    inter_op_threads=settings.ort_inter_op_threads,
+                    embed_batch_size=settings.embed_batch_size,
+                )
+                self.load_seconds = time.perf_counter() - t0
+
+                if settings.engine_warmup:
+                    t0 = time.perf_counter()
+                    engine.warmup()
+                    self.warmup_seconds = time.perf_counter() - t0
+            except Exception as e:
+                self.error = str(e)
+                logger.exception("Failed to load face engine")
+                raise
+
+            self.error = None
+            self.loaded_at = time.time()
+            self._engine = engine
+            logger.info(
+                f"Face engine loaded in {self.load_seconds:.2f}s"
+                + (f", warm-up {self.warmup_seconds:.2f}s" if self.warmup_seconds is not None else "")
+            )
+            return engine
+
+    def status(self) -> dict:
+        return {
+            "loaded": self.loaded,
+            "preload": settings.engine_preload,
+            "warmup": settings.engine_warmup,
+            "load_ms": round(self.load_seconds * 1000, 1) if self.load_seconds is not None else None,
+            "warmup_ms": round(self.warmup_seconds * 1000, 1) if self.warmup_seconds is not None else None,
+            "ort_intra_op_threads": settings.ort_intra_op_threads,
+            "ort_inter_op_threads": settings.ort_inter_op_threads,
+            "embed_batch_size": self._engine.embed_batch_size if self._engine is not None else settings.embed_batch_size,
+            "error": self.error,
+        }
+
+
+engine_registry = EngineRegistry()
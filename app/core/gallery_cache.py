@@ -0,0 +1,281 @@
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from app.settings import settings
+from app.core.matching import student_segments
+from app.core import calibration
+
+
+class Gallery:
+    """
+    Snapshot bất biến gallery của 1 lớp.
+
+    embs: (N, D) float32 C-contiguous, mỗi hàng đã L2-normalize,
+          các hàng được gom liền nhau theo student.
+    names / student_ids: lặp theo từng embedding (cùng thứ tự hàng với embs).
+    student_keys / student_names: (S,) student duy nhất, seg_starts: (S,) hàng
+          bắt đầu của từng student trong embs (dùng cho segment reduction).
+    version: version của lớp tại thời điểm bắt đầu build.
+    calibration: hiệu chỉnh điểm theo student (app/core/calibration.py), gắn bởi GalleryCache.
+    """
+
+    __slots__ = ("class_id", "version", "names", "student_ids", "embs",
+                 "student_keys", "student_names", "seg_starts", "calibration")
+
+    def __init__(self, class_id: str, version: int, names: list[str], student_ids: list[str], embs: np.ndarray):
+        order, keys, seg_starts = student_segments(student_ids)
+        # đã gom sẵn theo student (vd packed gallery) thì giữ nguyên, tránh copy
+        if len(order) and np.any(order != np.arange(len(order))):
+            names = [names[i] for i in order]
+            student_ids = [student_ids[i] for i in order]
+            embs = embs[order]
+        embs = np.ascontiguousarray(embs, dtype=np.float32)
+        # read-only để không request nào sửa nhầm matrix đang được dùng chung
+        embs.setflags(write=False)
+        self.class_id = class_id
+        self.version = version
+        self.names = names
+        self.student_ids = student_ids
+        self.embs = embs
+        self.student_keys = keys
+        self.student_names = [names[i] for i in seg_starts.tolist()]
+        self.seg_starts = seg_starts
+        self.calibration = None
+
+    def __len__(self):
+        return len(self.names)
+
+    @property
+    def nbytes(self) -> int:
+        return int(self.embs.nbytes)
+
+    @property
+    def shared(self) -> bool:
+        """embs đọc thẳng từ file mmap (packed float32): các worker dùng chung page cache, không copy."""
+        base = self.embs
+        while base is not None:
+            if isinstance(base, np.memmap):
+                return True
+            base = getattr(base, "base", None)
+        return False
+
+
+class GalleryCache:
+    """
+    Cache gallery theo class_id, dùng chung cho cả process.
+
+    - LRU, giới hạn theo số lớp và tổng số byte của các matrix.
+    - Mỗi lớp có 1 version counter; invalidate() tăng version và bỏ entry cũ.
+      Matrix được build ngoài lock rồi mới publish, nên reader chỉ thấy
+      snapshot đã build xong. Nếu lớp bị invalidate trong lúc build thì
+      kết quả build vẫn trả cho caller nhưng không được đưa vào cache.
+    - Mỗi gallery build xong được gắn calibration. Gallery vừa bị invalidate (enroll) được giữ
+      lại tới lần build sau để chỉ tính lại calibration của học sinh thay đổi.
+    - Nhiều worker: mỗi thay đổi của lớp tăng generation trong DB (bảng gallery_generations);
+      sync() so với generation đã thấy và invalidate lớp bị worker khác thay đổi.
+    """
+
+    def __init__(self, max_classes: int = 64, max_bytes: int = 256 * 1024 * 1024):
+        self.max_classes = max_classes
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._items: "OrderedDict[str, Gallery]" = OrderedDict()
+        self._versions: dict[str, int] = {}
+        self._retired: dict[str, Gallery] = {}
+        self._generations: dict[str, int] = {}
+        self._last_sync = None
+        self._bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.rebuilds = 0
+        self.rebuild_seconds = 0.0
+        self.evictions = 0
+        self.invalidations = 0
+        self.stale_builds = 0
+        self.calibrations = 0
+        self.calibrations_incremental = 0
+        self.calibration_seconds = 0.0
+        self.syncs = 0
+        self.sync_invalidations = 0
+
+    def version(self, class_id: str) -> int:
+        with self._lock:
+            return self._versions.get(class_id, 0)
+
+    def get(self, class_id: str, loader) -> Gallery:
+        """
+        loader() -> (names, student_ids, embs). Chỉ được gọi khi cache miss.
+        """
+        g, version = self._lookup(class_id)
+        if g is not None:
+            return g
+        t0 = time.perf_counter()
+        return self._publish(class_id, version, loader(), time.perf_counter() - t0)
+
+    async def aget(self, class_id: str, loader) -> Gallery:
+        """Như get() nhưng loader là coroutine function (đọc DB qua AsyncSession)."""
+        g, version = self._lookup(class_id)
+        if g is not None:
+            return g
+        t0 = time.perf_counter()
+        loaded = await loader()
+        # dựng Gallery + calibration (NumPy, vài ms - vài trăm ms với lớp lớn) ngoài event loop
+        return await asyncio.to_thread(self._publish, class_id, version, loaded, time.perf_counter() - t0)
+
+    def _lookup(self, class_id: str):
+        with self._lock:
+            version = self._versions.get(class_id, 0)
+            g = self._items.get(class_id)
+            if g is not None and g.version == version:
+                self._items.move_to_end(class_id)
+                self.hits += 1
+                return g, version
+            self.misses += 1
+            return None, version
+
+    def _publish(self, class_id: str, version: int, loaded, dt: float) -> Gallery:
+        names, student_ids, embs = loaded
+        g = Gallery(class_id, version, names, student_ids, embs)
+        with self._lock:
+            prev = self._retired.get(class_id)
+        g.calibration = self._calibrate(g, prev)
+
+        with self._lock:
+            self.rebuilds += 1
+            self.rebuild_seconds += dt
+            self.calibrations += 1
+            self.calibrations_incremental += int(g.calibration.incremental)
+            self.calibration_seconds += g.calibration.seconds
+            if self._versions.get(class_id, 0) != version:
+                self.stale_builds += 1
+                return g
+            self._retired.pop(class_id, None)
+            self._put_locked(g)
+        return g
+
+    @staticmethod
+    def _calibrate(g: Gallery, prev: Gallery | None):
+        kw = {
+            "mode": settings.calibration_mode,
+            "aggregate": settings.match_aggregate,
+            "top_k": settings.match_topk,
+            "z": settings.calibration_z,
+            "max_shift": settings.calibration_max_shift,
+            "min_students": settings.calibration_min_students,
+        }
+        if prev is not None and prev.calibration is not None:
+            return calibration.update(prev.student_keys, prev.embs, prev.seg_starts, prev.calibration,
+                                      g.student_keys, g.embs, g.seg_starts, **kw)
+        return calibration.calibrate(g.embs, g.seg_starts, **kw)
+
+    def invalidate(self, class_id: str, generation: int | None = None):
+        """generation: generation trong DB sau thay đổi (nếu biết), để sync() không invalidate lại."""
+        with self._lock:
+            if generation is not None:
+                self._generations[class_id] = max(self._generations.get(class_id, 0), generation)
+            self._invalidate_locked(class_id)
+
+    def _invalidate_locked(self, class_id: str):
+        self._versions[class_id] = self._versions.get(class_id, 0) + 1
+        self.invalidations += 1
+        g = self._pop_locked(class_id)
+        if g is not None:
+            self._retired[class_id] = g
+
+    def sync_due(self) -> bool:
+        """Đến lúc đọc lại gallery_generations chưa (settings.gallery_sync_interval_s)."""
+        interval = settings.gallery_sync_interval_s
+        if interval < 0:
+            return False
+        now = time.monotonic()
+        with self._lock:
+            if self._last_sync is not None and now - self._last_sync < interval:
+                return False
+            self._last_sync = now
+            return True
+
+    def sync(self, generations: dict) -> list[str]:
+        """
+        generations: {class_id: generation} đọc từ DB. Invalidate lớp có generation mới hơn
+        bản đã thấy (worker khác enroll / sửa). Return các lớp bị invalidate.
+        """
+        stale = []
+        with self._lock:
+            self.syncs += 1
+            for class_id, generation in generations.items():
+                seen = self._generations.get(class_id)
+                if seen is not None and generation <= seen:
+                    continue
+                self._generations[class_id] = generation
+                # lần đầu thấy lớp: chỉ bỏ nếu đã cache (build trước khi biết generation)
+                if seen is not None or class_id in self._items:
+                    self._invalidate_locked(class_id)
+                    stale.append(class_id)
+            self.sync_invalidations += len(stale)
+        return stale
+
+    def clear(self):
+        with self._lock:
+            for class_id in list(self._items.keys()):
+                self._versions[class_id] = self._versions.get(class_id, 0) + 1
+            self._items.clear()
+            self._retired.clear()
+            self._generations.clear()
+            self._last_sync = None
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "classes": len(self._items),
+                "bytes": self._bytes,
+                "shared_bytes": sum(g.nbytes for g in self._items.values() if g.shared),
+                "max_classes": self.max_classes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "rebuilds": self.rebuilds,
+                "rebuild_ms_total": round(self.rebuild_seconds * 1000, 3),
+                "rebuild_ms_avg": round(self.rebuild_seconds * 1000 / self.rebuilds, 3) if self.rebuilds else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "stale_builds": self.stale_builds,
+                "calibration_mode": settings.calibration_mode,
+                "calibrations": self.calibrations,
+                "calibrations_incremental": self.calibrations_incremental,
+                "calibration_ms_total": round(self.calibration_seconds * 1000, 3),
+                "sync_interval_s": settings.gallery_sync_interval_s,
+                "syncs": self.syncs,
+                "sync_invalidations": self.sync_invalidations,
+            }
+
+    def _pop_locked(self, class_id: str):
+        g = self._items.pop(class_id, None)
+        if g is not None:
+            self._bytes -= g.nbytes
+        return g
+
+    def _put_locked(self, g: Gallery):
+        self._pop_locked(g.class_id)
+        if g.nbytes > self.max_bytes:
+            # 1 lớp lớn hơn cả ngân sách cache -> không giữ lại
+            return
+        self._items[g.class_id] = g
+        self._bytes += g.nbytes
+        while len(self._items) > self.max_classes or self._bytes > self.max_bytes:
+            _, old = self._items.popitem(last=False)
+            self._bytes -= old.nbytes
+            self.evictions += 1
+
+
+gallery_cache = GalleryCache(
+    max_classes=settings.gallery_cache_max_classes,
+    max_bytes=settings.gallery_cache_max_mb * 1024 * 1024,
+)
@@ -0,0 +1,222 @@
+"""
+Cache kết quả decode/detect/quality/embed theo hash nội dung ảnh (client gửi lại đúng ảnh cũ:
+retry sau timeout, UI gửi lại cả lựa chọn). Ảnh trùng bỏ qua toàn bộ inference, chỉ match
+lại với gallery hiện tại (gallery không nằm trong key nên enroll mới vẫn có hiệu lực).
+
+  - Key: blake2b(fingerprint + bytes ảnh); fingerprint gồm ngưỡng quality, cấu hình detect
+    và settings.image_cache_version (đổi model thì tăng version).
+  - Bộ nhớ: LRU giới hạn theo byte + TTL.
+  - Đĩa (tuỳ chọn): <storage_dir>/image_cache/<2 ký tự đầu>/<key>.npz, TTL theo mtime,
+    dọn bởi app.jobs.cleanup. Ghi file tạm rồi os.replace nên không đọc phải file dở.
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from app.settings import settings
+
+logger = logging.getLogger(__name__)
+
+
+class CachedImage:
+    """Kết quả của 1 ảnh: out (như process_attendance_image, không có crop) + embs (F, D) | None."""
+
+    __slots__ = ("out", "embs", "nbytes", "expires")
+
+    def __init__(self, out: dict, embs, ttl: float):
+        self.out = out
+        self.embs = embs
+        # ước lượng: embedding + ~200 byte mỗi face / face bị loại
+        self.nbytes = (0 if embs is None else int(embs.nbytes)) + 200 * (len(out["faces"]) + len(out["rejected"])) + 512
+        self.expires = time.monotonic() + ttl
+
+
+def strip_crops(out: dict) -> dict:
+    """Output process_attendance_image bỏ crop đã align (không cache, embedding đã có)."""
+    return {k: v for k, v in out.items() if k != "aligned"}
+
+
+class ImageCache:
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024, ttl: float = 3600.0, disk_dir: str | None = None,
+                 disk_ttl: float = 86400.0, version: str = "1"):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.disk_dir = disk_dir
+        self.disk_ttl = disk_ttl
+        self.version = version
+        self._lock = threading.Lock()
+        self._items: "OrderedDict[str, CachedImage]" = OrderedDict()
+        self._bytes = 0
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expired = 0
+        self.disk_errors = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0 or self.disk_dir is not None
+
+    def key(self, data: bytes, fingerprint: str) -> str:
+        h = hashlib.blake2b(digest_size=20)
+        h.update(f"{self.version}|{fingerprint}|".encode("utf-8"))
+        h.update(data)
+        return h.hexdigest()
+
+    def get(self, key: str) -> CachedImage | None:
+        with self._lock:
+            item = self._items.get(key)
+            if item is not None:
+                if item.expires > time.monotonic():
+                    self._items.move_to_end(key)
+                    self.hits += 1
+                    return item
+                self._pop_locked(key)
+                self.expired += 1
+        item = self._disk_get(key)
+        with self._lock:
+            if item is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            self._put_locked(key, item)
+        return item
+
+    def lookup(self, datas: list[bytes], fingerprint: str):
+        """Return (keys, [CachedImage | None]) cho các ảnh (hash + đọc đĩa: gọi ngoài event loop)."""
+        keys = [self.key(d, fingerprint) for d in datas]
+        return keys, [self.get(k) for k in keys]
+
+    def put(self, key: str, out: dict, embs):
+        item = CachedImage(strip_crops(out), None if embs is None else np.ascontiguousarray(embs, dtype=np.float32),
+                           self.ttl)
+        with self._lock:
+            self._put_locked(key, item)
+        self._disk_put(key, item)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                "entries": len(self._items),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "ttl_s": self.ttl,
+                "disk": self.disk_dir is not None,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": round((self.hits + self.disk_hits) / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "expired": self.expired,
+                "disk_errors": self.disk_errors,
+            }
+
+    def _pop_locked(self, key: str):
+        item = self._items.pop(key, None)
+        if item is not None:
+            self._bytes -= item.nbytes
+
+    def _put_locked(self, key: str, item: CachedImage):
+        self._pop_locked(key)
+        if item.nbytes > self.max_bytes:
+            return
+        self._items[key] = item
+        self._bytes += item.nbytes
+        while self._bytes > self.max_bytes:
+            _, old = self._items.popitem(last=False)
+            self._bytes -= old.nbytes
+            self.evictions += 1
+
+    # ---- lớp đĩa ----
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, key[:2], key + ".npz")
+
+    def _disk_get(self, key: str) -> CachedImage | None:
+        if self.disk_dir is None:
+            return None
+        path = self._path(key)
+        try:
+            if time.time() - os.stat(path).st_mtime > self.disk_ttl:
+                os.remove(path)
+                return None
+            with np.load(path, allow_pickle=False) as z:
+                out = json.loads(z["meta"].tobytes().decode("utf-8"))
+                embs = z["embs"] if "embs" in z.files else None
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(f"Image cache read error {path}: {e}")
+            with self._lock:
+                self.disk_errors += 1
+            return None
+        return CachedImage(out, embs, self.ttl)
+
+    def _disk_put(self, key: str, item: CachedImage):
+        if self.disk_dir is None:
+            return
+        path = self._path(key)
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        arrays = {"meta": np.frombuffer(json.dumps(item.out, ensure_ascii=False).encode("utf-8"), dtype=np.uint8)}
+        if item.embs is not None:
+            arrays["embs"] = item.embs
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(tmp, "wb") as fh:
+                np.savez(fh, **arrays)
+            os.replace(tmp, path)
+        except Exception as e:
+            logger.warning(f"Image cache write error {path}: {e}")
+            with self._lock:
+                self.disk_errors += 1
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+
+    def prune_disk(self) -> int:
+        """Xoá file cache quá disk_ttl (app.jobs.cleanup). Return số file đã xoá."""
+        if self.disk_dir is None or not os.path.isdir(self.disk_dir):
+            return 0
+        removed = 0
+        cutoff = time.time() - self.disk_ttl
+        with os.scandir(self.disk_dir) as subs:
+            for sub in subs:
+                if not sub.is_dir(follow_symlinks=False):
+                    continue
+                with os.scandir(sub.path) as it:
+                    for entry in it:
+                        try:
+                            if entry.stat(follow_symlinks=False).st_mtime < cutoff:
+                                os.remove(entry.path)
+                                removed += 1
+                        except OSError:
+                            continue
+        return removed
+
+
+def image_cache_dir() -> str:
+    return os.path.join(settings.storage_dir, "image_cache")
+
+
+image_cache = ImageCache(
+    max_bytes=settings.image_cache_max_mb * 1024 * 1024 if settings.image_cache_enabled else 0,
+    ttl=settings.image_cache_ttl_s,
+    disk_dir=image_cache_dir() if settings.image_cache_enabled and settings.image_cache_disk else None,
+    disk_ttl=settings.image_cache_disk_ttl_s,
+    version=settings.image_cache_version,
+)
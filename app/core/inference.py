@@ -0,0 +1,92 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from app.settings import settings
+
+
+class InferenceBusy(Exception):
+    """Hàng đợi inference đã đầy."""
+
+
+class InferenceExecutor:
+    """
+    Thread pool chạy các bước nặng CPU (decode/detect/quality/embed) ngoài event loop.
+
+    ONNX Runtime và OpenCV nhả GIL khi chạy nên thread pool đủ để các ảnh
+    của 1 request chạy song song mà event loop vẫn rảnh.
+    Hàng đợi bị giới hạn: tối đa max_workers job đang chạy + max_queue job chờ
+    trong pool. Job vượt quá phải đợi slot trống; đợi quá queue_timeout giây thì
+    run() raise InferenceBusy để route trả 503.
+    """
+
+    def __init__(self, max_workers: int = 2, max_queue: int = 16, queue_timeout: float = 30.0):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="inference")
+        self._slots = asyncio.Semaphore(max_workers + max_queue)
+        self._lock = threading.Lock()
+        self._inflight = 0
+
+        self.submitted = 0
+        self.rejected = 0
+        self.queue_wait_seconds = 0.0
+
+    @property
+    def inflight(self) -> int:
+        return self._inflight
+
+    async def run(self, fn, *args, **kwargs):
+        """
+        Chạy fn(*args, **kwargs) trên pool, return (result, queue_wait_seconds).
+        """
+        submitted_at = time.perf_counter()
+        try:
+            await asyncio.wait_for(self._slots.acquire(), timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            with self._lock:
+                self.rejected += 1
+            raise InferenceBusy(f"inference queue full ({self._inflight} in flight)")
+
+        with self._lock:
+            self._inflight += 1
+            self.submitted += 1
+
+        def job():
+            wait = time.perf_counter() - submitted_at
+            return fn(*args, **kwargs), wait
+
+        try:
+            result, wait = await asyncio.wrap_future(self._pool.submit(job))
+        finally:
+            self._slots.release()
+            with self._lock:
+                self._inflight -= 1
+
+        with self._lock:
+            self.queue_wait_seconds += wait
+        return result, wait
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "max_workers": self.max_workers,
+                "max_queue": self.max_queue,
+                "queue_timeout": self.queue_timeout,
+                "inflight": self._inflight,
+                "submitted": self.submitted,
+                "rejected": self.rejected,
+                "queue_wait_ms_total": round(self.queue_wait_seconds * 1000, 3),
+            }
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+inference_executor = InferenceExecutor(
+    max_workers=settings.inference_workers,
+    max_queue=settings.inference_queue_size,
+    queue_timeout=settings.inference_queue_timeout,
+)
@@ -0,0 +1,336 @@
+import asyncio
+import logging
+import os
+import shutil
+import time
+import uuid
+from datetime import datetime
+
+from sqlalchemy import case, func
+
+from app.settings import settings
+from app.db.database import SessionLocal
+from app.db.models import AttendanceJob
+from app.core.inference import InferenceBusy
+
+logger = logging.getLogger(__name__)
+
+# thứ tự ưu tiên: điểm danh trực tiếp trước, xử lý lại hàng loạt sau
+LANES = ("live", "bulk")
+
+
+class JobQueueFull(Exception):
+    """Lane đã đủ số job chờ (backpressure)."""
+
+
+class AttendanceJobQueue:
+    """
+    Hàng đợi job điểm danh, lưu bền trong bảng attendance_jobs (SQLite).
+
+    - submit() ghi ảnh ra storage_dir/jobs/<id>/ rồi thêm 1 dòng queued; route trả job id ngay.
+    - workers coroutine trên event loop lấy job theo lane (live trước bulk) rồi chạy handler;
+      phần nặng CPU của handler vẫn chạy trên inference executor, mọi truy cập DB / file của
+      hàng đợi (claim, tiến độ, kết thúc job) chạy qua asyncio.to_thread.
+    - Nhận job bằng UPDATE ... WHERE status='queued' nên nhiều process dùng chung DB
+      cũng không lấy trùng job.
+    - Backpressure: mỗi lane tối đa max_queued job chờ, vượt thì JobQueueFull (route trả 429).
+      Job bulk chỉ được chiếm tối đa workers - 1 worker để luôn còn chỗ cho live.
+    - Inference executor đầy (InferenceBusy): job về lại 'queued', không tính là 1 lần thử,
+      và worker lùi lại (poll_interval, x2 mỗi lần bận liên tiếp, tối đa busy_backoff_max giây).
+    - Restart: job còn 'running' (process chết giữa chừng) được đưa lại về 'queued',
+      quá max_attempts lần thì 'failed'. recover() coi mọi job 'running' là mồ côi nên chỉ process
+      leader (app/core/leader.py) gọi start_workers(); các process khác chỉ start() để nhận submit.
+    """
+
+    def __init__(self, workers: int = 2, max_queued: dict | None = None, max_attempts: int = 3,
+                 poll_interval: float = 2.0, busy_backoff_max: float = 60.0):
+        self.workers = max(0, workers)
+        self.max_queued = max_queued or {"live": 20, "bulk": 200}
+        self.max_attempts = max_attempts
+        self.poll_interval = poll_interval
+        self.busy_backoff_max = busy_backoff_max
+        self.handler = None
+        self._tasks: list[asyncio.Task] = []
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._wakeup: asyncio.Event | None = None
+        self._running = {lane: 0 for lane in LANES}
+        self._busy_streak = 0
+        self._not_before: dict[str, float] = {}     # job_id -> monotonic: chưa lấy lại trước lúc này
+
+        self.submitted = 0
+        self.rejected = 0
+        self.completed = 0
+        self.failed = 0
+        self.recovered = 0
+        self.busy_requeued = 0
+
+    def job_dir(self, job_id: str) -> str:
+        return os.path.join(settings.storage_dir, "jobs", job_id)
+
+    # ---- vòng đời ----
+
+    async def start(self, handler):
+        """
+        Nhận submit ở process này. handler: async (job: AttendanceJob, datas: list[bytes], progress())
+        -> session_id; job đã tách khỏi session (chỉ đọc field); progress() tăng images_done thêm 1.
+        """
+        self.handler = handler
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+
+    async def start_workers(self):
+        """Chạy lại job dở dang rồi bật worker (chỉ ở process leader)."""
+        if self.workers == 0 or self._tasks:
+            return
+        await asyncio.to_thread(self.recover)
+        self._tasks = [asyncio.create_task(self._worker(i)) for i in range(self.workers)]
+
+    async def stop(self):
+        for t in self._tasks:
+            t.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def recover(self) -> int:
+        """Job 'running' còn sót sau khi process chết -> chạy lại (hoặc failed nếu quá số lần)."""
+        n = 0
+        db = SessionLocal()
+        try:
+            for job in db.query(AttendanceJob).filter(AttendanceJob.status == "running").all():
+                if job.attempts >= self.max_attempts:
+                    self._set_failed(job, f"interrupted {job.attempts} times")
+                else:
+                    job.status = "queued"
+                    job.images_done = 0
+                n += 1
+            db.commit()
+        finally:
+            db.close()
+        self.recovered += n
+        if n:
+            logger.info(f"Recovered {n} interrupted attendance jobs")
+        return n
+
+    # ---- submit / đọc trạng thái ----
+
+    def submit(self, class_id: str, threshold: float, lane: str, datas: list[bytes]):
+        """
+        Ghi ảnh + thêm job queued, return (job, position). Ghi file + DB sync:
+        route async gọi qua asyncio.to_thread.
+        """
+        if lane not in LANES:
+            raise ValueError(f"lane must be one of {LANES}")
+        db = SessionLocal()
+        try:
+            queued = db.query(func.count(AttendanceJob.id)).filter(
+                AttendanceJob.status == "queued", AttendanceJob.lane == lane
+            ).scalar()
+            if queued >= self.max_queued.get(lane, 0):
+                self.rejected += 1
+                raise JobQueueFull(f"{queued} {lane} jobs already queued")
+
+            job_id = str(uuid.uuid4())
+            d = self.job_dir(job_id)
+            os.makedirs(d, exist_ok=True)
+            for i, data in enumerate(datas):
+                with open(os.path.join(d, f"{i:04d}.img"), "wb") as fh:
+                    fh.write(data)
+
+            job = AttendanceJob(id=job_id, class_id=class_id, lane=lane, status="queued",
+                                threshold=threshold, images_total=len(datas))
+            db.add(job)
+            db.commit()
+            position = self.queue_position(db, job)
+        finally:
+            db.close()
+        self.submitted += 1
+        if self._loop is not None:
+            # submit chạy trong thread: asyncio.Event chỉ set được từ event loop
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+        return job, position
+
+    def queue_position(self, db, job: AttendanceJob) -> int | None:
+        """Số job queued đứng trước job này (cùng lane hoặc lane ưu tiên hơn)."""
+        if job.status != "queued":
+            return None
+        higher = LANES[:LANES.index(job.lane)]
+        return db.query(func.count(AttendanceJob.id)).filter(
+            AttendanceJob.status == "queued",
+            (AttendanceJob.lane.in_(higher)) | (
+                (AttendanceJob.lane == job.lane) & (AttendanceJob.created_at < job.created_at)
+            ),
+        ).scalar()
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "running": dict(self._running),
+            "max_queued": dict(self.max_queued),
+            "submitted": self.submitted,
+            "rejected": self.rejected,
+            "completed": self.completed,
+            "failed": self.failed,
+            "recovered": self.recovered,
+            "busy_requeued": self.busy_requeued,
+        }
+
+    # ---- worker ----
+
+    def _allowed_lanes(self):
+        if self.workers > 1 and self._running["bulk"] >= self.workers - 1:
+            return ["live"]
+        return list(LANES)
+
+    def _claim(self, lanes: list[str]):
+        """Lấy 1 job queued (chạy trong thread), return AttendanceJob đã tách khỏi session hoặc None."""
+        now = time.monotonic()
+        order = case({lane: i for i, lane in enumerate(LANES)}, value=AttendanceJob.lane)
+        db = SessionLocal()
+        try:
+            for job_id, in (
+                db.query(AttendanceJob.id)
+                .filter(AttendanceJob.status == "queued", AttendanceJob.lane.in_(lanes))
+                .order_by(order, AttendanceJob.created_at)
+                .limit(5 + len(self._not_before))
+            ):
+                if self._not_before.get(job_id, 0.0) > now:
+                    continue
+                claimed = db.query(AttendanceJob).filter(
+                    AttendanceJob.id == job_id, AttendanceJob.status == "queued"
+                ).update({
+                    AttendanceJob.status: "running",
+                    AttendanceJob.attempts: AttendanceJob.attempts + 1,
+                    AttendanceJob.images_done: 0,
+                    AttendanceJob.started_at: datetime.utcnow(),
+                }, synchronize_session=False)
+                db.commit()
+                if claimed:
+                    self._not_before.pop(job_id, None)
+                    return db.get(AttendanceJob, job_id)
+            return None
+        finally:
+            db.close()
+
+    @staticmethod
+    def _update(job_id: str, values: dict, status: str | None = None):
+        """UPDATE 1 job theo id (chạy trong thread); status: chỉ update khi job đang ở trạng thái đó."""
+        db = SessionLocal()
+        try:
+            q = db.query(AttendanceJob).filter(AttendanceJob.id == job_id)
+            if status is not None:
+                q = q.filter(AttendanceJob.status == status)
+            q.update(values, synchronize_session=False)
+            db.commit()
+        finally:
+            db.close()
+
+    def _read_images(self, job: AttendanceJob) -> list[bytes]:
+        d = self.job_dir(job.id)
+        names = sorted(os.listdir(d)) if os.path.isdir(d) else []
+        datas = []
+        for name in names:
+            with open(os.path.join(d, name), "rb") as fh:
+                datas.append(fh.read())
+        return datas
+
+    async def _worker(self, idx: int):
+        while True:
+            try:
+                job = await asyncio.to_thread(self._claim, self._allowed_lanes())
+                if job is None:
+                    self._wakeup.clear()
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+                await self._run(job)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.exception(f"Job worker {idx} error: {e}")
+                await asyncio.sleep(self.poll_interval)
+
+    async def _run(self, job: AttendanceJob):
+        lane = job.lane
+        self._running[lane] += 1
+        done = 0
+        flushing: asyncio.Task | None = None
+
+        async def flush():
+            # ghi images_done mới nhất; progress() gọi dồn dập chỉ tạo 1 lượt ghi mỗi lúc
+            written = -1
+            while written != done:
+                written = done
+                await asyncio.to_thread(self._update, job.id, {"images_done": written})
+
+        def progress():
+            nonlocal done, flushing
+            done += 1
+            if flushing is None or flushing.done():
+                flushing = asyncio.ensure_future(flush())
+
+        async def settle():
+            if flushing is not None:
+                await asyncio.gather(flushing, return_exceptions=True)
+
+        try:
+            datas = await asyncio.to_thread(self._read_images, job)
+            if len(datas) != job.images_total:
+                raise RuntimeError(f"job files missing ({len(datas)}/{job.images_total})")
+
+            session_id = await self.handler(job, datas, progress)
+            await settle()
+            await asyncio.to_thread(self._update, job.id, {
+                "status": "done", "session_id": session_id, "finished_at": datetime.utcnow(),
+            })
+            self.completed += 1
+            self._busy_streak = 0
+            await asyncio.to_thread(shutil.rmtree, self.job_dir(job.id), True)
+        except asyncio.CancelledError:
+            # shutdown bình thường: trả job về hàng đợi, không tính là 1 lần thử
+            await settle()
+            await asyncio.to_thread(self._requeue, job.id)
+            raise
+        except InferenceBusy as e:
+            # executor đầy: không phải lỗi của job -> trả về hàng đợi, không tính lần thử, lùi lại
+            await settle()
+            await asyncio.to_thread(self._requeue, job.id)
+            self.busy_requeued += 1
+            self._busy_streak += 1
+            delay = min(self.busy_backoff_max, self.poll_interval * 2 ** (self._busy_streak - 1))
+            self._not_before[job.id] = time.monotonic() + delay
+            logger.info(f"Job {job.id} requeued, inference busy ({e}); retry in {delay:.1f}s")
+            await asyncio.sleep(delay)
+        except Exception as e:
+            await settle()
+            await asyncio.to_thread(self._update, job.id, {
+                "status": "failed", "error": getattr(e, "detail", None) or str(e), "finished_at": datetime.utcnow(),
+            })
+            self.failed += 1
+            await asyncio.to_thread(shutil.rmtree, self.job_dir(job.id), True)
+        finally:
+            self._running[lane] -= 1
+
+    def _requeue(self, job_id: str):
+        # chỉ job còn 'running': bị cancel sau khi đã ghi done/failed (lúc xoá thư mục job)
+        # hay lúc đang lùi sau InferenceBusy thì không được đưa lại về hàng đợi
+        self._update(job_id, {
+            "status": "queued", "images_done": 0,
+            "attempts": case((AttendanceJob.attempts > 0, AttendanceJob.attempts - 1), else_=0),
+        }, status="running")
+
+    @staticmethod
+    def _set_failed(job: AttendanceJob, error: str):
+        job.status = "failed"
+        job.error = error
+        job.finished_at = datetime.utcnow()
+
+
+job_queue = AttendanceJobQueue(
+    workers=settings.jobs_workers,
+    max_queued={"live": settings.jobs_max_queued_live, "bulk": settings.jobs_max_queued_bulk},
+    max_attempts=settings.jobs_max_attempts,
+    poll_interval=settings.jobs_poll_interval,
+    busy_backoff_max=settings.jobs_busy_backoff_max_s,
+)
@@ -0,0 +1,112 @@
+"""
+Chọn 1 process "leader" trong các worker uvicorn (--workers N) chạy chung storage_dir.
+
+Chỉ leader chạy việc không được chạy trùng: scheduler cleanup, worker job điểm danh và
+job_queue.recover() (đưa job 'running' dở dang về hàng đợi). Leader giữ flock không chặn
+trên storage_dir/run/leader.lock; các process khác thử lại mỗi leader_retry_s giây. Hệ điều hành
+nhả lock khi process leader thoát hoặc chết (kể cả bị kill), nên process lấy được lock sau đó
+chắc chắn không còn process nào đang chạy job -> recover() an toàn.
+
+File lock không được xoá khi leader còn sống: xoá thì process khác flock được inode mới và
+cũng thành leader. Vì vậy nó nằm trong run/, thư mục cleanup không quét file mồ côi.
+
+flock chỉ có hiệu lực giữa các process cùng máy (storage_dir trên đĩa local). Không có fcntl
+(Windows) thì mọi process đều là leader như trước.
+"""
+import asyncio
+import logging
+import os
+import time
+
+from app.settings import settings
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+
+class LeaderLock:
+    def __init__(self, path: str, retry_interval: float = 10.0):
+        self.path = path
+        self.retry_interval = retry_interval
+        self._fh = None
+        self._task: asyncio.Task | None = None
+        self.acquired_at: float | None = None
+        self.attempts = 0
+
+    @property
+    def is_leader(self) -> bool:
+        return self._fh is not None
+
+    def try_acquire(self) -> bool:
+        """Thử lấy lock 1 lần (không chặn), return True nếu process này là leader."""
+        if self._fh is not None:
+            return True
+        self.attempts += 1
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        fh = open(self.path, "a+")
+        if fcntl is not None:
+            try:
+                fcntl.flock(fh.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                fh.close()
+                return False
+        else:
+            logger.warning("fcntl is not available, every process acts as leader")
+        # pid trong file chỉ để xem ai đang giữ lock, không dùng để quyết định
+        fh.seek(0)
+        fh.truncate()
+        fh.write(f"{os.getpid()}\n")
+        fh.flush()
+        self._fh = fh
+        self.acquired_at = time.time()
+        return True
+
+    def release(self):
+        if self._fh is None:
+            return
+        if fcntl is not None:
+            fcntl.flock(self._fh.fileno(), fcntl.LOCK_UN)
+        self._fh.close()
+        self._fh = None
+        self.acquired_at = None
+
+    async def _run(self, on_acquire):
+        while not await asyncio.to_thread(self.try_acquire):
+            await asyncio.sleep(self.retry_interval)
+        logger.info(f"Process {os.getpid()} is leader (scheduler, attendance job workers)")
+        try:
+            await on_acquire()
+        except Exception as e:
+            # giữ lock mà không chạy gì thì không process nào chạy job / scheduler: nhả cho worker khác
+            logger.exception(f"Leader startup failed, releasing lock: {e}")
+            self.release()
+
+    def start(self, on_acquire):
+        """
+        Chạy nền: lấy lock (thử lại tới khi được) rồi await on_acquire(). on_acquire lỗi thì
+        log và nhả lock (on_acquire tự dừng phần đã bật trước khi raise).
+        """
+        self._task = asyncio.create_task(self._run(on_acquire))
+
+    async def stop(self):
+        """Dừng thử lấy lock; lock (nếu có) giữ tới release() sau khi việc của leader đã dừng."""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def stats(self) -> dict:
+        return {
+            "pid": os.getpid(),
+            "is_leader": self.is_leader,
+            "acquired_at": self.acquired_at,
+            "attempts": self.attempts,
+            "lock_path": self.path,
+        }
+
+
+leader = LeaderLock(os.path.join(settings.storage_dir, "run", "leader.lock"), retry_interval=settings.leader_retry_s)
@@ -1,6 +1,21 @@
 import numpy as np
 
 
+def as_float32_matrix(mat: np.ndarray) -> np.ndarray:
+    """
+    Trả về mat dạng float32 C-contiguous.
+    Không copy nếu mat đã đúng dtype/layout (vd gallery lấy từ cache).
+    """
+    return np.ascontiguousarray(mat, dtype=np.float32)
+
+
+def normalize_rows(mat: np.ndarray) -> np.ndarray:
+    """L2-normalize từng hàng của (F, D), trả về float32 mới."""
+    mat = np.asarray(mat, dtype=np.float32)
+    norms = np.linalg.norm(mat, axis=1, keepdims=True)
+    return mat / (norms + 1e-9)
+
+
 def cosine_similarity_matrix(vec: np.ndarray, mat: np.ndarray) -> np.ndarray:
     """
     vec: (D,), mat: (N,D) đã normalize thì cosine = dot.
@@ -10,6 +25,191 @@ def cosine_similarity_matrix(vec: np.ndarray, mat: np.ndarray) -> np.ndarray:
     return mat @ vec
 
 
+def match_batch(embs: np.ndarray, gallery: np.ndarray, top_k: int = 0):
+    """
+    So khớp nhiều khuôn mặt với gallery bằng 1 phép GEMM.
+
+    embs: (F, D) embedding của các face (sẽ được normalize lại).
+    gallery: (N, D) đã normalize.
+    top_k: nếu > 0 trả thêm top-k index/score cho mỗi face (giảm dần).
+
+    Return (best_idx (F,), best_score (F,), topk_idx (F,k) | None, topk_score (F,k) | None).
+    Khi gallery rỗng best_idx = -1, best_score = 0.
+    """
+    q = np.asarray(embs)
+    if q.ndim == 1:
+        q = q.reshape(1, -1)
+    q = normalize_rows(q)
+    F = q.shape[0]
+
+    if gallery.size == 0 or F == 0:
+        empty_idx = np.full((F,), -1, dtype=np.int64)
+        empty_score = np.zeros((F,), dtype=np.float32)
+        if top_k <= 0:
+            return empty_idx, empty_score, None, None
+        return (empty_idx, empty_score,
+                np.full((F, top_k), -1, dtype=np.int64), np.zeros((F, top_k), dtype=np.float32))
+
+    g = as_float32_matrix(gallery)
+    sims = q @ g.T  # (F, N)
+
+    best_idx = np.argmax(sims, axis=1)
+    best_score = sims[np.arange(F), best_idx]
+
+    if top_k <= 0:
+        return best_idx, best_score, None, None
+
+    k = min(top_k, sims.shape[1])
+    if k < sims.shape[1]:
+        part = np.argpartition(-sims, k - 1, axis=1)[:, :k]
+    else:
+        part = np.broadcast_to(np.arange(k), (F, k))
+    part_scores = np.take_along_axis(sims, part, axis=1)
+    order = np.argsort(-part_scores, axis=1)
+    topk_idx = np.take_along_axis(part, order, axis=1)
+    topk_score = np.take_along_axis(part_scores, order, axis=1)
+    return best_idx, best_score, topk_idx, topk_score
+
+
+def student_segments(student_ids: list[str]):
+    """
+    Gom các hàng gallery theo student.
+
+    Return (order, keys, seg_starts):
+      order: hoán vị hàng sao cho embedding của cùng 1 student nằm liền nhau,
+      keys: Student.id duy nhất (S,) theo thứ tự segment,
+      seg_starts: (S,) vị trí bắt đầu mỗi segment sau khi hoán vị.
+    """
+    if len(student_ids) == 0:
+        return np.zeros((0,), dtype=np.int64), [], np.zeros((0,), dtype=np.int64)
+    keys, inv = np.unique(np.asarray(student_ids, dtype=str), return_inverse=True)
+    order = np.argsort(inv, kind="stable")
+    counts = np.bincount(inv, minlength=len(keys))
+    seg_starts = np.concatenate(([0], np.cumsum(counts)[:-1])).astype(np.int64)
+    return order, keys.tolist(), seg_starts
+
+
+def aggregate_by_student(sims_t: np.ndarray, seg_starts: np.ndarray, mode: str = "max", top_k: int = 3):
+    """
+    Gộp similarity theo embedding thành theo student.
+
+    sims_t: (N, F) = gallery @ faces.T, các hàng đã gom liền nhau theo student
+    (xem student_segments, mọi segment khác rỗng). Return (F, S).
+    mode="max": điểm cao nhất trong các embedding của student.
+    mode="mean_topk": trung bình top_k điểm cao nhất (student ít embedding hơn top_k
+    thì lấy trung bình tất cả).
+    Chi phí O(N * F): segment reduction, không pad theo student nhiều embedding nhất.
+    """
+    if mode not in ("max", "mean_topk"):
+        raise ValueError(f"unknown aggregate mode: {mode}")
+    N, F = sims_t.shape
+    S = len(seg_starts)
+    if S == 0 or F == 0:
+        return np.zeros((F, S), dtype=np.float32)
+
+    if mode == "max" or top_k <= 1:
+        return np.maximum.reduceat(sims_t, seg_starts, axis=0).T
+
+    counts = np.diff(np.append(seg_starts, N))
+    # student có <= top_k embedding: trung bình cả segment
+    total = np.add.reduceat(sims_t, seg_starts, axis=0).astype(np.float32)       # (S, F)
+    k_eff = np.minimum(counts, top_k).astype(np.float32)
+    # student nhiều hơn top_k: gom theo số embedding, partition trong từng nhóm (c, nhóm, F)
+    big = np.flatnonzero(counts > top_k)
+    for c in np.unique(counts[big]).tolist():
+        group = big[counts[big] == c]
+        rows = seg_starts[group][None, :] + np.arange(c)[:, None]                 # (c, G)
+        block = np.partition(sims_t[rows], c - top_k, axis=0)[c - top_k:]        # (k, G, F)
+        total[group] = block.sum(axis=0)
+    return (total / k_eff[:, None]).T.astype(np.float32)
+
+
+def assign_one_to_one(scores: np.ndarray, threshold: float):
+    """
+    Gán face -> student 1-1 cho các face trong cùng 1 ảnh (greedy theo score giảm dần).
+
+    scores: (F, S). Mỗi face chỉ cần xét top-min(F, S) student của nó: tối đa F-1
+    student đã bị face khác lấy nên student tốt nhất còn lại luôn nằm trong đó.
+    Return (student_idx (F,) với -1 = unknown, score (F,) của cặp được gán hoặc
+    điểm cao nhất nếu unknown).
+    """
+    F, S = scores.shape
+    assigned = np.full((F,), -1, dtype=np.int64)
+    if F == 0 or S == 0:
+        return assigned, np.zeros((F,), dtype=np.float32)
+
+    out_scores = scores.max(axis=1).astype(np.float32)
+    k = min(F, S)
+    if k < S:
+        cand = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    else:
+        cand = np.broadcast_to(np.arange(S), (F, S))
+    cand_scores = np.take_along_axis(scores, cand, axis=1)
+
+    flat = cand_scores.ravel()
+    order = np.argsort(-flat, kind="stable")
+    order = order[flat[order] >= threshold]
+
+    taken = set()
+    remaining = F
+    for pos in order.tolist():
+        f, j = divmod(pos, k)
+        if assigned[f] >= 0:
+            continue
+        s = int(cand[f, j])
+        if s in taken:
+            continue
+        assigned[f] = s
+        out_scores[f] = flat[pos]
+        taken.add(s)
+        remaining -= 1
+        if remaining == 0:
+            break
+    return assigned, out_scores
+
+
+def match_students(embs: np.ndarray, gallery: np.ndarray, seg_starts: np.ndarray, threshold: float,
+                   image_ids=None, aggregate: str = "max", top_k: int = 3, one_to_one: bool = True,
+                   calibration=None):
+    """
+    Match các face với student (không phải từng embedding).
+
+    gallery: (N, D) đã gom theo student, seg_starts: (S,) (xem student_segments).
+    image_ids: (F,) ảnh nguồn của mỗi face; ràng buộc 1-1 áp dụng trong từng ảnh.
+    calibration: app.core.calibration.Calibration của gallery (None = điểm cosine thô).
+    Return (student_idx (F,) với -1 = unknown, score (F,)).
+    """
+    q = np.asarray(embs)
+    if q.ndim == 1:
+        q = q.reshape(1, -1)
+    F = q.shape[0]
+    if F == 0 or gallery.size == 0 or len(seg_starts) == 0:
+        return np.full((F,), -1, dtype=np.int64), np.zeros((F,), dtype=np.float32)
+
+    sims_t = as_float32_matrix(gallery) @ normalize_rows(q).T   # (N, F)
+    scores = aggregate_by_student(sims_t, seg_starts, mode=aggregate, top_k=top_k)
+    if calibration is not None:
+        scores = calibration.apply(scores)
+
+    if not one_to_one:
+        idx = np.argmax(scores, axis=1)
+        best = scores[np.arange(F), idx]
+        return np.where(best >= threshold, idx, -1), best.astype(np.float32)
+
+    if image_ids is None:
+        return assign_one_to_one(scores, threshold)
+
+    image_ids = np.asarray(image_ids)
+    student_idx = np.full((F,), -1, dtype=np.int64)
+    best = np.zeros((F,), dtype=np.float32)
+    for img in np.unique(image_ids):
+        rows = np.flatnonzero(image_ids == img)
+        a, sc = assign_one_to_one(scores[rows], threshold)
+        student_idx[rows] = a
+        best[rows] = sc
+    return student_idx, best
+
+
 def best_match(vec: np.ndarray, names: list[str], gallery: np.ndarray, threshold: float):
     """
     Return (matched_name_or_None, best_score).
@@ -17,13 +217,43 @@ def best_match(vec: np.ndarray, names: list[str], gallery: np.ndarray, threshold
     if gallery.size == 0 or len(names) == 0:
         return None, 0.0
 
-    # đảm bảo normalize
-    v = vec.astype(np.float32).reshape(-1)
-    v = v / (np.linalg.norm(v) + 1e-9)
-
-    sims = cosine_similarity_matrix(v, gallery.astype(np.float32))
-    idx = int(np.argmax(sims))
-    best = float(sims[idx])
+    best_idx, best_score, _, _ = match_batch(np.asarray(vec).reshape(1, -1), gallery)
+    idx = int(best_idx[0])
+    best = float(best_score[0])
     if best >= threshold:
         return names[idx], best
     return None, best
+
+
+def match_tracks(embs: np.ndarray, track_ids, gallery: np.ndarray, seg_starts: np.ndarray, threshold: float,
+                 aggregate: str = "max", top_k: int = 3, one_to_one: bool = True, calibration=None):
+    """
+    Match theo track (video): điểm của 1 track với 1 student = trung bình điểm (đã gộp theo
+    student) của các embedding trong track, nên 1 frame mờ / lệch góc không quyết định kết quả.
+
+    track_ids: (F,) track của từng embedding. Mỗi track là 1 người khác nhau (tracker đã nối
+    các đoạn của cùng 1 người) nên one_to_one áp dụng trên toàn bộ track.
+    Return (tracks (T,) id track tăng dần, student_idx (T,) với -1 = unknown, score (T,)).
+    """
+    q = np.asarray(embs)
+    if q.ndim == 1:
+        q = q.reshape(1, -1)
+    tracks, inv = np.unique(np.asarray(track_ids), return_inverse=True)
+    T = len(tracks)
+    if T == 0 or gallery.size == 0 or len(seg_starts) == 0:
+        return tracks, np.full((T,), -1, dtype=np.int64), np.zeros((T,), dtype=np.float32)
+
+    sims_t = as_float32_matrix(gallery) @ normalize_rows(q).T              # (N, F)
+    per_emb = aggregate_by_student(sims_t, seg_starts, mode=aggregate, top_k=top_k)   # (F, S)
+    scores = np.zeros((T, per_emb.shape[1]), dtype=np.float32)
+    np.add.at(scores, inv, per_emb)
+    scores /= np.bincount(inv, minlength=T)[:, None].astype(np.float32)
+    if calibration is not None:
+        scores = calibration.apply(scores)      # affine: áp sau khi lấy trung bình là đủ
+
+    if one_to_one:
+        idx, best = assign_one_to_one(scores, threshold)
+        return tracks, idx, best
+    idx = np.argmax(scores, axis=1)
+    best = scores[np.arange(T), idx]
+    return tracks, np.where(best >= threshold, idx, -1), best.astype(np.float32)
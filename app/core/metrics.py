@@ -0,0 +1,326 @@
+"""
+Đo thời gian từng stage của pipeline và request, gộp trong process, xuất dạng Prometheus
+text ở GET /metrics.
+
+  - Histogram / Counter ghi vào shard riêng của từng thread (threading.local): hot path
+    không lấy lock, chỉ lúc scrape mới cộng các shard.
+  - span("detect") (context manager) / @timed("db_write") (decorator, sync hoặc async) đo và
+    ghi vào pipeline_stage_duration_seconds{stage=...}; observe_stage() ghi thời gian đã đo sẵn
+    (vd timings_ms trả về từ inference executor).
+  - Trong 1 request HTTP (MetricsMiddleware), thời gian các stage được cộng dồn vào 1 dict
+    của request: request_timings() và header Server-Timing (settings.metrics_server_timing).
+  - Collector: hàm trả về số liệu lúc scrape (inference executor, gallery cache, ...).
+"""
+import contextvars
+import functools
+import inspect
+import threading
+import time
+from bisect import bisect_left
+
+from app.settings import settings
+
+# giây, từ decode 1 ảnh nhỏ tới cả request nhiều ảnh
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_request_timings: contextvars.ContextVar = contextvars.ContextVar("request_timings", default=None)
+
+
+def _fmt_labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    parts = []
+    for k, v in labels.items():
+        v = str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        parts.append(f'{k}="{v}"')
+    return "{" + ",".join(parts) + "}"
+
+
+def _fmt_value(v: float) -> str:
+    if v == float("inf"):
+        return "+Inf"
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+
+class _Shards:
+    """Mỗi thread 1 list size phần tử; scrape cộng theo cột."""
+
+    __slots__ = ("size", "_local", "_all", "_lock")
+
+    def __init__(self, size: int):
+        self.size = size
+        self._local = threading.local()
+        self._all = []
+        self._lock = threading.Lock()
+
+    def local(self) -> list:
+        shard = getattr(self._local, "v", None)
+        if shard is None:
+            shard = [0] * self.size
+            with self._lock:
+                self._all.append(shard)
+            self._local.v = shard
+        return shard
+
+    def total(self) -> list:
+        with self._lock:
+            shards = list(self._all)
+        out = [0] * self.size
+        for s in shards:
+            for i, v in enumerate(s):
+                out[i] += v
+        return out
+
+
+class _HistogramChild:
+    __slots__ = ("buckets", "_shards")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        # [count mỗi bucket ..., count > bucket cuối, sum]
+        self._shards = _Shards(len(buckets) + 2)
+
+    def observe(self, seconds: float):
+        s = self._shards.local()
+        s[bisect_left(self.buckets, seconds)] += 1
+        s[-1] += seconds
+
+    def snapshot(self):
+        t = self._shards.total()
+        return t[:-1], t[-1]
+
+
+class _CounterChild:
+    __slots__ = ("_shards",)
+
+    def __init__(self):
+        self._shards = _Shards(1)
+
+    def inc(self, n: float = 1):
+        self._shards.local()[0] += n
+
+    def value(self):
+        return self._shards.total()[0]
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values, **kw):
+        key = values or tuple(kw[n] for n in self.labelnames)
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.get(key)
+                if child is None:
+                    child = self._children[key] = self._new_child()
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def _items(self):
+        with self._lock:
+            return [(dict(zip(self.labelnames, k)), c) for k, c in sorted(self._children.items())]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, seconds: float):
+        self.labels().observe(seconds)
+
+    def render(self) -> list[str]:
+        lines = []
+        for labels, child in self._items():
+            counts, total = child.snapshot()
+            cum = 0
+            for le, n in zip(self.buckets + (float("inf"),), counts):
+                cum += n
+                lines.append(f"{self.name}_bucket{_fmt_labels({**labels, 'le': _fmt_value(le)})} {cum}")
+            lines.append(f"{self.name}_sum{_fmt_labels(labels)} {_fmt_value(float(total))}")
+            lines.append(f"{self.name}_count{_fmt_labels(labels)} {cum}")
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, n: float = 1):
+        self.labels().inc(n)
+
+    def render(self) -> list[str]:
+        return [f"{self.name}{_fmt_labels(labels)} {_fmt_value(child.value())}" for labels, child in self._items()]
+
+
+class MetricsRegistry:
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self._metrics = {}
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def histogram(self, name: str, help: str, labelnames=(), buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help, labelnames, buckets))
+
+    def counter(self, name: str, help: str, labelnames=()) -> Counter:
+        return self._register(Counter(name, help, labelnames))
+
+    def register_collector(self, fn):
+        """fn() -> [(name, type, help, [(labels dict, value)])], gọi lúc scrape."""
+        with self._lock:
+            self._collectors.append(fn)
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+            collectors = list(self._collectors)
+        lines = []
+        for m in metrics:
+            lines.append(f"# HELP {m.name} {m.help}")
+            lines.append(f"# TYPE {m.name} {m.kind}")
+            lines.extend(m.render())
+        for fn in collectors:
+            for name, kind, help, samples in fn():
+                lines.append(f"# HELP {name} {help}")
+                lines.append(f"# TYPE {name} {kind}")
+                lines.extend(f"{name}{_fmt_labels(labels)} {_fmt_value(v)}" for labels, v in samples)
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry(enabled=settings.metrics_enabled)
+
+stage_duration = metrics.histogram(
+    "pipeline_stage_duration_seconds", "Thời gian từng stage (decode/detect/quality/align/embed/match/db...)",
+    ("stage",),
+)
+request_duration = metrics.histogram(
+    "http_request_duration_seconds", "Thời gian xử lý request HTTP", ("method", "route", "status"),
+)
+pipeline_items = metrics.counter(
+    "pipeline_items_total", "Số ảnh / face đi qua pipeline điểm danh", ("item",),
+)
+
+
+def observe_stage(stage: str, ms: float):
+    """Ghi thời gian (ms) đã đo của 1 stage vào histogram + breakdown của request hiện tại."""
+    if not metrics.enabled:
+        return
+    stage_duration.labels(stage).observe(ms / 1000)
+    req = _request_timings.get()
+    if req is not None:
+        req[stage] = req.get(stage, 0.0) + ms
+
+
+def count(item: str, n: int = 1):
+    if metrics.enabled and n:
+        pipeline_items.labels(item).inc(n)
+
+
+class span:
+    """
+    with span("match") as sp: ...   -> sp.ms: thời gian đã đo (ms), luôn có kể cả khi tắt metrics
+    """
+
+    __slots__ = ("stage", "t0", "ms")
+
+    def __init__(self, stage: str):
+        self.stage = stage
+        self.ms = 0.0
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.ms = (time.perf_counter() - self.t0) * 1000
+        observe_stage(self.stage, self.ms)
+        return False
+
+
+def timed(stage: str):
+    """Decorator đo cả hàm (sync hoặc coroutine function) như span(stage)."""
+    def deco(fn):
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def awrapper(*args, **kwargs):
+                with span(stage):
+                    return await fn(*args, **kwargs)
+            return awrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(stage):
+                return fn(*args, **kwargs)
+        return wrapper
+    return deco
+
+
+def request_timings() -> dict:
+    """Thời gian cộng dồn theo stage (ms) của request hiện tại ({} nếu ngoài request)."""
+    req = _request_timings.get()
+    return {k: round(v, 3) for k, v in req.items()} if req else {}
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware: đo thời gian mỗi request (theo route template, không theo path thật để
+    không nổ số label), mở breakdown theo stage cho request và thêm header Server-Timing.
+    """
+
+    def __init__(self, app, server_timing: bool = False):
+        self.app = app
+        self.server_timing = server_timing
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not metrics.enabled:
+            await self.app(scope, receive, send)
+            return
+
+        t0 = time.perf_counter()
+        timings = {}
+        token = _request_timings.set(timings)
+        status = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+                if self.server_timing:
+                    total = (time.perf_counter() - t0) * 1000
+                    value = ", ".join([f"{k};dur={v:.3f}" for k, v in timings.items()] + [f"app;dur={total:.3f}"])
+                    message = dict(message, headers=list(message.get("headers", [])) +
+                                   [(b"server-timing", value.encode("latin-1"))])
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _request_timings.reset(token)
+            route = scope.get("route")
+            path = getattr(route, "path", None) or "unmatched"
+            request_duration.labels(scope["method"], path, f"{status[0] // 100}xx").observe(time.perf_counter() - t0)
@@ -0,0 +1,163 @@
+import logging
+import time
+
+import numpy as np
+
+from app.core.quality import quality_gate_batch, quality_meta
+from app.utils.image import decode_upload_to_bgr, decode_for_detection
+
+logger = logging.getLogger(__name__)
+
+# reason của quality_gate -> tên counter trong dbg của routes_attendance
+REJECT_COUNTERS = {
+    "lowconf": "filtered_lowconf",
+    "small": "filtered_small",
+    "blur": "filtered_blur",
+    "empty_crop": "filtered_empty_crop",
+}
+
+
+def _align_faces(engine, data: bytes, det, full, faces, full_res_below: float):
+    """
+    Align các face (landmarks, cạnh bbox nhỏ nhất) detect trên det.
+
+    - Có sẵn ảnh full-res: align từ full-res (landmarks nhân theo tỉ lệ).
+    - Chưa decode full-res (decode thu nhỏ): nếu có face nhỏ hơn full_res_below px
+      trên ảnh detect thì decode full-res 1 lần; còn lại align thẳng từ ảnh detect
+      (face đã đủ lớn cho input 112x112 của ArcFace).
+    Return (crops, kept (index trong faces của từng crop), full_decoded, decode_ms).
+    """
+    decode_ms = 0.0
+    full_decoded = False
+    if full is None and any(side < full_res_below for _, side in faces):
+        t0 = time.perf_counter()
+        full = decode_upload_to_bgr(data)
+        decode_ms = (time.perf_counter() - t0) * 1000
+        full_decoded = full is not None
+
+    src = det if full is None else full
+    sx = src.shape[1] / det.shape[1]
+    sy = src.shape[0] / det.shape[0]
+    crops, kept = [], []
+    for i, (landmarks, _) in enumerate(faces):
+        lm = np.asarray(landmarks, dtype=np.float32)
+        if src is not det:
+            lm = lm * np.array([sx, sy], dtype=np.float32)
+        try:
+            crops.append(engine.align(src, lm))
+            kept.append(i)
+        except Exception as e:
+            logger.warning(f"Align error: {e}")
+    return crops, kept, full_decoded, decode_ms
+
+
+def process_attendance_image(engine, data: bytes, min_conf: float, min_face: int, min_blur: float,
+                             detect_max_side: int = 0, detect_decode: str = "reduced",
+                             align_full_res_below: int = 112) -> dict:
+    """
+    decode -> detect -> quality gate -> align cho 1 ảnh (chạy trong inference executor).
+    Embedding được tính sau, gộp batch cho mọi face của request (engine.embed_aligned).
+
+    detect_max_side > 0: detect + quality gate trên ảnh thu nhỏ (xem decode_for_detection),
+    min_face vẫn tính theo pixel full-res, chỉ vùng face được align từ full-res
+    (xem _align_faces). Blur đo trên ảnh thu nhỏ nên cao hơn một chút so với full-res.
+
+    Return dict:
+      decoded, faces_detected, faces_pass_quality, counters (filtered_* / faces_embedding_error),
+      rejected (meta các face bị loại), aligned (list crop 112x112),
+      faces (bbox full-res [x1, y1, x2, y2] + conf của từng crop trong aligned),
+      timings_ms: decode/detect/quality/align.
+    counters gồm thêm images_downscaled / images_full_res_decoded khi detect trên ảnh thu nhỏ.
+    """
+    out = {
+        "decoded": False,
+        "faces_detected": 0,
+        "faces_pass_quality": 0,
+        "counters": {},
+        "rejected": [],
+        "aligned": [],
+        "faces": [],
+        "timings_ms": {"decode": 0.0, "detect": 0.0, "quality": 0.0, "align": 0.0},
+    }
+    counters = out["counters"]
+    timings = out["timings_ms"]
+
+    t0 = time.perf_counter()
+    img, full, scale = decode_for_detection(data, detect_max_side, detect_decode)
+    timings["decode"] = (time.perf_counter() - t0) * 1000
+    if img is None:
+        return out
+    out["decoded"] = True
+    if scale > 1.0:
+        counters["images_downscaled"] = 1
+
+    t0 = time.perf_counter()
+    faces = engine.detect(img)  # multi-face detection
+    timings["detect"] = (time.perf_counter() - t0) * 1000
+    out["faces_detected"] = len(faces)
+
+    accepted = []
+    meta = []
+    t0 = time.perf_counter()
+    q = quality_gate_batch(img, faces, min_conf=min_conf, min_face=min_face / scale, min_blur=min_blur)
+    for face, row in zip(faces, q):
+        if not row["ok"]:
+            key = REJECT_COUNTERS.get(str(row["reason"]))
+            if key:
+                counters[key] = counters.get(key, 0) + 1
+            # Lưu chi tiết face bị reject để debug
+            out["rejected"].append(quality_meta(row, min_conf=min_conf, min_blur=min_blur))
+            continue
+
+        out["faces_pass_quality"] += 1
+
+        # Kiểm tra landmarks trước khi tính embedding
+        landmarks = getattr(face, "landmarks", None)
+        if landmarks is None:
+            counters["filtered_no_landmarks"] = counters.get("filtered_no_landmarks", 0) + 1
+            out["rejected"].append({"reason": "no_landmarks"})
+            continue
+        accepted.append((landmarks, min(int(row["w"]), int(row["h"]))))
+        box = [round(float(row[k]) * scale) for k in ("x1", "y1", "x2", "y2")]
+        meta.append({"bbox": box, "conf": None if np.isnan(row["conf"]) else round(float(row["conf"]), 4)})
+    timings["quality"] = (time.perf_counter() - t0) * 1000
+
+    t0 = time.perf_counter()
+    crops, kept, full_decoded, decode_ms = _align_faces(engine, data, img, full, accepted, align_full_res_below)
+    out["aligned"] = crops
+    out["faces"] = [meta[i] for i in kept]
+    if full_decoded:
+        counters["images_full_res_decoded"] = 1
+    if len(kept) < len(accepted):
+        counters["faces_embedding_error"] = counters.get("faces_embedding_error", 0) + len(accepted) - len(kept)
+    timings["decode"] += decode_ms
+    timings["align"] = (time.perf_counter() - t0) * 1000 - decode_ms
+    return out
+
+
+def embed_faces(engine, crops: list):
+    """Batch embedding cho các crop đã align. Return ((N, D) float32, embed_ms)."""
+    t0 = time.perf_counter()
+    embs = engine.embed_aligned(crops)
+    return embs, (time.perf_counter() - t0) * 1000
+
+
+def process_enroll_image(engine, data: bytes, detect_max_side: int = 0, detect_decode: str = "reduced",
+                         align_full_res_below: int = 112):
+    """
+    decode -> detect -> crop đã align của khuôn mặt có confidence cao nhất.
+    Return crop hoặc None nếu ảnh lỗi / không có mặt.
+    """
+    img, full, _ = decode_for_detection(data, detect_max_side, detect_decode)
+    if img is None:
+        return None
+
+    faces = engine.detect(img)
+    if not faces:
+        return None
+
+    face = max(faces, key=lambda x: x.confidence)
+    b = np.asarray(face.bbox, dtype=np.float32).reshape(-1)
+    side = float(min(b[2] - b[0], b[3] - b[1]))
+    crops, _, _, _ = _align_faces(engine, data, img, full, [(face.landmarks, side)], align_full_res_below)
+    return crops[0] if crops else None
@@ -0,0 +1,78 @@
+"""
+Gom embedding của 1 học sinh thành tối đa cap prototype (settings.enroll_max_embeddings),
+để gallery không phình ra mỗi lần enroll lại.
+
+  - "kmeans": spherical k-means, prototype = trung bình cụm (normalize lại); trung bình
+    nhiều ảnh cùng kiểu (góc, ánh sáng) thường khử nhiễu tốt hơn từng ảnh riêng.
+  - "kmedoids": prototype = embedding thật ở tâm cụm (không tạo vector mới).
+
+Khởi tạo k-means++ với seed cố định nên cùng input cho cùng kết quả.
+"""
+import numpy as np
+
+METHODS = ("kmeans", "kmedoids")
+
+
+def _normalize(x: np.ndarray) -> np.ndarray:
+    return x / np.maximum(np.linalg.norm(x, axis=-1, keepdims=True), 1e-9)
+
+
+def _init_indices(sims: np.ndarray, k: int, seed: int) -> list[int]:
+    """k-means++ trên khoảng cách cosine (1 - sim), điểm đầu = điểm gần tâm nhất."""
+    rng = np.random.default_rng(seed)
+    idx = [int(np.argmax(sims.sum(axis=1)))]
+    d = np.clip(1.0 - sims[idx[0]], 0.0, None)
+    for _ in range(1, k):
+        total = d.sum()
+        nxt = int(rng.choice(len(d), p=d / total)) if total > 1e-12 else int(np.argmax(d))
+        idx.append(nxt)
+        d = np.minimum(d, np.clip(1.0 - sims[nxt], 0.0, None))
+    return idx
+
+
+def kmeans_prototypes(embs: np.ndarray, k: int, iters: int = 20, seed: int = 0) -> np.ndarray:
+    sims = embs @ embs.T
+    centers = embs[_init_indices(sims, k, seed)].copy()
+    for _ in range(iters):
+        assign = np.argmax(embs @ centers.T, axis=1)
+        sums = np.zeros_like(centers)
+        np.add.at(sums, assign, embs)
+        empty = np.linalg.norm(sums, axis=1) < 1e-9
+        sums[empty] = centers[empty]
+        new = _normalize(sums)
+        if np.allclose(new, centers, atol=1e-6):
+            break
+        centers = new
+    return centers
+
+
+def kmedoids_prototypes(embs: np.ndarray, k: int, iters: int = 20, seed: int = 0) -> np.ndarray:
+    sims = embs @ embs.T
+    medoids = np.array(_init_indices(sims, k, seed))
+    for _ in range(iters):
+        assign = np.argmax(sims[:, medoids], axis=1)
+        new = medoids.copy()
+        for j in range(k):
+            members = np.flatnonzero(assign == j)
+            if len(members):
+                # medoid mới: thành viên có tổng similarity tới cả cụm lớn nhất
+                new[j] = members[np.argmax(sims[np.ix_(members, members)].sum(axis=1))]
+        if np.array_equal(new, medoids):
+            break
+        medoids = new
+    return embs[medoids].copy()
+
+
+def consolidate(embs: np.ndarray, cap: int, method: str = "kmeans") -> np.ndarray | None:
+    """
+    embs (n, D) của 1 học sinh. Return (cap, D) prototype đã L2-normalize,
+    hoặc None nếu n <= cap (không cần gom).
+    """
+    embs = np.asarray(embs, dtype=np.float32)
+    if cap <= 0 or len(embs) <= cap:
+        return None
+    if method not in METHODS:
+        raise ValueError(f"method must be one of {METHODS}")
+    embs = _normalize(embs)
+    fn = kmeans_prototypes if method == "kmeans" else kmedoids_prototypes
+    return np.ascontiguousarray(fn(embs, cap), dtype=np.float32)
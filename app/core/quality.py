@@ -63,3 +63,154 @@ def quality_gate(img_bgr: np.ndarray, face, min_conf=0.4, min_face=20, min_blur=
                         "conf": float(conf) if conf is not None else None}
 
     return True, {"reason": "ok", "w": w, "h": h, "blur": float(bscore), "conf": float(conf) if conf is not None else None}
+
+
+# ---- quality gate vector hoá cho cả ảnh ----
+
+QUALITY_DTYPE = np.dtype([
+    ("conf", np.float32),   # NaN nếu detector không trả confidence
+    ("x1", np.int32), ("y1", np.int32), ("x2", np.int32), ("y2", np.int32),
+    ("w", np.int32), ("h", np.int32),
+    ("blur", np.float32),   # NaN nếu không tính (bị loại trước bước blur)
+    ("ok", np.bool_),
+    ("reason", "U10"),      # ok|lowconf|nobbox|small|empty_crop|blur
+])
+
+# dùng integral image khi tổng diện tích các box >= hệ số này * diện tích vùng bao:
+# Laplacian + integral2 trên vùng bao chỉ rẻ hơn tính riêng từng crop khi các box
+# phủ dày / chồng lấn nhiều; face rải rác trên ảnh 4K thì tính từng crop rẻ hơn nhiều
+_INTEGRAL_MIN_COVERAGE = 2.0
+
+
+def _first_attr(obj, names):
+    for n in names:
+        if getattr(obj, n, None) is not None:
+            return n
+    return None
+
+
+def face_arrays(faces):
+    """
+    Return (conf (F,) float32 NaN=không có, boxes (F, 4) float64 NaN=không có bbox).
+    Tên thuộc tính (confidence/det_score, bbox_xyxy/bbox) chỉ dò 1 lần trên face đầu tiên.
+    """
+    F = len(faces)
+    conf = np.full((F,), np.nan, dtype=np.float32)
+    boxes = np.full((F, 4), np.nan, dtype=np.float64)
+    if F == 0:
+        return conf, boxes
+
+    conf_attr = _first_attr(faces[0], ("confidence", "det_score"))
+    box_attr = _first_attr(faces[0], ("bbox_xyxy", "bbox"))
+    if conf_attr is not None:
+        vals = [getattr(f, conf_attr, None) for f in faces]
+        conf[:] = [np.nan if v is None else v for v in vals]
+    if box_attr is not None:
+        for i, f in enumerate(faces):
+            b = getattr(f, box_attr, None)
+            if b is not None:
+                boxes[i] = np.asarray(b, dtype=np.float64).reshape(-1)[:4]
+    return conf, boxes
+
+
+def box_blur_scores(img_bgr: np.ndarray, boxes: np.ndarray, gray=None) -> np.ndarray:
+    """
+    Variance of Laplacian cho nhiều box (x1, y1, x2, y2) đã clamp, không rỗng.
+
+    - Box phủ dày: grayscale + Laplacian 1 lần trên vùng bao các box, rồi integral image
+      của Laplacian và Laplacian^2 cho variance O(1) mỗi box.
+    - Ngược lại: từng crop, Laplacian CV_32F + meanStdDev (không cấp phát float64 cỡ crop),
+      kết quả giống blur_score trên crop.
+    """
+    n = len(boxes)
+    if n == 0:
+        return np.zeros((0,), dtype=np.float32)
+
+    b = boxes.astype(np.int64)
+    area = ((b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])).astype(np.float64)
+    ox1, oy1, ox2, oy2 = int(b[:, 0].min()), int(b[:, 1].min()), int(b[:, 2].max()), int(b[:, 3].max())
+    union_area = float((ox2 - ox1) * (oy2 - oy1))
+
+    if area.sum() < _INTEGRAL_MIN_COVERAGE * union_area:
+        out = np.empty((n,), dtype=np.float32)
+        for i, (x1, y1, x2, y2) in enumerate(b.tolist()):
+            g = gray[y1:y2, x1:x2] if gray is not None else cv2.cvtColor(img_bgr[y1:y2, x1:x2], cv2.COLOR_BGR2GRAY)
+            _, std = cv2.meanStdDev(cv2.Laplacian(g, cv2.CV_32F))
+            out[i] = std[0, 0] ** 2
+        return out
+
+    g = gray[oy1:oy2, ox1:ox2] if gray is not None else cv2.cvtColor(img_bgr[oy1:oy2, ox1:ox2], cv2.COLOR_BGR2GRAY)
+    lap = cv2.Laplacian(g, cv2.CV_32F)
+    s, sq = cv2.integral2(lap, sdepth=cv2.CV_64F, sqdepth=cv2.CV_64F)
+    b = b - np.array([ox1, oy1, ox1, oy1])
+    x1, y1, x2, y2 = b[:, 0], b[:, 1], b[:, 2], b[:, 3]
+    box_sum = s[y2, x2] - s[y1, x2] - s[y2, x1] + s[y1, x1]
+    box_sq = sq[y2, x2] - sq[y1, x2] - sq[y2, x1] + sq[y1, x1]
+    mean = box_sum / area
+    return np.maximum(box_sq / area - mean * mean, 0.0).astype(np.float32)
+
+
+def quality_gate_batch(img_bgr: np.ndarray, faces, min_conf=0.4, min_face=20, min_blur=3.0, gray=None):
+    """
+    Quality gate cho mọi face của 1 ảnh. Cùng luật và thứ tự lý do như quality_gate
+    (lowconf -> nobbox (cho qua) -> small -> empty_crop -> blur), nhưng:
+      - đọc bbox/conf 1 lần cho cả list face,
+      - lọc conf/size bằng NumPy trên mọi face,
+      - blur chỉ tính cho face còn lại, bằng box_blur_scores
+        (gray có thể truyền sẵn nếu đã có grayscale của cả ảnh).
+    Return structured array QUALITY_DTYPE (F,).
+    """
+    conf, boxes = face_arrays(faces)
+    F = len(conf)
+    out = np.zeros((F,), dtype=QUALITY_DTYPE)
+    out["conf"] = conf
+    out["blur"] = np.nan
+    if F == 0:
+        return out
+
+    H, W = img_bgr.shape[:2]
+    has_box = ~np.isnan(boxes).any(axis=1)
+    bx = np.where(has_box[:, None], boxes, 0.0).astype(np.int64)   # int() như clamp_bbox_xyxy
+    x1 = np.clip(bx[:, 0], 0, W - 1)
+    y1 = np.clip(bx[:, 1], 0, H - 1)
+    x2 = np.clip(bx[:, 2], 0, W)
+    y2 = np.clip(bx[:, 3], 0, H)
+    w, h = x2 - x1, y2 - y1
+    out["x1"], out["y1"], out["x2"], out["y2"], out["w"], out["h"] = x1, y1, x2, y2, w, h
+
+    lowconf = conf < min_conf          # NaN -> False: không có conf thì không loại
+    nobbox = ~lowconf & ~has_box
+    small = ~lowconf & has_box & ((w < min_face) | (h < min_face))
+    empty = ~lowconf & has_box & ~small & ((w <= 0) | (h <= 0))
+    need_blur = ~lowconf & has_box & ~small & ~empty
+
+    if need_blur.any():
+        sel = np.flatnonzero(need_blur)
+        out["blur"][sel] = box_blur_scores(img_bgr, np.stack([x1[sel], y1[sel], x2[sel], y2[sel]], axis=1), gray=gray)
+    blur = need_blur & (out["blur"] < min_blur)
+
+    out["reason"] = np.select(
+        [lowconf, nobbox, small, empty, blur],
+        ["lowconf", "nobbox", "small", "empty_crop", "blur"],
+        default="ok",
+    )
+    out["ok"] = ~(lowconf | small | empty | blur)
+    return out
+
+
+def quality_meta(row, min_conf=0.4, min_blur=3.0) -> dict:
+    """1 dòng QUALITY_DTYPE -> dict debug giống meta của quality_gate."""
+    conf = None if np.isnan(row["conf"]) else float(row["conf"])
+    reason = str(row["reason"])
+    if reason == "lowconf":
+        return {"reason": reason, "conf": conf, "min_conf": min_conf}
+    if reason == "nobbox":
+        return {"reason": reason, "conf": conf}
+    if reason == "small":
+        return {"reason": reason, "w": int(row["w"]), "h": int(row["h"]), "conf": conf}
+    if reason == "empty_crop":
+        return {"reason": reason}
+    meta = {"reason": reason, "w": int(row["w"]), "h": int(row["h"]), "blur": float(row["blur"]), "conf": conf}
+    if reason == "blur":
+        meta["min_blur"] = min_blur
+    return meta
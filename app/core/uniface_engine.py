@@ -1,14 +1,87 @@
 import numpy as np
 from uniface import RetinaFace, ArcFace
+from uniface.face_utils import face_alignment
+
+# 5 landmark chuẩn của ArcFace trên ảnh 112x112 (dùng cho warm-up)
+_ARCFACE_REF_LANDMARKS = np.array(
+    [[38.2946, 51.6963], [73.5318, 51.5014], [56.0252, 71.7366], [41.5493, 92.3655], [70.7299, 92.2041]],
+    dtype=np.float32,
+)
+
+
+def _rebuild_session(model, model_path: str, intra_op_threads: int, inter_op_threads: int):
+    """
+    uniface không nhận SessionOptions, nên tạo lại session với số thread mong muốn
+    (giữ nguyên execution providers của session cũ).
+    """
+    import onnxruntime as ort
+
+    opts = ort.SessionOptions()
+    opts.log_severity_level = 3
+    if intra_op_threads > 0:
+        opts.intra_op_num_threads = intra_op_threads
+    if inter_op_threads > 0:
+        opts.inter_op_num_threads = inter_op_threads
+    model.session = ort.InferenceSession(model_path, sess_options=opts, providers=model.session.get_providers())
+
 
 class UniFaceEngine:
-    def __init__(self):
+    def __init__(self, intra_op_threads: int = 0, inter_op_threads: int = 0, embed_batch_size: int = 32):
         self.detector = RetinaFace()
         self.recognizer = ArcFace()
 
+        if intra_op_threads > 0 or inter_op_threads > 0:
+            _rebuild_session(self.detector, self.detector._model_path, intra_op_threads, inter_op_threads)
+            _rebuild_session(self.recognizer, self.recognizer.model_path, intra_op_threads, inter_op_threads)
+
+        # model export với batch cố định (vd 1) thì không thể gộp lớn hơn
+        batch_dim = self.recognizer.session.get_inputs()[0].shape[0]
+        if isinstance(batch_dim, int) and batch_dim > 0:
+            embed_batch_size = min(embed_batch_size, batch_dim)
+        self.embed_batch_size = max(1, embed_batch_size)
+
     def detect(self, image_bgr):
         return self.detector.detect(image_bgr)
 
     def embedding(self, image_bgr, landmarks):
         emb = self.recognizer.get_normalized_embedding(image_bgr, landmarks)
         return np.asarray(emb, dtype=np.float32).reshape(-1)
+
+    def align(self, image_bgr, landmarks):
+        """Crop + căn chỉnh khuôn mặt về kích thước input của recognizer (112x112 BGR)."""
+        aligned, _ = face_alignment(image_bgr, np.asarray(landmarks), image_size=self.recognizer.input_size)
+        return aligned
+
+    def embed_aligned(self, crops):
+        """
+        Embedding cho nhiều crop đã align, chạy recognizer theo từng batch
+        embed_batch_size crop (N, 3, 112, 112) thay vì N lần batch 1.
+        Return (N, D) float32 đã L2-normalize.
+        """
+        if len(crops) == 0:
+            return np.zeros((0, 0), dtype=np.float32)
+
+        rec = self.recognizer
+        out = []
+        for start in range(0, len(crops), self.embed_batch_size):
+            chunk = crops[start:start + self.embed_batch_size]
+            blob = np.concatenate([rec.preprocess(c) for c in chunk], axis=0)
+            out.append(rec.session.run(rec.output_names, {rec.input_name: blob})[0])
+
+        embs = np.concatenate(out, axis=0).astype(np.float32, copy=False).reshape(len(crops), -1)
+        norms = np.linalg.norm(embs, axis=1, keepdims=True)
+        return embs / np.where(norms > 0, norms, 1.0)
+
+    def embed_batch(self, items):
+        """items: list (image_bgr, landmarks), có thể từ nhiều ảnh khác nhau. Return (N, D)."""
+        return self.embed_aligned([self.align(img, lm) for img, lm in items])
+
+    def warmup(self):
+        """Chạy 1 lượt detect + embedding trên ảnh giả để ONNX Runtime khởi tạo xong."""
+        rng = np.random.default_rng(0)
+        img = rng.integers(0, 255, size=(640, 640, 3), dtype=np.uint8)
+        self.detect(img)
+        crop = self.align(img, _ARCFACE_REF_LANDMARKS * 4.0 + 100.0)
+        self.embed_aligned([crop])
+        if self.embed_batch_size > 1:
+            self.embed_aligned([crop] * self.embed_batch_size)
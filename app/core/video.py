@@ -0,0 +1,369 @@
+"""
+Điểm danh từ video (quay lia cả lớp) hoặc chuỗi ảnh burst đã ghép thành video.
+
+  - Đọc frame: 1 thread grab mọi frame nhưng chỉ retrieve (chuyển màu, copy) frame ứng viên
+    mỗi base_stride frame (~sample_fps), chạy song song với detect của frame trước.
+  - Lấy mẫu thích ứng: xử lý mỗi base_stride frame khi có chuyển động / mặt mới / track chưa
+    embed đủ; cảnh đứng yên và mọi track đã đủ embedding thì giãn dần (x2) tới max_stride.
+  - Track: detection được gán vào track theo IoU với bbox dự đoán (vận tốc không đổi);
+    detection không khớp mở track mới, embedding đầu tiên của track mới được so với các track
+    cũ không xuất hiện cùng frame (cosine >= reid_threshold) để nối lại track bị đứt.
+  - Embed: mỗi track tối đa embeds_per_track lần, cách nhau >= embed_gap frame (nhiều góc mặt),
+    điểm match được gộp theo track (matching.match_tracks).
+"""
+import logging
+import queue
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from app.core.pipeline import REJECT_COUNTERS
+from app.core.quality import quality_gate_batch
+from app.utils.image import resize_max_side
+
+logger = logging.getLogger(__name__)
+
+# face bị loại vì các lý do này vẫn được track (giữ liên tục), chỉ không embed
+_TRACK_REASONS = ("ok", "blur")
+
+
+class VideoError(Exception):
+    """File video không mở / không đọc được."""
+
+
+def iou_matrix(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """IoU giữa các box (A, 4) và (B, 4) dạng x1, y1, x2, y2. Return (A, B)."""
+    if len(a) == 0 or len(b) == 0:
+        return np.zeros((len(a), len(b)), dtype=np.float32)
+    x1 = np.maximum(a[:, None, 0], b[None, :, 0])
+    y1 = np.maximum(a[:, None, 1], b[None, :, 1])
+    x2 = np.minimum(a[:, None, 2], b[None, :, 2])
+    y2 = np.minimum(a[:, None, 3], b[None, :, 3])
+    inter = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    union = area_a[:, None] + area_b[None, :] - inter
+    return (inter / np.maximum(union, 1e-9)).astype(np.float32)
+
+
+class Track:
+    __slots__ = ("id", "bbox", "velocity", "last_frame", "frames", "embs", "last_embed_frame", "best_conf",
+                 "best_bbox")
+
+    def __init__(self, track_id: int, bbox: np.ndarray, frame: int, conf: float):
+        self.id = track_id
+        self.bbox = bbox                    # (4,) toạ độ full-res, lần thấy gần nhất
+        self.velocity = np.zeros(4)         # px / frame
+        self.last_frame = frame
+        self.frames = {frame}               # các frame đã xử lý có mặt track này
+        self.embs = []
+        self.last_embed_frame = None
+        self.best_conf = conf               # face conf cao nhất: bbox lưu vào attendance_faces
+        self.best_bbox = bbox
+
+    def predict(self, frame: int) -> np.ndarray:
+        return self.bbox + self.velocity * (frame - self.last_frame)
+
+    def update(self, bbox: np.ndarray, frame: int, conf: float):
+        dt = frame - self.last_frame
+        if dt > 0:
+            self.velocity = 0.5 * self.velocity + 0.5 * (bbox - self.bbox) / dt
+        self.bbox = bbox
+        self.last_frame = frame
+        self.frames.add(frame)
+        if conf >= self.best_conf:
+            self.best_conf, self.best_bbox = conf, bbox
+
+    def mean_emb(self) -> np.ndarray:
+        m = np.mean(self.embs, axis=0)
+        return m / max(float(np.linalg.norm(m)), 1e-9)
+
+
+class FaceTracker:
+    def __init__(self, iou_threshold: float = 0.3, max_age: int = 45, reid_threshold: float = 0.5,
+                 embeds_per_track: int = 3, embed_gap: int = 15):
+        self.iou_threshold = iou_threshold
+        self.max_age = max_age                  # frame: quá lâu không thấy thì không gán theo IoU nữa
+        self.reid_threshold = reid_threshold
+        self.embeds_per_track = embeds_per_track
+        self.embed_gap = embed_gap
+        self.tracks = {}
+        self.created = 0
+        self.merged = 0
+
+    def update(self, frame: int, boxes: np.ndarray, confs) -> tuple[list[int], int]:
+        """Gán các detection của frame vào track. Return (track id từng detection, số track mới)."""
+        assigned = [-1] * len(boxes)
+        active = [t for t in self.tracks.values() if frame - t.last_frame <= self.max_age]
+        if active and len(boxes):
+            iou = iou_matrix(boxes, np.stack([t.predict(frame) for t in active]))
+            used = set()
+            for pos in np.argsort(-iou, axis=None).tolist():
+                d, k = divmod(pos, len(active))
+                if iou[d, k] < self.iou_threshold:
+                    break
+                if assigned[d] >= 0 or k in used:
+                    continue
+                active[k].update(boxes[d], frame, confs[d])
+                assigned[d] = active[k].id
+                used.add(k)
+
+        new = 0
+        for d, tid in enumerate(assigned):
+            if tid < 0:
+                t = Track(self.created, boxes[d], frame, confs[d])
+                self.tracks[t.id] = t
+                self.created += 1
+                assigned[d] = t.id
+                new += 1
+        return assigned, new
+
+    def needs_embedding(self, track_id: int, frame: int) -> bool:
+        t = self.tracks[track_id]
+        if len(t.embs) >= self.embeds_per_track:
+            return False
+        return t.last_embed_frame is None or frame - t.last_embed_frame >= self.embed_gap
+
+    def add_embedding(self, track_id: int, emb: np.ndarray, frame: int) -> int:
+        """Thêm embedding vào track; track mới giống track cũ thì nối vào track cũ. Return id track."""
+        t = self.tracks[track_id]
+        if not t.embs:
+            other = self._reid(t, emb)
+            if other is not None:
+                self._merge(t, other)
+                t = other
+        if len(t.embs) < self.embeds_per_track:
+            t.embs.append(emb)
+            t.last_embed_frame = frame
+        return t.id
+
+    def _reid(self, t: Track, emb: np.ndarray):
+        best, best_sim = None, self.reid_threshold
+        for other in self.tracks.values():
+            if other is t or not other.embs or other.frames & t.frames:
+                continue
+            sim = float(other.mean_emb() @ emb)
+            if sim >= best_sim:
+                best, best_sim = other, sim
+        return best
+
+    def _merge(self, src: Track, dst: Track):
+        if src.last_frame >= dst.last_frame:
+            dst.bbox, dst.velocity, dst.last_frame = src.bbox, src.velocity, src.last_frame
+        if src.best_conf > dst.best_conf:
+            dst.best_conf, dst.best_bbox = src.best_conf, src.best_bbox
+        dst.frames |= src.frames
+        dst.embs.extend(src.embs[:max(0, self.embeds_per_track - len(dst.embs))])
+        del self.tracks[src.id]
+        self.merged += 1
+
+    def finalize(self) -> list[Track]:
+        """Nối lần cuối các track có embedding (theo embedding trung bình), return các track đó."""
+        done = []
+        for t in sorted((t for t in self.tracks.values() if t.embs), key=lambda t: min(t.frames)):
+            mean = t.mean_emb()
+            cands = [(float(o.mean_emb() @ mean), o) for o in done if not (o.frames & t.frames)]
+            sim, other = max(cands, key=lambda c: c[0], default=(-1.0, None))
+            if other is not None and sim >= self.reid_threshold:
+                self._merge(t, other)
+            else:
+                done.append(t)
+        return done
+
+
+def _put(q: queue.Queue, item, stop: threading.Event):
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return
+        except queue.Full:
+            continue
+
+
+def _read_frames(cap, base_stride: int, limit: int, out: queue.Queue, stop: threading.Event, stats: dict):
+    idx = 0
+    t0 = time.perf_counter()
+    try:
+        while not stop.is_set() and (limit <= 0 or idx < limit):
+            if not cap.grab():
+                break
+            if idx % base_stride == 0:
+                ok, frame = cap.retrieve()
+                if ok:
+                    _put(out, (idx, frame), stop)
+            idx += 1
+    except Exception as e:
+        logger.warning(f"Video read error at frame {idx}: {e}")
+    finally:
+        stats["frames_read"] = idx
+        stats["read_ms"] = (time.perf_counter() - t0) * 1000
+        _put(out, None, stop)
+
+
+def process_video(engine, path: str, min_conf: float, min_face: int, min_blur: float,
+                  detect_max_side: int = 1280, sample_fps: float = 4.0, max_gap_s: float = 1.0,
+                  max_seconds: float = 120.0, embeds_per_track: int = 3, embed_gap_s: float = 0.5,
+                  track_iou: float = 0.3, track_max_age_s: float = 1.5, reid_threshold: float = 0.5,
+                  motion_threshold: float = 6.0) -> dict:
+    """
+    Detect + track + embed các face trong video (chạy trong inference executor).
+    min_face tính theo pixel frame gốc; detect trên frame thu nhỏ cạnh dài <= detect_max_side,
+    align từ frame gốc.
+
+    Return dict:
+      tracks: [{track_id, embs (k, D), bbox, conf, first_s, last_s, frames}] (track có embedding),
+      video: fps, width, height, frames_total, frames_read, frames_processed, duration_s, truncated,
+             base_stride, max_stride,
+      counters: faces_detected, faces_pass_quality, faces_embedded, tracks_created, tracks_merged, filtered_*,
+      timings_ms: read (thread đọc, song song), detect, quality, track, align, embed, total.
+    """
+    t_start = time.perf_counter()
+    cap = cv2.VideoCapture(path)
+    if not cap.isOpened():
+        raise VideoError("cannot open video")
+
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    if not fps or not np.isfinite(fps) or fps <= 0 or fps > 240:
+        fps = 30.0
+    base_stride = max(1, round(fps / sample_fps)) if sample_fps > 0 else 1
+    max_stride = base_stride * max(1, round(fps * max_gap_s / base_stride))
+    limit = int(max_seconds * fps) if max_seconds > 0 else 0
+
+    tracker = FaceTracker(
+        iou_threshold=track_iou,
+        max_age=max(1, round(track_max_age_s * fps)),
+        reid_threshold=reid_threshold,
+        embeds_per_track=embeds_per_track,
+        embed_gap=max(1, round(embed_gap_s * fps)),
+    )
+    counters = {"faces_detected": 0, "faces_pass_quality": 0, "faces_embedded": 0}
+    timings = {"detect": 0.0, "quality": 0.0, "track": 0.0, "align": 0.0, "embed": 0.0}
+    video = {"fps": round(fps, 3), "width": int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
+             "height": int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+             "frames_total": int(cap.get(cv2.CAP_PROP_FRAME_COUNT) or 0)}
+
+    frames = queue.Queue(maxsize=4)
+    stop = threading.Event()
+    read_stats = {}
+    reader = threading.Thread(target=_read_frames, args=(cap, base_stride, limit, frames, stop, read_stats),
+                              name="video-reader", daemon=True)
+    reader.start()
+
+    processed = 0
+    next_frame = 0
+    stride = base_stride
+    prev_thumb = None
+    try:
+        while True:
+            item = frames.get()
+            if item is None:
+                break
+            idx, frame = item
+            if idx < next_frame:
+                continue
+            processed += 1
+
+            t0 = time.perf_counter()
+            det, _ = resize_max_side(frame, detect_max_side)
+            scale = frame.shape[1] / det.shape[1]
+            faces = engine.detect(det)
+            timings["detect"] += (time.perf_counter() - t0) * 1000
+            counters["faces_detected"] += len(faces)
+
+            t0 = time.perf_counter()
+            q = quality_gate_batch(det, faces, min_conf=min_conf, min_face=min_face / scale, min_blur=min_blur)
+            keep = [i for i, r in enumerate(q["reason"].tolist()) if r in _TRACK_REASONS]
+            for r in q["reason"].tolist():
+                key = REJECT_COUNTERS.get(r)
+                if key:
+                    counters[key] = counters.get(key, 0) + 1
+            counters["faces_pass_quality"] += int(q["ok"].sum())
+            boxes = np.stack([[q[k][i] * scale for k in ("x1", "y1", "x2", "y2")] for i in keep]) \
+                if keep else np.zeros((0, 4))
+            confs = [0.0 if np.isnan(q["conf"][i]) else float(q["conf"][i]) for i in keep]
+            thumb = cv2.resize(cv2.cvtColor(det, cv2.COLOR_BGR2GRAY), (64, 36), interpolation=cv2.INTER_AREA)
+            motion = float(np.mean(cv2.absdiff(thumb, prev_thumb))) if prev_thumb is not None else 255.0
+            prev_thumb = thumb
+            timings["quality"] += (time.perf_counter() - t0) * 1000
+
+            t0 = time.perf_counter()
+            track_ids, new_tracks = tracker.update(idx, boxes, confs)
+            todo = []
+            for i, tid in zip(keep, track_ids):
+                landmarks = getattr(faces[i], "landmarks", None)
+                if q["ok"][i] and landmarks is not None and tracker.needs_embedding(tid, idx):
+                    todo.append((tid, landmarks))
+            timings["track"] += (time.perf_counter() - t0) * 1000
+
+            if todo:
+                t0 = time.perf_counter()
+                crops, owners = [], []
+                for tid, landmarks in todo:
+                    try:
+                        crops.append(engine.align(frame, np.asarray(landmarks, dtype=np.float32) * scale))
+                        owners.append(tid)
+                    except Exception as e:
+                        logger.warning(f"Align error: {e}")
+                        counters["faces_embedding_error"] = counters.get("faces_embedding_error", 0) + 1
+                timings["align"] += (time.perf_counter() - t0) * 1000
+                if crops:
+                    t0 = time.perf_counter()
+                    embs = np.asarray(engine.embed_aligned(crops), dtype=np.float32)
+                    embs = embs / np.maximum(np.linalg.norm(embs, axis=1, keepdims=True), 1e-9)
+                    timings["embed"] += (time.perf_counter() - t0) * 1000
+                    counters["faces_embedded"] += len(crops)
+                    t0 = time.perf_counter()
+                    for tid, emb in zip(owners, embs):
+                        tracker.add_embedding(tid, emb, idx)
+                    timings["track"] += (time.perf_counter() - t0) * 1000
+
+            pending = any(tid in tracker.tracks and len(tracker.tracks[tid].embs) < embeds_per_track
+                          for tid in track_ids)
+            if new_tracks or pending or motion > motion_threshold:
+                stride = base_stride
+            else:
+                stride = min(stride * 2, max_stride)
+            next_frame = idx + stride
+    finally:
+        stop.set()
+        reader.join(timeout=5)
+        cap.release()
+
+    t0 = time.perf_counter()
+    tracks = tracker.finalize()
+    timings["track"] += (time.perf_counter() - t0) * 1000
+
+    frames_read = read_stats.get("frames_read", 0)
+    video.update({
+        "frames_read": frames_read,
+        "frames_processed": processed,
+        "duration_s": round(frames_read / fps, 3),
+        "truncated": bool(limit) and frames_read >= limit,
+        "base_stride": base_stride,
+        "max_stride": max_stride,
+    })
+    if frames_read == 0:
+        raise VideoError("no frames decoded")
+    counters["tracks_created"] = tracker.created
+    counters["tracks_merged"] = tracker.merged
+    timings["read"] = read_stats.get("read_ms", 0.0)
+    timings["total"] = (time.perf_counter() - t_start) * 1000
+    return {
+        "tracks": [
+            {
+                "track_id": t.id,
+                "embs": np.stack(t.embs),
+                "bbox": [round(float(v)) for v in t.best_bbox],
+                "conf": round(t.best_conf, 4),
+                "first_s": round(min(t.frames) / fps, 3),
+                "last_s": round(max(t.frames) / fps, 3),
+                "frames": len(t.frames),
+            }
+            for t in tracks
+        ],
+        "video": video,
+        "counters": counters,
+        "timings_ms": {k: round(v, 3) for k, v in timings.items()},
+    }
@@ -0,0 +1,51 @@
+"""
+Engine / session async (SQLAlchemy asyncio) cho các route async: query chạy qua driver
+async (aiosqlite, asyncpg) nên không chặn event loop. Đường sync (app/db/database.py)
+vẫn dùng cho script, job nền và các route def (chạy trong threadpool).
+
+Tách module riêng để script không cần cài driver async.
+"""
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+
+from app.settings import settings
+from app.db.database import install_sqlite_pragmas, sqlite_pragmas
+
+# driver async tương ứng với driver sync trong db_url
+_ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "sqlite+pysqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+    "postgresql+psycopg2": "postgresql+asyncpg",
+}
+
+
+def async_db_url(db_url: str) -> str:
+    """settings.db_async_url nếu có, ngược lại đổi driver của db_url sang driver async."""
+    if settings.db_async_url:
+        return settings.db_async_url
+    scheme, sep, rest = db_url.partition("://")
+    if scheme not in _ASYNC_DRIVERS:
+        raise ValueError(f"No async driver for '{scheme}', set DB_ASYNC_URL")
+    return _ASYNC_DRIVERS[scheme] + sep + rest
+
+
+def create_async_db_engine(db_url: str, pragmas: dict | None = None):
+    url = async_db_url(db_url)
+    kwargs = {}
+    if ":memory:" not in url:
+        kwargs.update(
+            pool_size=settings.db_pool_size,
+            max_overflow=settings.db_max_overflow,
+            pool_timeout=settings.db_pool_timeout,
+        )
+    eng = create_async_engine(url, **kwargs)
+    if url.startswith("sqlite"):
+        install_sqlite_pragmas(eng.sync_engine, sqlite_pragmas() if pragmas is None else pragmas)
+    return eng
+
+
+async_engine = create_async_db_engine(settings.db_url)
+
+# expire_on_commit=False: đọc lại attribute sau commit không phát sinh lazy load (không được phép với async)
+AsyncSessionLocal = async_sessionmaker(async_engine, class_=AsyncSession, expire_on_commit=False,
+                                       autoflush=False)
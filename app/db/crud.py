@@ -1,27 +1,85 @@
 import json
+from datetime import date, datetime
 import numpy as np
+from sqlalchemy import insert, update, delete, func, case, cast, Date, or_, and_
 from sqlalchemy.orm import Session
-from app.db.models import Student, StudentEmbedding, AttendanceSession
-from app.db.models import ClassRoom
+from app.db.models import Student, StudentEmbedding, AttendanceSession, AttendanceJob
+from app.db.models import AttendanceImage, AttendanceFace, AttendanceResult
+from app.db.models import ClassRoom, AttendanceDailyClass, AttendanceDailyStudent, GalleryGeneration
+from app.core.gallery_cache import gallery_cache
+from app.core.campus_index import campus_index
+from app.db import vector_store
+from app.core.prototypes import consolidate
+from app.settings import settings
 
 
-def upsert_student(db: Session, student_id: str, class_id: str, name: str):
+def _upsert_student_row(db: Session, student_id: str, class_id: str, name: str):
+    """Thêm / sửa Student (chưa commit). Return (student, các lớp có gallery bị ảnh hưởng)."""
     st = db.query(Student).filter(Student.id == student_id).first()
+    old_class_id = None
     if st is None:
         st = Student(id=student_id, class_id=class_id, name=name)
         db.add(st)
     else:
+        old_class_id = st.class_id
         st.class_id = class_id
         st.name = name
+
+    # tên / lớp thay đổi -> gallery của cả lớp cũ và lớp mới đều cũ
+    changed = [class_id]
+    if old_class_id is not None and old_class_id != class_id:
+        changed.append(old_class_id)
+    return st, changed
+
+def upsert_student(db: Session, student_id: str, class_id: str, name: str):
+    st, changed = _upsert_student_row(db, student_id, class_id, name)
+    generations = _gallery_changed(db, changed)
     db.commit()
     db.refresh(st)
+    _invalidate_galleries(generations)
+    campus_index.notify_student(student_id, name, class_id)
     return st
 
+def _student_class_id(db: Session, student_id: str):
+    return db.query(Student.class_id).filter(Student.id == student_id).scalar()
+
+def _drop_packs(db: Session, class_ids):
+    # gọi trước commit để pack cũ bị bỏ cùng transaction với thay đổi embedding
+    if settings.gallery_storage == "packed":
+        for class_id in class_ids:
+            if class_id is not None:
+                vector_store.drop_class_pack(db, class_id)
+
+def _gallery_changed(db: Session, class_ids) -> dict:
+    """
+    Gọi trước commit khi embedding / học sinh của các lớp thay đổi: bỏ pack cũ và tăng
+    generation của lớp cùng transaction. Return {class_id: generation mới}.
+    """
+    class_ids = sorted({c for c in class_ids if c is not None})
+    _drop_packs(db, class_ids)
+    if not class_ids:
+        return {}
+    _upsert_add(db, GalleryGeneration, [{"class_id": c, "generation": 1} for c in class_ids],
+                ["class_id"], ["generation"])
+    return dict(db.query(GalleryGeneration.class_id, GalleryGeneration.generation)
+                .filter(GalleryGeneration.class_id.in_(class_ids)).all())
+
+def _invalidate_galleries(generations: dict):
+    # generation đã biết nên lần sync sau không invalidate lại chính thay đổi của worker này
+    for class_id, generation in generations.items():
+        gallery_cache.invalidate(class_id, generation=generation)
+
+def sync_gallery_generations(db: Session):
+    """Bỏ gallery cache của lớp bị worker khác thay đổi (đọc gallery_generations theo chu kỳ)."""
+    if gallery_cache.sync_due():
+        gallery_cache.sync(dict(db.query(GalleryGeneration.class_id, GalleryGeneration.generation).all()))
+
 def upsert_embedding(db: Session, student_id: str, emb: np.ndarray):
     emb = np.asarray(emb, dtype=np.float32).reshape(-1)
     vec_bytes = emb.tobytes()
 
     row = db.query(StudentEmbedding).filter(StudentEmbedding.student_id == student_id).first()
+    replaced_id = row.id if row is not None else None
     if row is None:
         row = StudentEmbedding(
             student_id=student_id,
@@ -35,8 +93,14 @@ def upsert_embedding(db: Session, student_id: str, emb: np.ndarray):
         row.vector = vec_bytes
         row.source = "enroll"
 
+    class_id = _student_class_id(db, student_id)
+    generations = _gallery_changed(db, [class_id])
     db.commit()
     db.refresh(row)
+    _invalidate_galleries(generations)
+    if replaced_id is not None:
+        campus_index.notify_embeddings_removed([replaced_id])
+    campus_index.notify_embedding_added(row.id, student_id, emb)
     return row
 
 
@@ -49,57 +113,643 @@ def insert_embedding(db: Session, student_id: str, emb: np.ndarray, source: str
         source=source,
     )
     db.add(row)
+    class_id = _student_class_id(db, student_id)
+    generations = _gallery_changed(db, [class_id])
     db.commit()
     db.refresh(row)
+    _invalidate_galleries(generations)
+    campus_index.notify_embedding_added(row.id, student_id, emb)
     return row
 
-def load_gallery_for_class(db: Session, class_id: str):
-    q = (
-        db.query(Student, StudentEmbedding)
+def _consolidate_candidates(db: Session, student_ids, cap: int) -> dict:
+    """Embedding của các học sinh có hơn cap embedding: {student_id: (ids, vecs)} (chỉ SQL)."""
+    over = [sid for sid, n in (
+        db.query(StudentEmbedding.student_id, func.count(StudentEmbedding.id))
+        .filter(StudentEmbedding.student_id.in_(list(student_ids)))
+        .group_by(StudentEmbedding.student_id)
+        .having(func.count(StudentEmbedding.id) > cap)
+    )]
+    grouped = {}
+    if not over:
+        return grouped
+    for emb_id, sid, vec in (
+        db.query(StudentEmbedding.id, StudentEmbedding.student_id, StudentEmbedding.vector)
+        .filter(StudentEmbedding.student_id.in_(over))
+        .order_by(StudentEmbedding.id)
+    ):
+        ids, vecs = grouped.setdefault(sid, ([], []))
+        ids.append(emb_id)
+        vecs.append(np.frombuffer(vec, dtype=np.float32))
+    return grouped
+
+def _compute_prototypes(grouped: dict, cap: int, method: str):
+    """k-means / k-medoids cho từng học sinh (CPU, không đụng DB). Return (id sẽ xoá, params, owners)."""
+    removed, params, owners = [], [], []
+    for sid, (ids, vecs) in grouped.items():
+        protos = consolidate(np.stack(vecs), cap, method)
+        if protos is None:
+            continue
+        removed.extend(ids)
+        for e in protos:
+            params.append({"student_id": sid, "dim": int(e.shape[0]), "vector": e.tobytes(), "source": "prototype"})
+            owners.append((sid, e))
+    return removed, params, owners
+
+def _apply_prototypes(db: Session, removed: list, params: list, owners: list):
+    """Thay embedding bằng prototype (chưa commit). Return (id đã xoá, [(id mới, student_id, emb)])."""
+    if not removed:
+        return [], []
+    db.query(StudentEmbedding).filter(StudentEmbedding.id.in_(removed)).delete(synchronize_session=False)
+    new_ids = db.execute(
+        insert(StudentEmbedding).returning(StudentEmbedding.id, sort_by_parameter_order=True), params,
+    ).scalars().all()
+    return removed, [(i, sid, e) for i, (sid, e) in zip(new_ids, owners)]
+
+def _consolidate_rows(db: Session, student_ids, cap: int, method: str):
+    """
+    Học sinh có hơn cap embedding: thay toàn bộ bằng cap prototype (source="prototype"),
+    chưa commit. Return (id đã xoá, [(id mới, student_id, emb)]).
+    """
+    if cap <= 0:
+        return [], []
+    grouped = _consolidate_candidates(db, student_ids, cap)
+    return _apply_prototypes(db, *_compute_prototypes(grouped, cap, method))
+
+def _notify_campus_embeddings(inserted, removed, prototypes):
+    """inserted: [(id, student_id, emb)] vừa thêm (có thể đã bị gom ngay trong cùng transaction)."""
+    removed = set(removed)
+    for emb_id, sid, emb in inserted:
+        if emb_id not in removed:
+            campus_index.notify_embedding_added(emb_id, sid, emb)
+    inserted_ids = {i for i, _, _ in inserted}
+    old = [i for i in removed if i not in inserted_ids]
+    if old:
+        campus_index.notify_embeddings_removed(old)
+    for emb_id, sid, emb in prototypes:
+        campus_index.notify_embedding_added(emb_id, sid, emb)
+
+def consolidate_student_embeddings(db: Session, student_ids, cap: int | None = None, method: str | None = None):
+    """
+    Gom embedding của các học sinh về tối đa cap prototype (mặc định settings), 1 transaction.
+    Return (số embedding đã xoá, số prototype thêm).
+    """
+    cap = settings.enroll_max_embeddings if cap is None else cap
+    method = method or settings.prototype_method
+    class_ids = {r[0] for r in db.query(Student.class_id).filter(Student.id.in_(list(student_ids)))}
+    removed, prototypes = _consolidate_rows(db, student_ids, cap, method)
+    if not removed:
+        db.rollback()
+        return 0, 0
+    generations = _gallery_changed(db, class_ids)
+    db.commit()
+    _invalidate_galleries(generations)
+    _notify_campus_embeddings([], removed, prototypes)
+    return len(removed), len(prototypes)
+
+def _embedding_params(student_id: str, embs: np.ndarray, source: str) -> list[dict]:
+    """Tham số executemany cho student_embeddings, embs (k, D) float32."""
+    return [{"student_id": student_id, "dim": int(embs.shape[1]), "vector": e.tobytes(), "source": source}
+            for e in embs]
+
+def _enroll_student_rows(db: Session, class_id: str, student_id: str, name: str, params: list[dict],
+                         class_name: str | None = None):
+    """Phần SQL của enroll_student (chưa commit). Return (id embedding mới, lớp có gallery đổi)."""
+    cls = db.query(ClassRoom).filter(ClassRoom.id == class_id).first()
+    if cls is None:
+        db.add(ClassRoom(id=class_id, name=class_name))
+    elif class_name is not None:
+        cls.name = class_name
+    _, changed = _upsert_student_row(db, student_id, class_id, name)
+    db.flush()
+
+    ids = []
+    if params:
+        ids = db.execute(
+            insert(StudentEmbedding).returning(StudentEmbedding.id, sort_by_parameter_order=True), params,
+        ).scalars().all()
+    return ids, changed
+
+def _notify_enrolled(students, inserted, removed, prototypes):
+    """Sau commit: cập nhật campus index. students: [(student_id, name, class_id)]."""
+    for student_id, name, class_id in students:
+        campus_index.notify_student(student_id, name, class_id)
+    _notify_campus_embeddings(inserted, removed, prototypes)
+
+def enroll_student(db: Session, class_id: str, student_id: str, name: str, embs: np.ndarray,
+                   class_name: str | None = None, source: str = "enroll"):
+    """
+    Enroll 1 học sinh trong 1 transaction (1 commit thay vì 1 commit / embedding):
+    upsert lớp + học sinh, thêm mọi embedding bằng 1 executemany, rồi gom về tối đa
+    settings.enroll_max_embeddings prototype nếu vượt (xem app/core/prototypes.py).
+    Return id các embedding mới (theo thứ tự embs; có thể đã được gom thành prototype).
+    """
+    embs = np.asarray(embs, dtype=np.float32)
+    embs = embs.reshape(len(embs), -1)
+    ids, changed = _enroll_student_rows(db, class_id, student_id, name, _embedding_params(student_id, embs, source),
+                                        class_name=class_name)
+    removed, prototypes = _consolidate_rows(db, [student_id], settings.enroll_max_embeddings,
+                                            settings.prototype_method)
+    generations = _gallery_changed(db, changed)
+    db.commit()
+
+    _invalidate_galleries(generations)
+    _notify_enrolled([(student_id, name, class_id)], [(i, student_id, e) for i, e in zip(ids, embs)],
+                     removed, prototypes)
+    return ids
+
+def student_embeddings(db: Session, student_ids) -> dict:
+    """{student_id: (k, D) float32} embedding đã lưu của các học sinh (k = 0 thì không có key)."""
+    out = {}
+    rows = (
+        db.query(StudentEmbedding.student_id, StudentEmbedding.vector)
+        .filter(StudentEmbedding.student_id.in_(list(student_ids)))
+        .order_by(StudentEmbedding.id)
+    )
+    for sid, vec in rows:
+        out.setdefault(sid, []).append(np.frombuffer(vec, dtype=np.float32))
+    return {sid: np.stack(v) for sid, v in out.items()}
+
+def _bulk_embedding_params(students: list[dict], source: str):
+    """Tham số executemany cho mọi embedding của bulk enroll. Return (params, owners [(vị trí học sinh, emb)])."""
+    params, owners = [], []
+    for i, s in enumerate(students):
+        embs = np.asarray(s["embs"], dtype=np.float32)
+        if embs.size == 0:   # mọi ảnh đều trùng embedding đã lưu: chỉ cập nhật học sinh
+            continue
+        embs = embs.reshape(len(embs), -1)
+        params.extend(_embedding_params(s["student_id"], embs, source))
+        owners.extend((i, e) for e in embs)
+    return params, owners
+
+def _bulk_enroll_rows(db: Session, students: list[dict], params: list[dict]):
+    """Phần SQL của bulk_enroll_students (chưa commit). Return (id embedding mới, lớp đổi, {student_id: tên})."""
+    class_ids = {s["class_id"] for s in students}
+    known_classes = {r[0] for r in db.query(ClassRoom.id).filter(ClassRoom.id.in_(class_ids))}
+    new_classes = [{"id": c, "name": c} for c in sorted(class_ids - known_classes)]
+    if new_classes:
+        db.execute(insert(ClassRoom), new_classes)
+
+    sids = [s["student_id"] for s in students]
+    known = {sid: (cls, name) for sid, cls, name in
+             db.query(Student.id, Student.class_id, Student.name).filter(Student.id.in_(sids))}
+    changed = set(class_ids)
+    new_rows, update_rows = [], []
+    for s in students:
+        sid = s["student_id"]
+        if sid in known:
+            old_class, old_name = known[sid]
+            changed.add(old_class)
+            update_rows.append({"id": sid, "class_id": s["class_id"], "name": s["name"] or old_name})
+        else:
+            new_rows.append({"id": sid, "class_id": s["class_id"], "name": s["name"] or sid})
+    names = {r["id"]: r["name"] for r in new_rows + update_rows}
+    if new_rows:
+        db.execute(insert(Student), new_rows)
+    if update_rows:
+        db.execute(update(Student), update_rows)   # bulk UPDATE theo primary key
+
+    ids = []
+    if params:
+        ids = db.execute(
+            insert(StudentEmbedding).returning(StudentEmbedding.id, sort_by_parameter_order=True), params,
+        ).scalars().all()
+    return ids, changed, names
+
+def _after_bulk_enroll(students: list[dict], names: dict, ids: list, owners: list, removed, prototypes):
+    """Sau commit: cập nhật campus index, return id embedding mới theo từng học sinh."""
+    _notify_enrolled([(s["student_id"], names[s["student_id"]], s["class_id"]) for s in students],
+                     [(emb_id, students[i]["student_id"], e) for emb_id, (i, e) in zip(ids, owners)],
+                     removed, prototypes)
+    out = [[] for _ in students]
+    for emb_id, (i, _) in zip(ids, owners):
+        out[i].append(emb_id)
+    return out
+
+def bulk_enroll_students(db: Session, students: list[dict], source: str = "enroll") -> list[list[int]]:
+    """
+    Enroll nhiều học sinh trong 1 transaction (import cả lớp / cả trường):
+    students: [{"class_id", "student_id", "name" (None = giữ tên cũ), "embs" (k, D)}].
+    Lớp mới, học sinh mới / cập nhật và mọi embedding: mỗi loại 1 executemany; học sinh
+    vượt settings.enroll_max_embeddings được gom thành prototype trong cùng transaction.
+    Return id embedding mới của từng học sinh (theo thứ tự students).
+    """
+    if not students:
+        return []
+    params, owners = _bulk_embedding_params(students, source)
+    ids, changed, names = _bulk_enroll_rows(db, students, params)
+    removed, prototypes = _consolidate_rows(db, [s["student_id"] for s in students],
+                                            settings.enroll_max_embeddings, settings.prototype_method)
+    generations = _gallery_changed(db, changed)
+    db.commit()
+
+    _invalidate_galleries(generations)
+    return _after_bulk_enroll(students, names, ids, owners, removed, prototypes)
+
+def _load_gallery_arrays(db: Session, class_id: str):
+    """
+    Return (names, student_ids, embs) với embs (N, D) đã normalize.
+
+    gallery_storage="packed": mmap file packed của lớp (ghi lại từ ORM nếu chưa có).
+    Ngược lại chỉ select các cột cần thiết, ghép toàn bộ blob rồi normalize 1 lần.
+    """
+    if settings.gallery_storage == "packed":
+        packed = vector_store.load_class_pack(db, class_id)
+        if packed is None:
+            vector_store.write_class_pack(db, class_id)
+            packed = vector_store.load_class_pack(db, class_id)
+        if packed is not None:
+            return packed
+    rows = (
+        db.query(Student.id, Student.name, StudentEmbedding.vector)
         .join(StudentEmbedding, StudentEmbedding.student_id == Student.id)
         .filter(Student.class_id == class_id)
+        .order_by(StudentEmbedding.id)
     ).all()
+    return gallery_arrays_from_rows(rows)
 
-    names, embs = [], []
-    for st, eb in q:
-        names.append(st.name)
-        vec = np.frombuffer(eb.vector, dtype=np.float32).copy()
-        # Re-normalize để đảm bảo cosine similarity chính xác
-        norm = np.linalg.norm(vec)
-        if norm > 1e-6:
-            vec = vec / norm
-        embs.append(vec)
+def gallery_arrays_from_rows(rows):
+    """Các dòng (student_id, name, vector bytes) -> (names, student_ids, embs đã normalize)."""
+    if not rows:
+        return [], [], np.zeros((0, 0), dtype=np.float32)
 
-    if not embs:
-        return [], np.zeros((0, 0), dtype=np.float32)
+    student_ids = [r[0] for r in rows]
+    names = [r[1] for r in rows]
+    embs = np.frombuffer(b"".join(r[2] for r in rows), dtype=np.float32).reshape(len(rows), -1)
 
-    return names, np.stack(embs, axis=0)
+    # Re-normalize để đảm bảo cosine similarity chính xác
+    norms = np.linalg.norm(embs, axis=1, keepdims=True)
+    embs = embs / np.where(norms > 1e-6, norms, 1.0)
+    return names, student_ids, np.ascontiguousarray(embs, dtype=np.float32)
 
-def save_attendance_session(db: Session, session_id: str, class_id: str, images_count: int, result: dict, threshold: float = 0.6):
-    row = AttendanceSession(
+def load_gallery_for_class(db: Session, class_id: str):
+    names, _, embs = _load_gallery_arrays(db, class_id)
+    return names, embs
+
+def pack_class_gallery(db: Session, class_id: str):
+    """Ghi lại file packed của lớp ngay (sau enroll), chỉ khi gallery_storage="packed"."""
+    if settings.gallery_storage == "packed":
+        vector_store.write_class_pack(db, class_id)
+
+def get_gallery(db: Session, class_id: str):
+    """Gallery của lớp qua cache process-wide (xem app/core/gallery_cache.py)."""
+    sync_gallery_generations(db)
+    return gallery_cache.get(class_id, lambda: _load_gallery_arrays(db, class_id))
+
+# debug từng face (có thể rất dài) không lưu vào note: face đã nằm trong attendance_faces
+_NOTE_DROP_KEYS = ("rejected_details", "unknown_best_scores")
+
+def save_attendance_session(db: Session, session_id: str, class_id: str, images_count: int, result: dict,
+                            threshold: float = 0.6, faces: list | None = None):
+    """
+    Lưu 1 phiên trong 1 transaction, mỗi bảng 1 lần executemany:
+      attendance_sessions: note chỉ còn debug rút gọn (counter, timing),
+      attendance_results: 1 dòng / học sinh của lớp (present|absent, best_score),
+      attendance_images + attendance_faces (settings.attendance_store_faces): 1 dòng / face đã embed.
+    faces: list dict {image_idx, bbox, conf, emb, student_id (None = unknown), score}.
+    Ảnh điểm danh không lưu ra đĩa nên attendance_images.file_path = "".
+    """
+    now = datetime.utcnow()
+    debug = result.get("debug") or {}
+    note = {k: v for k, v in debug.items() if k not in _NOTE_DROP_KEYS}
+    note["rejected_count"] = len(debug.get("rejected_details", []))
+
+    db.add(AttendanceSession(
         id=session_id,
         class_id=class_id,
+        created_at=now,
         images_count=images_count,
         threshold=threshold,
         unknown_faces_count=int(result.get("unknown_faces_count", 0)),
-        note=json.dumps(result, ensure_ascii=False),
-    )
-    db.add(row)
+        note=json.dumps({"debug": note}, ensure_ascii=False),
+    ))
+    db.flush()
+
+    rows = [
+        {"session_id": session_id, "student_id": r["student_id"], "status": "present",
+         "best_score": float(r["score"]), "created_at": now}
+        for r in result.get("present", [])
+    ] + [
+        {"session_id": session_id, "student_id": r["student_id"], "status": "absent",
+         "best_score": None, "created_at": now}
+        for r in result.get("absent", [])
+    ]
+    if rows:
+        db.execute(insert(AttendanceResult), rows)
+
+    _add_daily_rollup(db, class_id, now.date(), rows, int(result.get("unknown_faces_count", 0)))
+
+    if faces and settings.attendance_store_faces:
+        # id ảnh theo đúng thứ tự image_idx (RETURNING + sort_by_parameter_order, SQLite >= 3.35)
+        image_ids = db.execute(
+            insert(AttendanceImage).returning(AttendanceImage.id, sort_by_parameter_order=True),
+            [{"session_id": session_id, "file_path": "", "created_at": now} for _ in range(images_count)],
+        ).scalars().all()
+        store_emb = settings.attendance_store_face_embeddings
+        db.execute(insert(AttendanceFace), [
+            {
+                "session_id": session_id,
+                "image_id": image_ids[f["image_idx"]],
+                "bbox": json.dumps(f["bbox"]),
+                "confidence": f["conf"],
+                "embedding": np.asarray(f["emb"], dtype=np.float32).tobytes() if store_emb and f.get("emb") is not None else None,
+                "matched_student_id": f["student_id"],
+                "match_score": float(f["score"]),
+                "status": "matched" if f["student_id"] is not None else "unknown",
+                "created_at": now,
+            }
+            for f in faces
+        ])
+
     db.commit()
-    return row
 
-def list_sessions(db: Session, class_id: str, limit: int = 50):
+def get_session_result(db: Session, row: AttendanceSession):
+    """
+    Kết quả 1 phiên (cùng dạng response POST /attendance/) dựng từ attendance_results.
+    Phiên lưu trước khi có attendance_results: đọc lại JSON đầy đủ trong note.
+    """
+    note = {}
+    if row.note:
+        try:
+            note = json.loads(row.note)
+        except ValueError:
+            return {"raw_note": row.note}
+
+    results = (
+        db.query(AttendanceResult.student_id, Student.name, AttendanceResult.status, AttendanceResult.best_score)
+        .outerjoin(Student, Student.id == AttendanceResult.student_id)
+        .filter(AttendanceResult.session_id == row.id)
+        .order_by(Student.name, AttendanceResult.student_id)
+        .all()
+    )
+    if not results:
+        return note or None
+
+    present = [{"student_id": sid, "name": name, "score": score}
+               for sid, name, status, score in results if status == "present"]
+    absent = [{"student_id": sid, "name": name}
+              for sid, name, status, _ in results if status != "present"]
+    return {
+        "class_id": row.class_id,
+        "count_total": len(results),
+        "count_present": len(present),
+        "present": present,
+        "absent": absent,
+        "unknown_faces_count": row.unknown_faces_count,
+        "threshold": row.threshold,
+        "debug": note.get("debug"),
+    }
+
+def list_session_faces(db: Session, session_id: str):
     return (
-        db.query(AttendanceSession)
-        .filter(AttendanceSession.class_id == class_id)
-        .order_by(AttendanceSession.created_at.desc())
+        db.query(AttendanceFace)
+        .filter(AttendanceFace.session_id == session_id)
+        .order_by(AttendanceFace.image_id, AttendanceFace.id)
+        .all()
+    )
+
+def _present_count():
+    return func.sum(case((AttendanceResult.status == "present", 1), else_=0))
+
+def _date_filters(column, date_from: datetime | None, date_to: datetime | None):
+    conds = []
+    if date_from is not None:
+        conds.append(column >= date_from)
+    if date_to is not None:
+        conds.append(column < date_to)
+    return conds
+
+def student_attendance_summary(db: Session, student_id: str, date_from: datetime | None = None,
+                               date_to: datetime | None = None, limit: int = 50):
+    """
+    Thống kê điểm danh 1 học sinh trong [date_from, date_to): đếm bằng SQL trên
+    attendance_results (index student_id + created_at), kèm limit phiên gần nhất.
+    """
+    conds = [AttendanceResult.student_id == student_id,
+             *_date_filters(AttendanceResult.created_at, date_from, date_to)]
+    total, present, avg_score, first_at, last_at = (
+        db.query(
+            func.count(AttendanceResult.id),
+            _present_count(),
+            func.avg(AttendanceResult.best_score),   # absent có best_score NULL -> chỉ tính phiên có mặt
+            func.min(AttendanceResult.created_at),
+            func.max(AttendanceResult.created_at),
+        )
+        .filter(*conds)
+        .one()
+    )
+    history = (
+        db.query(AttendanceResult.session_id, AttendanceSession.class_id, AttendanceResult.created_at,
+                 AttendanceResult.status, AttendanceResult.best_score)
+        .join(AttendanceSession, AttendanceSession.id == AttendanceResult.session_id)
+        .filter(*conds)
+        .order_by(AttendanceResult.created_at.desc())
         .limit(limit)
         .all()
     )
+    return {
+        "sessions": total or 0,
+        "present": present or 0,
+        "absent": (total or 0) - (present or 0),
+        "avg_score": avg_score,
+        "first_at": first_at,
+        "last_at": last_at,
+        "history": history,
+    }
+
+def class_attendance_report(db: Session, class_id: str, date_from: datetime | None = None,
+                            date_to: datetime | None = None):
+    """
+    Báo cáo điểm danh 1 lớp trong [date_from, date_to): số phiên + mỗi học sinh
+    (số phiên, có mặt, điểm trung bình, lần có mặt gần nhất), GROUP BY trong SQL.
+    """
+    conds = [AttendanceSession.class_id == class_id,
+             *_date_filters(AttendanceSession.created_at, date_from, date_to)]
+    sessions = db.query(func.count(AttendanceSession.id)).filter(*conds).scalar()
+    last_present = func.max(case((AttendanceResult.status == "present", AttendanceResult.created_at)))
+    rows = (
+        db.query(
+            AttendanceResult.student_id,
+            Student.name,
+            func.count(AttendanceResult.id),
+            _present_count(),
+            func.avg(AttendanceResult.best_score),
+            last_present,
+        )
+        .join(AttendanceSession, AttendanceSession.id == AttendanceResult.session_id)
+        .outerjoin(Student, Student.id == AttendanceResult.student_id)
+        .filter(*conds)
+        .group_by(AttendanceResult.student_id, Student.name)
+        .order_by(Student.name, AttendanceResult.student_id)
+        .all()
+    )
+    return sessions or 0, rows
+
+# ---- tổng hợp theo ngày (attendance_daily_class / attendance_daily_student) ----
+
+def _upsert_add(db: Session, model, rows: list[dict], keys: list[str], add_cols: list[str]):
+    """INSERT ... ON CONFLICT (keys) DO UPDATE SET col = col + excluded.col (SQLite / PostgreSQL)."""
+    if not rows:
+        return
+    if db.get_bind().dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    stmt = dialect_insert(model)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=keys,
+        set_={c: getattr(model, c) + getattr(stmt.excluded, c) for c in add_cols},
+    )
+    db.execute(stmt, rows)
+
+def _add_daily_rollup(db: Session, class_id: str, day: date, rows: list[dict], unknown_faces: int):
+    """Cộng 1 phiên (các dòng attendance_results vừa ghi) vào tổng hợp ngày, cùng transaction."""
+    present = sum(r["status"] == "present" for r in rows)
+    _upsert_add(db, AttendanceDailyClass,
+                [{"class_id": class_id, "day": day, "sessions": 1, "results": len(rows),
+                  "present": present, "unknown_faces": unknown_faces}],
+                ["class_id", "day"], ["sessions", "results", "present", "unknown_faces"])
+    _upsert_add(db, AttendanceDailyStudent,
+                [{"student_id": r["student_id"], "day": day, "class_id": class_id, "sessions": 1,
+                  "present": int(r["status"] == "present"), "score_sum": r["best_score"] or 0.0}
+                 for r in rows],
+                ["student_id", "day", "class_id"], ["sessions", "present", "score_sum"])
+
+def _day_of(db: Session, column):
+    # SQLite: CAST(.. AS DATE) ra số -> dùng date() (trả 'YYYY-MM-DD')
+    if db.get_bind().dialect.name == "sqlite":
+        return func.date(column)
+    return cast(column, Date)
+
+def _as_date(v):
+    return date.fromisoformat(v) if isinstance(v, str) else v
+
+def rebuild_attendance_rollups(db: Session, class_ids=None) -> dict:
+    """
+    Tính lại tổng hợp ngày từ attendance_sessions / attendance_results (migrate DB cũ, sửa lệch).
+    Chỉ ghi đè các ngày còn phiên trong DB: ngày đã bị cleanup xoá phiên giữ nguyên tổng hợp cũ.
+    Mỗi lớp 1 transaction. Return {class_id: số ngày đã tính lại}.
+    """
+    if class_ids is None:
+        class_ids = [r[0] for r in db.query(AttendanceSession.class_id).distinct().order_by(AttendanceSession.class_id)]
+    out = {}
+    for class_id in class_ids:
+        s_day = _day_of(db, AttendanceSession.created_at)
+        days = (
+            db.query(s_day, func.count(AttendanceSession.id), func.coalesce(func.sum(AttendanceSession.unknown_faces_count), 0))
+            .filter(AttendanceSession.class_id == class_id)
+            .group_by(s_day)
+            .all()
+        )
+        if not days:
+            out[class_id] = 0
+            continue
+        present_flag = case((AttendanceResult.status == "present", 1), else_=0)
+        per_student = (
+            db.query(
+                AttendanceResult.student_id,
+                s_day,
+                func.count(AttendanceResult.id),
+                func.sum(present_flag),
+                func.coalesce(func.sum(case((AttendanceResult.status == "present", AttendanceResult.best_score))), 0.0),
+            )
+            .join(AttendanceSession, AttendanceSession.id == AttendanceResult.session_id)
+            .filter(AttendanceSession.class_id == class_id)
+            .group_by(AttendanceResult.student_id, s_day)
+            .all()
+        )
+        class_rows = {
+            _as_date(d): {"class_id": class_id, "day": _as_date(d), "sessions": n, "results": 0, "present": 0,
+                          "unknown_faces": int(unknown)}
+            for d, n, unknown in days
+        }
+        student_rows = []
+        for sid, d, n, present, score_sum in per_student:
+            row = class_rows[_as_date(d)]
+            row["results"] += n
+            row["present"] += present or 0
+            student_rows.append({"student_id": sid, "day": row["day"], "class_id": class_id, "sessions": n,
+                                 "present": present or 0, "score_sum": float(score_sum)})
+
+        db.execute(delete(AttendanceDailyClass).where(
+            AttendanceDailyClass.class_id == class_id, AttendanceDailyClass.day.in_(list(class_rows))))
+        db.execute(delete(AttendanceDailyStudent).where(
+            AttendanceDailyStudent.class_id == class_id, AttendanceDailyStudent.day.in_(list(class_rows))))
+        db.execute(insert(AttendanceDailyClass), list(class_rows.values()))
+        if student_rows:
+            db.execute(insert(AttendanceDailyStudent), student_rows)
+        db.commit()
+        out[class_id] = len(days)
+    return out
+
+def _day_filters(column, date_from: date | None, date_to: date | None):
+    """[date_from, date_to], gồm cả 2 đầu (ngày UTC)."""
+    conds = []
+    if date_from is not None:
+        conds.append(column >= date_from)
+    if date_to is not None:
+        conds.append(column <= date_to)
+    return conds
+
+def class_daily_rollup(db: Session, class_id: str, date_from: date | None = None, date_to: date | None = None):
+    """Các ngày có điểm danh của lớp: (day, sessions, results, present, unknown_faces), theo ngày tăng dần."""
+    return (
+        db.query(AttendanceDailyClass.day, AttendanceDailyClass.sessions, AttendanceDailyClass.results,
+                 AttendanceDailyClass.present, AttendanceDailyClass.unknown_faces)
+        .filter(AttendanceDailyClass.class_id == class_id,
+                *_day_filters(AttendanceDailyClass.day, date_from, date_to))
+        .order_by(AttendanceDailyClass.day)
+        .all()
+    )
+
+def class_student_daily_rollup(db: Session, class_id: str, date_from: date | None = None,
+                               date_to: date | None = None):
+    """(student_id, name, day, sessions, present, score_sum) của mọi học sinh trong lớp, theo học sinh rồi ngày."""
+    return (
+        db.query(AttendanceDailyStudent.student_id, Student.name, AttendanceDailyStudent.day,
+                 AttendanceDailyStudent.sessions, AttendanceDailyStudent.present, AttendanceDailyStudent.score_sum)
+        .outerjoin(Student, Student.id == AttendanceDailyStudent.student_id)
+        .filter(AttendanceDailyStudent.class_id == class_id,
+                *_day_filters(AttendanceDailyStudent.day, date_from, date_to))
+        .order_by(AttendanceDailyStudent.student_id, AttendanceDailyStudent.day)
+        .all()
+    )
+
+def student_daily_rollup(db: Session, student_id: str, date_from: date | None = None, date_to: date | None = None):
+    """(day, class_id, sessions, present, score_sum) của 1 học sinh, theo ngày tăng dần."""
+    return (
+        db.query(AttendanceDailyStudent.day, AttendanceDailyStudent.class_id, AttendanceDailyStudent.sessions,
+                 AttendanceDailyStudent.present, AttendanceDailyStudent.score_sum)
+        .filter(AttendanceDailyStudent.student_id == student_id,
+                *_day_filters(AttendanceDailyStudent.day, date_from, date_to))
+        .order_by(AttendanceDailyStudent.day, AttendanceDailyStudent.class_id)
+        .all()
+    )
+
+def list_sessions(db: Session, class_id: str, limit: int = 50, before: tuple | None = None,
+                  date_from: datetime | None = None, date_to: datetime | None = None):
+    """
+    Phiên của lớp, mới nhất trước, phân trang keyset theo (created_at, id):
+    before = (created_at, id) của dòng cuối trang trước. Chỉ select cột cần cho danh sách
+    (không đọc note), đi theo index (class_id, created_at).
+    """
+    q = (
+        db.query(AttendanceSession.id, AttendanceSession.class_id, AttendanceSession.created_at,
+                 AttendanceSession.images_count, AttendanceSession.unknown_faces_count, AttendanceSession.threshold)
+        .filter(AttendanceSession.class_id == class_id,
+                *_date_filters(AttendanceSession.created_at, date_from, date_to))
+    )
+    if before is not None:
+        created_at, session_id = before
+        q = q.filter(or_(AttendanceSession.created_at < created_at,
+                         and_(AttendanceSession.created_at == created_at, AttendanceSession.id < session_id)))
+    return q.order_by(AttendanceSession.created_at.desc(), AttendanceSession.id.desc()).limit(limit).all()
 
 def get_session(db: Session, session_id: str):
     return db.query(AttendanceSession).filter(AttendanceSession.id == session_id).first()
 
+def get_attendance_job(db: Session, job_id: str):
+    return db.query(AttendanceJob).filter(AttendanceJob.id == job_id).first()
+
 
 # danh sách lớp 
 
@@ -0,0 +1,129 @@
+"""
+Phiên bản async (AsyncSession) của các hàm crud dùng trong route async.
+
+Đọc gallery (đường nóng) query trực tiếp bằng select; các hàm ghi nhiều bước dùng lại
+đúng code sync trong crud.py qua AsyncSession.run_sync (query vẫn đi qua driver async,
+không chặn event loop chờ I/O).
+
+run_sync chạy hàm sync trên chính thread của event loop (greenlet), nên chỉ phần SQL được
+đưa vào run_sync; phần CPU (dựng tham số executemany, k-means prototype, normalize) và
+file (ghi / mmap pack) chạy qua asyncio.to_thread, giống get_gallery.
+"""
+import asyncio
+
+import numpy as np
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.settings import settings
+from app.db import crud, vector_store
+from app.db.models import Student, StudentEmbedding, GalleryGeneration
+from app.core.gallery_cache import gallery_cache
+from app.core.metrics import timed
+
+
+async def _load_gallery_arrays(db: AsyncSession, class_id: str):
+    if settings.gallery_storage == "packed":
+        # packed: đọc bảng index (SQL) rồi mmap file ngoài loop; chưa có pack thì ghi rồi đọc lại
+        packed = await asyncio.to_thread(vector_store.open_pack, class_id,
+                                         await db.run_sync(vector_store.read_pack_index, class_id))
+        if packed is None:
+            await _write_class_pack(db, class_id)
+            packed = await asyncio.to_thread(vector_store.open_pack, class_id,
+                                             await db.run_sync(vector_store.read_pack_index, class_id))
+        if packed is not None:
+            return packed
+    rows = (await db.execute(
+        select(Student.id, Student.name, StudentEmbedding.vector)
+        .join(StudentEmbedding, StudentEmbedding.student_id == Student.id)
+        .where(Student.class_id == class_id)
+        .order_by(StudentEmbedding.id)
+    )).all()
+    # ghép blob + normalize (N, D) ngoài event loop
+    return await asyncio.to_thread(crud.gallery_arrays_from_rows, rows)
+
+
+async def _write_class_pack(db: AsyncSession, class_id: str):
+    """vector_store.write_class_pack: bước SQL qua run_sync, normalize + ghi / dọn file qua to_thread."""
+    rows = await db.run_sync(vector_store.begin_class_pack, class_id)
+    student_ids, embs = await asyncio.to_thread(vector_store.rows_to_embs, rows)
+    file_name = await asyncio.to_thread(vector_store.save_pack_file, class_id, embs) if student_ids else None
+    old_file, current = await db.run_sync(vector_store.commit_class_pack, class_id, student_ids,
+                                          embs.shape if student_ids else None, file_name)
+    if file_name is None:
+        await asyncio.to_thread(vector_store.remove_pack_file, old_file)
+    else:
+        await asyncio.to_thread(vector_store.prune_pack_files, class_id, file_name, current)
+
+
+async def _consolidate_rows(db: AsyncSession, student_ids, cap: int, method: str):
+    """crud._consolidate_rows: k-means / k-medoids chạy ngoài loop, đọc / ghi qua run_sync."""
+    if cap <= 0:
+        return [], []
+    grouped = await db.run_sync(crud._consolidate_candidates, student_ids, cap)
+    if not grouped:
+        return [], []
+    computed = await asyncio.to_thread(crud._compute_prototypes, grouped, cap, method)
+    return await db.run_sync(crud._apply_prototypes, *computed)
+
+
+@timed("gallery_load")
+async def get_gallery(db: AsyncSession, class_id: str):
+    """Gallery của lớp qua cache process-wide, miss thì load bằng AsyncSession."""
+    if gallery_cache.sync_due():
+        rows = (await db.execute(select(GalleryGeneration.class_id, GalleryGeneration.generation))).all()
+        gallery_cache.sync(dict(rows))
+    return await gallery_cache.aget(class_id, lambda: _load_gallery_arrays(db, class_id))
+
+
+@timed("db_write")
+async def save_attendance_session(db: AsyncSession, session_id: str, class_id: str, images_count: int,
+                                  result: dict, threshold: float = 0.6, faces: list | None = None):
+    await db.run_sync(crud.save_attendance_session, session_id, class_id, images_count, result,
+                      threshold=threshold, faces=faces)
+
+
+@timed("db_enroll")
+async def enroll_student(db: AsyncSession, class_id: str, student_id: str, name: str, embs,
+                         class_name: str | None = None, source: str = "enroll"):
+    """crud.enroll_student, 1 transaction; xem docstring module về phần chạy ngoài loop."""
+    embs = np.asarray(embs, dtype=np.float32)
+    embs = embs.reshape(len(embs), -1)
+    params = await asyncio.to_thread(crud._embedding_params, student_id, embs, source)
+    ids, changed = await db.run_sync(crud._enroll_student_rows, class_id, student_id, name, params,
+                                     class_name=class_name)
+    removed, prototypes = await _consolidate_rows(db, [student_id], settings.enroll_max_embeddings,
+                                                  settings.prototype_method)
+    generations = await db.run_sync(crud._gallery_changed, changed)
+    await db.commit()
+
+    crud._invalidate_galleries(generations)
+    # campus index: add / remove dưới lock của index (có thể đang identify trong thread khác)
+    await asyncio.to_thread(crud._notify_enrolled, [(student_id, name, class_id)],
+                            [(i, student_id, e) for i, e in zip(ids, embs)], removed, prototypes)
+    return ids
+
+
+async def student_embeddings(db: AsyncSession, student_ids) -> dict:
+    return await db.run_sync(crud.student_embeddings, student_ids)
+
+
+@timed("db_enroll")
+async def bulk_enroll_students(db: AsyncSession, students: list[dict], source: str = "enroll"):
+    """crud.bulk_enroll_students, 1 transaction; xem docstring module về phần chạy ngoài loop."""
+    if not students:
+        return []
+    params, owners = await asyncio.to_thread(crud._bulk_embedding_params, students, source)
+    ids, changed, names = await db.run_sync(crud._bulk_enroll_rows, students, params)
+    removed, prototypes = await _consolidate_rows(db, [s["student_id"] for s in students],
+                                                  settings.enroll_max_embeddings, settings.prototype_method)
+    generations = await db.run_sync(crud._gallery_changed, changed)
+    await db.commit()
+
+    crud._invalidate_galleries(generations)
+    return await asyncio.to_thread(crud._after_bulk_enroll, students, names, ids, owners, removed, prototypes)
+
+
+async def pack_class_gallery(db: AsyncSession, class_id: str):
+    if settings.gallery_storage == "packed":
+        await _write_class_pack(db, class_id)
@@ -1,11 +1,67 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker, declarative_base
 from app.settings import settings
 
-engine = create_engine(
-    settings.db_url,
-    connect_args={"check_same_thread": False} if settings.db_url.startswith("sqlite") else {}
-)
+
+def sqlite_pragmas(s=settings) -> dict:
+    """PRAGMA chạy trên mỗi connection SQLite mới (thứ tự giữ nguyên)."""
+    return {
+        # chỉ có tác dụng với DB mới (trước khi tạo bảng): cho phép cleanup chạy
+        # PRAGMA incremental_vacuum thay vì VACUUM cả file
+        "auto_vacuum": "INCREMENTAL",
+        # WAL: đọc không chặn ghi và ngược lại; lưu trong file DB nên chỉ cần đổi 1 lần
+        "journal_mode": s.sqlite_journal_mode,
+        "synchronous": s.sqlite_synchronous,
+        # đợi lock thay vì báo "database is locked" ngay
+        "busy_timeout": int(s.sqlite_busy_timeout_ms),
+        # số âm = KiB (mỗi connection)
+        "cache_size": -int(s.sqlite_cache_size_kb),
+        "mmap_size": int(s.sqlite_mmap_size_mb) * 1024 * 1024,
+        "temp_store": "MEMORY",
+    }
+
+
+def install_sqlite_pragmas(sync_engine, pragmas: dict):
+    """Chạy pragmas trên mỗi connection mới của engine (AsyncEngine: truyền .sync_engine)."""
+    @event.listens_for(sync_engine, "connect")
+    def _sqlite_on_connect(dbapi_conn, _):
+        cur = dbapi_conn.cursor()
+        for name, value in pragmas.items():
+            cur.execute(f"PRAGMA {name}={value}")
+        cur.close()
+
+
+def create_db_engine(db_url: str, pragmas: dict | None = None, pool_size: int | None = None,
+                     max_overflow: int | None = None):
+    """
+    Engine theo db_url. SQLite: pool QueuePool (mỗi thread mượn 1 connection, tối đa
+    pool_size + max_overflow) và chạy pragmas trên mỗi connection mới.
+    """
+    kwargs = {}
+    is_sqlite = db_url.startswith("sqlite")
+    if is_sqlite:
+        kwargs["connect_args"] = {"check_same_thread": False}
+    if not is_sqlite or ":memory:" not in db_url:
+        kwargs.update(
+            pool_size=settings.db_pool_size if pool_size is None else pool_size,
+            max_overflow=settings.db_max_overflow if max_overflow is None else max_overflow,
+            pool_timeout=settings.db_pool_timeout,
+        )
+    eng = create_engine(db_url, **kwargs)
+
+    if is_sqlite:
+        install_sqlite_pragmas(eng, sqlite_pragmas() if pragmas is None else pragmas)
+    return eng
+
+
+engine = create_db_engine(settings.db_url)
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
+
+
+def create_missing_indexes():
+    """create_all chỉ tạo index khi tạo bảng mới: tạo thêm index khai báo sau trên DB đã có."""
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
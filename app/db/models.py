@@ -1,5 +1,5 @@
 from datetime import datetime
-from sqlalchemy import Column, String, Integer, Float, Text, DateTime, ForeignKey, LargeBinary
+from sqlalchemy import Column, String, Integer, Float, Text, Date, DateTime, ForeignKey, LargeBinary, Index
 from app.db.database import Base
 
 class ClassRoom(Base):
@@ -73,7 +73,51 @@ class AttendanceResult(Base):
     student_id = Column(String, ForeignKey("students.id", ondelete="CASCADE"), nullable=False, index=True)
     status = Column(String, nullable=False)  # present|absent
     best_score = Column(Float, nullable=True)
-    created_at = Column(DateTime, default=datetime.utcnow)
+    created_at = Column(DateTime, default=datetime.utcnow)  # = created_at của session
+
+# lịch sử / báo cáo điểm danh theo học sinh và theo lớp trong 1 khoảng thời gian
+Index("ix_attendance_results_student_created", AttendanceResult.student_id, AttendanceResult.created_at)
+Index("ix_attendance_sessions_class_created", AttendanceSession.class_id, AttendanceSession.created_at)
+
+# Tổng hợp điểm danh theo ngày (UTC), cập nhật cộng dồn trong cùng transaction lưu phiên
+# (crud.save_attendance_session). Báo cáo dài hạn đọc từ đây thay vì quét attendance_results;
+# cleanup không xoá nên vẫn còn lịch sử sau khi phiên hết retention_days.
+class AttendanceDailyClass(Base):
+    __tablename__ = "attendance_daily_class"
+    class_id = Column(String, ForeignKey("classes.id", ondelete="CASCADE"), primary_key=True)
+    day = Column(Date, primary_key=True)
+    sessions = Column(Integer, nullable=False, default=0)
+    results = Column(Integer, nullable=False, default=0)      # số dòng học sinh x phiên
+    present = Column(Integer, nullable=False, default=0)
+    unknown_faces = Column(Integer, nullable=False, default=0)
+
+class AttendanceDailyStudent(Base):
+    __tablename__ = "attendance_daily_student"
+    student_id = Column(String, ForeignKey("students.id", ondelete="CASCADE"), primary_key=True)
+    day = Column(Date, primary_key=True)
+    class_id = Column(String, ForeignKey("classes.id", ondelete="CASCADE"), primary_key=True)
+    sessions = Column(Integer, nullable=False, default=0)
+    present = Column(Integer, nullable=False, default=0)
+    score_sum = Column(Float, nullable=False, default=0.0)    # tổng best_score các phiên có mặt
+
+Index("ix_attendance_daily_student_class_day", AttendanceDailyStudent.class_id, AttendanceDailyStudent.day)
+
+# Job điểm danh bất đồng bộ (POST /attendance/jobs), ảnh lưu dưới storage_dir/jobs/<id>/
+class AttendanceJob(Base):
+    __tablename__ = "attendance_jobs"
+    id = Column(String, primary_key=True)  # uuid
+    class_id = Column(String, nullable=False, index=True)
+    lane = Column(String, nullable=False, default="live")       # live|bulk (live được ưu tiên)
+    status = Column(String, nullable=False, default="queued", index=True)  # queued|running|done|failed
+    threshold = Column(Float, default=0.4)
+    images_total = Column(Integer, default=0)
+    images_done = Column(Integer, default=0)
+    attempts = Column(Integer, default=0)
+    session_id = Column(String, nullable=True)
+    error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
 
 class CleanupRun(Base):
     __tablename__ = "cleanup_runs"
@@ -82,3 +126,30 @@ class CleanupRun(Base):
     deleted_sessions = Column(Integer, default=0)
     deleted_files = Column(Integer, default=0)
     note = Column(Text, nullable=True)
+
+# Packed gallery (settings.gallery_storage = "packed"):
+# mỗi lớp 1 file .npy (N, D) dưới storage_dir/galleries, hàng gom theo student.
+class PackedGallery(Base):
+    __tablename__ = "packed_galleries"
+    class_id = Column(String, ForeignKey("classes.id", ondelete="CASCADE"), primary_key=True)
+    file_name = Column(String, nullable=False)
+    rows = Column(Integer, nullable=False)
+    dim = Column(Integer, nullable=False)
+    dtype = Column(String, nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+class PackedGallerySegment(Base):
+    __tablename__ = "packed_gallery_segments"
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    class_id = Column(String, ForeignKey("classes.id", ondelete="CASCADE"), nullable=False, index=True)
+    student_id = Column(String, ForeignKey("students.id", ondelete="CASCADE"), nullable=False)
+    offset = Column(Integer, nullable=False)   # hàng đầu tiên trong file
+    count = Column(Integer, nullable=False)    # số embedding của student
+
+# Generation của gallery mỗi lớp: +1 trong cùng transaction với mọi thay đổi embedding / học sinh
+# của lớp. Chạy nhiều worker (uvicorn --workers N), mỗi worker so generation với bản đã thấy
+# để bỏ gallery cache cũ khi worker khác enroll (xem GalleryCache.sync).
+class GalleryGeneration(Base):
+    __tablename__ = "gallery_generations"
+    class_id = Column(String, primary_key=True)
+    generation = Column(Integer, nullable=False, default=0)
@@ -0,0 +1,225 @@
+"""
+Lưu gallery dạng packed: mỗi lớp 1 ma trận .npy (float16/float32, đã normalize)
+dưới settings.storage_dir/galleries, kèm bảng index (student_id, offset, count).
+
+Load bằng np.load(mmap_mode="r"): không hydrate ORM, không copy dữ liệu.
+File được ghi với tên mới mỗi lần (class.<token>.npy) rồi mới đổi con trỏ
+trong bảng packed_galleries, nên reader đang mmap file cũ không bị ảnh hưởng.
+"""
+import hashlib
+import logging
+import os
+import re
+import uuid
+from datetime import datetime
+
+import numpy as np
+from sqlalchemy.orm import Session
+
+from app.settings import settings
+from app.db.models import Student, StudentEmbedding, PackedGallery, PackedGallerySegment
+
+logger = logging.getLogger(__name__)
+
+
+def gallery_dir() -> str:
+    return os.path.join(settings.storage_dir, "galleries")
+
+
+def _safe_name(class_id: str) -> str:
+    safe = re.sub(r"[^A-Za-z0-9_-]", "_", class_id)
+    if safe != class_id:
+        safe += "-" + hashlib.sha1(class_id.encode("utf-8")).hexdigest()[:8]
+    return safe
+
+
+def query_class_rows(db: Session, class_id: str):
+    """Các dòng (student_id, vector bytes) của lớp, gom theo student_id (chỉ SQL)."""
+    return (
+        db.query(Student.id, StudentEmbedding.vector)
+        .join(StudentEmbedding, StudentEmbedding.student_id == Student.id)
+        .filter(Student.class_id == class_id)
+        .order_by(Student.id, StudentEmbedding.id)
+    ).all()
+
+
+def rows_to_embs(rows):
+    """Dòng của query_class_rows -> (student_ids per row, embs (N, D) float32 đã normalize)."""
+    if not rows:
+        return [], np.zeros((0, 0), dtype=np.float32)
+    embs = np.frombuffer(b"".join(r[1] for r in rows), dtype=np.float32).reshape(len(rows), -1)
+    norms = np.linalg.norm(embs, axis=1, keepdims=True)
+    embs = embs / np.where(norms > 1e-6, norms, 1.0)
+    return [r[0] for r in rows], embs
+
+
+def read_class_rows(db: Session, class_id: str):
+    """
+    Đọc embedding của lớp từ bảng student_embeddings, gom theo student_id.
+    Return (student_ids per row, embs (N, D) float32 đã normalize).
+    """
+    return rows_to_embs(query_class_rows(db, class_id))
+
+
+def begin_class_pack(db: Session, class_id: str):
+    """
+    Bước 1 (SQL) của write_class_pack: xoá index trước để mở transaction ghi (SQLite: giữ write
+    lock) rồi mới đọc embedding: nhiều worker cùng ghi pack 1 lớp thì ghi lần lượt, không ghi đè
+    pack mới bằng dữ liệu đọc trước enroll. Return các dòng của query_class_rows.
+    """
+    db.query(PackedGallerySegment).filter(PackedGallerySegment.class_id == class_id).delete()
+    return query_class_rows(db, class_id)
+
+
+def save_pack_file(class_id: str, embs: np.ndarray) -> str:
+    """Bước 2 (file): ghi embs ra file .npy tên mới (tmp + fsync + rename). Return tên file."""
+    os.makedirs(gallery_dir(), exist_ok=True)
+    file_name = f"{_safe_name(class_id)}.{uuid.uuid4().hex[:12]}.npy"
+    path = os.path.join(gallery_dir(), file_name)
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as fh:
+        np.save(fh, np.ascontiguousarray(embs, dtype=settings.packed_dtype))
+        fh.flush()
+        os.fsync(fh.fileno())
+    os.replace(tmp, path)
+    return file_name
+
+
+def commit_class_pack(db: Session, class_id: str, student_ids: list[str], shape: tuple | None,
+                      file_name: str | None):
+    """
+    Bước 3 (SQL): ghi index segment + đổi con trỏ sang file_name rồi commit; lớp rỗng (shape None)
+    thì xoá con trỏ. Return (file cũ cần xoá khi lớp rỗng, file đang được trỏ tới).
+    """
+    old = db.query(PackedGallery).filter(PackedGallery.class_id == class_id).first()
+    if not student_ids:
+        old_file = old.file_name if old is not None else None
+        if old is not None:
+            db.delete(old)
+        db.commit()
+        return old_file, None
+
+    # segment liên tiếp theo student (rows đã order_by Student.id)
+    ids = np.asarray(student_ids, dtype=str)
+    starts = np.flatnonzero(np.r_[True, ids[1:] != ids[:-1]])
+    counts = np.diff(np.r_[starts, len(ids)])
+    db.bulk_insert_mappings(PackedGallerySegment, [
+        {"class_id": class_id, "student_id": student_ids[s], "offset": int(s), "count": int(c)}
+        for s, c in zip(starts.tolist(), counts.tolist())
+    ])
+
+    if old is None:
+        old = PackedGallery(class_id=class_id)
+        db.add(old)
+    old.file_name = file_name
+    old.rows = int(shape[0])
+    old.dim = int(shape[1])
+    old.dtype = settings.packed_dtype
+    old.updated_at = datetime.utcnow()
+    db.commit()
+    return None, db.query(PackedGallery.file_name).filter(PackedGallery.class_id == class_id).scalar()
+
+
+def prune_pack_files(class_id: str, file_name: str, current: str | None):
+    """
+    Bước 4 (file): dọn file cũ của lớp (kể cả file bị drop_class_pack bỏ con trỏ). Nhiều worker
+    có thể cùng ghi pack 1 lớp: chỉ xoá file cũ hơn file vừa ghi và không phải file đang được trỏ tới.
+    """
+    prefix = _safe_name(class_id) + "."
+    mtime = os.stat(os.path.join(gallery_dir(), file_name)).st_mtime_ns
+    with os.scandir(gallery_dir()) as it:
+        stale = [e.name for e in it if e.name.startswith(prefix) and e.name.endswith(".npy")
+                 and e.name not in (file_name, current) and e.stat().st_mtime_ns < mtime]
+    for name in stale:
+        remove_pack_file(name)
+
+
+def write_class_pack(db: Session, class_id: str):
+    """
+    Ghi lại file packed của lớp từ student_embeddings và cập nhật bảng index.
+    Các bước SQL / CPU / file tách riêng để bản async (crud_async.pack_class_gallery) chạy phần
+    CPU + file ngoài event loop.
+    """
+    student_ids, embs = rows_to_embs(begin_class_pack(db, class_id))
+    file_name = save_pack_file(class_id, embs) if student_ids else None
+    old_file, current = commit_class_pack(db, class_id, student_ids, embs.shape if student_ids else None, file_name)
+    if file_name is None:
+        remove_pack_file(old_file)
+        return None
+    prune_pack_files(class_id, file_name, current)
+    return os.path.join(gallery_dir(), file_name)
+
+
+def drop_class_pack(db: Session, class_id: str):
+    """
+    Đánh dấu pack của lớp đã cũ (xoá con trỏ, không commit).
+    Lần load sau sẽ đọc lại từ student_embeddings và ghi pack mới.
+    """
+    db.query(PackedGallery).filter(PackedGallery.class_id == class_id).delete()
+    db.query(PackedGallerySegment).filter(PackedGallerySegment.class_id == class_id).delete()
+
+
+def read_pack_index(db: Session, class_id: str):
+    """Con trỏ + segment của pack (chỉ SQL). Return ((file_name, rows, dim), segs) hoặc None."""
+    head = db.query(PackedGallery).filter(PackedGallery.class_id == class_id).first()
+    if head is None:
+        return None
+    segs = (
+        db.query(PackedGallerySegment.student_id, Student.name, PackedGallerySegment.offset, PackedGallerySegment.count)
+        .join(Student, Student.id == PackedGallerySegment.student_id)
+        .filter(PackedGallerySegment.class_id == class_id)
+        .order_by(PackedGallerySegment.offset)
+    ).all()
+    return (head.file_name, head.rows, head.dim), segs
+
+
+def open_pack(class_id: str, index):
+    """mmap file theo index của read_pack_index. Return (names, student_ids, embs memmap) hoặc None."""
+    if index is None:
+        return None
+    (file_name, rows, dim), segs = index
+    try:
+        embs = np.load(os.path.join(gallery_dir(), file_name), mmap_mode="r")
+    except FileNotFoundError:
+        logger.warning(f"Packed gallery file missing for class_id={class_id}: {file_name}")
+        return None
+    if embs.shape != (rows, dim) or sum(s[3] for s in segs) != rows:
+        logger.warning(f"Packed gallery index mismatch for class_id={class_id}, ignoring pack")
+        return None
+
+    names, student_ids = [], []
+    for sid, name, _, count in segs:
+        names.extend([name] * count)
+        student_ids.extend([sid] * count)
+    return names, student_ids, embs
+
+
+def load_class_pack(db: Session, class_id: str):
+    """
+    Return (names, student_ids, embs memmap (N, D)) hoặc None nếu lớp chưa có pack.
+    """
+    return open_pack(class_id, read_pack_index(db, class_id))
+
+
+def pack_all(db: Session, class_ids=None):
+    """Ghi pack cho các lớp (mặc định: mọi lớp có student). Return {class_id: rows}."""
+    if class_ids is None:
+        class_ids = [r[0] for r in db.query(Student.class_id).distinct().all()]
+    out = {}
+    for class_id in class_ids:
+        write_class_pack(db, class_id)
+        head = db.query(PackedGallery).filter(PackedGallery.class_id == class_id).first()
+        out[class_id] = head.rows if head is not None else 0
+    return out
+
+
+def remove_pack_file(file_name):
+    if not file_name:
+        return
+    try:
+        os.remove(os.path.join(gallery_dir(), file_name))
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        # Windows không cho xoá file đang được mmap; để lần ghi sau / admin command dọn
+        logger.warning(f"Cannot remove old packed gallery {file_name}: {e}")
@@ -1,4 +1,6 @@
 from app.db.database import SessionLocal
+from app.db.async_database import AsyncSessionLocal
+from app.core.engine_registry import engine_registry
 
 def get_db():
     db = SessionLocal()
@@ -6,3 +8,12 @@ def get_db():
         yield db
     finally:
         db.close()
+
+def get_engine():
+    # dependency sync -> FastAPI chạy trong threadpool, lần load đầu không chặn event loop
+    return engine_registry.get()
+
+async def get_async_db():
+    # AsyncSession cho route async def (query không chặn event loop)
+    async with AsyncSessionLocal() as db:
+        yield db
@@ -0,0 +1,71 @@
+"""
+Import enroll offline cho cả trường (không qua HTTP):
+
+    python -m app.jobs.bulk_enroll photos/                 # photos/<lớp>/<mã HS>[__<tên>]/<ảnh>
+    python -m app.jobs.bulk_enroll photos.zip --workers 4 --report report.json
+
+Detect/embed chạy trên pool --workers thread, ghi DB theo batch --batch-students học sinh
+/ transaction. In report (lỗi từng học sinh, images_per_s) dạng JSON.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import zipfile
+
+from app.settings import settings
+from app.db.database import Base, engine as db_engine, create_missing_indexes
+from app.db.async_database import AsyncSessionLocal, async_engine
+from app.core.bulk_enroll import bulk_enroll, scan_directory, scan_zip
+from app.core.engine_registry import engine_registry
+from app.core.inference import InferenceExecutor
+
+
+async def run(args) -> dict:
+    zf = None
+    if os.path.isdir(args.source):
+        students, conflicts = scan_directory(args.source)
+    else:
+        zf = zipfile.ZipFile(args.source)
+        students, conflicts = scan_zip(zf)
+    print(f"{len(students)} students, {sum(len(s.images) for s in students)} images", file=sys.stderr)
+
+    executor = InferenceExecutor(max_workers=args.workers, max_queue=args.workers * 2, queue_timeout=3600)
+    try:
+        face_engine = await asyncio.to_thread(engine_registry.get)
+        async with AsyncSessionLocal() as db:
+            return await bulk_enroll(face_engine, db, students, conflicts, executor=executor,
+                                     batch_students=args.batch_students, dedup_threshold=args.dedup)
+    finally:
+        executor.shutdown()
+        if zf is not None:
+            zf.close()
+        await async_engine.dispose()
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Bulk enroll students from <class>/<student>/<images>")
+    ap.add_argument("source", help="thư mục hoặc file .zip")
+    ap.add_argument("--workers", type=int, default=settings.inference_workers, help="số thread detect/embed")
+    ap.add_argument("--batch-students", type=int, default=settings.bulk_enroll_batch_students)
+    ap.add_argument("--dedup", type=float, default=settings.enroll_dedup_threshold,
+                    help="bỏ embedding có cosine >= ngưỡng với embedding khác của cùng học sinh")
+    ap.add_argument("--report", help="ghi report JSON ra file này")
+    args = ap.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    Base.metadata.create_all(bind=db_engine)
+    create_missing_indexes()
+    report = asyncio.run(run(args))
+
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as fh:
+            fh.write(text)
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,250 @@
+"""
+Dọn dữ liệu quá hạn (settings.retention_days): phiên điểm danh + face/result/ảnh của nó,
+job đã xong, file mồ côi trong storage_dir, rồi incremental VACUUM.
+
+    python -m app.jobs.cleanup                       # chạy 1 lần
+    python -m app.jobs.cleanup --retention-days 7
+    python -m app.jobs.cleanup --enable-incremental-vacuum   # chuyển DB cũ sang auto_vacuum=INCREMENTAL (VACUUM đầy đủ 1 lần)
+
+Chạy định kỳ bằng APScheduler: xem app/jobs/scheduler.py.
+"""
+import argparse
+import json
+import logging
+import os
+import shutil
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import text
+
+from app.settings import settings
+from app.core.image_cache import image_cache
+from app.db.database import Base, SessionLocal, engine, create_missing_indexes
+from app.db.models import (
+    AttendanceSession, AttendanceImage, AttendanceFace, AttendanceResult, AttendanceJob,
+    StudentEnrollImage, CleanupRun,
+)
+
+logger = logging.getLogger(__name__)
+
+# thư mục trong storage_dir do module khác quản lý, không quét file mồ côi
+# (galleries: app.jobs.pack_galleries, index: campus index, jobs: xử lý riêng theo bảng attendance_jobs,
+# image_cache: app.core.image_cache, dọn theo TTL, run: file lock của process, vd leader.lock)
+_MANAGED_DIRS = {"galleries", "index", "jobs", "image_cache", "run"}
+
+# số trang trả về OS mỗi transaction của incremental_vacuum
+_VACUUM_CHUNK = 200
+
+
+def _delete_expired_sessions(db, cutoff: datetime, batch_size: int, pause: float, stats: dict):
+    """
+    Xoá phiên cũ hơn cutoff theo từng batch, mỗi batch 1 transaction ngắn (SQLite chỉ có
+    1 writer: transaction dài sẽ chặn điểm danh đang chạy). Xoá bảng con trước vì SQLite
+    không bật foreign_keys nên ON DELETE CASCADE không tự chạy.
+    """
+    while True:
+        ids = [r[0] for r in (
+            db.query(AttendanceSession.id)
+            .filter(AttendanceSession.created_at < cutoff)
+            .order_by(AttendanceSession.created_at)
+            .limit(batch_size)
+        )]
+        if not ids:
+            return
+
+        paths = [r[0] for r in db.query(AttendanceImage.file_path).filter(AttendanceImage.session_id.in_(ids))]
+        stats["faces"] += db.query(AttendanceFace).filter(AttendanceFace.session_id.in_(ids)).delete(synchronize_session=False)
+        stats["results"] += db.query(AttendanceResult).filter(AttendanceResult.session_id.in_(ids)).delete(synchronize_session=False)
+        stats["images"] += db.query(AttendanceImage).filter(AttendanceImage.session_id.in_(ids)).delete(synchronize_session=False)
+        stats["sessions"] += db.query(AttendanceSession).filter(AttendanceSession.id.in_(ids)).delete(synchronize_session=False)
+        db.commit()
+        stats["batches"] += 1
+
+        # file xoá sau commit: lỗi giữa chừng chỉ để lại file mồ côi (lần sau prune), không mất dòng DB còn trỏ tới
+        for p in paths:
+            if p and _remove_file(p):
+                stats["files"] += 1
+
+        if len(ids) < batch_size:
+            return
+        # nhường write lock cho request điểm danh giữa các batch
+        time.sleep(pause)
+
+
+def _delete_finished_jobs(db, cutoff: datetime, batch_size: int, stats: dict):
+    while True:
+        ids = [r[0] for r in (
+            db.query(AttendanceJob.id)
+            .filter(AttendanceJob.status.in_(("done", "failed")), AttendanceJob.created_at < cutoff)
+            .limit(batch_size)
+        )]
+        if not ids:
+            return
+        stats["jobs"] += db.query(AttendanceJob).filter(AttendanceJob.id.in_(ids)).delete(synchronize_session=False)
+        db.commit()
+        if len(ids) < batch_size:
+            return
+
+
+def _remove_file(path: str) -> bool:
+    try:
+        os.remove(path)
+        return True
+    except OSError:
+        return False
+
+
+def iter_files(root: str, skip_top_dirs=()):
+    """Duyệt file dưới root bằng os.scandir (không dựng cả danh sách trong RAM)."""
+    stack = [root]
+    while stack:
+        d = stack.pop()
+        try:
+            it = os.scandir(d)
+        except OSError:
+            continue
+        with it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    if not (d == root and entry.name in skip_top_dirs):
+                        stack.append(entry.path)
+                elif entry.is_file(follow_symlinks=False):
+                    yield entry
+
+
+def _prune_orphan_files(db, root: str, grace_seconds: float, stats: dict):
+    """
+    Xoá file ảnh dưới storage_dir không còn dòng attendance_images / student_enroll_images nào trỏ tới,
+    và thư mục job không còn job queued/running. Bỏ qua file mới hơn grace_seconds (có thể đang được ghi).
+    """
+    if not os.path.isdir(root):
+        return
+    now = time.time()
+
+    referenced = set()
+    for model in (AttendanceImage, StudentEnrollImage):
+        for (p,) in db.query(model.file_path).yield_per(1000):
+            if p:   # attendance_images.file_path = "": ảnh không lưu ra đĩa
+                referenced.add(os.path.abspath(p))
+
+    for entry in iter_files(root, skip_top_dirs=_MANAGED_DIRS):
+        try:
+            if now - entry.stat(follow_symlinks=False).st_mtime < grace_seconds:
+                continue
+        except OSError:
+            continue
+        if os.path.abspath(entry.path) not in referenced and _remove_file(entry.path):
+            stats["orphan_files"] += 1
+
+    jobs_dir = os.path.join(root, "jobs")
+    if os.path.isdir(jobs_dir):
+        active = {r[0] for r in db.query(AttendanceJob.id).filter(AttendanceJob.status.in_(("queued", "running")))}
+        with os.scandir(jobs_dir) as it:
+            for entry in it:
+                if not entry.is_dir(follow_symlinks=False) or entry.name in active:
+                    continue
+                try:
+                    if now - entry.stat(follow_symlinks=False).st_mtime < grace_seconds:
+                        continue
+                except OSError:
+                    continue
+                stats["orphan_files"] += sum(1 for _ in iter_files(entry.path))
+                shutil.rmtree(entry.path, ignore_errors=True)
+
+
+def incremental_vacuum(db, pages: int) -> dict:
+    """
+    PRAGMA incremental_vacuum(pages): trả tối đa pages trang trống về OS, mỗi lần 1 ít
+    thay vì VACUUM cả file (khoá DB lâu). Chỉ có tác dụng khi auto_vacuum=INCREMENTAL.
+    """
+    if not settings.db_url.startswith("sqlite"):
+        return {"mode": None}
+    mode = db.execute(text("PRAGMA auto_vacuum")).scalar()
+    before = db.execute(text("PRAGMA freelist_count")).scalar()
+    if mode == 2 and before:
+        db.commit()
+        # sqlite3 của Python chỉ chạy 1 bước của pragma (= 1 trang) mỗi execute, nên gọi lặp,
+        # gom mỗi _VACUUM_CHUNK trang vào 1 transaction ngắn để không giữ write lock lâu
+        raw = db.connection().connection
+        cur = raw.cursor()
+        try:
+            todo = min(int(pages), int(before))
+            while todo > 0:
+                n = min(_VACUUM_CHUNK, todo)
+                cur.execute("BEGIN IMMEDIATE")
+                for _ in range(n):
+                    cur.execute("PRAGMA incremental_vacuum(1)")
+                cur.execute("COMMIT")
+                todo -= n
+        finally:
+            cur.close()
+    after = db.execute(text("PRAGMA freelist_count")).scalar()
+    return {"mode": {0: "none", 1: "full", 2: "incremental"}.get(mode, mode),
+            "freelist_before": before, "freelist_after": after}
+
+
+def enable_incremental_vacuum():
+    """Chuyển DB SQLite đã có sang auto_vacuum=INCREMENTAL (cần VACUUM đầy đủ 1 lần, khoá DB)."""
+    with engine.connect() as conn:
+        conn.execute(text("PRAGMA auto_vacuum=INCREMENTAL"))
+        conn.execute(text("VACUUM"))
+
+
+def run_cleanup(retention_days: int | None = None, batch_size: int | None = None) -> CleanupRun:
+    """Chạy 1 lượt dọn dẹp, ghi kết quả vào cleanup_runs. Return dòng CleanupRun."""
+    retention_days = settings.retention_days if retention_days is None else retention_days
+    batch_size = batch_size or settings.cleanup_batch_size
+    cutoff = datetime.utcnow() - timedelta(days=retention_days)
+    stats = {"sessions": 0, "faces": 0, "results": 0, "images": 0, "jobs": 0,
+             "files": 0, "orphan_files": 0, "image_cache_files": 0, "batches": 0}
+
+    t0 = time.perf_counter()
+    db = SessionLocal()
+    try:
+        _delete_expired_sessions(db, cutoff, batch_size, settings.cleanup_batch_pause, stats)
+        _delete_finished_jobs(db, cutoff, batch_size, stats)
+        _prune_orphan_files(db, settings.storage_dir, settings.cleanup_orphan_grace_minutes * 60, stats)
+        stats["image_cache_files"] = image_cache.prune_disk()
+        vacuum = incremental_vacuum(db, settings.cleanup_vacuum_pages)
+        duration_ms = (time.perf_counter() - t0) * 1000
+
+        row = CleanupRun(
+            deleted_sessions=stats["sessions"],
+            deleted_files=stats["files"] + stats["orphan_files"] + stats["image_cache_files"],
+            note=json.dumps({
+                "retention_days": retention_days,
+                "cutoff": cutoff.isoformat(),
+                "duration_ms": round(duration_ms, 1),
+                **stats,
+                "vacuum": vacuum,
+            }),
+        )
+        db.add(row)
+        db.commit()
+        db.refresh(row)
+        logger.info(f"Cleanup: {row.note}")
+        return row
+    finally:
+        db.close()
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Delete attendance data older than the retention period")
+    ap.add_argument("--retention-days", type=int, default=None)
+    ap.add_argument("--batch-size", type=int, default=None)
+    ap.add_argument("--enable-incremental-vacuum", action="store_true",
+                    help="chuyển DB cũ sang auto_vacuum=INCREMENTAL (VACUUM đầy đủ, chạy lúc không có ai dùng)")
+    args = ap.parse_args()
+
+    Base.metadata.create_all(bind=engine)
+    create_missing_indexes()
+    if args.enable_incremental_vacuum:
+        enable_incremental_vacuum()
+    row = run_cleanup(retention_days=args.retention_days, batch_size=args.batch_size)
+    print(json.dumps({"id": row.id, "deleted_sessions": row.deleted_sessions,
+                      "deleted_files": row.deleted_files, **json.loads(row.note)}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
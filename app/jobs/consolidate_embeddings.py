@@ -0,0 +1,163 @@
+"""
+Gom embedding của học sinh đã vượt cap thành prototype (chạy 1 lần cho dữ liệu cũ, hoặc
+sau khi giảm ENROLL_MAX_EMBEDDINGS). Enroll mới đã tự gom (xem crud.enroll_student).
+
+    python -m app.jobs.consolidate_embeddings                    # mọi lớp, cap/method theo settings
+    python -m app.jobs.consolidate_embeddings --cap 5 --class-id 10A1 --eval-probes 500 --dry-run
+
+In report JSON: số embedding trước / sau (tổng + từng lớp) và, nếu --eval-probes > 0,
+độ chính xác top-1 leave-one-out trước / sau: lấy ngẫu nhiên các embedding đã lưu làm
+probe, match với gallery của lớp khi bỏ chính probe đó ra (cả khi tính prototype).
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+from sqlalchemy import func
+
+from app.settings import settings
+from app.db.database import Base, SessionLocal, engine
+from app.db.models import Student, StudentEmbedding
+from app.db import crud
+from app.core.gallery_cache import Gallery
+from app.core.matching import match_students
+from app.core.prototypes import consolidate
+
+
+def gallery_sizes(db, class_ids=None) -> dict:
+    q = (
+        db.query(Student.class_id, func.count(StudentEmbedding.id))
+        .join(StudentEmbedding, StudentEmbedding.student_id == Student.id)
+        .group_by(Student.class_id)
+    )
+    if class_ids:
+        q = q.filter(Student.class_id.in_(class_ids))
+    return dict(q.all())
+
+
+def students_over_cap(db, cap: int, class_ids=None) -> list[str]:
+    q = (
+        db.query(StudentEmbedding.student_id)
+        .join(Student, Student.id == StudentEmbedding.student_id)
+        .group_by(StudentEmbedding.student_id)
+        .having(func.count(StudentEmbedding.id) > cap)
+        .order_by(StudentEmbedding.student_id)
+    )
+    if class_ids:
+        q = q.filter(Student.class_id.in_(class_ids))
+    return [r[0] for r in q]
+
+
+def _class_vectors(db, class_id: str) -> dict:
+    rows = (
+        db.query(StudentEmbedding.student_id, StudentEmbedding.vector)
+        .join(Student, Student.id == StudentEmbedding.student_id)
+        .filter(Student.class_id == class_id)
+        .order_by(StudentEmbedding.id)
+    )
+    out = {}
+    for sid, vec in rows:
+        out.setdefault(sid, []).append(np.frombuffer(vec, dtype=np.float32))
+    return {sid: np.stack(v) for sid, v in out.items()}
+
+
+def _top1(gallery: dict, probe: np.ndarray):
+    sids = [sid for sid, v in gallery.items() for _ in range(len(v))]
+    g = Gallery("eval", 0, sids, sids, np.concatenate(list(gallery.values())))
+    idx, score = match_students(probe, g.embs, g.seg_starts, threshold=-1.0,
+                                aggregate=settings.match_aggregate, top_k=settings.match_topk, one_to_one=False)
+    return g.student_keys[int(idx[0])], float(score[0])
+
+
+def evaluate(db, class_ids, cap: int, method: str, probes: int, seed: int = 0) -> dict:
+    """Top-1 leave-one-out trước / sau khi gom (trên các lớp class_ids)."""
+    rng = np.random.default_rng(seed)
+    per_class = {cid: _class_vectors(db, cid) for cid in class_ids}
+    candidates = [(cid, sid, i) for cid, vecs in per_class.items() if len(vecs) > 1
+                  for sid, v in vecs.items() if len(v) > 1 for i in range(len(v))]
+    if not candidates:
+        return {"probes": 0}
+    pick = rng.choice(len(candidates), size=min(probes, len(candidates)), replace=False)
+
+    protos = {cid: {sid: (p if (p := consolidate(v, cap, method)) is not None else v) for sid, v in vecs.items()}
+              for cid, vecs in per_class.items()}
+    hits = {"before": 0, "after": 0}
+    genuine = {"before": [], "after": []}
+    for j in pick:
+        cid, sid, i = candidates[j]
+        vecs = per_class[cid]
+        probe = vecs[sid][i:i + 1]
+        rest = np.delete(vecs[sid], i, axis=0)
+
+        before = dict(vecs)
+        before[sid] = rest
+        after = dict(protos[cid])
+        p = consolidate(rest, cap, method)
+        after[sid] = p if p is not None else rest
+
+        for label, g in (("before", before), ("after", after)):
+            pred, score = _top1(g, probe)
+            hits[label] += int(pred == sid)
+            genuine[label].append(float((g[sid] @ probe[0]).max()))
+
+    n = len(pick)
+    return {
+        "probes": n,
+        "top1_before": round(hits["before"] / n, 4),
+        "top1_after": round(hits["after"] / n, 4),
+        "genuine_score_before": round(float(np.mean(genuine["before"])), 4),
+        "genuine_score_after": round(float(np.mean(genuine["after"])), 4),
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Consolidate per-student embeddings into prototypes")
+    ap.add_argument("--cap", type=int, default=settings.enroll_max_embeddings)
+    ap.add_argument("--method", default=settings.prototype_method, choices=["kmeans", "kmedoids"])
+    ap.add_argument("--class-id", action="append", dest="class_ids")
+    ap.add_argument("--batch-students", type=int, default=200, help="số học sinh mỗi transaction")
+    ap.add_argument("--eval-probes", type=int, default=0, help="số probe đánh giá top-1 trước / sau")
+    ap.add_argument("--dry-run", action="store_true", help="chỉ báo cáo, không ghi DB")
+    args = ap.parse_args()
+    if args.cap <= 0:
+        ap.error("--cap must be > 0")
+
+    Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    try:
+        t0 = time.perf_counter()
+        before = gallery_sizes(db, args.class_ids)
+        todo = students_over_cap(db, args.cap, args.class_ids)
+        report = {"cap": args.cap, "method": args.method, "students_over_cap": len(todo)}
+        if args.eval_probes > 0:
+            report["eval"] = evaluate(db, sorted(before), args.cap, args.method, args.eval_probes)
+
+        removed = added = 0
+        if not args.dry_run:
+            for i in range(0, len(todo), args.batch_students):
+                r, a = crud.consolidate_student_embeddings(db, todo[i:i + args.batch_students],
+                                                           cap=args.cap, method=args.method)
+                removed += r
+                added += a
+        after = gallery_sizes(db, args.class_ids)
+
+        total_before = sum(before.values())
+        total_after = sum(after.values())
+        report.update({
+            "dry_run": args.dry_run,
+            "embeddings_removed": removed,
+            "prototypes_added": added,
+            "embeddings_before": total_before,
+            "embeddings_after": total_after,
+            "reduction": round(1 - total_after / total_before, 4) if total_before else 0.0,
+            "classes": {cid: {"before": n, "after": after.get(cid, 0)} for cid, n in sorted(before.items())},
+            "duration_s": round(time.perf_counter() - t0, 3),
+        })
+    finally:
+        db.close()
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
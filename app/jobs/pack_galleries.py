@@ -0,0 +1,56 @@
+"""
+Admin command: ghi (lại) packed gallery cho các lớp từ bảng student_embeddings.
+Dùng để migrate dữ liệu cũ khi bật GALLERY_STORAGE=packed, hoặc rebuild khi nghi file lỗi.
+
+    python -m app.jobs.pack_galleries               # mọi lớp
+    python -m app.jobs.pack_galleries --class-id 10A1
+"""
+import argparse
+import os
+import time
+
+from app.db.database import Base, SessionLocal, engine
+from app.db.models import PackedGallery
+from app.db import vector_store
+
+
+def prune_unreferenced_files(db) -> int:
+    """Xoá file .npy trong thư mục galleries không còn được bảng packed_galleries trỏ tới."""
+    d = vector_store.gallery_dir()
+    if not os.path.isdir(d):
+        return 0
+    keep = {r[0] for r in db.query(PackedGallery.file_name).all()}
+    removed = 0
+    with os.scandir(d) as it:
+        for entry in it:
+            if entry.is_file() and entry.name not in keep:
+                try:
+                    os.remove(entry.path)
+                    removed += 1
+                except OSError:
+                    pass
+    return removed
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Rebuild packed gallery files")
+    ap.add_argument("--class-id", action="append", dest="class_ids", help="chỉ rebuild lớp này (lặp lại được)")
+    args = ap.parse_args()
+
+    Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    try:
+        t0 = time.perf_counter()
+        packed = vector_store.pack_all(db, class_ids=args.class_ids)
+        removed = prune_unreferenced_files(db)
+        dt = time.perf_counter() - t0
+    finally:
+        db.close()
+
+    for class_id, rows in sorted(packed.items()):
+        print(f"{class_id}: {rows} vectors")
+    print(f"packed {len(packed)} classes, {sum(packed.values())} vectors in {dt:.2f}s; removed {removed} stale files")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,37 @@
+"""
+Admin command: tính lại bảng tổng hợp điểm danh theo ngày (attendance_daily_class /
+attendance_daily_student) từ attendance_sessions + attendance_results.
+Dùng 1 lần cho DB có phiên lưu trước khi có bảng tổng hợp, hoặc khi nghi tổng hợp bị lệch.
+Ngày không còn phiên (đã bị cleanup xoá) giữ nguyên tổng hợp cũ.
+
+    python -m app.jobs.rebuild_rollups               # mọi lớp
+    python -m app.jobs.rebuild_rollups --class-id 10A1
+"""
+import argparse
+import time
+
+from app.db.database import Base, SessionLocal, engine
+from app.db import crud
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Rebuild daily attendance rollups")
+    ap.add_argument("--class-id", action="append", dest="class_ids", help="chỉ tính lại lớp này (lặp lại được)")
+    args = ap.parse_args()
+
+    Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    try:
+        t0 = time.perf_counter()
+        rebuilt = crud.rebuild_attendance_rollups(db, class_ids=args.class_ids)
+        dt = time.perf_counter() - t0
+    finally:
+        db.close()
+
+    for class_id, days in sorted(rebuilt.items()):
+        print(f"{class_id}: {days} days")
+    print(f"rebuilt {len(rebuilt)} classes, {sum(rebuilt.values())} days in {dt:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+"""
+Việc định kỳ trong process API (APScheduler, chạy trên thread nền):
+  - cleanup: dọn dữ liệu quá retention_days (app/jobs/cleanup.py), mỗi ngày lúc cleanup_hour.
+
+Chạy nhiều process: app.main chỉ gọi start_scheduler() ở process leader (app/core/leader.py).
+"""
+import logging
+
+from app.settings import settings
+
+logger = logging.getLogger(__name__)
+
+_scheduler = None
+
+
+def _cleanup_job():
+    from app.jobs.cleanup import run_cleanup
+
+    try:
+        run_cleanup()
+    except Exception as e:
+        logger.exception(f"Cleanup job failed: {e}")
+
+
+def start_scheduler():
+    global _scheduler
+    if not settings.scheduler_enabled or _scheduler is not None:
+        return None
+    try:
+        from apscheduler.schedulers.background import BackgroundScheduler
+    except ImportError:
+        logger.warning("apscheduler is not installed, periodic cleanup disabled")
+        return None
+
+    sched = BackgroundScheduler(timezone="UTC")
+    # coalesce + max_instances=1: lỡ nhiều lượt (server tắt) thì chỉ chạy bù 1 lần, không chạy chồng
+    sched.add_job(
+        _cleanup_job, "cron", hour=settings.cleanup_hour, minute=settings.cleanup_minute,
+        id="cleanup", coalesce=True, max_instances=1, misfire_grace_time=3600,
+    )
+    sched.start()
+    _scheduler = sched
+    return sched
+
+
+def shutdown_scheduler():
+    global _scheduler
+    if _scheduler is not None:
+        _scheduler.shutdown(wait=False)
+        _scheduler = None
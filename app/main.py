@@ -1,18 +1,97 @@
 import os
+import asyncio
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
+from fastapi.responses import JSONResponse
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, PlainTextResponse
 from app.settings import settings
 from app.api.routes_enroll import router as enroll_router
 from app.api.routes_attendance import router as attendance_router
-from app.db.database import Base, engine
+from app.db.database import Base, engine, create_missing_indexes
 from app.api.routes_students import router as students_router
 from app.api.routes_classes import router as classes_router
+from app.core.engine_registry import engine_registry
+from app.core.inference import inference_executor
+from app.core.campus_index import campus_index
+from app.core.gallery_cache import gallery_cache
+from app.core.image_cache import image_cache
+from app.core.job_queue import job_queue
+from app.core.leader import leader
+from app.core.metrics import metrics, MetricsMiddleware
+from app.api.routes_attendance import run_attendance_job
+from app.jobs.scheduler import start_scheduler, shutdown_scheduler
 
 
 Base.metadata.create_all(bind=engine)
+create_missing_indexes()
+
+
+async def _on_leader():
+    try:
+        await job_queue.start_workers()
+        start_scheduler()
+    except Exception:
+        # leader sẽ nhả lock: dừng phần đã bật để không chạy song song với leader mới
+        shutdown_scheduler()
+        await job_queue.stop()
+        raise
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if settings.engine_preload:
+        # load + warm-up model trước khi nhận request (chạy ngoài event loop)
+        await asyncio.to_thread(engine_registry.load)
+    # mọi process nhận submit job; chạy lại job dở dang, worker job và scheduler chỉ ở process leader
+    await job_queue.start(run_attendance_job)
+    leader.start(_on_leader)
+    yield
+    await leader.stop()
+    shutdown_scheduler()
+    await job_queue.stop()
+    leader.release()
+    inference_executor.shutdown()
+    campus_index.save_if_dirty()
+
 
-app = FastAPI(title=settings.app_name)
+def _collect_runtime_metrics():
+    # số liệu đã có sẵn trong các singleton, đọc lúc scrape
+    inf = inference_executor.stats()
+    gc = gallery_cache.stats()
+    ic = image_cache.stats()
+    jq = job_queue.stats()
+    return [
+        ("inference_inflight", "gauge", "Số job detect/embed đang chạy + chờ", [({}, inf["inflight"])]),
+        ("inference_submitted_total", "counter", "Số job đã nhận", [({}, inf["submitted"])]),
+        ("inference_rejected_total", "counter", "Số job bị từ chối (hàng đợi đầy)", [({}, inf["rejected"])]),
+        ("inference_queue_wait_seconds_total", "counter", "Tổng thời gian chờ hàng đợi",
+         [({}, inf["queue_wait_ms_total"] / 1000)]),
+        ("gallery_cache_hits_total", "counter", "Gallery cache hit", [({}, gc["hits"])]),
+        ("gallery_cache_misses_total", "counter", "Gallery cache miss", [({}, gc["misses"])]),
+        ("gallery_cache_bytes", "gauge", "Dung lượng gallery đang cache", [({}, gc["bytes"])]),
+        ("gallery_cache_classes", "gauge", "Số lớp đang cache", [({}, gc["classes"])]),
+        ("gallery_cache_sync_invalidations_total", "counter", "Lớp bị bỏ cache do worker khác thay đổi",
+         [({}, gc["sync_invalidations"])]),
+        ("gallery_cache_calibration_seconds_total", "counter", "Tổng thời gian tính hiệu chỉnh điểm",
+         [({}, gc["calibration_ms_total"] / 1000)]),
+        ("image_cache_hits_total", "counter", "Image cache hit",
+         [({"layer": "memory"}, ic["hits"]), ({"layer": "disk"}, ic["disk_hits"])]),
+        ("image_cache_misses_total", "counter", "Image cache miss", [({}, ic["misses"])]),
+        ("image_cache_bytes", "gauge", "Dung lượng image cache (bộ nhớ)", [({}, ic["bytes"])]),
+        ("jobs_running", "gauge", "Job điểm danh đang chạy", [({"lane": k}, v) for k, v in jq["running"].items()]),
+        ("jobs_completed_total", "counter", "Job điểm danh đã xong", [({}, jq["completed"])]),
+        ("jobs_failed_total", "counter", "Job điểm danh lỗi", [({}, jq["failed"])]),
+        ("jobs_rejected_total", "counter", "Job điểm danh bị từ chối (429)", [({}, jq["rejected"])]),
+    ]
+
+
+metrics.register_collector(_collect_runtime_metrics)
+
+
+app = FastAPI(title=settings.app_name, lifespan=lifespan)
+app.add_middleware(MetricsMiddleware, server_timing=settings.metrics_server_timing)
 app.include_router(enroll_router)
 app.include_router(attendance_router)
 app.include_router(students_router)
@@ -30,3 +109,16 @@ if os.path.isdir(_static_dir):
 @app.get("/")
 def health():
     return {"service": settings.app_name, "status": "running"}
+
+@app.get("/ready")
+def ready():
+    # readiness tách khỏi health: chỉ sẵn sàng khi engine load được
+    # (chế độ lazy thì engine sẽ load ở request đầu tiên)
+    status = engine_registry.status()
+    ok = status["error"] is None and (status["loaded"] or not settings.engine_preload)
+    return JSONResponse(status_code=200 if ok else 503, content={"ready": ok, "engine": status})
+
+@app.get("/metrics", include_in_schema=False)
+def get_metrics():
+    # Prometheus text exposition format
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
@@ -6,6 +6,142 @@ class Settings(BaseSettings):
     storage_dir: str = "./storage"
     retention_days: int = 30
 
+    # SQLite: PRAGMA áp dụng mỗi connection mới (xem app/db/database.py)
+    sqlite_journal_mode: str = "WAL"        # "DELETE" = rollback journal như cũ
+    sqlite_synchronous: str = "NORMAL"      # NORMAL + WAL: không fsync mỗi commit, vẫn không hỏng DB khi crash
+    sqlite_busy_timeout_ms: int = 10000     # đợi write lock tối đa trước khi báo "database is locked"
+    sqlite_cache_size_kb: int = 65536       # page cache mỗi connection
+    sqlite_mmap_size_mb: int = 256          # 0 = tắt mmap
+    # connection pool (QueuePool)
+    db_pool_size: int = 5
+    db_max_overflow: int = 10
+    db_pool_timeout: float = 30.0
+    # route async dùng SQLAlchemy asyncio; "" = tự đổi driver của db_url (sqlite -> aiosqlite,
+    # postgresql -> asyncpg)
+    db_async_url: str = ""
+
+    # gallery cache (in-memory, theo class_id)
+    gallery_cache_max_classes: int = 64
+    gallery_cache_max_mb: int = 256
+    # lưu gallery: "orm" (đọc student_embeddings) | "packed" (file .npy mmap mỗi lớp)
+    gallery_storage: str = "orm"
+    packed_dtype: str = "float16"
+    # nhiều worker: chu kỳ (giây) mỗi worker đọc bảng gallery_generations để bỏ gallery cũ
+    # do worker khác enroll; 0 = đọc mỗi lần lấy gallery, < 0 = tắt (chạy 1 worker)
+    gallery_sync_interval_s: float = 1.0
+
+    # campus index (POST /attendance/identify, không theo lớp)
+    campus_index_backend: str = "ivf"      # "ivf" | "flat"
+    campus_ivf_min_vectors: int = 5000     # ít hơn thì dùng flat
+    campus_ivf_nlist: int = 0              # 0 = tự chọn ~ sqrt(N)
+    campus_ivf_nprobe: int = 16
+    campus_search_k: int = 20
+
+    # matching: gộp điểm theo student ("max" | "mean_topk") và gán 1-1 face -> student mỗi ảnh
+    match_aggregate: str = "max"
+    match_topk: int = 3
+    match_one_to_one: bool = True
+
+    # hiệu chỉnh điểm theo từng học sinh từ phân bố impostor trong lớp (app/core/calibration.py):
+    # "off" (mặc định: điểm cosine thô) | "znorm" | "offset"; bật thì score trả về / lưu là điểm
+    # đã hiệu chỉnh (có thể > 1) và threshold áp lên thang đó; độ dịch điểm tối đa quanh ngưỡng quyết định
+    calibration_mode: str = "off"
+    calibration_z: float = 3.0
+    calibration_max_shift: float = 0.08
+    calibration_min_students: int = 3
+
+    # inference executor: số thread chạy detect/embed và số job được chờ thêm
+    inference_workers: int = 2
+    inference_queue_size: int = 16
+    inference_queue_timeout: float = 30.0
+
+    # face engine: load model lúc startup (True) hay ở request đầu tiên (False)
+    engine_preload: bool = False
+    engine_warmup: bool = True
+    # số thread ONNX Runtime mỗi session (0 = mặc định của ORT = số core);
+    # chạy nhiều uvicorn worker thì nên đặt ~ số core / số worker
+    ort_intra_op_threads: int = 0
+    ort_inter_op_threads: int = 0
+    # số face tối đa mỗi lần chạy ArcFace (batch embedding)
+    embed_batch_size: int = 32
+
+    # detect trên ảnh thu nhỏ cho ảnh lớn (điện thoại 12-48MP): cạnh dài tối đa khi detect,
+    # 0 = detect trên ảnh full-res như cũ
+    detect_max_side: int = 0
+    # "reduced": decode thu nhỏ 1/2-1/8 (IMREAD_REDUCED_COLOR_*), chỉ decode full-res khi cần
+    # "resize": decode full-res rồi resize (RAM như cũ, chỉ giảm thời gian detect)
+    detect_decode: str = "reduced"
+    # face có cạnh bbox (px trên ảnh detect) nhỏ hơn ngưỡng này thì align từ ảnh full-res
+    align_full_res_below: int = 112
+
+    # enroll hàng loạt (POST /enroll/bulk, python -m app.jobs.bulk_enroll)
+    bulk_enroll_max_mb: int = 1024          # tổng dung lượng ảnh trong zip (sau giải nén)
+    bulk_enroll_batch_students: int = 200   # số học sinh mỗi transaction
+    # bỏ embedding gần trùng (cosine >= ngưỡng) với embedding khác của cùng học sinh
+    enroll_dedup_threshold: float = 0.97
+    # số embedding tối đa mỗi học sinh: vượt thì gom thành prototype (app/core/prototypes.py),
+    # 0 = không giới hạn; "kmeans" (trung bình cụm) | "kmedoids" (embedding thật ở tâm cụm)
+    enroll_max_embeddings: int = 10
+    prototype_method: str = "kmeans"
+
+    # cache detect + embedding theo hash nội dung ảnh (ảnh gửi lại), xem app/core/image_cache.py
+    image_cache_enabled: bool = True
+    image_cache_max_mb: int = 64
+    image_cache_ttl_s: float = 3600.0
+    image_cache_disk: bool = False         # thêm lớp đĩa dưới storage_dir/image_cache
+    image_cache_disk_ttl_s: float = 86400.0
+    image_cache_version: str = "1"         # đổi model / cách tiền xử lý thì tăng để bỏ cache cũ
+
+    # POST /attendance/stream: giới hạn mỗi request (tổng MB body, số ảnh)
+    stream_max_mb: int = 100
+    stream_max_images: int = 30
+
+    # POST /attendance/video (app/core/video.py)
+    video_max_mb: int = 300
+    video_max_seconds: float = 120.0       # chỉ xử lý chừng này giây đầu, 0 = cả video
+    video_sample_fps: float = 4.0          # tần số lấy mẫu khi có chuyển động / mặt mới
+    video_max_gap_s: float = 1.0           # cảnh đứng yên, đã embed đủ: giãn dần tới khoảng này
+    video_detect_max_side: int = 1280      # detect trên frame thu nhỏ, align từ frame gốc
+    video_embeds_per_track: int = 3        # số lần embed tối đa mỗi track (mỗi người)
+    video_embed_gap_s: float = 0.5         # khoảng cách tối thiểu giữa 2 lần embed của 1 track
+    video_track_iou: float = 0.3
+    video_track_max_age_s: float = 1.5     # mất quá lâu thì chỉ nối lại track bằng embedding
+    video_reid_threshold: float = 0.5      # cosine để nối 2 đoạn track của cùng 1 người
+    video_motion_threshold: float = 6.0    # chênh lệch xám trung bình (0-255) giữa 2 frame mẫu
+
+    # job điểm danh bất đồng bộ (POST /attendance/jobs)
+    jobs_workers: int = 2                  # số worker ở process leader; 0 = không chạy job (chỉ nhận submit)
+    jobs_max_queued_live: int = 20         # vượt thì trả 429
+    jobs_max_queued_bulk: int = 200
+    jobs_max_attempts: int = 3             # số lần chạy lại job bị gián đoạn (restart)
+    jobs_poll_interval: float = 2.0
+    jobs_busy_backoff_max_s: float = 60.0  # inference bận: job về hàng đợi, lùi poll_interval x2 mỗi lần, tối đa
+
+    # lưu kết quả từng phiên vào attendance_results (luôn) + attendance_faces (mỗi face: bbox, score)
+    attendance_store_faces: bool = True
+    attendance_store_face_embeddings: bool = False   # thêm embedding float32 của face (~2KB/face)
+
+    # báo cáo từ bảng tổng hợp ngày (GET /classes/{id}/attendance-summary, /students/{id}/attendance-summary):
+    # vắng thường xuyên = vắng >= tỉ lệ này số phiên (khi có ít nhất chronic_min_sessions phiên)
+    chronic_absence_rate: float = 0.1
+    chronic_min_sessions: int = 5
+
+    # metrics (GET /metrics, Prometheus text): histogram thời gian từng stage + request
+    metrics_enabled: bool = True
+    metrics_server_timing: bool = False    # thêm header Server-Timing (breakdown theo stage) mỗi response
+
+    # dọn dữ liệu quá retention_days (app/jobs/cleanup.py), chạy hằng ngày qua APScheduler
+    scheduler_enabled: bool = True
+    # nhiều worker: chỉ process giữ storage_dir/run/leader.lock chạy scheduler + worker job (app/core/leader.py),
+    # process khác thử lấy lại lock sau mỗi chừng này giây (leader thoát / chết)
+    leader_retry_s: float = 10.0
+    cleanup_hour: int = 3                  # giờ UTC
+    cleanup_minute: int = 0
+    cleanup_batch_size: int = 500          # số phiên xoá mỗi transaction
+    cleanup_batch_pause: float = 0.05      # nghỉ giữa các batch (giây) để request khác ghi được
+    cleanup_orphan_grace_minutes: int = 60 # không xoá file mồ côi mới hơn
+    cleanup_vacuum_pages: int = 2000       # PRAGMA incremental_vacuum mỗi lượt
+
     class Config:
         env_file = ".env"
 
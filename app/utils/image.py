@@ -1,7 +1,108 @@
+import struct
+
 import cv2
 import numpy as np
 
+# hệ số thu nhỏ khi decode -> flag của OpenCV (JPEG dùng DCT scaling của libjpeg,
+# không phải decode full rồi resize)
+_REDUCED_FLAGS = {2: cv2.IMREAD_REDUCED_COLOR_2, 4: cv2.IMREAD_REDUCED_COLOR_4, 8: cv2.IMREAD_REDUCED_COLOR_8}
+
+# marker SOF của JPEG (baseline/progressive/...), không gồm DHT (C4), JPG (C8), DAC (CC)
+_JPEG_SOF = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+
 def decode_upload_to_bgr(data: bytes):
     arr = np.frombuffer(data, dtype=np.uint8)
     img = cv2.imdecode(arr, cv2.IMREAD_COLOR)
     return img
+
+
+def peek_image_size(data: bytes):
+    """
+    (width, height) đọc từ header JPEG/PNG, không decode pixel. None nếu không nhận ra.
+    Lưu ý: chưa tính EXIF orientation (ảnh xoay 90 độ thì width/height đổi chỗ sau decode).
+    """
+    if data[:8] == b"\x89PNG\r\n\x1a\n" and len(data) >= 24:
+        w, h = struct.unpack(">II", data[16:24])
+        return int(w), int(h)
+    if data[:2] != b"\xff\xd8":
+        return None
+
+    i, n = 2, len(data)
+    while i + 4 <= n:
+        if data[i] != 0xFF:
+            return None
+        marker = data[i + 1]
+        if marker == 0xFF:          # byte đệm
+            i += 1
+            continue
+        if marker in (0xD8, 0x01) or 0xD0 <= marker <= 0xD7:
+            i += 2
+            continue
+        seg_len = struct.unpack(">H", data[i + 2:i + 4])[0]
+        if marker in _JPEG_SOF:
+            if i + 9 > n:
+                return None
+            h, w = struct.unpack(">HH", data[i + 5:i + 9])
+            return int(w), int(h)
+        if marker == 0xDA:          # start of scan mà chưa thấy SOF
+            return None
+        i += 2 + seg_len
+    return None
+
+
+def reduced_decode_factor(size, max_side: int) -> int:
+    """Hệ số 1/2/4/8 lớn nhất mà cạnh dài sau khi thu nhỏ vẫn >= max_side."""
+    if size is None or max_side <= 0:
+        return 1
+    long_side = max(size)
+    factor = 1
+    for f in (2, 4, 8):
+        if long_side / f >= max_side:
+            factor = f
+    return factor
+
+
+def resize_max_side(img: np.ndarray, max_side: int):
+    """Thu nhỏ (INTER_AREA) để cạnh dài <= max_side. Return (img, đã resize hay chưa)."""
+    h, w = img.shape[:2]
+    long_side = max(h, w)
+    if max_side <= 0 or long_side <= max_side:
+        return img, False
+    s = max_side / long_side
+    size = (max(1, round(w * s)), max(1, round(h * s)))
+    return cv2.resize(img, size, interpolation=cv2.INTER_AREA), True
+
+
+def decode_for_detection(data: bytes, max_side: int, mode: str = "reduced"):
+    """
+    Decode ảnh upload cho bước detect, cạnh dài khoảng <= max_side (0 = giữ nguyên).
+
+    mode="reduced": đọc kích thước từ header, decode thu nhỏ 1/2, 1/4, 1/8 bằng
+      IMREAD_REDUCED_COLOR_* (JPEG rẻ hơn nhiều so với decode full), rồi resize nốt.
+      Ảnh full-res không được decode, trả None (pipeline decode lại khi thật sự cần).
+    mode="resize": decode full-res rồi resize, trả luôn ảnh full-res.
+
+    Return (det_img | None nếu decode lỗi, full_img | None, scale) với
+    scale = cạnh dài full-res / cạnh dài det_img (toạ độ full-res = toạ độ det * scale).
+    Khi det_img là ảnh full-res thì full_img is det_img và scale = 1.
+    """
+    if max_side <= 0:
+        img = decode_upload_to_bgr(data)
+        return img, img, 1.0
+
+    arr = np.frombuffer(data, dtype=np.uint8)
+    if mode == "reduced":
+        size = peek_image_size(data)
+        factor = reduced_decode_factor(size, max_side)
+        if factor > 1:
+            img = cv2.imdecode(arr, _REDUCED_FLAGS[factor])
+            if img is not None:
+                det, _ = resize_max_side(img, max_side)
+                return det, None, max(size) / max(det.shape[:2])
+
+    full = cv2.imdecode(arr, cv2.IMREAD_COLOR)
+    if full is None:
+        return None, None, 1.0
+    det, _ = resize_max_side(full, max_side)
+    return det, full, max(full.shape[:2]) / max(det.shape[:2])
@@ -0,0 +1,136 @@
+"""
+Đọc multipart/form-data trực tiếp từ request.stream(), trả từng part ngay khi part đó
+nhận xong (không chờ cả body như UploadFile / request.form()).
+"""
+from python_multipart.multipart import MultipartParser, parse_options_header
+from starlette.requests import ClientDisconnect
+from starlette.responses import StreamingResponse
+
+
+class StreamLimitExceeded(Exception):
+    """Request vượt giới hạn byte / số ảnh."""
+
+
+class MultipartPart:
+    __slots__ = ("name", "filename", "content_type", "data")
+
+    def __init__(self, name: str, filename, content_type: str, data: bytes):
+        self.name = name
+        self.filename = filename          # None = field thường (không phải file)
+        self.content_type = content_type
+        self.data = data
+
+    @property
+    def is_file(self) -> bool:
+        return self.filename is not None
+
+    def text(self) -> str:
+        return self.data.decode("utf-8", errors="replace")
+
+
+class BodyStreamingResponse(StreamingResponse):
+    """
+    StreamingResponse cho generator vẫn đang đọc request body.
+
+    Với ASGI spec < 2.4, StreamingResponse chạy song song 1 task chờ http.disconnect,
+    task đó nhận (và bỏ) luôn các message http.request -> generator không còn đọc được body.
+    Ở đây chỉ stream response; client ngắt kết nối khi body còn đang gửi thì request.stream()
+    báo ClientDisconnect. Sau khi body đã đọc hết, generator tự gọi request.is_disconnected()
+    giữa các lần yield để dừng (send của server có thể bỏ qua im lặng khi client đã đi).
+    """
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await self.stream_response(send)
+        except OSError:
+            raise ClientDisconnect()
+        if self.background is not None:
+            await self.background()
+
+
+def multipart_boundary(content_type: str) -> bytes:
+    """Boundary từ header Content-Type, ValueError nếu không phải multipart/form-data."""
+    ctype, params = parse_options_header(content_type or "")
+    boundary = params.get(b"boundary")
+    if ctype != b"multipart/form-data" or not boundary:
+        raise ValueError("Content-Type must be multipart/form-data with a boundary")
+    return boundary
+
+
+async def iter_multipart(request, max_bytes: int, max_files: int, max_field_bytes: int = 64 * 1024):
+    """
+    Async generator MultipartPart theo đúng thứ tự trong body.
+
+    max_bytes: tổng byte body; max_files: số part file; max_field_bytes: mỗi field thường.
+    Vượt giới hạn -> StreamLimitExceeded (phần body còn lại không được đọc nữa).
+    """
+    boundary = multipart_boundary(request.headers.get("content-type", ""))
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > max_bytes:
+        raise StreamLimitExceeded(f"request body {content_length} bytes > limit {max_bytes}")
+
+    done: list[MultipartPart] = []
+    cur = {"headers": {}, "field": b"", "value": b"", "chunks": [], "size": 0, "files": 0}
+    limit_error = []
+
+    def on_part_begin():
+        cur["headers"] = {}
+        cur["chunks"] = []
+        cur["size"] = 0
+
+    def on_header_field(data, start, end):
+        cur["field"] += data[start:end]
+
+    def on_header_value(data, start, end):
+        cur["value"] += data[start:end]
+
+    def on_header_end():
+        cur["headers"][cur["field"].lower()] = cur["value"]
+        cur["field"] = b""
+        cur["value"] = b""
+
+    def on_headers_finished():
+        _, opts = parse_options_header(cur["headers"].get(b"content-disposition", b""))
+        cur["name"] = opts.get(b"name", b"").decode("utf-8", errors="replace")
+        filename = opts.get(b"filename")
+        cur["filename"] = filename.decode("utf-8", errors="replace") if filename is not None else None
+        cur["content_type"] = cur["headers"].get(b"content-type", b"").decode("latin-1")
+        if cur["filename"] is not None:
+            cur["files"] += 1
+            if cur["files"] > max_files:
+                limit_error.append(f"more than {max_files} images")
+
+    def on_part_data(data, start, end):
+        cur["size"] += end - start
+        if cur["filename"] is None and cur["size"] > max_field_bytes:
+            limit_error.append(f"form field '{cur['name']}' > {max_field_bytes} bytes")
+            return
+        cur["chunks"].append(bytes(data[start:end]))
+
+    def on_part_end():
+        done.append(MultipartPart(cur["name"], cur["filename"], cur["content_type"], b"".join(cur["chunks"])))
+        cur["chunks"] = []
+
+    parser = MultipartParser(boundary, {
+        "on_part_begin": on_part_begin,
+        "on_header_field": on_header_field,
+        "on_header_value": on_header_value,
+        "on_header_end": on_header_end,
+        "on_headers_finished": on_headers_finished,
+        "on_part_data": on_part_data,
+        "on_part_end": on_part_end,
+    })
+
+    received = 0
+    async for chunk in request.stream():
+        received += len(chunk)
+        if received > max_bytes:
+            raise StreamLimitExceeded(f"request body > limit {max_bytes} bytes")
+        parser.write(chunk)
+        if limit_error:
+            raise StreamLimitExceeded(limit_error[0])
+        while done:
+            yield done.pop(0)
+    parser.finalize()
+    while done:
+        yield done.pop(0)
@@ -0,0 +1,91 @@
+"""
+Recall / latency của IVFIndex so với FlatIndex (chính xác) trên dữ liệu giả lập
+kiểu campus: S học sinh x E embedding/học sinh, query = embedding mới của học sinh.
+
+    python -m benchmarks.bench_ann --students 20000 --per-student 5 --nprobe 8 16 32
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from app.core.ann_index import FlatIndex, IVFIndex, save_index, load_index
+from app.core.matching import normalize_rows
+
+
+def synth(students, per_student, dim, queries, noise, rng, latent=64):
+    # embedding thật nằm gần 1 đa tạp ít chiều hơn D: sinh tâm từ latent chiều rồi chiếu lên D
+    basis = rng.standard_normal((latent, dim)).astype(np.float32)
+    centers = normalize_rows(rng.standard_normal((students, latent)).astype(np.float32) @ basis)
+    owner = np.repeat(np.arange(students), per_student)
+    vecs = normalize_rows(centers[owner] + noise * rng.standard_normal((len(owner), dim)).astype(np.float32))
+    q_owner = rng.choice(students, size=queries, replace=False)
+    q = normalize_rows(centers[q_owner] + noise * rng.standard_normal((queries, dim)).astype(np.float32))
+    return vecs, owner, q, q_owner
+
+
+def timed(fn, batches):
+    t0 = time.perf_counter()
+    out = [fn(b) for b in batches]
+    dt = time.perf_counter() - t0
+    return out, dt
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--students", type=int, default=20000)
+    ap.add_argument("--per-student", type=int, default=5)
+    ap.add_argument("--dim", type=int, default=512)
+    ap.add_argument("--queries", type=int, default=500)
+    ap.add_argument("--batch", type=int, default=4, help="số face mỗi lần search (1 ảnh ở cổng)")
+    ap.add_argument("--noise", type=float, default=0.03, help="độ lệch chuẩn nhiễu mỗi chiều")
+    ap.add_argument("--latent", type=int, default=64, help="số chiều của đa tạp sinh tâm học sinh")
+    ap.add_argument("--nlist", type=int, default=0)
+    ap.add_argument("--nprobe", type=int, nargs="+", default=[4, 8, 16, 32])
+    ap.add_argument("--k", type=int, default=10)
+    args = ap.parse_args()
+
+    rng = np.random.default_rng(0)
+    vecs, owner, q, q_owner = synth(args.students, args.per_student, args.dim, args.queries, args.noise, rng, args.latent)
+    labels = np.arange(len(vecs), dtype=np.int64)
+    batches = [q[i:i + args.batch] for i in range(0, len(q), args.batch)]
+    print(f"vectors={len(vecs)} dim={args.dim} queries={len(q)} batch={args.batch}")
+
+    flat = FlatIndex(args.dim)
+    flat.add(labels, vecs)
+    res, dt = timed(lambda b: flat.search(b, k=args.k), batches)
+    exact = np.concatenate([r[1] for r in res])
+    acc = np.mean(owner[exact[:, 0]] == q_owner)
+    print(f"  flat            {dt / len(q) * 1000:7.3f} ms/face  top1-student-acc={acc:.4f}")
+
+    nlist = args.nlist or int(np.sqrt(len(vecs)))
+    ivf = IVFIndex(args.dim, nlist=nlist)
+    t0 = time.perf_counter()
+    ivf.train(vecs[rng.choice(len(vecs), size=min(len(vecs), 50 * nlist), replace=False)])
+    ivf.add(labels, vecs)
+    print(f"  ivf build       nlist={ivf.nlist} in {time.perf_counter() - t0:.2f}s")
+
+    for nprobe in args.nprobe:
+        res, dt = timed(lambda b: ivf.search(b, k=args.k, nprobe=nprobe), batches)
+        approx = np.concatenate([r[1] for r in res])
+        r1 = np.mean(approx[:, 0] == exact[:, 0])
+        rk = np.mean([len(np.intersect1d(a, e)) / args.k for a, e in zip(approx, exact)])
+        acc = np.mean(owner[approx[:, 0]] == q_owner)
+        print(f"  ivf nprobe={nprobe:<4} {dt / len(q) * 1000:7.3f} ms/face  recall@1={r1:.4f} "
+              f"recall@{args.k}={rk:.4f} top1-student-acc={acc:.4f}")
+
+    # add/remove tăng dần + lưu/đọc
+    ivf.remove(labels[:args.per_student])
+    ivf.add(labels[:args.per_student], vecs[:args.per_student])
+    with tempfile.TemporaryDirectory() as d:
+        path = os.path.join(d, "ivf.npz")
+        t0 = time.perf_counter()
+        save_index(ivf, path, count=len(vecs))
+        loaded, meta = load_index(path)
+        print(f"  save+load       {time.perf_counter() - t0:.2f}s  vectors={len(loaded)} meta={meta}")
+
+
+if __name__ == "__main__":
+    main()
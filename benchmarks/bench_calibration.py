@@ -0,0 +1,169 @@
+"""
+Hiệu chỉnh điểm theo học sinh (app/core/calibration.py): độ chính xác có mặt / vắng với ngưỡng
+chung (off) so với znorm / offset, và thời gian tính lại toàn bộ so với cập nhật sau enroll.
+
+    python -m benchmarks.bench_calibration --students 40 --sessions 200
+
+Dữ liệu tổng hợp: mỗi học sinh 1 tâm danh tính; --noisy học sinh có ảnh enroll kém (nhiễu
+lớn, điểm genuine thấp), --lookalikes cặp học sinh giống nhau (tâm gần nhau). Mỗi phiên:
+ngẫu nhiên --present-rate học sinh có mặt (1 face mỗi người) + --strangers người lạ.
+Với mỗi cách hiệu chỉnh, chọn ngưỡng thấp nhất sao cho tỉ lệ "vắng mà báo có mặt" (học sinh
+vắng bị gán face của người khác) <= --far, rồi báo recall học sinh có mặt ở ngưỡng đó.
+"""
+import argparse
+import time
+
+import numpy as np
+
+from app.settings import settings
+from app.core import calibration
+from app.core.gallery_cache import Gallery
+from app.core.matching import match_students
+
+DIM = 512
+
+
+def _unit(x):
+    return x / np.linalg.norm(x, axis=-1, keepdims=True)
+
+
+def _sample(center, noise, n, rng):
+    return _unit(center + noise * _unit(rng.standard_normal((n, DIM)))).astype(np.float32)
+
+
+def make_class(args, rng):
+    common = _unit(rng.standard_normal(DIM))
+    ident = _unit(rng.standard_normal((args.students, DIM)) + args.common * common)
+    for a in range(args.lookalikes):           # học sinh 2a+1 giống học sinh 2a
+        ident[2 * a + 1] = _unit(ident[2 * a] + args.lookalike_dist * _unit(rng.standard_normal(DIM)))
+    noisy = set(range(args.students - args.noisy, args.students))
+    enroll = [_sample(ident[s], args.noise * (args.noisy_factor if s in noisy else 1.0), args.per_student, rng)
+              for s in range(args.students)]
+    return common, ident, enroll
+
+
+def make_sessions(args, common, ident, rng):
+    sessions = []
+    for _ in range(args.sessions):
+        present = np.flatnonzero(rng.random(args.students) < args.present_rate)
+        faces = [_sample(ident[s], args.noise, 1, rng) for s in present]
+        strangers = _unit(rng.standard_normal((args.strangers, DIM)) + args.common * common)
+        faces += [_sample(c, args.noise, 1, rng) for c in strangers]
+        sessions.append((present, np.concatenate(faces) if faces else np.zeros((0, DIM), np.float32)))
+    return sessions
+
+
+def evaluate(label, g, calib, sessions, args):
+    """In recall / tỉ lệ vắng mà báo có mặt ở ngưỡng thấp nhất đạt --far, tách riêng 2 nhóm khó."""
+    scored = []
+    for present, faces in sessions:
+        idx, sc = match_students(faces, g.embs, g.seg_starts, threshold=-1.0, aggregate=settings.match_aggregate,
+                                 top_k=settings.match_topk, calibration=calib)
+        scored.append((set(present.tolist()), idx, sc))
+
+    best = None
+    for t in np.arange(0.0, 1.0, 0.005):
+        hit = miss = false_present = absent = 0
+        for present, idx, sc in scored:
+            marked = {int(i) for i, s in zip(idx, sc) if i >= 0 and s >= t}
+            hit += len(marked & present)
+            miss += len(present - marked)
+            absent += args.students - len(present)
+            false_present += len(marked - present)
+        far = false_present / max(1, absent)
+        if far <= args.far:
+            best = (hit / max(1, hit + miss), far, float(t))
+            break
+    recall, far, t = best if best is not None else (0.0, 1.0, 1.0)
+
+    S = len(g.seg_starts)
+    noisy = list(range(S - args.noisy, S))
+    look = list(range(2 * args.lookalikes))
+    # recall riêng nhóm ảnh enroll kém ở cùng ngưỡng
+    nh = nt = 0
+    for present, idx, sc in scored:
+        marked = {int(i) for i, s in zip(idx, sc) if i >= 0 and s >= t}
+        p = present & set(noisy)
+        nh += len(p & marked)
+        nt += len(p)
+    # false present riêng nhóm giống nhau
+    lf = la = 0
+    for present, idx, sc in scored:
+        marked = {int(i) for i, s in zip(idx, sc) if i >= 0 and s >= t}
+        a = set(look) - present
+        lf += len(a & marked)
+        la += len(a)
+    print(f"{label:<8} threshold={t:.3f}  recall={recall:.4f}  false_present={far:.4f}  "
+          f"recall_noisy={nh / max(1, nt):.4f}  false_present_lookalike={lf / max(1, la):.4f}")
+
+
+def bench_update(args, enroll, rng):
+    """Enroll thêm ảnh cho 1 học sinh: update() so với calibrate() toàn bộ, và sai số giữa 2 cách."""
+    kw = {"mode": settings.calibration_mode if settings.calibration_mode != "off" else "znorm",
+          "aggregate": settings.match_aggregate, "top_k": settings.match_topk, "z": settings.calibration_z,
+          "max_shift": settings.calibration_max_shift, "min_students": settings.calibration_min_students}
+
+    def gallery(per_student):
+        sids = [f"S{i:03d}" for i, v in enumerate(per_student) for _ in range(len(v))]
+        return Gallery("bench", 0, sids, sids, np.concatenate(per_student))
+
+    g0 = gallery(enroll)
+    c0 = calibration.calibrate(g0.embs, g0.seg_starts, **kw)
+    s = int(rng.integers(0, len(enroll)))
+    more = list(enroll)
+    more[s] = np.concatenate([enroll[s], _sample(enroll[s].mean(axis=0), args.noise, 3, rng)])
+    g1 = gallery(more)
+
+    full_ms, inc_ms = [], []
+    for _ in range(args.repeat):
+        t0 = time.perf_counter()
+        full = calibration.calibrate(g1.embs, g1.seg_starts, **kw)
+        full_ms.append((time.perf_counter() - t0) * 1000)
+        t0 = time.perf_counter()
+        inc = calibration.update(g0.student_keys, g0.embs, g0.seg_starts, c0,
+                                 g1.student_keys, g1.embs, g1.seg_starts, **kw)
+        inc_ms.append((time.perf_counter() - t0) * 1000)
+    err = max(float(np.abs(full.scale - inc.scale).max()), float(np.abs(full.bias - inc.bias).max()))
+    print(f"rows={len(g1.embs)}  full={np.median(full_ms):.2f} ms  update={np.median(inc_ms):.2f} ms "
+          f"(incremental={inc.incremental})  max|diff scale/bias|={err:.2e}")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--students", type=int, default=40, help="số học sinh / lớp")
+    ap.add_argument("--per-student", type=int, default=5, help="số embedding enroll mỗi học sinh")
+    ap.add_argument("--noise", type=float, default=1.7, help="nhiễu ảnh (cos genuine ~ 1 / (1 + noise^2))")
+    ap.add_argument("--noisy", type=int, default=6, help="số học sinh có ảnh enroll kém")
+    ap.add_argument("--noisy-factor", type=float, default=1.8, help="nhân nhiễu enroll của nhóm ảnh kém")
+    ap.add_argument("--lookalikes", type=int, default=4, help="số cặp học sinh giống nhau")
+    ap.add_argument("--lookalike-dist", type=float, default=1.2, help="khoảng cách tâm của cặp giống nhau")
+    ap.add_argument("--common", type=float, default=0.5, help="thành phần chung của cả lớp")
+    ap.add_argument("--sessions", type=int, default=200)
+    ap.add_argument("--present-rate", type=float, default=0.9)
+    ap.add_argument("--strangers", type=int, default=5, help="người lạ mỗi phiên")
+    ap.add_argument("--far", type=float, default=0.005, help="tỉ lệ vắng mà báo có mặt cho phép")
+    ap.add_argument("--repeat", type=int, default=5)
+    args = ap.parse_args()
+
+    rng = np.random.default_rng(0)
+    common, ident, enroll = make_class(args, rng)
+    sessions = make_sessions(args, common, ident, rng)
+    sids = [f"S{i:03d}" for i, v in enumerate(enroll) for _ in range(len(v))]
+    g = Gallery("bench", 0, sids, sids, np.concatenate(enroll))
+    print(f"students={args.students} per_student={args.per_student} noisy={args.noisy} "
+          f"lookalike_pairs={args.lookalikes} sessions={args.sessions} aggregate={settings.match_aggregate} "
+          f"far<={args.far}")
+
+    for mode in ("off", "znorm", "offset"):
+        calib = calibration.calibrate(g.embs, g.seg_starts, mode, settings.match_aggregate, settings.match_topk,
+                                      settings.calibration_z, settings.calibration_max_shift,
+                                      settings.calibration_min_students)
+        evaluate(mode, g, None if calib.identity else calib, sessions, args)
+        if not calib.identity:
+            print(f"{'':<8} {calib.stats()}")
+
+    bench_update(args, enroll, rng)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""
+Trade-off độ chính xác / độ trễ của detect trên ảnh thu nhỏ (Settings.detect_max_side).
+Cần model thật và ảnh thật có mặt người (ảnh lớp học chụp bằng điện thoại).
+
+    python -m benchmarks.bench_detect_scale photos/*.jpg --max-sides 0 2560 1920 1280 960
+
+Với mỗi max_side: thời gian decode+detect+quality+align mỗi ảnh, số ảnh phải decode lại
+full-res, và so với chạy full-res (max_side=0):
+  recall = tỉ lệ face full-res có face tương ứng (IoU >= 0.5 sau khi map bbox về full-res),
+  cos = cosine trung bình giữa embedding của 2 cách (1.0 = giống hệt).
+"""
+import argparse
+import resource
+import time
+
+import numpy as np
+
+from app.core.pipeline import process_attendance_image, embed_faces
+from app.core.uniface_engine import UniFaceEngine
+from app.utils.image import decode_for_detection
+
+MIN_CONF, MIN_FACE, MIN_BLUR = 0.4, 20, 3.0
+
+
+def _iou(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """IoU (A, B) giữa 2 tập bbox xyxy."""
+    x1 = np.maximum(a[:, None, 0], b[None, :, 0])
+    y1 = np.maximum(a[:, None, 1], b[None, :, 1])
+    x2 = np.minimum(a[:, None, 2], b[None, :, 2])
+    y2 = np.minimum(a[:, None, 3], b[None, :, 3])
+    inter = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    return inter / (area_a[:, None] + area_b[None, :] - inter + 1e-9)
+
+
+def _boxes(engine, data: bytes, max_side: int, mode: str) -> np.ndarray:
+    """bbox các face (toạ độ full-res) khi detect với max_side."""
+    img, _, scale = decode_for_detection(data, max_side, mode)
+    faces = engine.detect(img)
+    if not faces:
+        return np.zeros((0, 4), dtype=np.float32)
+    return np.stack([np.asarray(f.bbox, dtype=np.float32)[:4] for f in faces]) * scale
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("images", nargs="+")
+    ap.add_argument("--max-sides", type=int, nargs="+", default=[0, 2560, 1920, 1280, 960])
+    ap.add_argument("--mode", default="reduced", choices=["reduced", "resize"])
+    ap.add_argument("--align-full-res-below", type=int, default=112)
+    ap.add_argument("--repeat", type=int, default=3)
+    args = ap.parse_args()
+
+    engine = UniFaceEngine()
+    engine.warmup()
+    datas = [open(p, "rb").read() for p in args.images]
+
+    ref_boxes = [_boxes(engine, d, 0, args.mode) for d in datas]
+    ref_embs = []
+    for d in datas:
+        out = process_attendance_image(engine, d, MIN_CONF, MIN_FACE, MIN_BLUR)
+        ref_embs.append(embed_faces(engine, out["aligned"])[0])
+
+    print(f"images={len(datas)} mode={args.mode} faces(full-res)={sum(len(b) for b in ref_boxes)}")
+    for max_side in args.max_sides:
+        kw = dict(detect_max_side=max_side, detect_decode=args.mode,
+                  align_full_res_below=args.align_full_res_below)
+        best = float("inf")
+        for _ in range(args.repeat):
+            t0 = time.perf_counter()
+            outs = [process_attendance_image(engine, d, MIN_CONF, MIN_FACE, MIN_BLUR, **kw) for d in datas]
+            best = min(best, time.perf_counter() - t0)
+
+        found = total = 0
+        cos = []
+        for d, ref_b, ref_e, out in zip(datas, ref_boxes, ref_embs, outs):
+            b = _boxes(engine, d, max_side, args.mode)
+            total += len(ref_b)
+            if len(ref_b) and len(b):
+                found += int((_iou(ref_b, b).max(axis=1) >= 0.5).sum())
+            e = embed_faces(engine, out["aligned"])[0]
+            if len(e) and len(ref_e):
+                cos.extend((ref_e @ e.T).max(axis=1).tolist())
+
+        full_decodes = sum(o["counters"].get("images_full_res_decoded", 0) for o in outs)
+        print(f"  max_side={max_side:<5} {best * 1000 / len(datas):8.1f} ms/img  "
+              f"recall={found / max(total, 1):.3f}  cos={np.mean(cos) if cos else float('nan'):.4f}  "
+              f"full-res decodes={full_decodes}/{len(datas)}")
+
+    # peak RSS của cả process (Linux: KB), chạy riêng từng max_side để so sánh RAM
+    print(f"peak RSS: {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} MB")
+
+
+if __name__ == "__main__":
+    main()
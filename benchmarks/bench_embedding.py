@@ -0,0 +1,54 @@
+"""
+So sánh throughput ArcFace: từng face (batch 1) vs batch embedding, trên CPU.
+Cần model thật (uniface tự tải weights lần đầu).
+
+    python -m benchmarks.bench_embedding --faces 40 --batch-size 32
+"""
+import argparse
+import time
+
+import numpy as np
+
+from app.core.uniface_engine import UniFaceEngine, _ARCFACE_REF_LANDMARKS
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--faces", type=int, default=40)
+    ap.add_argument("--batch-size", type=int, default=32)
+    ap.add_argument("--repeat", type=int, default=5)
+    ap.add_argument("--threads", type=int, default=0, help="ORT intra-op threads (0 = mặc định)")
+    args = ap.parse_args()
+
+    engine = UniFaceEngine(intra_op_threads=args.threads, embed_batch_size=args.batch_size)
+    engine.warmup()
+
+    rng = np.random.default_rng(0)
+    img = rng.integers(0, 255, size=(1080, 1920, 3), dtype=np.uint8)
+    # landmarks rải khắp ảnh như 1 ảnh lớp học nhiều người
+    offsets = rng.uniform([0, 0], [1920 - 112 * 3, 1080 - 112 * 3], size=(args.faces, 2))
+    items = [(img, _ARCFACE_REF_LANDMARKS * 3.0 + off) for off in offsets]
+
+    def per_face():
+        for im, lm in items:
+            engine.embedding(im, lm)
+
+    def batched():
+        engine.embed_batch(items)
+
+    print(f"faces={args.faces} batch_size={engine.embed_batch_size}")
+    for name, fn in (("per-face (batch 1)", per_face), ("batched", batched)):
+        best = float("inf")
+        for _ in range(args.repeat):
+            t0 = time.perf_counter()
+            fn()
+            best = min(best, time.perf_counter() - t0)
+        print(f"  {name:<20} {best * 1000:9.1f} ms  {args.faces / best:8.1f} faces/s")
+
+    a = np.stack([engine.embedding(im, lm) for im, lm in items])
+    b = engine.embed_batch(items)
+    print(f"  max |per-face - batched| = {np.abs(a - b).max():.2e}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+"""
+Độ trễ event loop khi route async truy cập DB: gọi thẳng crud sync trong coroutine (cách cũ,
+mỗi query chặn loop) so với crud_async (AsyncSession + aiosqlite).
+
+    python -m benchmarks.bench_event_loop --clients 16 --seconds 10
+
+--clients coroutine gửi tải trộn: load gallery khi cache miss (đọc), lưu phiên điểm danh
+(ghi) và enroll (ghi) theo tỉ lệ --mix. Song song 1 coroutine đo lag: sleep 1 ms rồi
+đo thời gian thức dậy trễ. In ops/s và lag p50/p99/max của từng chế độ.
+"""
+import argparse
+import asyncio
+import os
+import shutil
+import tempfile
+import time
+import uuid
+
+import numpy as np
+
+_tmp = tempfile.mkdtemp(prefix="bench_loop_")
+os.environ["DB_URL"] = f"sqlite:///{_tmp}/bench.db"
+os.environ["STORAGE_DIR"] = os.path.join(_tmp, "storage")
+os.environ["GALLERY_STORAGE"] = "orm"
+
+from app.db.database import Base, SessionLocal, engine  # noqa: E402
+from app.db.async_database import AsyncSessionLocal, async_engine  # noqa: E402
+from app.db import crud, crud_async  # noqa: E402
+from app.core.gallery_cache import gallery_cache  # noqa: E402
+
+DIM = 512
+CLASSES = 8
+STUDENTS = 40
+PER_STUDENT = 5
+
+
+def populate():
+    rng = np.random.default_rng(0)
+    db = SessionLocal()
+    try:
+        for c in range(CLASSES):
+            for s in range(STUDENTS):
+                sid = f"C{c}-{s:03d}"
+                crud.enroll_student(db, f"C{c}", sid, sid, rng.standard_normal((PER_STUDENT, DIM)).astype(np.float32),
+                                    class_name=f"C{c}")
+    finally:
+        db.close()
+
+
+def _session_args(class_id):
+    sids = [f"{class_id}-{s:03d}" for s in range(STUDENTS)]
+    result = {
+        "present": [{"student_id": s, "score": 0.7} for s in sids[:30]],
+        "absent": [{"student_id": s} for s in sids[30:]],
+        "unknown_faces_count": 0,
+        "debug": {},
+    }
+    faces = [{"image_idx": 0, "bbox": [0, 0, 10, 10], "conf": 0.9, "emb": None, "student_id": s, "score": 0.7}
+             for s in sids[:30]]
+    return str(uuid.uuid4()), class_id, 1, result, 0.4, faces
+
+
+async def op_sync(kind, class_id, emb):
+    db = SessionLocal()
+    try:
+        if kind == "read":
+            gallery_cache.invalidate(class_id)
+            crud.get_gallery(db, class_id)
+        elif kind == "write":
+            sid, cid, n, result, thr, faces = _session_args(class_id)
+            crud.save_attendance_session(db, sid, cid, n, result, threshold=thr, faces=faces)
+        else:
+            crud.enroll_student(db, class_id, f"{class_id}-{STUDENTS:03d}", "new", emb, class_name=class_id)
+    finally:
+        db.close()
+
+
+async def op_async(kind, class_id, emb):
+    async with AsyncSessionLocal() as db:
+        if kind == "read":
+            gallery_cache.invalidate(class_id)
+            await crud_async.get_gallery(db, class_id)
+        elif kind == "write":
+            sid, cid, n, result, thr, faces = _session_args(class_id)
+            await crud_async.save_attendance_session(db, sid, cid, n, result, threshold=thr, faces=faces)
+        else:
+            await crud_async.enroll_student(db, class_id, f"{class_id}-{STUDENTS:03d}", "new", emb,
+                                            class_name=class_id)
+
+
+async def run(label, op, args):
+    kinds = [k for k, n in zip(("read", "write", "enroll"), args.mix) for _ in range(n)]
+    deadline = time.perf_counter() + args.seconds
+    lags = []
+    done = [0]
+
+    async def monitor():
+        while time.perf_counter() < deadline:
+            t0 = time.perf_counter()
+            await asyncio.sleep(0.001)
+            lags.append(time.perf_counter() - t0 - 0.001)
+
+    async def client(i):
+        rng = np.random.default_rng(i)
+        emb = rng.standard_normal((2, DIM)).astype(np.float32)
+        k = 0
+        while time.perf_counter() < deadline:
+            await op(kinds[(i + k) % len(kinds)], f"C{(i + k) % CLASSES}", emb)
+            done[0] += 1
+            k += 1
+            await asyncio.sleep(0)
+
+    t0 = time.perf_counter()
+    await asyncio.gather(monitor(), *(client(i) for i in range(args.clients)))
+    elapsed = time.perf_counter() - t0
+    lag = np.array(lags) * 1000
+    print(f"{label:<6} {done[0] / elapsed:8.1f} ops/s  loop lag p50={np.percentile(lag, 50):6.2f} ms  "
+          f"p99={np.percentile(lag, 99):7.2f} ms  max={lag.max():7.2f} ms")
+
+
+async def amain(args):
+    await run("sync", op_sync, args)
+    await run("async", op_async, args)
+    await async_engine.dispose()
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--clients", type=int, default=16)
+    ap.add_argument("--seconds", type=float, default=10.0)
+    ap.add_argument("--mix", type=int, nargs=3, default=[6, 3, 1], metavar=("READ", "WRITE", "ENROLL"),
+                    help="tỉ lệ đọc gallery / lưu phiên / enroll")
+    args = ap.parse_args()
+
+    Base.metadata.create_all(bind=engine)
+    populate()
+    print(f"clients={args.clients} seconds={args.seconds} mix(read/write/enroll)={args.mix} "
+          f"gallery={STUDENTS * PER_STUDENT}x{DIM}")
+    try:
+        asyncio.run(amain(args))
+    finally:
+        shutil.rmtree(_tmp, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""
+Thời gian + bộ nhớ load gallery 1 lớp: ORM (cách cũ, hydrate Student/StudentEmbedding),
+ORM theo cột (load_gallery_for_class, gallery_storage="orm") và packed mmap.
+
+    python -m benchmarks.bench_gallery_load --sizes 100 1000 10000 100000
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+_tmp = tempfile.mkdtemp(prefix="bench_gallery_")
+os.environ["DB_URL"] = f"sqlite:///{_tmp}/bench.db"
+os.environ["STORAGE_DIR"] = os.path.join(_tmp, "storage")
+os.environ["GALLERY_STORAGE"] = "orm"
+
+from app.settings import settings  # noqa: E402
+from app.db.database import Base, SessionLocal, engine  # noqa: E402
+from app.db.models import ClassRoom, Student, StudentEmbedding  # noqa: E402
+from app.db import crud, vector_store  # noqa: E402
+
+
+def legacy_load(db, class_id):
+    # load_gallery_for_class trước khi có cache/packed: hydrate ORM từng cặp + normalize từng hàng
+    q = (
+        db.query(Student, StudentEmbedding)
+        .join(StudentEmbedding, StudentEmbedding.student_id == Student.id)
+        .filter(Student.class_id == class_id)
+    ).all()
+    names, embs = [], []
+    for st, eb in q:
+        names.append(st.name)
+        vec = np.frombuffer(eb.vector, dtype=np.float32).copy()
+        norm = np.linalg.norm(vec)
+        if norm > 1e-6:
+            vec = vec / norm
+        embs.append(vec)
+    return names, np.stack(embs, axis=0)
+
+
+def packed_load(db, class_id):
+    names, sids, embs = vector_store.load_class_pack(db, class_id)
+    # float16 -> float32 contiguous như khi đưa vào Gallery
+    return names, np.ascontiguousarray(embs, dtype=np.float32)
+
+
+def populate(db, class_id, n, per_student=5, dim=512):
+    rng = np.random.default_rng(0)
+    db.add(ClassRoom(id=class_id, name=class_id))
+    students = max(1, n // per_student)
+    db.bulk_insert_mappings(Student, [
+        {"id": f"{class_id}-{i:06d}", "class_id": class_id, "name": f"Student {i}"} for i in range(students)
+    ])
+    vecs = rng.standard_normal((n, dim)).astype(np.float32)
+    db.bulk_insert_mappings(StudentEmbedding, [
+        {"student_id": f"{class_id}-{i % students:06d}", "dim": dim, "vector": vecs[i].tobytes(), "source": "bench"}
+        for i in range(n)
+    ])
+    db.commit()
+
+
+def measure(fn, repeat):
+    fn()
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best * 1000, peak / 1024 / 1024
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10000, 100000])
+    ap.add_argument("--repeat", type=int, default=3)
+    args = ap.parse_args()
+
+    Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    try:
+        print(f"packed dtype={settings.packed_dtype}")
+        print(f"{'vectors':>8}  {'legacy ORM':>22}  {'ORM columns':>22}  {'packed mmap':>22}")
+        for n in args.sizes:
+            class_id = f"C{n}"
+            populate(db, class_id, n)
+            vector_store.write_class_pack(db, class_id)
+            db.expire_all()
+            cols = []
+            for fn in (
+                lambda: legacy_load(db, class_id),
+                lambda: crud.load_gallery_for_class(db, class_id),
+                lambda: packed_load(db, class_id),
+            ):
+                ms, mb = measure(fn, args.repeat)
+                cols.append(f"{ms:9.1f} ms {mb:7.1f} MB")
+            print(f"{n:>8}  " + "  ".join(f"{c:>22}" for c in cols))
+    finally:
+        db.close()
+        shutil.rmtree(_tmp, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
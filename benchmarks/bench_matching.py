@@ -0,0 +1,67 @@
+"""
+Benchmark matching theo student: GEMM + segment reduction + gán 1-1.
+
+    python -m benchmarks.bench_matching --faces 50 --students 1000 --per-student 5
+"""
+import argparse
+import time
+
+import numpy as np
+
+from app.core.matching import (
+    student_segments, match_batch, match_students, aggregate_by_student, assign_one_to_one,
+)
+
+
+def _gallery(students: int, per_student: int, dim: int, rng):
+    embs = rng.standard_normal((students * per_student, dim)).astype(np.float32)
+    embs /= np.linalg.norm(embs, axis=1, keepdims=True)
+    sids = [f"HS{i:05d}" for i in range(students) for _ in range(per_student)]
+    order, keys, seg_starts = student_segments(sids)
+    return np.ascontiguousarray(embs[order]), keys, seg_starts
+
+
+def _timeit(fn, repeat: int):
+    fn()  # warm-up
+    samples = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - t0) * 1000)
+    samples.sort()
+    return samples[len(samples) // 2], samples[int(len(samples) * 0.95) - 1]
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--faces", type=int, default=50)
+    ap.add_argument("--students", type=int, default=1000)
+    ap.add_argument("--per-student", type=int, default=5)
+    ap.add_argument("--dim", type=int, default=512)
+    ap.add_argument("--repeat", type=int, default=200)
+    args = ap.parse_args()
+
+    rng = np.random.default_rng(0)
+    gallery, keys, seg_starts = _gallery(args.students, args.per_student, args.dim, rng)
+    # face = embedding của student ngẫu nhiên + nhiễu
+    picks = rng.choice(len(gallery), size=args.faces, replace=False)
+    faces = gallery[picks] + 0.05 * rng.standard_normal((args.faces, args.dim)).astype(np.float32)
+    sims_t = gallery @ faces.T
+    scores = aggregate_by_student(sims_t, seg_starts, mode="max")
+
+    cases = {
+        "gemm (N x F)": lambda: gallery @ faces.T,
+        "match_batch": lambda: match_batch(faces, gallery),
+        "aggregate max": lambda: aggregate_by_student(sims_t, seg_starts, mode="max"),
+        "aggregate mean_top3": lambda: aggregate_by_student(sims_t, seg_starts, mode="mean_topk", top_k=3),
+        "assign_one_to_one": lambda: assign_one_to_one(scores, 0.4),
+        "match_students (end-to-end)": lambda: match_students(faces, gallery, seg_starts, threshold=0.4),
+    }
+    print(f"faces={args.faces} students={args.students} gallery={gallery.shape}")
+    for name, fn in cases.items():
+        p50, p95 = _timeit(fn, args.repeat)
+        print(f"  {name:<30} p50={p50:8.3f} ms  p95={p95:8.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+"""
+Chi phí instrumentation (app/core/metrics.py): ns mỗi lần ghi histogram / span / counter và
+phần trăm thời gian thêm vào 1 request điểm danh khi bật metrics so với tắt.
+
+    python -m benchmarks.bench_metrics --requests 200 --images 4 --students 30
+
+Phần 1: microbenchmark observe_stage / span / count / @timed, 1 thread và --threads thread
+ghi song song (shard theo thread, không lấy lock). Phần 2: POST /attendance/ qua TestClient
+với engine giả (benchmarks.bench_video.StubEngine, --detect-ms/--embed-ms = 0 mặc định: model
+không tốn thời gian nên overhead đo được là cận trên), xen kẽ metrics bật / tắt từng request.
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+_tmp = tempfile.mkdtemp(prefix="bench_metrics_")
+os.environ["DB_URL"] = f"sqlite:///{_tmp}/bench.db"
+os.environ["STORAGE_DIR"] = os.path.join(_tmp, "storage")
+os.environ["GALLERY_STORAGE"] = "orm"
+os.environ["IMAGE_CACHE_ENABLED"] = "false"   # ảnh gửi lại nhiều lần, không được lấy từ cache
+os.environ["SCHEDULER_ENABLED"] = "false"
+
+from fastapi.testclient import TestClient  # noqa: E402
+
+from app.core.metrics import metrics, observe_stage, span, count, timed, stage_duration  # noqa: E402
+from app.db.database import SessionLocal  # noqa: E402
+from app.db import crud  # noqa: E402
+from app.deps import get_engine  # noqa: E402
+from app.main import app  # noqa: E402
+from benchmarks.bench_video import StubEngine, make_photo  # noqa: E402
+
+
+def ns_per_op(fn, n: int) -> float:
+    t0 = time.perf_counter_ns()
+    fn(n)
+    return (time.perf_counter_ns() - t0) / n
+
+
+def micro(n: int, threads: int):
+    @timed("bench_timed")
+    def work():
+        pass
+
+    def loop_observe(k):
+        for _ in range(k):
+            observe_stage("bench_observe", 1.5)
+
+    def loop_span(k):
+        for _ in range(k):
+            with span("bench_span"):
+                pass
+
+    def loop_count(k):
+        for _ in range(k):
+            count("bench_count")
+
+    def loop_timed(k):
+        for _ in range(k):
+            work()
+
+    def loop_empty(k):
+        for _ in range(k):
+            pass
+
+    base = ns_per_op(loop_empty, n)
+    print(f"{'op':<16} {'on ns/op':>9} {'off ns/op':>10} {f'{threads} threads':>11}")
+    for name, fn in [("observe_stage", loop_observe), ("span", loop_span), ("count", loop_count),
+                     ("@timed", loop_timed)]:
+        metrics.enabled = True
+        on = ns_per_op(fn, n) - base
+        metrics.enabled = False
+        off = ns_per_op(fn, n) - base
+        metrics.enabled = True
+        ths = [threading.Thread(target=fn, args=(n // threads,)) for _ in range(threads)]
+        t0 = time.perf_counter_ns()
+        for t in ths:
+            t.start()
+        for t in ths:
+            t.join()
+        par = (time.perf_counter_ns() - t0) / n
+        print(f"{name:<16} {on:9.0f} {off:10.0f} {par:11.0f}")
+
+
+def observations() -> int:
+    return sum(sum(child.snapshot()[0]) for _, child in stage_duration._items())
+
+
+def e2e(args):
+    engine = StubEngine(args.students, args.detect_ms, args.embed_ms)
+    app.dependency_overrides[get_engine] = lambda: engine
+    db = SessionLocal()
+    crud.upsert_class(db, "BENCH", "BENCH")
+    for s in range(args.students):
+        crud.upsert_student(db, f"S{s:03d}", "BENCH", f"Student {s}")
+        crud.insert_embedding(db, f"S{s:03d}", engine.basis[s], "enroll")
+    db.close()
+
+    files = [("images", (f"img{i}.jpg", make_photo(args.students, args.faces, i), "image/jpeg"))
+             for i in range(args.images)]
+    times = {True: [], False: []}
+    with TestClient(app) as client:
+        for _ in range(5):
+            client.post("/attendance/", data={"class_id": "BENCH"}, files=files)
+        obs0 = observations()
+        for i in range(2 * args.requests):
+            metrics.enabled = i % 2 == 0
+            t0 = time.perf_counter()
+            r = client.post("/attendance/", data={"class_id": "BENCH"}, files=files)
+            times[metrics.enabled].append((time.perf_counter() - t0) * 1000)
+            assert r.status_code == 200, r.text
+        metrics.enabled = True
+        per_req = (observations() - obs0) / args.requests
+
+    on, off = np.array(times[True]), np.array(times[False])
+    print(f"\nPOST /attendance/: {args.images} images x {args.faces} faces, {args.requests} requests each")
+    print(f"{'metrics':<8} {'mean ms':>8} {'p50 ms':>8} {'p95 ms':>8}")
+    for label, t in (("on", on), ("off", off)):
+        print(f"{label:<8} {t.mean():8.2f} {np.percentile(t, 50):8.2f} {np.percentile(t, 95):8.2f}")
+    print(f"histogram observations / request: {per_req:.1f}")
+    print(f"overhead: {(np.median(on) / np.median(off) - 1) * 100:+.2f}% (p50)")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--ops", type=int, default=200_000)
+    ap.add_argument("--threads", type=int, default=4)
+    ap.add_argument("--requests", type=int, default=200)
+    ap.add_argument("--images", type=int, default=4)
+    ap.add_argument("--faces", type=int, default=6, help="số face mỗi ảnh")
+    ap.add_argument("--students", type=int, default=30)
+    ap.add_argument("--detect-ms", type=float, default=0.0)
+    ap.add_argument("--embed-ms", type=float, default=0.0)
+    args = ap.parse_args()
+    try:
+        micro(args.ops, args.threads)
+        e2e(args)
+    finally:
+        shutil.rmtree(_tmp, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
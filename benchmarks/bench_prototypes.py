@@ -0,0 +1,84 @@
+"""
+Gom embedding enroll thành prototype: kích thước gallery, độ chính xác top-1 và thời gian
+match của gallery thô (mọi embedding) so với kmeans / kmedoids ở nhiều cap.
+
+    python -m benchmarks.bench_prototypes --students 40 --per-student 30 --caps 3 5 10
+
+Dữ liệu tổng hợp: mỗi học sinh có --looks "kiểu" (góc mặt, ánh sáng...) quanh 1 tâm danh
+tính, mỗi embedding enroll = 1 kiểu + nhiễu. Probe sinh riêng (không nằm trong gallery),
+match theo lớp bằng match_students(one_to_one=False) như đường điểm danh.
+"""
+import argparse
+import time
+
+import numpy as np
+
+from app.settings import settings
+from app.core.gallery_cache import Gallery
+from app.core.matching import match_students
+from app.core.prototypes import consolidate
+
+DIM = 512
+
+
+def _unit(x):
+    return x / np.linalg.norm(x, axis=-1, keepdims=True)
+
+
+def make_data(args, rng):
+    ident = _unit(rng.standard_normal((args.students, DIM)))
+    looks = _unit(ident[:, None, :] + args.look_spread * _unit(rng.standard_normal((args.students, args.looks, DIM))))
+
+    def sample(n):
+        which = rng.integers(0, args.looks, size=(args.students, n))
+        x = looks[np.arange(args.students)[:, None], which] + args.noise * _unit(
+            rng.standard_normal((args.students, n, DIM)))
+        return _unit(x).astype(np.float32)
+
+    return sample(args.per_student), sample(args.probes)
+
+
+def evaluate(label, per_student, probes, args):
+    sids = [f"S{i:03d}" for i, v in enumerate(per_student) for _ in range(len(v))]
+    g = Gallery("bench", 0, sids, sids, np.concatenate(per_student))
+    q = probes.reshape(-1, DIM)
+    truth = np.repeat(np.arange(len(per_student)), probes.shape[1])
+
+    t0 = time.perf_counter()
+    for _ in range(args.repeat):
+        idx, _ = match_students(q, g.embs, g.seg_starts, threshold=-1.0, aggregate=settings.match_aggregate,
+                                top_k=settings.match_topk, one_to_one=False)
+    match_ms = (time.perf_counter() - t0) / args.repeat * 1000
+    pred = np.array([int(g.student_keys[i][1:]) for i in idx])
+    acc = float(np.mean(pred == truth))
+    print(f"{label:<16} rows={len(g.embs):6d}  top1={acc:.4f}  match={match_ms:7.2f} ms / {len(q)} probes")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--students", type=int, default=40, help="số học sinh / lớp")
+    ap.add_argument("--per-student", type=int, default=30, help="số embedding enroll mỗi học sinh")
+    ap.add_argument("--probes", type=int, default=10, help="số probe mỗi học sinh")
+    ap.add_argument("--looks", type=int, default=4, help="số kiểu (góc / ánh sáng) mỗi học sinh")
+    ap.add_argument("--look-spread", type=float, default=0.9)
+    ap.add_argument("--noise", type=float, default=3.0)
+    ap.add_argument("--caps", type=int, nargs="+", default=[3, 5, 10])
+    ap.add_argument("--repeat", type=int, default=20)
+    args = ap.parse_args()
+
+    rng = np.random.default_rng(0)
+    enroll, probes = make_data(args, rng)
+    print(f"students={args.students} per_student={args.per_student} looks={args.looks} "
+          f"probes={args.students * args.probes} aggregate={settings.match_aggregate}")
+    evaluate("raw", list(enroll), probes, args)
+    for method in ("kmeans", "kmedoids"):
+        for cap in args.caps:
+            t0 = time.perf_counter()
+            protos = [p if (p := consolidate(v, cap, method)) is not None else v for v in enroll]
+            build_ms = (time.perf_counter() - t0) / args.students * 1000
+            evaluate(f"{method} cap={cap}", protos, probes, args)
+            print(f"{'':<16} consolidate={build_ms:.2f} ms / student")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+Benchmark quality gate: quality_gate từng face vs quality_gate_batch cho cả ảnh.
+
+    python -m benchmarks.bench_quality --width 3840 --height 2160 --faces 60
+    python -m benchmarks.bench_quality --dense      # face chồng lấn -> nhánh integral image
+"""
+import argparse
+import time
+
+import cv2
+import numpy as np
+
+from app.core.quality import quality_gate, quality_gate_batch
+
+
+class _Face:
+    def __init__(self, bbox, confidence):
+        self.bbox = np.asarray(bbox, dtype=np.float32)
+        self.confidence = confidence
+        self.landmarks = None
+
+
+def _faces(n: int, W: int, H: int, dense: bool, rng):
+    faces = []
+    for _ in range(n):
+        if dense:
+            # nhiều box lồng nhau quanh 1 vùng (vd detector trả box trùng ở ảnh đông người)
+            x, y = rng.uniform(0.4 * W, 0.45 * W), rng.uniform(0.4 * H, 0.45 * H)
+            s = rng.uniform(0.08, 0.12) * min(W, H)
+        else:
+            x, y = rng.uniform(-20, W - 40), rng.uniform(-20, H - 40)
+            s = rng.uniform(8, 160)
+        faces.append(_Face([x, y, x + s, y + s * 1.2], float(rng.uniform(0.2, 1.0))))
+    return faces
+
+
+def _timeit(fn, repeat: int):
+    fn()  # warm-up
+    samples = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - t0) * 1000)
+    samples.sort()
+    return samples[len(samples) // 2], samples[int(len(samples) * 0.95) - 1]
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--width", type=int, default=3840)
+    ap.add_argument("--height", type=int, default=2160)
+    ap.add_argument("--faces", type=int, default=60)
+    ap.add_argument("--dense", action="store_true")
+    ap.add_argument("--min-blur", type=float, default=30.0)
+    ap.add_argument("--repeat", type=int, default=30)
+    args = ap.parse_args()
+
+    rng = np.random.default_rng(0)
+    img = (rng.random((args.height, args.width, 3)) * 255).astype(np.uint8)
+    img = cv2.GaussianBlur(img, (0, 0), 1.5)
+    faces = _faces(args.faces, args.width, args.height, args.dense, rng)
+
+    batch = quality_gate_batch(img, faces, min_blur=args.min_blur)
+    same = sum(
+        1 for f, row in zip(faces, batch)
+        if quality_gate(img, f, min_blur=args.min_blur)[1]["reason"] == str(row["reason"])
+    )
+
+    cases = {
+        "quality_gate (per face)": lambda: [quality_gate(img, f, min_blur=args.min_blur) for f in faces],
+        "quality_gate_batch": lambda: quality_gate_batch(img, faces, min_blur=args.min_blur),
+    }
+    print(f"image={args.width}x{args.height} faces={args.faces} dense={args.dense} "
+          f"reason agreement={same}/{len(faces)}")
+    for name, fn in cases.items():
+        p50, p95 = _timeit(fn, args.repeat)
+        print(f"  {name:<26} p50={p50:8.3f} ms  p95={p95:8.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+"""
+Ghi SQLite đồng thời: cấu hình cũ (rollback journal, synchronous=FULL, enroll commit từng
+embedding) so với cấu hình mới (WAL, synchronous=NORMAL, busy_timeout, enroll 1 commit).
+
+    python -m benchmarks.bench_sqlite_writes --threads 8 --ops 40 --readers 2
+    python -m benchmarks.bench_sqlite_writes --dir /data/bench   # đo trên đĩa thật (fsync)
+
+Mỗi thread ghi xen kẽ enroll (1 học sinh, --images embedding) và lưu phiên điểm danh
+(attendance_results + attendance_faces), các thread reader load gallery liên tục.
+In số request ghi / giây, số dòng / giây, p50/p95 và số lỗi "database is locked".
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+
+import numpy as np
+
+_tmp = tempfile.mkdtemp(prefix="bench_sqlite_")
+os.environ.setdefault("STORAGE_DIR", os.path.join(_tmp, "storage"))
+os.environ["GALLERY_STORAGE"] = "orm"
+
+from sqlalchemy.exc import OperationalError  # noqa: E402
+from sqlalchemy.orm import sessionmaker  # noqa: E402
+
+from app.settings import settings  # noqa: E402
+from app.db.database import Base, create_db_engine, sqlite_pragmas  # noqa: E402
+from app.db import crud  # noqa: E402
+
+DIM = 512
+CLASS_SIZE = 40
+
+# trước khi có cấu hình SQLite: chỉ auto_vacuum, còn lại mặc định (journal DELETE, synchronous FULL)
+LEGACY_PRAGMAS = {"auto_vacuum": "INCREMENTAL"}
+
+
+def enroll_legacy(db, class_id, student_id, embs):
+    # đường enroll cũ: mỗi hàm crud 1 commit, mỗi embedding 1 commit + refresh
+    crud.upsert_class(db, class_id=class_id, name=class_id)
+    crud.upsert_student(db, student_id=student_id, class_id=class_id, name=student_id)
+    for emb in embs:
+        crud.insert_embedding(db, student_id=student_id, emb=emb, source="enroll")
+
+
+def enroll_bulk(db, class_id, student_id, embs):
+    crud.enroll_student(db, class_id=class_id, student_id=student_id, name=student_id,
+                        embs=embs, class_name=class_id)
+
+
+def save_session(db, class_id, faces_per_image=CLASS_SIZE // 2, images=3):
+    sids = [f"{class_id}-{i:03d}" for i in range(CLASS_SIZE)]
+    present = sids[:faces_per_image]
+    result = {
+        "present": [{"student_id": s, "score": 0.7} for s in present],
+        "absent": [{"student_id": s} for s in sids[faces_per_image:]],
+        "unknown_faces_count": 0,
+        "debug": {"images_received": images},
+    }
+    faces = [
+        {"image_idx": i, "bbox": [0, 0, 10, 10], "conf": 0.9, "emb": None, "student_id": s, "score": 0.7}
+        for i in range(images) for s in present
+    ]
+    crud.save_attendance_session(db, str(uuid.uuid4()), class_id, images, result, threshold=0.4, faces=faces)
+    return len(result["present"]) + len(result["absent"]) + len(faces) + images + 1
+
+
+def run(label, pragmas, enroll_fn, args):
+    path = os.path.join(args.dir, f"{label}.db")
+    for suffix in ("", "-wal", "-shm", "-journal"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    eng = create_db_engine(f"sqlite:///{path}", pragmas=pragmas,
+                           pool_size=args.threads + args.readers, max_overflow=0)
+    Session = sessionmaker(autocommit=False, autoflush=False, bind=eng)
+    Base.metadata.create_all(bind=eng)
+
+    # mỗi writer 1 lớp riêng (CLASS_SIZE học sinh, 1 embedding) để có gallery cho reader
+    rng = np.random.default_rng(0)
+    db = Session()
+    for t in range(args.threads):
+        class_id = f"C{t}"
+        for i in range(CLASS_SIZE):
+            crud.enroll_student(db, class_id, f"{class_id}-{i:03d}", f"{class_id}-{i:03d}",
+                                rng.standard_normal((1, DIM)).astype(np.float32), class_name=class_id)
+    db.close()
+
+    latencies, errors, rows = [], [0], [0]
+    lock = threading.Lock()
+    stop = threading.Event()
+
+    def writer(t):
+        local_rng = np.random.default_rng(t)
+        class_id = f"C{t}"
+        db = Session()
+        try:
+            for k in range(args.ops):
+                t0 = time.perf_counter()
+                try:
+                    if k % 2 == 0:
+                        embs = local_rng.standard_normal((args.images, DIM)).astype(np.float32)
+                        enroll_fn(db, class_id, f"{class_id}-{k:03d}", embs)
+                        n = args.images + 2
+                    else:
+                        n = save_session(db, class_id)
+                except OperationalError:
+                    db.rollback()
+                    with lock:
+                        errors[0] += 1
+                    continue
+                with lock:
+                    latencies.append(time.perf_counter() - t0)
+                    rows[0] += n
+        finally:
+            db.close()
+
+    def reader(t):
+        db = Session()
+        try:
+            while not stop.is_set():
+                try:
+                    crud._load_gallery_arrays(db, f"C{t % args.threads}")
+                    db.rollback()
+                except OperationalError:
+                    db.rollback()
+        finally:
+            db.close()
+
+    readers = [threading.Thread(target=reader, args=(i,)) for i in range(args.readers)]
+    writers = [threading.Thread(target=writer, args=(i,)) for i in range(args.threads)]
+    for th in readers:
+        th.start()
+    t0 = time.perf_counter()
+    for th in writers:
+        th.start()
+    for th in writers:
+        th.join()
+    elapsed = time.perf_counter() - t0
+    stop.set()
+    for th in readers:
+        th.join()
+    eng.dispose()
+
+    lat = np.array(latencies) * 1000 if latencies else np.zeros(1)
+    print(f"{label:<8} {len(latencies) / elapsed:9.1f} req/s {rows[0] / elapsed:10.0f} rows/s  "
+          f"p50={np.percentile(lat, 50):7.1f} ms  p95={np.percentile(lat, 95):7.1f} ms  "
+          f"locked={errors[0]}/{args.threads * args.ops}")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--threads", type=int, default=8, help="số thread ghi")
+    ap.add_argument("--readers", type=int, default=2, help="số thread đọc gallery")
+    ap.add_argument("--ops", type=int, default=40, help="số request ghi mỗi thread")
+    ap.add_argument("--images", type=int, default=10, help="số embedding mỗi lần enroll")
+    ap.add_argument("--dir", default=_tmp, help="thư mục chứa file DB (nên là đĩa thật)")
+    args = ap.parse_args()
+
+    tuned = sqlite_pragmas()
+    print(f"threads={args.threads} readers={args.readers} ops={args.ops} images/enroll={args.images} dir={args.dir}")
+    print(f"tuned: journal_mode={settings.sqlite_journal_mode} synchronous={settings.sqlite_synchronous} "
+          f"busy_timeout={settings.sqlite_busy_timeout_ms}ms")
+    try:
+        run("before", LEGACY_PRAGMAS, enroll_legacy, args)
+        run("after", tuned, enroll_bulk, args)
+    finally:
+        shutil.rmtree(_tmp, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
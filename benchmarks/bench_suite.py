@@ -0,0 +1,323 @@
+"""
+Bộ benchmark CPU lặp lại được cho đường nóng điểm danh (detect -> quality -> embed -> match),
+ghi kết quả ra JSON để so sánh giữa các lần chạy / commit.
+
+    python -m benchmarks.bench_suite --out base.json
+    python -m benchmarks.bench_suite --out new.json --compare base.json
+    python -m benchmarks.bench_suite --only e2e --concurrency 1 4 16 --requests 200
+    python -m benchmarks.bench_suite --engine real --photos ./anh_lop --out real.json   # cần uniface + model
+
+Các phần (--only để chạy 1 phần):
+  best_match    best_match (1 face) và match_students (cả ảnh) theo kích thước gallery
+  load_gallery  crud.load_gallery_for_class (không qua gallery cache) theo số học sinh, orm + packed
+  quality       quality_gate (từng face) và quality_gate_batch theo số face / ảnh
+  e2e           POST /attendance/ (ASGI, không qua mạng) ở nhiều mức đồng thời: req/s, p50/p95/p99
+
+--engine stub (mặc định): engine giả tất định của benchmarks.bench_video (detect ô màu bằng
+OpenCV, embedding theo hue), --detect-ms / --embed-ms mô phỏng chi phí model; không cần tải model.
+--engine real: RetinaFace/ArcFace qua engine_registry, ảnh lấy từ --photos, gallery ngẫu nhiên
+(đo thời gian, không đo độ chính xác).
+
+Mỗi dòng kết quả: {section, name, params, n, mean_ms, p50_ms, p95_ms, p99_ms, ...}; --compare
+in tỉ lệ p50 mới / cũ cho các dòng có cùng (section, name, params).
+"""
+import argparse
+import asyncio
+import glob
+import json
+import os
+import platform
+import shutil
+import subprocess
+import tempfile
+import time
+from datetime import datetime, timezone
+
+import cv2
+import numpy as np
+
+_tmp = tempfile.mkdtemp(prefix="bench_suite_")
+os.environ["DB_URL"] = f"sqlite:///{_tmp}/bench.db"
+os.environ["STORAGE_DIR"] = os.path.join(_tmp, "storage")
+os.environ["GALLERY_STORAGE"] = "orm"
+os.environ["IMAGE_CACHE_ENABLED"] = "false"   # cùng ảnh gửi nhiều lần, phải chạy inference thật
+os.environ["SCHEDULER_ENABLED"] = "false"
+os.environ["JOBS_WORKERS"] = "0"
+
+import httpx  # noqa: E402
+
+from app.settings import settings  # noqa: E402
+from app.core.matching import best_match, match_students, student_segments  # noqa: E402
+from app.core.quality import quality_gate, quality_gate_batch  # noqa: E402
+from app.core.gallery_cache import gallery_cache  # noqa: E402
+from app.db.database import Base, SessionLocal, engine as db_engine  # noqa: E402
+from app.db import crud  # noqa: E402
+from benchmarks.bench_video import StubEngine, make_photo, _Face  # noqa: E402
+
+SEED = 0
+REAL_DIM = 512
+
+
+def summarize(samples_ms) -> dict:
+    a = np.asarray(samples_ms, dtype=np.float64)
+    return {
+        "n": int(a.size),
+        "mean_ms": round(float(a.mean()), 4),
+        "p50_ms": round(float(np.percentile(a, 50)), 4),
+        "p95_ms": round(float(np.percentile(a, 95)), 4),
+        "p99_ms": round(float(np.percentile(a, 99)), 4),
+    }
+
+
+def timeit(fn, repeat: int, warmup: int = 2) -> dict:
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - t0) * 1000)
+    return summarize(samples)
+
+
+def row(section: str, name: str, params: dict, stats: dict, **extra) -> dict:
+    r = {"section": section, "name": name, "params": params, **stats, **extra}
+    print(f"  {name:<20} {json.dumps(params):<44} p50={r['p50_ms']:9.3f} ms  p95={r['p95_ms']:9.3f}  "
+          f"p99={r['p99_ms']:9.3f}" + "".join(f"  {k}={v}" for k, v in extra.items()))
+    return r
+
+
+def random_gallery(students: int, per_student: int, dim: int, rng):
+    embs = rng.standard_normal((students * per_student, dim)).astype(np.float32)
+    embs /= np.linalg.norm(embs, axis=1, keepdims=True)
+    sids = [f"HS{i:05d}" for i in range(students) for _ in range(per_student)]
+    return embs, sids
+
+
+# ---- các phần ----
+
+def bench_best_match(args) -> list:
+    print("best_match / match_students")
+    rng = np.random.default_rng(SEED)
+    out = []
+    for students in args.gallery_sizes:
+        embs, sids = random_gallery(students, args.per_student, REAL_DIM, rng)
+        order, keys, seg_starts = student_segments(sids)
+        gallery = np.ascontiguousarray(embs[order])
+        names = [sids[i] for i in order]
+        probe = gallery[rng.integers(len(gallery))] + 0.3 * rng.standard_normal(REAL_DIM).astype(np.float32) / np.sqrt(REAL_DIM)
+        faces = gallery[rng.choice(len(gallery), size=min(args.faces, len(gallery)), replace=False)]
+        params = {"students": students, "per_student": args.per_student, "dim": REAL_DIM}
+        out.append(row("best_match", "best_match", params,
+                       timeit(lambda: best_match(probe, names, gallery, 0.5), args.repeat)))
+        out.append(row("best_match", "match_students", dict(params, faces=len(faces)), timeit(
+            lambda: match_students(faces, gallery, seg_starts, threshold=0.5, aggregate=settings.match_aggregate,
+                                   top_k=settings.match_topk, one_to_one=settings.match_one_to_one), args.repeat)))
+    return out
+
+
+def _seed_class(db, class_id: str, students: int, per_student: int, dim: int, rng):
+    embs, sids = random_gallery(students, per_student, dim, rng)
+    batch = []
+    for s in range(students):
+        batch.append({"class_id": class_id, "student_id": f"{class_id}-{s:05d}", "name": f"Student {s}",
+                      "embs": embs[s * per_student:(s + 1) * per_student]})
+    for i in range(0, len(batch), settings.bulk_enroll_batch_students):
+        crud.bulk_enroll_students(db, batch[i:i + settings.bulk_enroll_batch_students])
+
+
+def bench_load_gallery(args) -> list:
+    print("load_gallery_for_class")
+    rng = np.random.default_rng(SEED + 1)
+    db = SessionLocal()
+    out = []
+    try:
+        for students in args.db_sizes:
+            class_id = f"LG{students}"
+            _seed_class(db, class_id, students, args.per_student, REAL_DIM, rng)
+            for storage in ("orm", "packed"):
+                settings.gallery_storage = storage
+                crud.pack_class_gallery(db, class_id)
+                stats = timeit(lambda: crud.load_gallery_for_class(db, class_id), args.repeat)
+                out.append(row("load_gallery", "load_gallery_for_class",
+                               {"students": students, "per_student": args.per_student, "storage": storage}, stats))
+    finally:
+        settings.gallery_storage = "orm"
+        db.close()
+    return out
+
+
+def bench_quality(args) -> list:
+    print("quality_gate")
+    rng = np.random.default_rng(SEED + 2)
+    img = cv2.GaussianBlur(rng.integers(0, 255, size=(1080, 1920, 3), dtype=np.uint8), (0, 0), 1.5)
+    out = []
+    for n in args.face_counts:
+        sizes = rng.integers(16, 160, size=n)
+        faces = [_Face(int(rng.integers(0, 1920 - s)), int(rng.integers(0, 1080 - s)), int(s), int(s)) for s in sizes]
+        for f, c in zip(faces, rng.uniform(0.3, 1.0, size=n)):
+            f.confidence = float(c)
+        params = {"faces": n, "image": "1920x1080"}
+        out.append(row("quality", "quality_gate", params,
+                       timeit(lambda: [quality_gate(img, f) for f in faces], args.repeat)))
+        out.append(row("quality", "quality_gate_batch", params,
+                       timeit(lambda: quality_gate_batch(img, faces), args.repeat)))
+    return out
+
+
+def _e2e_setup(args):
+    """Engine + gallery lớp + danh sách ảnh cho POST /attendance/."""
+    db = SessionLocal()
+    try:
+        if args.engine == "real":
+            from app.core.engine_registry import engine_registry
+            engine = engine_registry.get()
+            paths = sorted(p for ext in ("jpg", "jpeg", "png") for p in glob.glob(os.path.join(args.photos, f"*.{ext}")))
+            if not paths:
+                raise SystemExit(f"--engine real cần ảnh trong --photos (không thấy ảnh ở {args.photos!r})")
+            photos = [open(p, "rb").read() for p in paths[:args.images]]
+            _seed_class(db, "E2E", args.students, args.per_student, REAL_DIM, np.random.default_rng(SEED + 3))
+        else:
+            engine = StubEngine(args.students, args.detect_ms, args.embed_ms, seed=SEED)
+            photos = [make_photo(args.students, args.faces, SEED + i) for i in range(args.images)]
+            crud.bulk_enroll_students(db, [{"class_id": "E2E", "student_id": f"S{s:03d}", "name": f"Student {s}",
+                                            "embs": engine.basis[s:s + 1]} for s in range(args.students)])
+    finally:
+        db.close()
+    return engine, photos
+
+
+async def _e2e_run(app, files, concurrency: int, requests: int):
+    latencies = []
+    errors = 0
+    sem = asyncio.Semaphore(concurrency)
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=300) as client:
+        async def one():
+            nonlocal errors
+            async with sem:
+                t0 = time.perf_counter()
+                r = await client.post("/attendance/", data={"class_id": "E2E"}, files=files)
+                latencies.append((time.perf_counter() - t0) * 1000)
+                errors += r.status_code != 200
+
+        for _ in range(min(concurrency, 4)):   # warm-up: gallery cache, pool, JIT của BLAS
+            await one()
+        latencies.clear()
+        t0 = time.perf_counter()
+        await asyncio.gather(*(one() for _ in range(requests)))
+        elapsed = time.perf_counter() - t0
+    return latencies, errors, elapsed
+
+
+def bench_e2e(args) -> list:
+    print(f"POST /attendance/ ({args.engine} engine)")
+    from app.main import app
+    from app.deps import get_engine
+
+    engine, photos = _e2e_setup(args)
+    app.dependency_overrides[get_engine] = lambda: engine
+    files = [("images", (f"img{i}.jpg", data, "image/jpeg")) for i, data in enumerate(photos)]
+    out = []
+
+    async def run_all():
+        async with app.router.lifespan_context(app):
+            for c in args.concurrency:
+                gallery_cache.clear()
+                latencies, errors, elapsed = await _e2e_run(app, files, c, args.requests)
+                params = {"concurrency": c, "images": len(photos), "faces_per_image": args.faces,
+                          "students": args.students, "engine": args.engine}
+                out.append(row("e2e", "attendance", params, summarize(latencies),
+                               req_per_s=round(len(latencies) / elapsed, 2), errors=errors))
+
+    try:
+        asyncio.run(run_all())
+    finally:
+        app.dependency_overrides.pop(get_engine, None)
+    return out
+
+
+SECTIONS = {
+    "best_match": bench_best_match,
+    "load_gallery": bench_load_gallery,
+    "quality": bench_quality,
+    "e2e": bench_e2e,
+}
+
+
+def environment(args) -> dict:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, timeout=10,
+                                cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "git_commit": commit,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "opencv": cv2.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "args": vars(args),
+        "settings": {k: getattr(settings, k) for k in (
+            "inference_workers", "inference_queue_size", "detect_max_side", "detect_decode",
+            "embed_batch_size", "match_aggregate", "match_topk", "match_one_to_one", "packed_dtype",
+        )},
+    }
+
+
+def compare(results: list, base_path: str):
+    with open(base_path, encoding="utf-8") as fh:
+        base = json.load(fh)
+    key = lambda r: (r["section"], r["name"], json.dumps(r["params"], sort_keys=True))  # noqa: E731
+    old = {key(r): r for r in base["results"]}
+    print(f"\ncompare with {base_path} (commit {base['environment'].get('git_commit')}): p50 new / old")
+    for r in results:
+        o = old.get(key(r))
+        if o is None or not o["p50_ms"]:
+            continue
+        ratio = r["p50_ms"] / o["p50_ms"]
+        flag = "  <-- slower" if ratio > 1.1 else ("  faster" if ratio < 0.9 else "")
+        print(f"  {r['name']:<20} {json.dumps(r['params']):<44} {o['p50_ms']:9.3f} -> {r['p50_ms']:9.3f} ms  "
+              f"x{ratio:.2f}{flag}")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--only", nargs="+", choices=list(SECTIONS), help="chỉ chạy các phần này")
+    ap.add_argument("--out", default="bench_results.json")
+    ap.add_argument("--compare", help="file JSON của lần chạy trước")
+    ap.add_argument("--repeat", type=int, default=50, help="số lần đo mỗi micro benchmark")
+    ap.add_argument("--gallery-sizes", type=int, nargs="+", default=[40, 500, 5000])
+    ap.add_argument("--db-sizes", type=int, nargs="+", default=[40, 200, 1000])
+    ap.add_argument("--per-student", type=int, default=5)
+    ap.add_argument("--face-counts", type=int, nargs="+", default=[1, 10, 50, 200])
+    ap.add_argument("--engine", choices=["stub", "real"], default="stub")
+    ap.add_argument("--photos", help="thư mục ảnh cho --engine real")
+    ap.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16])
+    ap.add_argument("--requests", type=int, default=100, help="số request mỗi mức đồng thời")
+    ap.add_argument("--images", type=int, default=4, help="số ảnh mỗi request")
+    ap.add_argument("--faces", type=int, default=8, help="số face mỗi ảnh (stub)")
+    ap.add_argument("--students", type=int, default=40, help="sĩ số lớp e2e")
+    ap.add_argument("--detect-ms", type=float, default=25.0, help="chi phí detect giả lập mỗi ảnh (stub)")
+    ap.add_argument("--embed-ms", type=float, default=4.0, help="chi phí embed giả lập mỗi face (stub)")
+    args = ap.parse_args()
+
+    Base.metadata.create_all(bind=db_engine)
+    try:
+        results = []
+        for name in args.only or list(SECTIONS):
+            results.extend(SECTIONS[name](args))
+        report = {"environment": environment(args), "results": results}
+        with open(args.out, "w", encoding="utf-8") as fh:
+            json.dump(report, fh, ensure_ascii=False, indent=2)
+        print(f"\nwrote {len(results)} results to {args.out}")
+        if args.compare:
+            compare(results, args.compare)
+    finally:
+        shutil.rmtree(_tmp, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+"""
+Điểm danh từ video: tốc độ (frame / giây, so với thời gian thực) và số lần embed của
+process_video (lấy mẫu thích ứng + track) so với lấy mẫu cố định embed mọi face mỗi frame.
+
+    python -m benchmarks.bench_video --seconds 30 --students 30
+    python -m benchmarks.bench_video --video lop10a1.mp4 --real     # video thật + RetinaFace/ArcFace
+
+Mặc định sinh video tổng hợp 1080p: đứng yên vài giây, lia ngang qua "lớp học" rồi đứng yên.
+Mỗi học sinh là 1 ô màu riêng (hue) có texture; engine giả detect các ô màu bằng OpenCV,
+embedding = vector của hue + nhiễu, cộng thêm --detect-ms / --embed-ms (sleep, nhả GIL như
+ONNX Runtime) để mô phỏng chi phí model trên CPU. Với --real dùng engine thật (cần uniface).
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+from app.settings import settings
+from app.core.gallery_cache import Gallery
+from app.core.matching import match_tracks
+from app.core.video import process_video
+
+W, H = 1920, 1080
+DIM = 128
+FACE = 90
+
+
+class _Face:
+    __slots__ = ("bbox", "confidence", "landmarks")
+
+    def __init__(self, x, y, w, h):
+        self.bbox = np.array([x, y, x + w, y + h], dtype=np.float32)
+        self.confidence = 0.95
+        self.landmarks = np.array([[x + 0.3 * w, y + 0.4 * h], [x + 0.7 * w, y + 0.4 * h], [x + 0.5 * w, y + 0.55 * h],
+                                   [x + 0.35 * w, y + 0.75 * h], [x + 0.65 * w, y + 0.75 * h]], dtype=np.float32)
+
+
+class StubEngine:
+    """Detect ô màu bão hoà, embedding theo hue (mỗi học sinh 1 hue)."""
+
+    def __init__(self, students: int, detect_ms: float, embed_ms: float, seed: int = 0):
+        rng = np.random.default_rng(seed)
+        self.students = students
+        self.basis = rng.standard_normal((students, DIM)).astype(np.float32)
+        self.basis /= np.linalg.norm(self.basis, axis=1, keepdims=True)
+        self.rng = rng
+        self.detect_ms = detect_ms
+        self.embed_ms = embed_ms
+
+    def detect(self, img):
+        t0 = time.perf_counter()
+        sat = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)[:, :, 1]
+        n, _, stats, _ = cv2.connectedComponentsWithStats((sat > 120).astype(np.uint8))
+        faces = [_Face(x, y, w, h) for x, y, w, h, area in stats[1:].tolist()
+                 if w > 8 and h > 8 and area > 0.5 * w * h and x > 0 and x + w < img.shape[1]]
+        time.sleep(max(0.0, self.detect_ms / 1000 - (time.perf_counter() - t0)))
+        return faces
+
+    def align(self, img, landmarks):
+        lm = np.asarray(landmarks)
+        w = (lm[1, 0] - lm[0, 0]) / 0.4
+        x1, y1 = int(lm[0, 0] - 0.3 * w), int(lm[0, 1] - 0.4 * w)
+        crop = img[max(0, y1):y1 + int(w), max(0, x1):x1 + int(w)]
+        return cv2.resize(crop, (112, 112))
+
+    def hue_student(self, crop):
+        hsv = cv2.cvtColor(crop, cv2.COLOR_BGR2HSV)
+        hue = float(np.median(hsv[:, :, 0][hsv[:, :, 1] > 120])) if (hsv[:, :, 1] > 120).any() else 0.0
+        return int(round(hue / 170 * (self.students - 1)))
+
+    def embed_aligned(self, crops):
+        time.sleep(self.embed_ms / 1000 * len(crops))
+        out = np.stack([self.basis[self.hue_student(c)] for c in crops])
+        out = out + 0.6 * self.rng.standard_normal(out.shape).astype(np.float32) / np.sqrt(DIM)
+        return out / np.linalg.norm(out, axis=1, keepdims=True)
+
+
+def face_patch(students: int, s: int, rng):
+    """Ô màu của học sinh s (hue riêng, texture ngẫu nhiên để qua được quality gate)."""
+    hue = int(round(s / max(1, students - 1) * 170))
+    tex = rng.integers(150, 255, size=(FACE, FACE), dtype=np.uint8)
+    face = cv2.merge([np.full((FACE, FACE), hue, np.uint8), np.full((FACE, FACE), 220, np.uint8), tex])
+    return cv2.cvtColor(face, cv2.COLOR_HSV2BGR)
+
+
+def make_photo(students: int, per_image: int, seed: int, width: int = 1280, height: int = 720) -> bytes:
+    """Ảnh JPEG 1 góc lớp: per_image học sinh ngẫu nhiên (khác nhau), xếp lưới."""
+    rng = np.random.default_rng(seed)
+    img = cv2.GaussianBlur(rng.integers(60, 140, size=(height, width), dtype=np.uint8), (0, 0), 3)
+    img = cv2.cvtColor(img, cv2.COLOR_GRAY2BGR)
+    cols = max(1, (width - 60) // 150)
+    for j, s in enumerate(rng.choice(students, size=min(per_image, students), replace=False).tolist()):
+        r, c = divmod(j, cols)
+        x, y = 60 + c * 150, 60 + r * 200
+        if y + FACE > height:
+            break
+        img[y:y + FACE, x:x + FACE] = face_patch(students, s, rng)
+    return cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, 90])[1].tobytes()
+
+
+def make_video(path: str, seconds: float, students: int, fps: int = 30, seed: int = 0):
+    """Lớp học rộng 2 khung hình, 1/6 thời gian đầu + cuối đứng yên, giữa lia ngang."""
+    rng = np.random.default_rng(seed)
+    pano = cv2.GaussianBlur(rng.integers(60, 140, size=(H, 2 * W), dtype=np.uint8), (0, 0), 3)
+    pano = cv2.cvtColor(pano, cv2.COLOR_GRAY2BGR)
+    cols = (students + 2) // 3
+    for s in range(students):
+        r, c = divmod(s, cols)
+        x = int(150 + c * (2 * W - 300) / max(1, cols - 1)) - FACE // 2 if cols > 1 else W
+        y = 250 + r * 250
+        pano[y:y + FACE, x:x + FACE] = face_patch(students, s, rng)
+
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"mp4v"), fps, (W, H))
+    n = int(seconds * fps)
+    hold = n // 6
+    for i in range(n):
+        p = min(1.0, max(0.0, (i - hold) / max(1, n - 2 * hold)))
+        x0 = int(p * W)
+        writer.write(pano[:, x0:x0 + W])
+    writer.release()
+
+
+def run(label, engine, path, gallery, kwargs):
+    t0 = time.perf_counter()
+    out = process_video(engine, path, min_conf=0.4, min_face=20, min_blur=3.0, **kwargs)
+    elapsed = time.perf_counter() - t0
+    tracks = out["tracks"]
+    present = set()
+    if tracks:
+        embs = np.concatenate([t["embs"] for t in tracks])
+        owner = np.repeat(np.arange(len(tracks)), [len(t["embs"]) for t in tracks])
+        _, idx, _ = match_tracks(embs, owner, gallery.embs, gallery.seg_starts, threshold=0.4,
+                                 aggregate=settings.match_aggregate, top_k=settings.match_topk)
+        present = {gallery.student_keys[i] for i in idx.tolist() if i >= 0}
+    v, c = out["video"], out["counters"]
+    print(f"{label:<9} {v['frames_read'] / elapsed:7.1f} frames/s  realtime x{v['duration_s'] / elapsed:5.2f}  "
+          f"processed={v['frames_processed']:4d}  detected={c['faces_detected']:5d}  embedded={c['faces_embedded']:5d}  "
+          f"tracks={len(tracks):3d}  present={len(present)}/{len(gallery.student_keys)}")
+    print(f"{'':<9} timings_ms={out['timings_ms']}")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--video", help="file video có sẵn (mặc định: sinh video tổng hợp)")
+    ap.add_argument("--real", action="store_true", help="dùng RetinaFace/ArcFace thật (gallery rỗng)")
+    ap.add_argument("--seconds", type=float, default=30.0)
+    ap.add_argument("--students", type=int, default=30)
+    ap.add_argument("--detect-ms", type=float, default=60.0, help="chi phí detect giả lập mỗi frame")
+    ap.add_argument("--embed-ms", type=float, default=8.0, help="chi phí embed giả lập mỗi face")
+    args = ap.parse_args()
+
+    tmp = tempfile.mkdtemp(prefix="bench_video_")
+    try:
+        path = args.video
+        if path is None:
+            path = os.path.join(tmp, "class.mp4")
+            t0 = time.perf_counter()
+            make_video(path, args.seconds, args.students)
+            print(f"synthetic video {W}x{H} {args.seconds:.0f}s, {args.students} students "
+                  f"(generated in {time.perf_counter() - t0:.1f}s)")
+        if args.real:
+            from app.core.engine_registry import engine_registry
+            engine = engine_registry.get()
+            gallery = Gallery("bench", 0, [], [], np.zeros((0, 512), np.float32))
+        else:
+            engine = StubEngine(args.students, args.detect_ms, args.embed_ms)
+            sids = [f"S{s:03d}" for s in range(args.students)]
+            gallery = Gallery("bench", 0, sids, sids, engine.basis)
+
+        base = {
+            "detect_max_side": settings.video_detect_max_side,
+            "sample_fps": settings.video_sample_fps,
+            "max_seconds": 0,
+            "track_iou": settings.video_track_iou,
+            "track_max_age_s": settings.video_track_max_age_s,
+            "reid_threshold": settings.video_reid_threshold,
+            "motion_threshold": settings.video_motion_threshold,
+        }
+        # trước: mỗi frame mẫu là 1 ảnh độc lập, embed mọi face
+        run("per-frame", engine, path, gallery, dict(base, max_gap_s=0, embeds_per_track=10 ** 6, embed_gap_s=0))
+        run("tracked", engine, path, gallery, dict(base, max_gap_s=settings.video_max_gap_s,
+                                                    embeds_per_track=settings.video_embeds_per_track,
+                                                    embed_gap_s=settings.video_embed_gap_s))
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
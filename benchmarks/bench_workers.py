@@ -0,0 +1,190 @@
+"""
+Chạy nhiều worker (uvicorn --workers N): bộ nhớ gallery mỗi worker khi mỗi worker giữ bản copy
+riêng (GALLERY_STORAGE=orm) so với mmap chung file packed float32 (GALLERY_STORAGE=packed,
+PACKED_DTYPE=float32), và thời gian để 1 enroll ở process này được worker khác thấy
+(GALLERY_SYNC_INTERVAL_S).
+
+    python -m benchmarks.bench_workers --workers 4 --classes 40 --students 40 --per-student 10
+
+Mỗi worker là 1 process riêng, load gallery của mọi lớp qua crud.get_gallery (như request điểm
+danh) và match 1 probe mỗi lớp, rồi đo từ /proc/self/smaps_rollup (Linux) trong lúc mọi worker
+còn sống: RSS, USS (trang riêng, giải phóng khi worker thoát) và PSS (trang chung chia đều).
+Số liệu là phần tăng so với ngay trước khi load gallery (không gồm Python / NumPy / model).
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+_ROLE = os.environ.get("BENCH_WORKER_ROLE")
+if _ROLE is None:
+    _tmp = tempfile.mkdtemp(prefix="bench_workers_")
+    os.environ["DB_URL"] = f"sqlite:///{_tmp}/bench.db"
+    os.environ["STORAGE_DIR"] = os.path.join(_tmp, "storage")
+    os.environ["GALLERY_STORAGE"] = "packed"    # enroll ở process chính ghi lại pack như worker thật
+    os.environ["PACKED_DTYPE"] = "float32"
+    os.environ["SCHEDULER_ENABLED"] = "false"
+
+from app.settings import settings  # noqa: E402
+from app.db.database import Base, SessionLocal, engine  # noqa: E402
+from app.db.models import ClassRoom, Student, StudentEmbedding  # noqa: E402
+from app.db import crud, vector_store  # noqa: E402
+from app.core.gallery_cache import gallery_cache  # noqa: E402
+from app.core.matching import match_students  # noqa: E402
+
+DIM = 512
+
+
+def memory() -> dict:
+    """MB theo /proc/self/smaps_rollup (rss, pss, uss)."""
+    out = {}
+    try:
+        with open("/proc/self/smaps_rollup") as fh:
+            for line in fh:
+                key, _, rest = line.partition(":")
+                if key in ("Rss", "Pss", "Private_Clean", "Private_Dirty"):
+                    out[key] = int(rest.split()[0]) / 1024
+    except FileNotFoundError:
+        import resource
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        return {"rss": rss, "pss": rss, "uss": rss}
+    return {"rss": out["Rss"], "pss": out["Pss"], "uss": out["Private_Clean"] + out["Private_Dirty"]}
+
+
+def populate(classes: int, students: int, per_student: int):
+    rng = np.random.default_rng(0)
+    db = SessionLocal()
+    try:
+        for c in range(classes):
+            class_id = f"C{c:03d}"
+            db.add(ClassRoom(id=class_id, name=class_id))
+            db.bulk_insert_mappings(Student, [
+                {"id": f"{class_id}-{i:04d}", "class_id": class_id, "name": f"Student {i}"} for i in range(students)
+            ])
+            vecs = rng.standard_normal((students * per_student, DIM)).astype(np.float32)
+            db.bulk_insert_mappings(StudentEmbedding, [
+                {"student_id": f"{class_id}-{i // per_student:04d}", "dim": DIM, "vector": v.tobytes(),
+                 "source": "bench"}
+                for i, v in enumerate(vecs)
+            ])
+        db.commit()
+        vector_store.pack_all(db)
+    finally:
+        db.close()
+
+
+def child_memory():
+    """Worker: load mọi lớp, in số đo rồi giữ process sống tới khi stdin đóng."""
+    db = SessionLocal()
+    class_ids = [r[0] for r in db.query(ClassRoom.id).order_by(ClassRoom.id)]
+    probe = np.random.default_rng(1).standard_normal((1, DIM)).astype(np.float32)
+    before = memory()
+    for class_id in class_ids:
+        g = crud.get_gallery(db, class_id)
+        match_students(probe, g.embs, g.seg_starts, threshold=0.4, calibration=g.calibration)
+    after = memory()
+    db.close()
+    print(json.dumps({k: after[k] - before[k] for k in after} | {"cache": gallery_cache.stats()}), flush=True)
+    sys.stdin.read()
+
+
+def child_watch():
+    """Worker: hỏi gallery của lớp liên tục, in thời điểm thấy số embedding đổi."""
+    class_id = os.environ["BENCH_WATCH_CLASS"]
+    db = SessionLocal()
+    n = len(crud.get_gallery(db, class_id))
+    print("ready", flush=True)
+    for line in sys.stdin:
+        target = n + int(line)
+        while True:
+            db.rollback()    # snapshot mới mỗi vòng
+            n = len(crud.get_gallery(db, class_id))
+            if n >= target:
+                break
+            time.sleep(0.002)
+        print(time.time(), flush=True)
+    db.close()
+
+
+def spawn(role: str, env: dict):
+    return subprocess.Popen([sys.executable, "-m", "benchmarks.bench_workers"], stdin=subprocess.PIPE,
+                            stdout=subprocess.PIPE, text=True, env=os.environ | env | {"BENCH_WORKER_ROLE": role})
+
+
+def bench_memory(args, storage: str):
+    env = {"GALLERY_STORAGE": storage, "GALLERY_CACHE_MAX_CLASSES": str(args.classes + 1),
+           "GALLERY_CACHE_MAX_MB": "100000"}
+    procs = [spawn("memory", env) for _ in range(args.workers)]
+    rows = [json.loads(p.stdout.readline()) for p in procs]     # mọi worker đã load xong và còn sống
+    for p in procs:
+        p.stdin.close()
+        p.wait()
+    rss = np.mean([r["rss"] for r in rows])
+    uss = np.mean([r["uss"] for r in rows])
+    pss = sum(r["pss"] for r in rows)
+    shared = rows[0]["cache"]["shared_bytes"] / 2**20
+    print(f"{storage:<7} workers={args.workers}  per worker: rss=+{rss:7.1f} MB  uss=+{uss:7.1f} MB  "
+          f"| all workers pss=+{pss:7.1f} MB  (gallery mmap shared={shared:.1f} MB)")
+
+
+def bench_sync(args, interval: float):
+    env = {"GALLERY_STORAGE": "packed", "GALLERY_SYNC_INTERVAL_S": str(interval), "BENCH_WATCH_CLASS": "C000"}
+    p = spawn("watch", env)
+    assert p.stdout.readline().strip() == "ready"
+    rng = np.random.default_rng(2)
+    db = SessionLocal()
+    lat = []
+    try:
+        for i in range(args.enrolls):
+            p.stdin.write("1\n")
+            p.stdin.flush()
+            crud.enroll_student(db, "C000", f"NEW-{interval}-{i}", "New", rng.standard_normal((1, DIM)))
+            t0 = time.time()
+            crud.pack_class_gallery(db, "C000")
+            lat.append((float(p.stdout.readline()) - t0) * 1000)
+    finally:
+        db.close()
+        p.stdin.close()
+        p.wait()
+    print(f"sync interval={interval:>5}s  enroll -> visible in other worker: "
+          f"p50={np.percentile(lat, 50):7.1f} ms  max={max(lat):7.1f} ms  ({args.enrolls} enrolls)")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--workers", type=int, default=4)
+    ap.add_argument("--classes", type=int, default=40)
+    ap.add_argument("--students", type=int, default=40, help="số học sinh / lớp")
+    ap.add_argument("--per-student", type=int, default=10, help="số embedding mỗi học sinh")
+    ap.add_argument("--intervals", type=float, nargs="+", default=[0.0, 0.25, 1.0], help="GALLERY_SYNC_INTERVAL_S")
+    ap.add_argument("--enrolls", type=int, default=10)
+    args = ap.parse_args()
+
+    Base.metadata.create_all(bind=engine)
+    try:
+        t0 = time.perf_counter()
+        populate(args.classes, args.students, args.per_student)
+        rows = args.classes * args.students * args.per_student
+        print(f"classes={args.classes} rows={rows} gallery float32={rows * DIM * 4 / 2**20:.1f} MB "
+              f"(populate {time.perf_counter() - t0:.1f}s)")
+        for storage in ("orm", "packed"):
+            bench_memory(args, storage)
+        for interval in args.intervals:
+            bench_sync(args, interval)
+    finally:
+        shutil.rmtree(_tmp, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    if _ROLE == "memory":
+        child_memory()
+    elif _ROLE == "watch":
+        child_watch()
+    else:
+        main()
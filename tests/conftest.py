@@ -0,0 +1,75 @@
+import os
+import tempfile
+
+# DB + storage tạm cho cả phiên test, đặt trước khi import app.settings
+_tmp = tempfile.mkdtemp(prefix="attendance_tests_")
+os.environ.setdefault("DB_URL", f"sqlite:///{_tmp}/test.db")
+os.environ.setdefault("STORAGE_DIR", os.path.join(_tmp, "storage"))
+os.environ.setdefault("SCHEDULER_ENABLED", "false")
+os.environ.setdefault("ENGINE_PRELOAD", "false")
+
+from app.db import models  # noqa: E402,F401  (đăng ký bảng vào Base.metadata)
+from app.db.database import Base, engine  # noqa: E402
+
+Base.metadata.create_all(bind=engine)
+
+import cv2  # noqa: E402
+import numpy as np  # noqa: E402
+import pytest  # noqa: E402
+
+# mọi embedding trong DB test cùng số chiều (campus index dựng từ toàn bộ DB)
+DIM = 16
+
+
+class FakeFace:
+    def __init__(self, bbox, conf, landmarks):
+        self.bbox = np.array(bbox, np.float32)
+        self.confidence = conf
+        self.landmarks = np.array(landmarks, np.float32)
+
+
+class FakeEngine:
+    """
+    Engine giả (không cần model): mỗi ảnh 2 face cố định ở nửa trái / phải; face trái có
+    embedding e_0, face phải e_5 (one-hot DIM chiều).
+    """
+
+    def detect(self, img):
+        return [FakeFace([100, 100, 300, 340], 0.9, [[150, 150], [250, 150], [200, 200], [160, 260], [240, 260]]),
+                FakeFace([350, 100, 550, 340], 0.8, [[400, 150], [500, 150], [450, 200], [410, 260], [490, 260]])]
+
+    def align(self, img, landmarks):
+        return np.full((112, 112, 3), 0 if landmarks[0][0] < 300 else 5, np.uint8)
+
+    def embed_aligned(self, crops):
+        v = np.zeros((len(crops), DIM), np.float32)
+        for i, c in enumerate(crops):
+            v[i, int(c[0, 0, 0])] = 1
+        return v
+
+
+def one_hot(i: int) -> np.ndarray:
+    e = np.zeros(DIM, np.float32)
+    e[i] = 1
+    return e
+
+
+@pytest.fixture
+def fake_engine():
+    from app.main import app
+    from app.deps import get_engine
+    from app.core.engine_registry import engine_registry
+
+    engine = FakeEngine()
+    app.dependency_overrides[get_engine] = lambda: engine
+    original = engine_registry.get
+    engine_registry.get = lambda: engine
+    yield engine
+    engine_registry.get = original
+    app.dependency_overrides.pop(get_engine, None)
+
+
+@pytest.fixture(scope="session")
+def jpeg_bytes() -> bytes:
+    img = cv2.GaussianBlur((np.random.default_rng(0).random((480, 640, 3)) * 255).astype(np.uint8), (0, 0), 1)
+    return cv2.imencode(".jpg", img)[1].tobytes()
@@ -0,0 +1,203 @@
+import asyncio
+import os
+import uuid
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+
+from app.main import app
+from app.db.database import SessionLocal
+from app.db.models import AttendanceJob, AttendanceSession, ClassRoom
+from app.core.inference import InferenceBusy
+from app.core.job_queue import AttendanceJobQueue, JobQueueFull
+from app.api import routes_attendance
+
+client = TestClient(app)     # không vào lifespan: không bật worker job / scheduler
+
+
+def _job(job_id: str) -> AttendanceJob:
+    db = SessionLocal()
+    try:
+        return db.get(AttendanceJob, job_id)
+    finally:
+        db.close()
+
+
+def _run_queue(handler, submit_kwargs, until, **queue_kwargs):
+    """Chạy 1 AttendanceJobQueue riêng tới khi until(job) đúng, return (queue, job)."""
+    queue = AttendanceJobQueue(workers=1, poll_interval=0.01, **queue_kwargs)
+
+    async def main():
+        await queue.start(handler)
+        job, _ = await asyncio.to_thread(queue.submit, **submit_kwargs)
+        await queue.start_workers()
+        try:
+            for _ in range(500):
+                current = await asyncio.to_thread(_job, job.id)
+                if until(current):
+                    return current
+                await asyncio.sleep(0.01)
+            raise AssertionError(f"job stuck in {current.status}")
+        finally:
+            await queue.stop()
+
+    return queue, asyncio.run(main())
+
+
+def _submit(lane="live"):
+    return {"class_id": f"C-{uuid.uuid4().hex[:8]}", "threshold": 0.4, "lane": lane, "datas": [b"a", b"b"]}
+
+
+def test_job_requeued_on_inference_busy_without_counting_attempt():
+    calls = []
+
+    async def handler(job, datas, progress):
+        calls.append(job.attempts)
+        if len(calls) <= 2:
+            raise InferenceBusy("full")
+        for _ in datas:
+            progress()
+        return "session-1"
+
+    queue, job = _run_queue(handler, _submit(), lambda j: j.status in ("done", "failed"), max_attempts=1)
+
+    assert job.status == "done"
+    assert job.session_id == "session-1"
+    assert job.attempts == 1
+    assert job.images_done == 2
+    assert calls == [1, 1, 1]
+    assert queue.busy_requeued == 2
+    assert not os.path.exists(queue.job_dir(job.id))
+
+
+def test_job_failed_on_handler_error():
+    async def handler(job, datas, progress):
+        progress()
+        raise RuntimeError("boom")
+
+    queue, job = _run_queue(handler, _submit(), lambda j: j.status in ("done", "failed"))
+
+    assert job.status == "failed"
+    assert job.error == "boom"
+    assert job.finished_at is not None
+    assert queue.failed == 1
+    assert not os.path.exists(queue.job_dir(job.id))
+
+
+def test_job_submit_rejects_when_lane_full():
+    queue = AttendanceJobQueue(workers=0, max_queued={"live": 0, "bulk": 10})
+    with pytest.raises(JobQueueFull):
+        queue.submit(**_submit("live"))
+    assert queue.rejected == 1
+
+
+def test_recover_requeues_or_fails_interrupted_jobs():
+    queue = AttendanceJobQueue(workers=0, max_attempts=2)
+    ids = []
+    for attempts in (1, 2):
+        job, _ = queue.submit(**_submit())
+        ids.append(job.id)
+        db = SessionLocal()
+        db.query(AttendanceJob).filter(AttendanceJob.id == job.id).update(
+            {"status": "running", "attempts": attempts, "images_done": 1})
+        db.commit()
+        db.close()
+
+    assert queue.recover() >= 2
+    retried, exhausted = _job(ids[0]), _job(ids[1])
+    assert (retried.status, retried.images_done) == ("queued", 0)
+    assert exhausted.status == "failed"
+    assert "interrupted" in exhausted.error
+
+
+def test_requeue_leaves_finished_jobs_alone():
+    # worker bị cancel lúc xoá thư mục job (sau khi đã ghi done) không được chạy lại job
+    queue = AttendanceJobQueue(workers=0)
+    job, _ = queue.submit(**_submit())
+    queue._update(job.id, {"status": "done", "attempts": 1, "images_done": 2})
+
+    queue._requeue(job.id)
+
+    current = _job(job.id)
+    assert (current.status, current.attempts, current.images_done) == ("done", 1, 2)
+
+
+def test_run_attendance_job_turns_503_into_inference_busy(monkeypatch):
+    async def busy(*args, **kwargs):
+        raise HTTPException(503, "Server busy")
+
+    monkeypatch.setattr(routes_attendance, "_run_attendance", busy)
+    monkeypatch.setattr(routes_attendance.engine_registry, "get", lambda: None)
+    job = AttendanceJob(id="j", class_id="C", threshold=0.4)
+    with pytest.raises(InferenceBusy):
+        asyncio.run(routes_attendance.run_attendance_job(job, [b"x"], lambda: None))
+
+
+def test_list_sessions_cursor_pagination():
+    class_id = f"C-{uuid.uuid4().hex[:8]}"
+    base = datetime(2026, 1, 5, 8, 0, 0)
+    db = SessionLocal()
+    db.add(ClassRoom(id=class_id, name=class_id))
+    # 3 phiên trùng created_at: thứ tự phải ổn định theo id
+    times = [base + timedelta(minutes=i) for i in range(5)] + [base + timedelta(minutes=10)] * 3
+    for i, t in enumerate(times):
+        db.add(AttendanceSession(id=f"{class_id}-s{i:02d}", class_id=class_id, created_at=t, images_count=1))
+    db.commit()
+    db.close()
+    expected = [sid for _, sid in sorted(((t, f"{class_id}-s{i:02d}") for i, t in enumerate(times)), reverse=True)]
+
+    seen, cursor, pages = [], None, 0
+    while True:
+        params = {"class_id": class_id, "limit": 3} | ({"cursor": cursor} if cursor else {})
+        r = client.get("/attendance/sessions", params=params)
+        assert r.status_code == 200
+        seen += [row["session_id"] for row in r.json()]
+        pages += 1
+        cursor = r.headers.get("X-Next-Cursor")
+        if cursor is None:
+            break
+        # phiên mới chen vào giữa chừng không làm lệch trang sau
+        if pages == 1:
+            db = SessionLocal()
+            db.add(AttendanceSession(id=f"{class_id}-new", class_id=class_id, created_at=base + timedelta(days=1)))
+            db.commit()
+            db.close()
+
+    assert seen == expected
+    assert pages == 3
+
+
+def test_list_sessions_invalid_cursor():
+    r = client.get("/attendance/sessions", params={"class_id": "C", "cursor": "not-a-cursor"})
+    assert r.status_code == 400
+
+
+def test_identify_uses_campus_index(fake_engine, jpeg_bytes):
+    from conftest import DIM
+    from app.db import crud
+
+    # campus index gồm mọi học sinh của DB test: embedding riêng, không trùng one-hot của test khác
+    rng = np.random.default_rng(42)
+    known, stranger = rng.normal(size=(2, DIM)).astype(np.float32)
+    known /= np.linalg.norm(known)
+    stranger /= np.linalg.norm(stranger)
+    fake_engine.embed_aligned = lambda crops: np.stack([known if c[0, 0, 0] == 0 else stranger for c in crops])
+
+    db = SessionLocal()
+    crud.enroll_student(db, "ID-C1", "ID-S1", "An", known[None])
+    db.close()
+
+    # byte ảnh riêng: image cache không trả embedding này cho test khác
+    data = jpeg_bytes + b"\0\1"
+    # threshold chặt: mặt lạ không khớp học sinh nào khác trong DB
+    r = client.post("/attendance/identify", data={"threshold": "0.95"},
+                    files=[("images", ("a.jpg", data, "image/jpeg"))])
+
+    assert r.status_code == 200
+    body = r.json()
+    assert [p["student_id"] for p in body["identified"]] == ["ID-S1"]
+    assert body["identified"][0]["class_id"] == "ID-C1"
+    assert body["unknown_faces_count"] == 1
@@ -0,0 +1,94 @@
+import numpy as np
+
+from app.core.ann_index import FlatIndex, IVFIndex, load_index, save_index
+from app.core.campus_index import CampusIndex
+from app.core.matching import normalize_rows
+from app.db import crud
+from app.db.database import SessionLocal
+from app.db.models import StudentEmbedding
+from conftest import DIM
+
+
+def _clustered(n: int, dim: int = 32, clusters: int = 20, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    centers = normalize_rows(rng.normal(size=(clusters, dim)).astype(np.float32))
+    vecs = centers[rng.integers(0, clusters, n)] + 0.05 * rng.normal(size=(n, dim)).astype(np.float32)
+    return normalize_rows(vecs.astype(np.float32))
+
+
+def _ivf(vecs, nlist=32, nprobe=8):
+    index = IVFIndex(vecs.shape[1], nlist=nlist, nprobe=nprobe)
+    index.train(vecs)
+    index.add(np.arange(len(vecs)), vecs)
+    return index
+
+
+def test_ivf_recall_against_flat():
+    vecs = _clustered(3000)
+    queries = _clustered(200, seed=1)
+    flat = FlatIndex(vecs.shape[1])
+    flat.add(np.arange(len(vecs)), vecs)
+    ivf = _ivf(vecs)
+
+    _, exact = flat.search(queries, k=10)
+    _, approx = ivf.search(queries, k=10)
+    recall = np.mean([len(set(a) & set(e)) / 10 for a, e in zip(approx.tolist(), exact.tolist())])
+    assert recall >= 0.9
+
+    # probe mọi cụm = brute force
+    scores_all, labels_all = ivf.search(queries, k=10, nprobe=ivf.nlist)
+    scores_flat, _ = flat.search(queries, k=10)
+    np.testing.assert_allclose(scores_all, scores_flat, atol=1e-5)
+    assert (labels_all[:, 0] == exact[:, 0]).all()
+
+
+def test_indexes_remove_pad_and_roundtrip(tmp_path):
+    vecs = _clustered(500)
+    for index in (FlatIndex(vecs.shape[1]), _ivf(vecs, nlist=8)):
+        if isinstance(index, FlatIndex):
+            index.add(np.arange(len(vecs)), vecs)
+        assert index.remove([0, 1, 2, 9999]) == 3
+        assert len(index) == 497
+        _, labels = index.search(vecs[:3], k=5, **({"nprobe": 8} if isinstance(index, IVFIndex) else {}))
+        assert not np.isin(labels, [0, 1, 2]).any()
+
+        path = str(tmp_path / f"{index.kind}.npz")
+        save_index(index, path, count=497, max_id=499)
+        loaded, meta = load_index(path)
+        assert meta == {"count": 497, "max_id": 499}
+        np.testing.assert_array_equal(loaded.search(vecs[3:6], k=5)[1], index.search(vecs[3:6], k=5)[1])
+
+    # ít vector hơn k: phần thiếu label -1
+    small = FlatIndex(4)
+    small.add([7], np.ones((1, 4), np.float32))
+    scores, labels = small.search(np.ones((1, 4), np.float32), k=3)
+    assert labels.tolist() == [[7, -1, -1]]
+    assert np.isneginf(scores[0, 1:]).all()
+
+
+def test_apply_delta_syncs_changes_from_other_workers():
+    # vector ngẫu nhiên (không trùng one-hot của test khác trong cùng DB)
+    embs = normalize_rows(np.random.default_rng(7).normal(size=(10, DIM)).astype(np.float32))
+    db = SessionLocal()
+    try:
+        for i in range(4):
+            crud.enroll_student(db, "CI-C1", f"CI-S{i}", f"Student {i}", embs[i][None])
+        # index riêng = worker khác: không nhận notify_* từ crud của worker này
+        other = CampusIndex()
+        other.ensure(db)
+        builds = other.builds
+
+        crud.enroll_student(db, "CI-C2", "CI-S9", "New", embs[9][None])
+        db.query(StudentEmbedding).filter(StudentEmbedding.student_id == "CI-S0").delete()
+        db.commit()
+        other.ensure(db)
+
+        assert (other.builds, other.deltas) == (builds, 1)
+        ids, _ = other.identify(embs[[9, 0]], threshold=0.9, image_ids=[0, 1])
+        assert ids == ["CI-S9", None]
+        assert other.student_info("CI-S9") == ("New", "CI-C2")
+
+        other.ensure(db)     # chữ ký khớp: không làm gì thêm
+        assert (other.builds, other.deltas) == (builds, 1)
+    finally:
+        db.close()
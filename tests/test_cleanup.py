@@ -0,0 +1,122 @@
+import json
+import os
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from app.settings import settings
+from app.core.job_queue import AttendanceJobQueue
+from app.core.leader import LeaderLock, leader
+from app.db.database import SessionLocal
+from app.db.models import (
+    AttendanceFace, AttendanceImage, AttendanceJob, AttendanceResult, AttendanceSession, StudentEnrollImage,
+)
+from app.jobs.cleanup import run_cleanup
+
+
+def _age(path: str, seconds: float):
+    t = time.time() - seconds
+    os.utime(path, (t, t))
+
+
+def test_cleanup_keeps_aged_leader_lock():
+    lock = LeaderLock(leader.path)
+    assert lock.try_acquire()
+    try:
+        inode = os.stat(lock.path).st_ino
+        _age(lock.path, 7 * 86400)
+
+        run_cleanup()
+
+        assert os.path.exists(lock.path)
+        assert os.stat(lock.path).st_ino == inode
+        # process khác vẫn không thể thành leader thứ 2
+        assert not LeaderLock(lock.path).try_acquire()
+    finally:
+        lock.release()
+
+
+def _old_session(db, storage: str, days: float, note_bytes: int = 0) -> tuple[str, str]:
+    sid = f"CL-{uuid.uuid4().hex[:8]}"
+    created = datetime.utcnow() - timedelta(days=days)
+    path = os.path.join(storage, "attendance", f"{sid}.jpg")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as fh:
+        fh.write(b"jpg")
+    db.add(AttendanceSession(id=sid, class_id="CL-C1", created_at=created, note="x" * note_bytes))
+    image = AttendanceImage(session_id=sid, file_path=path, created_at=created)
+    db.add(image)
+    db.flush()
+    db.add(AttendanceFace(session_id=sid, image_id=image.id, status="unknown", created_at=created))
+    db.add(AttendanceResult(session_id=sid, student_id="CL-S1", status="present", created_at=created))
+    db.commit()
+    return sid, path
+
+
+def test_cleanup_deletes_expired_sessions_in_batches(monkeypatch):
+    monkeypatch.setattr(settings, "cleanup_batch_pause", 0)
+    db = SessionLocal()
+    try:
+        old = [_old_session(db, settings.storage_dir, 40, note_bytes=20_000) for _ in range(5)]
+        keep = _old_session(db, settings.storage_dir, 1)
+
+        row = run_cleanup(retention_days=30, batch_size=2)
+
+        stats = json.loads(row.note)
+        assert stats["batches"] >= 3
+        assert row.deleted_sessions >= 5
+        old_ids = [sid for sid, _ in old]
+        for model in (AttendanceSession, AttendanceImage, AttendanceFace, AttendanceResult):
+            col = model.id if model is AttendanceSession else model.session_id
+            assert db.query(model).filter(col.in_(old_ids)).count() == 0
+            assert db.query(model).filter(col == keep[0]).count() == 1
+        assert not any(os.path.exists(p) for _, p in old)
+        assert os.path.exists(keep[1])
+
+        # note lớn của các phiên đã xoá thành trang trống, incremental_vacuum trả lại cho OS
+        vacuum = stats["vacuum"]
+        assert vacuum["mode"] == "incremental"
+        assert vacuum["freelist_before"] > 0
+        assert vacuum["freelist_after"] == 0
+    finally:
+        db.close()
+
+
+def test_cleanup_prunes_orphan_files_after_grace_period():
+    root = settings.storage_dir
+    files = {}
+    for key, rel in (("orphan", "attendance/orphan.jpg"), ("fresh", "attendance/fresh.jpg"),
+                     ("enrolled", "enroll/CL-S1/a.jpg"), ("managed", "index/other.npz")):
+        path = os.path.join(root, rel)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as fh:
+            fh.write(b"x")
+        if key != "fresh":
+            _age(path, 2 * 86400)
+        files[key] = path
+
+    queue = AttendanceJobQueue(workers=0)
+    active, _ = queue.submit(class_id="CL-C1", threshold=0.4, lane="bulk", datas=[b"a"])
+    stale_dir = os.path.join(root, "jobs", "finished-job")
+    os.makedirs(stale_dir, exist_ok=True)
+    with open(os.path.join(stale_dir, "0000.jpg"), "wb") as fh:
+        fh.write(b"a")
+    for d in (queue.job_dir(active.id), stale_dir):
+        _age(d, 2 * 86400)
+
+    db = SessionLocal()
+    try:
+        db.add(StudentEnrollImage(student_id="CL-S1", file_path=files["enrolled"]))
+        db.commit()
+
+        run_cleanup()
+
+        assert not os.path.exists(files["orphan"])
+        assert all(os.path.exists(files[k]) for k in ("fresh", "enrolled", "managed"))
+        assert not os.path.exists(stale_dir)
+        assert os.path.isdir(queue.job_dir(active.id))
+    finally:
+        # job queued còn lại sẽ bị worker của test khác nhận
+        db.query(AttendanceJob).filter(AttendanceJob.id == active.id).update({"status": "failed"})
+        db.commit()
+        db.close()
@@ -0,0 +1,56 @@
+import asyncio
+import threading
+
+import numpy as np
+
+from app.settings import settings
+from app.db import crud, crud_async, vector_store
+from app.db.async_database import AsyncSessionLocal
+from app.db.database import SessionLocal
+from app.db.models import StudentEmbedding
+
+
+def _embs(n, dim=16, seed=0):
+    e = np.random.default_rng(seed).standard_normal((n, dim)).astype(np.float32)
+    return e / np.linalg.norm(e, axis=1, keepdims=True)
+
+
+def test_async_enroll_runs_cpu_and_file_work_off_the_loop(monkeypatch):
+    monkeypatch.setattr(settings, "gallery_storage", "packed")
+    monkeypatch.setattr(settings, "enroll_max_embeddings", 2)
+    threads = {}
+
+    def spy(name, module, attr):
+        fn = getattr(module, attr)
+
+        def wrapper(*args, **kwargs):
+            threads[name] = threading.current_thread() is threading.main_thread()
+            return fn(*args, **kwargs)
+        monkeypatch.setattr(module, attr, wrapper)
+
+    spy("prototypes", crud, "_compute_prototypes")
+    spy("params", crud, "_embedding_params")
+    spy("save", vector_store, "save_pack_file")
+    spy("open", vector_store, "open_pack")
+
+    async def main():
+        async with AsyncSessionLocal() as db:
+            ids = await crud_async.enroll_student(db, "CA1", "CA1-S1", "An", _embs(5))
+            await crud_async.enroll_student(db, "CA1", "CA1-S2", "Binh", _embs(1, seed=1))
+            await crud_async.pack_class_gallery(db, "CA1")
+            gallery = await crud_async.get_gallery(db, "CA1")
+        return ids, gallery
+
+    ids, gallery = asyncio.run(main())
+
+    assert len(ids) == 5
+    # k-means, tham số executemany, ghi / mmap pack đều chạy trong thread, không trên event loop
+    assert threads == {"prototypes": False, "params": False, "save": False, "open": False}
+    db = SessionLocal()
+    try:
+        sources = [s for (s,) in db.query(StudentEmbedding.source).filter(StudentEmbedding.student_id == "CA1-S1")]
+        assert sources == ["prototype", "prototype"]
+        assert vector_store.load_class_pack(db, "CA1") is not None
+    finally:
+        db.close()
+    assert len(gallery) == 3
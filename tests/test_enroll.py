@@ -0,0 +1,133 @@
+import asyncio
+import io
+import zipfile
+
+import cv2
+import numpy as np
+import pytest
+
+from app.core.bulk_enroll import BulkEnrollError, bulk_enroll, dedup_embeddings, scan_zip
+from app.core.inference import InferenceExecutor
+from app.db import crud
+from app.db.async_database import AsyncSessionLocal
+from app.db.database import SessionLocal
+from app.db.models import Student
+from conftest import DIM, FakeEngine
+
+
+def _vec(value: int) -> np.ndarray:
+    v = np.random.default_rng(1000 + value).normal(size=DIM).astype(np.float32)
+    return v / np.linalg.norm(v)
+
+
+class ColorEngine(FakeEngine):
+    """Embedding theo màu của ảnh: ảnh cùng màu -> cùng embedding (ảnh chụp trùng)."""
+
+    def align(self, img, landmarks):
+        return np.full((112, 112, 3), img[0, 0, 0], np.uint8)
+
+    def embed_aligned(self, crops):
+        return np.stack([_vec(int(c[0, 0, 0])) for c in crops])
+
+
+def _png(value: int) -> bytes:
+    return cv2.imencode(".png", np.full((480, 640, 3), value, np.uint8))[1].tobytes()
+
+
+def _zip(files: dict) -> zipfile.ZipFile:
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w") as zf:
+        for name, data in files.items():
+            zf.writestr(name, data)
+    return zipfile.ZipFile(io.BytesIO(buf.getvalue()))
+
+
+def test_scan_zip_layout_and_conflicts():
+    zf = _zip({
+        "export/BE-C1/BE-S1__Nguyen Van A/1.jpg": b"a",
+        "export/BE-C1/BE-S1__Nguyen Van A/2.PNG": b"b",
+        "export/BE-C1/BE-S1__Nguyen Van A/notes.txt": b"skip",
+        "export/BE-C1/BE-S2/front.jpg": b"c",
+        "export/BE-C2/BE-S2/side.jpg": b"d",                 # cùng mã HS ở lớp khác
+        "__MACOSX/BE-C1/BE-S1/._1.jpg": b"skip",
+        "BE-C1/loose.jpg": b"skip",                           # thiếu cấp học sinh
+    })
+    students, conflicts = scan_zip(zf)
+
+    assert [(s.class_id, s.student_id, s.name, [n for n, _ in s.images]) for s in students] == [
+        ("BE-C1", "BE-S1", "Nguyen Van A", ["1.jpg", "2.PNG"]),
+        ("BE-C1", "BE-S2", None, ["front.jpg"]),
+    ]
+    assert students[0].images[1][1]() == b"b"
+    assert conflicts == [{"class_id": "BE-C2", "student_id": "BE-S2",
+                          "error": "student_id already used in class BE-C1"}]
+
+
+def test_scan_zip_size_cap():
+    zf = _zip({"C/S/1.jpg": b"x" * 600, "C/S/2.jpg": b"x" * 600})
+    with pytest.raises(BulkEnrollError):
+        scan_zip(zf, max_bytes=1000)
+    assert len(scan_zip(zf, max_bytes=2000)[0]) == 1
+
+
+def test_dedup_embeddings():
+    a, b = _vec(1), _vec(2)
+    near_a = a + 0.01 * _vec(3)
+    near_a /= np.linalg.norm(near_a)
+
+    kept, dropped = dedup_embeddings(np.stack([a, near_a, b]), None, 0.97)
+    assert dropped == 1
+    np.testing.assert_array_equal(kept, np.stack([a, b]))
+
+    # trùng với embedding đã lưu trong DB
+    kept, dropped = dedup_embeddings(np.stack([near_a, b]), np.stack([a]), 0.97)
+    assert dropped == 1 and len(kept) == 1
+
+    kept, dropped = dedup_embeddings(np.stack([a]), np.stack([a]), 0.97)
+    assert (kept.shape, dropped) == ((0, DIM), 1)
+
+
+def test_bulk_enroll_report_and_rows():
+    zf = _zip({
+        "BE-C3/BE-S10__An/1.png": _png(10),
+        "BE-C3/BE-S10__An/2.png": _png(10),                 # ảnh trùng
+        "BE-C3/BE-S10__An/3.png": _png(11),
+        "BE-C3/BE-S11__Binh/1.png": _png(12),
+        "BE-C3/BE-S11__Binh/broken.jpg": b"not an image",
+        "BE-C4/BE-S12/1.jpg": b"not an image",                # không ảnh nào dùng được
+    })
+    students, conflicts = scan_zip(zf)
+
+    async def main():
+        executor = InferenceExecutor(max_workers=2, max_queue=8)
+        try:
+            async with AsyncSessionLocal() as db:
+                return await bulk_enroll(ColorEngine(), db, students, conflicts, executor=executor, batch_students=2)
+        finally:
+            executor.shutdown()
+
+    report = asyncio.run(main())
+    # import lại cùng file: mọi embedding trùng với bản đã lưu
+    again = asyncio.run(main())
+
+    assert report["students_total"] == 3
+    assert (report["students_enrolled"], report["students_failed"]) == (2, 1)
+    assert report["images_total"] == 6
+    assert report["images_failed"] == 2
+    assert (report["embeddings_saved"], report["duplicates_skipped"]) == (3, 1)
+    assert report["transactions"] == 1
+    assert report["failures"][0]["student_id"] == "BE-S12"
+    assert report["image_failures"] == [{"class_id": "BE-C3", "student_id": "BE-S11",
+                                         "images": {"broken.jpg": "no_face"}}]
+
+    assert (again["embeddings_saved"], again["duplicates_skipped"]) == (0, 4)
+    assert again["students_enrolled"] == 2
+
+    db = SessionLocal()
+    try:
+        assert db.get(Student, "BE-S10").name == "An"
+        stored = crud.student_embeddings(db, ["BE-S10", "BE-S11"])
+        assert len(stored["BE-S10"]) == 2 and len(stored["BE-S11"]) == 1
+        assert db.get(Student, "BE-S12") is None
+    finally:
+        db.close()
@@ -0,0 +1,91 @@
+import numpy as np
+
+from app.core.gallery_cache import GalleryCache
+from app.db import crud
+from app.db.database import SessionLocal
+from conftest import one_hot
+
+
+def _loader(calls: list, n_students: int = 2):
+    def load():
+        calls.append(1)
+        ids = [f"S{i}" for i in range(n_students)]
+        return [f"name {i}" for i in range(n_students)], ids, np.stack([one_hot(i) for i in range(n_students)])
+    return load
+
+
+def test_get_builds_once_until_invalidated():
+    cache = GalleryCache()
+    calls = []
+
+    g1 = cache.get("C1", _loader(calls))
+    g2 = cache.get("C1", _loader(calls))
+    assert g1 is g2
+    assert (len(calls), cache.hits, cache.misses) == (1, 1, 1)
+
+    cache.invalidate("C1")
+    g3 = cache.get("C1", _loader(calls, n_students=3))
+    assert len(calls) == 2
+    assert g3.version == cache.version("C1") == 1
+    assert g3.student_keys == ["S0", "S1", "S2"]
+
+
+def test_build_invalidated_midway_is_returned_but_not_cached():
+    cache = GalleryCache()
+    calls = []
+    inner = _loader(calls)
+
+    def racing_loader():
+        # enroll ở request khác trong lúc đang build
+        cache.invalidate("C1")
+        return inner()
+
+    g = cache.get("C1", racing_loader)
+    assert len(g) == 2
+    assert cache.stale_builds == 1
+    cache.get("C1", inner)
+    assert len(calls) == 2
+
+
+def test_sync_invalidates_classes_changed_by_other_workers():
+    cache = GalleryCache()
+    calls = []
+    cache.get("C1", _loader(calls))
+    cache.get("C2", _loader(calls))
+
+    # lần đầu thấy generation: lớp đã cache (build trước khi biết generation) bị bỏ
+    assert sorted(cache.sync({"C1": 1, "C2": 1})) == ["C1", "C2"]
+    cache.get("C1", _loader(calls))
+    cache.get("C2", _loader(calls))
+
+    # C1 đổi ở chính worker này (đã biết generation 2), C2 đổi ở worker khác
+    cache.invalidate("C1", generation=2)
+    cache.get("C1", _loader(calls))
+    assert cache.sync({"C1": 2, "C2": 2}) == ["C2"]
+    assert cache.sync({"C1": 2, "C2": 2}) == []
+    assert cache.sync_invalidations == 3
+
+
+def test_lru_evicts_oldest_class():
+    cache = GalleryCache(max_classes=2)
+    calls = []
+    for class_id in ("C1", "C2", "C1", "C3"):
+        cache.get(class_id, _loader(calls))
+
+    assert cache.evictions == 1
+    assert cache.stats()["classes"] == 2
+    cache.get("C1", _loader(calls))
+    assert len(calls) == 3          # C1 vừa dùng nên còn, C2 bị bỏ
+
+
+def test_enroll_invalidates_cached_gallery():
+    db = SessionLocal()
+    try:
+        crud.enroll_student(db, "GC-C1", "GC-S1", "An", one_hot(0)[None])
+        assert crud.get_gallery(db, "GC-C1").student_keys == ["GC-S1"]
+
+        crud.enroll_student(db, "GC-C1", "GC-S2", "Binh", one_hot(1)[None])
+        g = crud.get_gallery(db, "GC-C1")
+        assert sorted(g.student_keys) == ["GC-S1", "GC-S2"]
+    finally:
+        db.close()
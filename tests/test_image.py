@@ -0,0 +1,68 @@
+import cv2
+import numpy as np
+import pytest
+
+from app.utils.image import decode_for_detection, peek_image_size, reduced_decode_factor
+
+
+def _img(w=1600, h=1200):
+    rng = np.random.default_rng(0)
+    return cv2.resize((rng.random((h // 40, w // 40, 3)) * 255).astype(np.uint8), (w, h))
+
+
+@pytest.mark.parametrize("ext, params", [
+    (".jpg", []),
+    (".jpg", [cv2.IMWRITE_JPEG_PROGRESSIVE, 1]),
+    (".png", []),
+])
+def test_peek_image_size_reads_header(ext, params):
+    data = cv2.imencode(ext, _img(640, 360), params)[1].tobytes()
+    assert peek_image_size(data) == (640, 360)
+
+
+def test_peek_image_size_unknown_or_truncated():
+    assert peek_image_size(b"GIF89a....") is None
+    assert peek_image_size(b"") is None
+    jpg = cv2.imencode(".jpg", _img(640, 360))[1].tobytes()
+    assert peek_image_size(jpg[:30]) is None
+
+
+@pytest.mark.parametrize("size, max_side, factor", [
+    ((4000, 3000), 1280, 2),
+    ((4000, 3000), 960, 4),
+    ((4000, 3000), 400, 8),
+    ((4000, 3000), 100, 8),
+    ((1280, 720), 1280, 1),
+    ((1000, 800), 1280, 1),
+    (None, 1280, 1),
+    ((4000, 3000), 0, 1),
+])
+def test_reduced_decode_factor(size, max_side, factor):
+    assert reduced_decode_factor(size, max_side) == factor
+
+
+def test_decode_for_detection_modes():
+    data = cv2.imencode(".jpg", _img())[1].tobytes()
+
+    det, full, scale = decode_for_detection(data, 0)
+    assert det is full and det.shape[:2] == (1200, 1600) and scale == 1.0
+
+    # reduced: decode 1/4 rồi resize nốt, không decode full-res
+    det, full, scale = decode_for_detection(data, 300, "reduced")
+    assert full is None
+    assert max(det.shape[:2]) == 300
+    assert scale == pytest.approx(1600 / 300)
+
+    det, full, scale = decode_for_detection(data, 300, "resize")
+    assert full.shape[:2] == (1200, 1600)
+    assert max(det.shape[:2]) == 300
+    assert scale == pytest.approx(1600 / 300)
+
+    # ảnh nhỏ hơn max_side: giữ nguyên
+    det, full, scale = decode_for_detection(data, 2000, "reduced")
+    assert det is full and scale == 1.0
+
+
+def test_decode_for_detection_invalid_data():
+    assert decode_for_detection(b"not an image", 640) == (None, None, 1.0)
+    assert decode_for_detection(b"not an image", 0)[0] is None
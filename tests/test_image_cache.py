@@ -0,0 +1,104 @@
+import os
+import time
+
+import numpy as np
+from fastapi.testclient import TestClient
+
+from app.main import app
+from app.core.image_cache import ImageCache
+from app.db import crud
+from app.db.database import SessionLocal
+from conftest import one_hot
+
+
+def _out(faces: int = 0):
+    return {"decoded": True, "faces_detected": faces, "faces": [{"bbox": [0, 0, 1, 1], "conf": 0.9}] * faces,
+            "rejected": [], "aligned": ["crop"] * faces, "timings_ms": {"detect": 2.0}}
+
+
+def test_key_depends_on_version_fingerprint_and_bytes():
+    a, b = ImageCache(version="1"), ImageCache(version="2")
+    k = a.key(b"img", "fp")
+    assert k == ImageCache(version="1").key(b"img", "fp")
+    assert len({k, b.key(b"img", "fp"), a.key(b"img", "fp2"), a.key(b"img2", "fp")}) == 4
+
+
+def test_memory_lru_by_bytes():
+    cache = ImageCache(max_bytes=1100)        # mỗi entry không face ~512 byte: giữ được 2
+    for key in ("a", "b"):
+        cache.put(key, _out(), None)
+    assert cache.get("a") is not None         # a vừa dùng -> b là LRU
+    cache.put("c", _out(), None)
+
+    assert cache.get("b") is None
+    assert cache.get("a") is not None and cache.get("c") is not None
+    assert cache.evictions == 1
+    assert cache.stats()["bytes"] <= 1100
+
+    # entry lớn hơn cả ngân sách: không giữ
+    cache.put("big", _out(faces=10), np.zeros((10, 512), np.float32))
+    assert cache.get("big") is None
+
+
+def test_memory_ttl():
+    cache = ImageCache(ttl=0.05)
+    cache.put("a", _out(1), one_hot(0)[None])
+    assert cache.get("a") is not None
+    time.sleep(0.06)
+    assert cache.get("a") is None
+    assert (cache.expired, cache.misses) == (1, 1)
+
+
+def test_disk_layer_shared_across_instances_and_pruned(tmp_path):
+    first = ImageCache(disk_dir=str(tmp_path), disk_ttl=60)
+    first.put("ab" + "0" * 38, _out(2), np.stack([one_hot(0), one_hot(5)]))
+
+    # process khác / sau restart: RAM trống, đọc từ đĩa rồi đưa lên RAM
+    second = ImageCache(disk_dir=str(tmp_path), disk_ttl=60)
+    item = second.get("ab" + "0" * 38)
+    assert item is not None and second.disk_hits == 1
+    assert "aligned" not in item.out and item.out["faces_detected"] == 2
+    np.testing.assert_array_equal(item.embs, np.stack([one_hot(0), one_hot(5)]))
+    assert second.get("ab" + "0" * 38) is not None and second.hits == 1
+
+    # file quá disk_ttl: bỏ khi đọc, và prune_disk xoá
+    second.put("cd" + "0" * 38, _out(), None)
+    for key in ("ab", "cd"):
+        path = second._path(key + "0" * 38)
+        old = time.time() - 120
+        os.utime(path, (old, old))
+    third = ImageCache(disk_dir=str(tmp_path), disk_ttl=60)
+    assert third.get("ab" + "0" * 38) is None
+    assert third.prune_disk() == 1
+    assert not any(files for _, _, files in os.walk(tmp_path))
+
+
+def test_disk_read_error_counts_as_miss(tmp_path):
+    cache = ImageCache(disk_dir=str(tmp_path))
+    path = cache._path("ef" + "0" * 38)
+    os.makedirs(os.path.dirname(path))
+    with open(path, "wb") as fh:
+        fh.write(b"not an npz")
+
+    assert cache.get("ef" + "0" * 38) is None
+    assert (cache.disk_errors, cache.misses) == (1, 1)
+
+
+def test_resent_image_skips_inference(fake_engine, jpeg_bytes):
+    db = SessionLocal()
+    crud.enroll_student(db, "IC-C1", "IC-S1", "An", one_hot(0)[None])
+    db.close()
+    calls = []
+    detect = fake_engine.detect
+    fake_engine.detect = lambda img: calls.append(1) or detect(img)
+    # ảnh khác byte với các test khác (key theo nội dung ảnh)
+    data = jpeg_bytes + b"\0"
+    client = TestClient(app)
+
+    bodies = [client.post("/attendance/", data={"class_id": "IC-C1"},
+                          files=[("images", ("a.jpg", data, "image/jpeg"))]).json() for _ in range(2)]
+
+    assert len(calls) == 1
+    assert [b["debug"]["image_cache"]["hits"] for b in bodies] == [0, 1]
+    assert [p["student_id"] for p in bodies[1]["present"]] == ["IC-S1"]
+    assert bodies[0]["present"] == bodies[1]["present"]
@@ -0,0 +1,23 @@
+import asyncio
+
+from app.core.leader import LeaderLock
+
+
+def test_leader_releases_lock_when_startup_fails(tmp_path, caplog):
+    lock = LeaderLock(str(tmp_path / "run" / "leader.lock"), retry_interval=0.01)
+
+    async def broken():
+        raise RuntimeError("scheduler failed")
+
+    async def main():
+        lock.start(broken)
+        await lock._task
+        await lock.stop()
+
+    asyncio.run(main())
+
+    assert not lock.is_leader
+    assert "scheduler failed" in caplog.text
+    other = LeaderLock(lock.path)
+    assert other.try_acquire()
+    other.release()
@@ -0,0 +1,141 @@
+import numpy as np
+import pytest
+
+from app.core import calibration
+from app.core.matching import aggregate_by_student, assign_one_to_one, match_students, student_segments
+
+
+def _unit(x):
+    return (x / np.linalg.norm(x, axis=-1, keepdims=True)).astype(np.float32)
+
+
+def _aggregate_reference(sims_t, seg_starts, mode, top_k):
+    N = sims_t.shape[0]
+    ends = np.append(seg_starts[1:], N)
+    cols = []
+    for a, b in zip(seg_starts, ends):
+        seg = np.sort(sims_t[a:b], axis=0)[::-1]
+        cols.append(seg[0] if mode == "max" else seg[:top_k].mean(axis=0))
+    return np.stack(cols, axis=1)      # (F, S)
+
+
+@pytest.mark.parametrize("mode,top_k", [("max", 3), ("mean_topk", 1), ("mean_topk", 3), ("mean_topk", 5)])
+def test_aggregate_by_student_matches_reference(mode, top_k):
+    rng = np.random.default_rng(0)
+    counts = np.array([1, 2, 3, 7, 3, 40, 1, 5])       # lệch: 1 học sinh nhiều embedding hơn hẳn
+    seg_starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    sims_t = rng.uniform(-1, 1, (counts.sum(), 6)).astype(np.float32)
+
+    out = aggregate_by_student(sims_t, seg_starts, mode=mode, top_k=top_k)
+
+    assert out.shape == (6, len(counts))
+    np.testing.assert_allclose(out, _aggregate_reference(sims_t, seg_starts, mode, top_k), atol=1e-6)
+
+
+def test_aggregate_by_student_empty():
+    assert aggregate_by_student(np.zeros((0, 3), np.float32), np.zeros(0, np.int64)).shape == (3, 0)
+    assert aggregate_by_student(np.zeros((4, 0), np.float32), np.array([0, 2])).shape == (0, 2)
+
+
+@pytest.mark.parametrize("top_k", [1, 3])
+def test_aggregate_by_student_unknown_mode(top_k):
+    with pytest.raises(ValueError):
+        aggregate_by_student(np.zeros((2, 1), np.float32), np.array([0]), mode="median", top_k=top_k)
+    # lỗi chính tả cũng không được âm thầm thành "max", kể cả khi input rỗng
+    with pytest.raises(ValueError):
+        aggregate_by_student(np.zeros((0, 0), np.float32), np.zeros(0, np.int64), mode="mean_top_k", top_k=top_k)
+
+
+def test_student_segments_groups_rows():
+    order, keys, seg_starts = student_segments(["b", "a", "b", "c", "a"])
+    assert keys == ["a", "b", "c"]
+    assert seg_starts.tolist() == [0, 2, 4]
+    assert np.asarray(["b", "a", "b", "c", "a"])[order].tolist() == ["a", "a", "b", "b", "c"]
+
+
+def test_assign_one_to_one_resolves_conflict():
+    # face 0 và 1 đều thích student 0 nhất; face 0 điểm cao hơn nên giữ student 0
+    scores = np.array([[0.9, 0.2, 0.1],
+                       [0.8, 0.7, 0.1],
+                       [0.3, 0.2, 0.35]], dtype=np.float32)
+    idx, sc = assign_one_to_one(scores, threshold=0.4)
+    assert idx.tolist() == [0, 1, -1]
+    np.testing.assert_allclose(sc, [0.9, 0.7, 0.35])
+
+
+def test_assign_one_to_one_more_faces_than_students():
+    scores = np.array([[0.9], [0.95], [0.5]], dtype=np.float32)
+    idx, sc = assign_one_to_one(scores, threshold=0.4)
+    assert idx.tolist() == [-1, 0, -1]
+    np.testing.assert_allclose(sc, [0.9, 0.95, 0.5])
+
+
+def test_assign_one_to_one_matches_greedy_reference():
+    rng = np.random.default_rng(1)
+    scores = rng.uniform(0, 1, (7, 12)).astype(np.float32)
+    idx, _ = assign_one_to_one(scores, threshold=0.3)
+
+    expected = np.full(7, -1)
+    taken = set()
+    for pos in np.argsort(-scores.ravel(), kind="stable"):
+        f, s = divmod(int(pos), 12)
+        if scores[f, s] < 0.3 or expected[f] >= 0 or s in taken:
+            continue
+        expected[f] = s
+        taken.add(s)
+    assert idx.tolist() == expected.tolist()
+
+
+def test_match_students_one_to_one_per_image():
+    gallery = _unit(np.eye(4, 8, dtype=np.float32) + 0.01)
+    seg_starts = np.arange(4)
+    faces = np.stack([gallery[0], gallery[0], gallery[2]])
+    idx, _ = match_students(faces, gallery, seg_starts, threshold=0.5, image_ids=[0, 1, 1])
+    # ảnh khác nhau: cả 2 face đều là student 0; cùng ảnh thì 1-1
+    assert idx.tolist() == [0, 0, 2]
+    idx, _ = match_students(faces, gallery, seg_starts, threshold=0.5, image_ids=[0, 0, 1])
+    assert idx.tolist() == [0, -1, 2]
+
+
+def _class_gallery(rng, per_student, dim=32):
+    centers = _unit(rng.standard_normal((len(per_student), dim)))
+    rows = [_unit(c + 0.6 * rng.standard_normal((n, dim))) for c, n in zip(centers, per_student)]
+    seg_starts = np.concatenate(([0], np.cumsum(per_student)[:-1])).astype(np.int64)
+    return centers, rows, seg_starts
+
+
+@pytest.mark.parametrize("mode", ["znorm", "offset"])
+def test_calibration_update_matches_full(mode):
+    rng = np.random.default_rng(2)
+    kw = {"mode": mode, "aggregate": "mean_topk", "top_k": 3, "z": 3.0, "max_shift": 0.08, "min_students": 3}
+    per_student = rng.integers(3, 7, 24).tolist()
+    centers, rows, seg0 = _class_gallery(rng, per_student)
+    keys0 = [f"S{i}" for i in range(len(per_student))]
+    embs0 = np.concatenate(rows)
+    prev = calibration.calibrate(embs0, seg0, **kw)
+
+    # enroll thêm 2 ảnh cho S3 và 1 học sinh mới (đổi ít hàng -> cập nhật từng phần)
+    rows[3] = np.concatenate([rows[3], _unit(centers[3] + 0.6 * rng.standard_normal((2, 32)))])
+    rows.append(_unit(_unit(rng.standard_normal(32)) + 0.6 * rng.standard_normal((4, 32))))
+    keys1 = keys0 + ["NEW"]
+    embs1 = np.concatenate(rows)
+    seg1 = np.concatenate(([0], np.cumsum([len(r) for r in rows])[:-1])).astype(np.int64)
+
+    full = calibration.calibrate(embs1, seg1, **kw)
+    inc = calibration.update(keys0, embs0, seg0, prev, keys1, embs1, seg1, **kw)
+
+    assert inc.incremental
+    assert not inc.identity
+    np.testing.assert_allclose(inc.scale, full.scale, atol=1e-5)
+    np.testing.assert_allclose(inc.bias, full.bias, atol=1e-5)
+    scores = rng.uniform(0, 1, (5, len(keys1))).astype(np.float32)
+    np.testing.assert_allclose(inc.apply(scores), full.apply(scores), atol=1e-5)
+
+
+def test_calibration_off_is_identity():
+    rng = np.random.default_rng(3)
+    _, rows, seg = _class_gallery(rng, [3, 3, 3, 3])
+    calib = calibration.calibrate(np.concatenate(rows), seg, "off", "max", 3, 3.0, 0.08, 3)
+    assert calib.identity
+    scores = rng.uniform(0, 1, (2, 4)).astype(np.float32)
+    np.testing.assert_array_equal(calib.apply(scores), scores)
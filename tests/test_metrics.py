@@ -0,0 +1,84 @@
+import threading
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.core.metrics import MetricsMiddleware, MetricsRegistry, metrics, observe_stage, request_timings, span
+
+
+def _samples(text: str, prefix: str) -> dict:
+    return {line.rsplit(" ", 1)[0]: float(line.rsplit(" ", 1)[1])
+            for line in text.splitlines() if line.startswith(prefix)}
+
+
+def test_histogram_buckets_are_cumulative_and_le_inclusive():
+    reg = MetricsRegistry()
+    h = reg.histogram("t_seconds", "test", ("stage",), buckets=(0.01, 0.1, 1.0))
+    for v in (0.005, 0.01, 0.05, 0.1, 0.5, 2.0):
+        h.labels("detect").observe(v)
+
+    s = _samples(reg.render(), "t_seconds")
+    assert s['t_seconds_bucket{stage="detect",le="0.01"}'] == 2
+    assert s['t_seconds_bucket{stage="detect",le="0.1"}'] == 4
+    assert s['t_seconds_bucket{stage="detect",le="1.0"}'] == 5
+    assert s['t_seconds_bucket{stage="detect",le="+Inf"}'] == 6
+    assert s['t_seconds_count{stage="detect"}'] == 6
+    assert abs(s['t_seconds_sum{stage="detect"}'] - 2.665) < 1e-9
+    assert reg.histogram("t_seconds", "again") is h
+
+
+def test_shards_from_all_threads_are_summed():
+    reg = MetricsRegistry()
+    h = reg.histogram("t_seconds", "test", buckets=(1.0,))
+    c = reg.counter("t_total", "test", ("item",))
+
+    def work():
+        for _ in range(1000):
+            h.observe(0.5)
+            c.labels("faces").inc(2)
+
+    threads = [threading.Thread(target=work) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    s = _samples(reg.render(), "t_")
+    assert s['t_seconds_count'] == 4000
+    assert s['t_total{item="faces"}'] == 8000
+
+
+def _app(server_timing: bool) -> TestClient:
+    app = FastAPI()
+
+    @app.get("/items/{item_id}")
+    async def item(item_id: str):
+        observe_stage("detect", 12.5)
+        observe_stage("detect", 2.5)
+        with span("match"):
+            pass
+        return request_timings()
+
+    app.add_middleware(MetricsMiddleware, server_timing=server_timing)
+    return TestClient(app)
+
+
+def test_server_timing_header_and_route_label():
+    r = _app(server_timing=True).get("/items/abc")
+
+    assert r.json()["detect"] == 15.0
+    parts = [p.strip() for p in r.headers["server-timing"].split(",")]
+    assert parts[0] == "detect;dur=15.000"
+    assert parts[1].startswith("match;dur=")
+    assert parts[-1].startswith("app;dur=")
+    # label theo route template, không theo path thật
+    assert 'route="/items/{item_id}",status="2xx"' in metrics.render()
+    assert 'route="/items/abc"' not in metrics.render()
+
+
+def test_server_timing_disabled():
+    r = _app(server_timing=False).get("/items/abc")
+    assert r.status_code == 200
+    assert "server-timing" not in r.headers
+    # ngoài request: không có breakdown
+    assert request_timings() == {}
@@ -0,0 +1,93 @@
+import asyncio
+
+import pytest
+from starlette.requests import Request
+
+from app.utils.multipart_stream import StreamLimitExceeded, iter_multipart, multipart_boundary
+
+BOUNDARY = "b0undary"
+
+
+def _body(fields: dict, files: list[bytes]) -> bytes:
+    out = b""
+    for name, value in fields.items():
+        out += f"--{BOUNDARY}\r\nContent-Disposition: form-data; name=\"{name}\"\r\n\r\n".encode() + value + b"\r\n"
+    for i, data in enumerate(files):
+        out += (f"--{BOUNDARY}\r\nContent-Disposition: form-data; name=\"images\"; filename=\"{i}.jpg\"\r\n"
+                f"Content-Type: image/jpeg\r\n\r\n").encode() + data + b"\r\n"
+    return out + f"--{BOUNDARY}--\r\n".encode()
+
+
+def _parse(body: bytes, chunk: int = 7, content_length: bool = False, state=None, **limits):
+    """
+    Chạy iter_multipart với body chia nhỏ thành nhiều message. Return (parts, số byte đã đọc);
+    state["sent"]: số message đã nhận (xem được cả khi raise).
+    """
+    chunks = [body[i:i + chunk] for i in range(0, len(body), chunk)]
+    state = {} if state is None else state
+    state["sent"] = 0
+
+    async def receive():
+        i = state["sent"]
+        state["sent"] += 1
+        return {"type": "http.request", "body": chunks[i], "more_body": i + 1 < len(chunks)}
+
+    headers = [(b"content-type", f"multipart/form-data; boundary={BOUNDARY}".encode())]
+    if content_length:
+        headers.append((b"content-length", str(len(body)).encode()))
+    request = Request({"type": "http", "method": "POST", "headers": headers}, receive)
+
+    async def main():
+        return [p async for p in iter_multipart(request, **limits)]
+
+    return asyncio.run(main()), sum(len(c) for c in chunks[:state["sent"]])
+
+
+def test_parts_in_order_across_chunks():
+    body = _body({"class_id": b"C1", "threshold": b"0.5"}, [b"\xff\xd8" + b"x" * 100, b"second"])
+    parts, read = _parse(body, max_bytes=10_000, max_files=5)
+
+    assert [(p.name, p.filename) for p in parts] == [("class_id", None), ("threshold", None),
+                                                     ("images", "0.jpg"), ("images", "1.jpg")]
+    assert parts[0].text() == "C1"
+    assert parts[2].data == b"\xff\xd8" + b"x" * 100 and parts[2].content_type == "image/jpeg"
+    assert read == len(body)
+
+
+def test_byte_cap_stops_reading():
+    body = _body({}, [b"x" * 5000])
+    state = {}
+    with pytest.raises(StreamLimitExceeded):
+        _parse(body, chunk=100, state=state, max_bytes=1000, max_files=5)
+    assert state["sent"] == 11          # dừng ngay message vượt 1000 byte
+
+
+def test_content_length_over_cap_rejected_before_reading():
+    body = _body({}, [b"x" * 5000])
+    state = {}
+    with pytest.raises(StreamLimitExceeded):
+        _parse(body, content_length=True, state=state, max_bytes=1000, max_files=5)
+    assert state["sent"] == 0
+
+
+def test_file_count_cap():
+    with pytest.raises(StreamLimitExceeded, match="more than 2 images"):
+        _parse(_body({}, [b"a", b"b", b"c"]), max_bytes=10_000, max_files=2)
+    parts, _ = _parse(_body({}, [b"a", b"b"]), max_bytes=10_000, max_files=2)
+    assert len(parts) == 2
+
+
+def test_field_cap():
+    body = _body({"class_id": b"x" * 200}, [b"a"])
+    with pytest.raises(StreamLimitExceeded, match="class_id"):
+        _parse(body, max_bytes=10_000, max_files=5, max_field_bytes=64)
+    # file không bị giới hạn theo max_field_bytes
+    parts, _ = _parse(_body({}, [b"y" * 200]), max_bytes=10_000, max_files=5, max_field_bytes=64)
+    assert len(parts[0].data) == 200
+
+
+def test_multipart_boundary():
+    assert multipart_boundary(f"multipart/form-data; boundary={BOUNDARY}") == BOUNDARY.encode()
+    for bad in ("application/json", "multipart/form-data", ""):
+        with pytest.raises(ValueError):
+            multipart_boundary(bad)
@@ -0,0 +1,73 @@
+import numpy as np
+import pytest
+
+from app.settings import settings
+from app.core.prototypes import consolidate
+from app.db import crud
+from app.db.database import SessionLocal
+from app.db.models import StudentEmbedding
+from conftest import DIM
+
+
+def _clusters(k: int = 3, per: int = 8, seed: int = 0):
+    """k cụm tách biệt (góc khác nhau của 1 học sinh), mỗi cụm per embedding. Return (embs, tâm)."""
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(k, DIM)).astype(np.float32)
+    centers /= np.linalg.norm(centers, axis=1, keepdims=True)
+    embs = np.repeat(centers, per, axis=0) + 0.05 * rng.normal(size=(k * per, DIM)).astype(np.float32)
+    embs /= np.linalg.norm(embs, axis=1, keepdims=True)
+    return embs[rng.permutation(len(embs))], centers
+
+
+@pytest.mark.parametrize("method", ["kmeans", "kmedoids"])
+def test_consolidate_recovers_clusters(method):
+    embs, centers = _clusters()
+    protos = consolidate(embs, 3, method)
+
+    assert protos.shape == (3, DIM) and protos.dtype == np.float32
+    np.testing.assert_allclose(np.linalg.norm(protos, axis=1), 1.0, atol=1e-5)
+    # mỗi cụm có đúng 1 prototype gần tâm
+    sims = protos @ centers.T
+    assert sorted(np.argmax(sims, axis=1).tolist()) == [0, 1, 2]
+    assert sims.max(axis=1).min() > 0.95
+    if method == "kmedoids":
+        assert all(np.any(np.all(np.isclose(embs, p, atol=1e-6), axis=1)) for p in protos)
+    # seed cố định: cùng input cho cùng kết quả
+    np.testing.assert_array_equal(consolidate(embs, 3, method), protos)
+
+
+def test_consolidate_noop_and_invalid_method():
+    embs, _ = _clusters(per=1)
+    assert consolidate(embs, 3) is None
+    assert consolidate(embs, 0) is None
+    with pytest.raises(ValueError):
+        consolidate(np.concatenate([embs, embs]), 3, "median")
+
+
+def _sources(db, student_id: str) -> list[str]:
+    return [r[0] for r in db.query(StudentEmbedding.source).filter(StudentEmbedding.student_id == student_id)]
+
+
+@pytest.mark.parametrize("method", ["kmeans", "kmedoids"])
+def test_enroll_and_consolidate_job_keep_cap(monkeypatch, method):
+    monkeypatch.setattr(settings, "enroll_max_embeddings", 3)
+    monkeypatch.setattr(settings, "prototype_method", method)
+    embs, _ = _clusters(seed=1)
+    class_id, sid = f"PR-C-{method}", f"PR-S-{method}"
+    db = SessionLocal()
+    try:
+        crud.enroll_student(db, class_id, sid, "An", embs[:2])
+        assert _sources(db, sid) == ["enroll", "enroll"]
+
+        # vượt cap: gom ngay trong transaction của enroll
+        crud.enroll_student(db, class_id, sid, "An", embs[2:])
+        assert _sources(db, sid) == ["prototype"] * 3
+        assert len(crud.get_gallery(db, class_id).embs) == 3
+
+        # giảm cap rồi chạy lại (app.jobs.consolidate_embeddings)
+        assert crud.consolidate_student_embeddings(db, [sid], cap=2, method=method) == (3, 2)
+        assert crud.consolidate_student_embeddings(db, [sid], cap=2, method=method) == (0, 0)
+        assert len(_sources(db, sid)) == 2
+        assert len(crud.get_gallery(db, class_id).embs) == 2
+    finally:
+        db.close()
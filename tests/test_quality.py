@@ -0,0 +1,65 @@
+import cv2
+import numpy as np
+
+from app.core.quality import quality_gate, quality_gate_batch, quality_meta
+
+
+class Face:
+    def __init__(self, bbox, conf):
+        self.bbox = None if bbox is None else np.array(bbox, np.float32)
+        self.confidence = conf
+
+
+def _image(seed=0):
+    """Nửa trên nhiễu (nét), nửa dưới gần phẳng (mờ)."""
+    rng = np.random.default_rng(seed)
+    img = (rng.random((480, 640, 3)) * 255).astype(np.uint8)
+    img[240:] = cv2.GaussianBlur(img[240:], (0, 0), 8)
+    return img
+
+
+def _faces():
+    return [
+        Face([10, 10, 110, 120], 0.9),          # nét
+        Face([300, 300, 420, 430], 0.8),        # mờ
+        Face([200, 50, 210, 58], 0.95),         # nhỏ
+        Face([50, 300, 150, 400], 0.2),         # lowconf
+        Face(None, 0.9),                        # không bbox: cho qua
+        Face([600, 400, 700, 520], None),       # không conf, tràn ra ngoài ảnh
+        Face([-40, -40, 80, 90], 0.7),          # toạ độ âm
+        Face([700, 10, 800, 120], 0.9),         # nằm ngoài ảnh -> small sau clamp
+    ]
+
+
+def _assert_same(img, faces, **kw):
+    rows = quality_gate_batch(img, faces, **kw)
+    for face, row in zip(faces, rows):
+        ok, meta = quality_gate(img, face, **kw)
+        assert bool(row["ok"]) == ok
+        assert str(row["reason"]) == meta["reason"]
+        if "blur" in meta:
+            assert abs(float(row["blur"]) - meta["blur"]) <= 1e-3 * max(1.0, meta["blur"])
+    return rows
+
+
+def test_batch_matches_per_face_gate_on_sparse_faces():
+    img = _image()
+    rows = _assert_same(img, _faces(), min_conf=0.4, min_face=20, min_blur=30.0)
+    assert [str(r) for r in rows["reason"]] == ["ok", "blur", "small", "lowconf", "nobbox", "blur", "ok", "small"]
+    assert quality_meta(rows[1], min_blur=30.0)["min_blur"] == 30.0
+
+
+def test_batch_dense_faces_use_integral_blur():
+    img = _image(1)
+    # nhiều box chồng nhau trong 1 vùng: đi nhánh integral image, blur xấp xỉ theo crop
+    # (Laplacian ở mép crop dùng pixel thật thay vì border reflect)
+    for x, y, ok in ((20, 20, True), (300, 300, False)):
+        faces = [Face([x + 4 * i, y + 3 * i, x + 120 + 4 * i, y + 130 + 3 * i], 0.9) for i in range(8)]
+        rows = quality_gate_batch(img, faces, min_blur=30.0)
+        expected = [quality_gate(img, f, min_blur=30.0) for f in faces]
+        assert rows["ok"].tolist() == [e for e, _ in expected] == [ok] * 8
+        np.testing.assert_allclose(rows["blur"], [m["blur"] for _, m in expected], rtol=0.1)
+
+
+def test_batch_empty():
+    assert len(quality_gate_batch(_image(), [])) == 0
@@ -0,0 +1,139 @@
+import json
+import uuid
+from datetime import datetime
+
+import numpy as np
+import pytest
+
+from app.settings import settings
+from app.core.attendance_logic import build_result
+from app.db import crud
+from app.db.database import SessionLocal
+from app.db.models import AttendanceDailyClass, AttendanceDailyStudent, AttendanceResult, AttendanceSession
+from conftest import one_hot
+
+STUDENTS = {"RP-S1": "An", "RP-S2": "Binh", "RP-S3": "Chi"}
+
+
+def _class(db, class_id: str):
+    for sid, name in STUDENTS.items():
+        crud.upsert_student(db, f"{class_id}-{sid}", class_id, name)
+    return {f"{class_id}-{sid}": name for sid, name in STUDENTS.items()}
+
+
+def _result(class_id: str, students: dict, present_best: dict, unknown: int = 0):
+    dbg = {"images_received": 2, "rejected_details": [{"reason": "blur"}, {"reason": "small"}],
+           "unknown_best_scores": [0.1], "timings_ms": {"detect": 1.5}}
+    return build_result(class_id=class_id, students=students, present_best=present_best,
+                        unknown_faces=unknown, threshold=0.45, dbg=dbg)
+
+
+def test_save_and_get_session_result_round_trip(monkeypatch):
+    monkeypatch.setattr(settings, "attendance_store_face_embeddings", True)
+    db = SessionLocal()
+    try:
+        students = _class(db, "RP-C1")
+        keys = list(students)
+        result = _result("RP-C1", students, {keys[0]: 0.81, keys[2]: 0.66}, unknown=1)
+        faces = [
+            {"image_idx": 1, "bbox": [1, 2, 3, 4], "conf": 0.9, "emb": one_hot(0), "student_id": keys[0], "score": 0.81},
+            {"image_idx": 0, "bbox": [5, 6, 7, 8], "conf": 0.8, "emb": one_hot(1), "student_id": None, "score": 0.2},
+            {"image_idx": 1, "bbox": [9, 9, 9, 9], "conf": 0.7, "emb": None, "student_id": keys[2], "score": 0.66},
+        ]
+        sid = str(uuid.uuid4())
+        crud.save_attendance_session(db, session_id=sid, class_id="RP-C1", images_count=2, result=result,
+                                     threshold=0.45, faces=faces)
+
+        row = db.get(AttendanceSession, sid)
+        got = crud.get_session_result(db, row)
+        expected = {k: v for k, v in result.items() if k != "debug"}
+        assert {k: v for k, v in got.items() if k != "debug"} == expected
+
+        # note chỉ giữ debug rút gọn
+        assert "rejected_details" not in got["debug"] and "unknown_best_scores" not in got["debug"]
+        assert got["debug"]["rejected_count"] == 2
+        assert got["debug"]["timings_ms"] == {"detect": 1.5}
+
+        stored = crud.list_session_faces(db, sid)
+        assert [(f.matched_student_id, f.status) for f in stored] == [(None, "unknown"), (keys[0], "matched"),
+                                                                      (keys[2], "matched")]
+        assert json.loads(stored[1].bbox) == [1, 2, 3, 4]
+        np.testing.assert_array_equal(np.frombuffer(stored[1].embedding, np.float32), one_hot(0))
+        assert stored[2].embedding is None
+        assert len({f.image_id for f in stored}) == 2
+    finally:
+        db.close()
+
+
+def test_get_session_result_reads_old_json_note():
+    db = SessionLocal()
+    try:
+        students = _class(db, "RP-C2")
+        # phiên lưu trước khi có attendance_results: cả response nằm trong note
+        legacy = _result("RP-C2", students, {next(iter(students)): 0.7})
+        db.add(AttendanceSession(id="RP-legacy", class_id="RP-C2", note=json.dumps(legacy)))
+        db.add(AttendanceSession(id="RP-broken", class_id="RP-C2", note="{not json"))
+        db.commit()
+
+        assert crud.get_session_result(db, db.get(AttendanceSession, "RP-legacy")) == legacy
+        assert crud.get_session_result(db, db.get(AttendanceSession, "RP-broken")) == {"raw_note": "{not json"}
+    finally:
+        db.close()
+
+
+def _at(monkeypatch, when: datetime):
+    """save_attendance_session ghi phiên (và tổng hợp) vào ngày when."""
+    class FixedDatetime(datetime):
+        @classmethod
+        def utcnow(cls):
+            return when
+    monkeypatch.setattr(crud, "datetime", FixedDatetime)
+
+
+def _rollups(db, class_id: str):
+    daily = [(r.day, r.sessions, r.results, r.present, r.unknown_faces) for r in
+             db.query(AttendanceDailyClass).filter(AttendanceDailyClass.class_id == class_id)
+             .order_by(AttendanceDailyClass.day)]
+    students = [(r.student_id, r.day, r.sessions, r.present, pytest.approx(r.score_sum)) for r in
+                db.query(AttendanceDailyStudent).filter(AttendanceDailyStudent.class_id == class_id)
+                .order_by(AttendanceDailyStudent.day, AttendanceDailyStudent.student_id)]
+    return daily, students
+
+
+def test_rebuild_rollups_matches_incremental(monkeypatch):
+    db = SessionLocal()
+    try:
+        students = _class(db, "RP-C3")
+        keys = list(students)
+        for when, present, unknown in (
+            (datetime(2026, 3, 2, 7, 30), {keys[0]: 0.8, keys[1]: 0.6}, 1),
+            (datetime(2026, 3, 2, 13, 0), {keys[0]: 0.7}, 0),
+            (datetime(2026, 3, 3, 7, 30), {}, 3),
+            (datetime(2026, 3, 4, 23, 59), {keys[2]: 0.9}, 0),
+        ):
+            _at(monkeypatch, when)
+            crud.save_attendance_session(db, session_id=str(uuid.uuid4()), class_id="RP-C3", images_count=1,
+                                         result=_result("RP-C3", students, present, unknown))
+        incremental = _rollups(db, "RP-C3")
+        assert incremental[0][0][1:] == (2, 6, 3, 1)
+
+        # DB cũ chưa có tổng hợp + 1 ngày bị lệch
+        db.query(AttendanceDailyStudent).filter(AttendanceDailyStudent.class_id == "RP-C3").delete()
+        db.query(AttendanceDailyClass).filter(AttendanceDailyClass.class_id == "RP-C3",
+                                              AttendanceDailyClass.day == incremental[0][0][0]).delete()
+        db.query(AttendanceDailyClass).filter(AttendanceDailyClass.class_id == "RP-C3").update({"sessions": 99})
+        db.commit()
+
+        assert crud.rebuild_attendance_rollups(db, class_ids=["RP-C3"]) == {"RP-C3": 3}
+        assert _rollups(db, "RP-C3") == incremental
+
+        # cleanup xoá phiên ngày đầu: tổng hợp của ngày đó giữ nguyên khi rebuild
+        first_day = [r[0] for r in db.query(AttendanceSession.id).filter(
+            AttendanceSession.class_id == "RP-C3", AttendanceSession.created_at < datetime(2026, 3, 3))]
+        db.query(AttendanceResult).filter(AttendanceResult.session_id.in_(first_day)).delete()
+        db.query(AttendanceSession).filter(AttendanceSession.id.in_(first_day)).delete()
+        db.commit()
+        assert crud.rebuild_attendance_rollups(db, class_ids=["RP-C3"]) == {"RP-C3": 2}
+        assert _rollups(db, "RP-C3") == incremental
+    finally:
+        db.close()
@@ -0,0 +1,81 @@
+import asyncio
+import json
+
+from starlette.requests import Request
+
+from app.api.routes_attendance import _attendance_events
+from app.db import crud
+from app.db.database import SessionLocal
+from app.db.models import AttendanceSession
+from conftest import one_hot
+
+BOUNDARY = "testboundary"
+
+
+def _multipart(fields: dict, images: list[bytes]) -> bytes:
+    out = b""
+    for name, value in fields.items():
+        out += (f"--{BOUNDARY}\r\nContent-Disposition: form-data; name=\"{name}\"\r\n\r\n{value}\r\n").encode()
+    for i, data in enumerate(images):
+        out += (f"--{BOUNDARY}\r\nContent-Disposition: form-data; name=\"images\"; filename=\"{i}.jpg\"\r\n"
+                f"Content-Type: image/jpeg\r\n\r\n").encode() + data + b"\r\n"
+    return out + f"--{BOUNDARY}--\r\n".encode()
+
+
+def _request(body: bytes, disconnected: bool) -> Request:
+    """Request với cả body trong 1 message; sau đó client đã đi (disconnected) hoặc còn chờ."""
+    sent = False
+
+    async def receive():
+        nonlocal sent
+        if not sent:
+            sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        if disconnected:
+            return {"type": "http.disconnect"}
+        await asyncio.Event().wait()
+
+    scope = {"type": "http", "method": "POST", "path": "/attendance/stream", "query_string": b"",
+             "headers": [(b"content-type", f"multipart/form-data; boundary={BOUNDARY}".encode())]}
+    return Request(scope, receive)
+
+
+def _run_stream(engine, class_id: str, images: list[bytes], disconnected: bool) -> list[dict]:
+    request = _request(_multipart({"class_id": class_id, "threshold": "0.5"}, images), disconnected)
+
+    async def main():
+        return [json.loads(line) async for line in _attendance_events(request, engine, False, 10 * 1024 * 1024)]
+
+    return asyncio.run(main())
+
+
+def _sessions(class_id: str) -> int:
+    db = SessionLocal()
+    try:
+        return db.query(AttendanceSession).filter(AttendanceSession.class_id == class_id).count()
+    finally:
+        db.close()
+
+
+def test_stream_returns_result_while_client_connected(fake_engine, jpeg_bytes):
+    db = SessionLocal()
+    crud.enroll_student(db, "ST-C1", "ST-S1", "An", one_hot(0)[None])
+    db.close()
+
+    events = _run_stream(fake_engine, "ST-C1", [jpeg_bytes] * 3, disconnected=False)
+
+    assert [e["event"] for e in events] == ["image"] * 3 + ["result"]
+    assert events[-1]["count_present"] == 1
+    assert _sessions("ST-C1") == 1
+
+
+def test_stream_stops_when_client_disconnects_after_body(fake_engine, jpeg_bytes):
+    db = SessionLocal()
+    crud.enroll_student(db, "ST-C2", "ST-S2", "An", one_hot(0)[None])
+    db.close()
+
+    events = _run_stream(fake_engine, "ST-C2", [jpeg_bytes] * 3, disconnected=True)
+
+    # client đã đi: không chạy tới cuối, không lưu phiên điểm danh
+    assert "result" not in [e["event"] for e in events]
+    assert _sessions("ST-C2") == 0
@@ -0,0 +1,118 @@
+import io
+import os
+import tempfile
+
+import numpy as np
+import pytest
+
+from app.api.routes_attendance import _spool_video
+from app.core.video import FaceTracker
+from conftest import one_hot
+
+
+class _CountingReader(io.BytesIO):
+    def __init__(self, data):
+        super().__init__(data)
+        self.bytes_read = 0
+
+    def read(self, n=-1):
+        chunk = super().read(n)
+        self.bytes_read += len(chunk)
+        return chunk
+
+
+def _spooled_files():
+    return {f for f in os.listdir(tempfile.gettempdir()) if f.startswith("attendance_video_")}
+
+
+def test_spool_video_copies_within_limit():
+    path = _spool_video(io.BytesIO(b"x" * 3000), "clip.MOV", max_bytes=4096, chunk_size=1024)
+    try:
+        assert path.endswith(".mov")
+        assert os.path.getsize(path) == 3000
+    finally:
+        os.remove(path)
+
+
+def test_spool_video_stops_as_soon_as_limit_is_exceeded():
+    before = _spooled_files()
+    src = _CountingReader(b"x" * (10 * 1024))
+    with pytest.raises(ValueError):
+        _spool_video(src, "clip.mp4", max_bytes=2048, chunk_size=1024)
+    # dừng ở chunk đầu tiên vượt giới hạn, không đọc / ghi hết upload
+    assert src.bytes_read == 3 * 1024
+    assert _spooled_files() == before
+
+
+def _box(x, y, size=100):
+    return np.array([[x, y, x + size, y + size]], np.float64)
+
+
+def _mix(a: int, b: int, w: float) -> np.ndarray:
+    v = (1 - w) * one_hot(a) + w * one_hot(b)
+    return v / np.linalg.norm(v)
+
+
+def test_tracker_follows_moving_face_by_iou():
+    tracker = FaceTracker(iou_threshold=0.3)
+    ids = []
+    # di chuyển 40 px / frame: IoU giữa 2 lần thấy liên tiếp < 0.3, chỉ khớp nhờ vận tốc dự đoán
+    for i, frame in enumerate(range(0, 50, 5)):
+        assigned, new = tracker.update(frame, _box(100 + 40 * i, 100), [0.9])
+        ids.extend(assigned)
+    assert set(ids) == {0}
+    assert tracker.created == 1
+
+    # 2 mặt cùng frame luôn là 2 track
+    assigned, new = tracker.update(50, np.concatenate([_box(500, 100), _box(900, 500)]), [0.9, 0.8])
+    assert assigned == [0, 1] and new == 1
+
+
+def test_tracker_embedding_gap_and_cap():
+    tracker = FaceTracker(embeds_per_track=2, embed_gap=10)
+    (tid,), _ = tracker.update(0, _box(0, 0), [0.9])
+    assert tracker.needs_embedding(tid, 0)
+    tracker.add_embedding(tid, one_hot(0), 0)
+    assert not tracker.needs_embedding(tid, 5)
+    assert tracker.needs_embedding(tid, 10)
+    tracker.add_embedding(tid, one_hot(0), 10)
+    assert not tracker.needs_embedding(tid, 100)
+
+
+def test_tracker_reid_joins_broken_track():
+    tracker = FaceTracker(max_age=10, reid_threshold=0.5)
+    (a,), _ = tracker.update(0, _box(0, 0), [0.7])
+    tracker.add_embedding(a, one_hot(0), 0)
+    (other,), _ = tracker.update(5, _box(800, 800), [0.9])      # người khác
+    tracker.add_embedding(other, one_hot(3), 5)
+
+    # a bị che quá max_age rồi xuất hiện lại ở chỗ khác: track mới, nối lại nhờ embedding
+    (b,), new = tracker.update(40, _box(400, 300), [0.95])
+    assert new == 1 and b != a
+    assert tracker.add_embedding(b, _mix(0, 1, 0.3), 40) == a
+    assert b not in tracker.tracks and tracker.merged == 1
+    t = tracker.tracks[a]
+    assert t.last_frame == 40 and t.best_conf == 0.95 and len(t.embs) == 2
+
+    # track cùng frame với a không bao giờ bị nối vào a, dù embedding giống
+    (a2, c), _ = tracker.update(41, np.concatenate([_box(400, 300), _box(0, 600)]), [0.9, 0.9])
+    assert a2 == a
+    assert tracker.add_embedding(c, one_hot(0), 41) == c
+
+
+def test_tracker_finalize_merges_by_mean_embedding():
+    tracker = FaceTracker(max_age=10, reid_threshold=0.5)
+    (a,), _ = tracker.update(0, _box(0, 0), [0.9])
+    tracker.add_embedding(a, one_hot(0), 0)
+    (b,), _ = tracker.update(50, _box(500, 0), [0.9])
+    # embedding đầu của b (nghiêng mặt) chưa đủ giống để nối ngay
+    assert tracker.add_embedding(b, _mix(0, 2, 0.8), 50) == b
+    tracker.add_embedding(b, one_hot(0), 70)
+    tracker.add_embedding(b, one_hot(0), 90)
+    (no_emb,), _ = tracker.update(200, _box(0, 500), [0.9])
+
+    done = tracker.finalize()
+    assert [t.id for t in done] == [a]
+    assert done[0].frames == {0, 50}
+    assert len(done[0].embs) == 3          # embeds_per_track
+    assert no_emb in tracker.tracks         # track chưa embed không có trong kết quả